@@ -24,6 +24,7 @@ import builtins
 import codecs
 import collections
 import contextlib
+import ctypes
 import errno
 import fnmatch
 import functools
@@ -42,6 +43,7 @@ import os
 import pickle
 import random
 import re
+import select
 import signal
 import shutil
 import socket
@@ -2030,54 +2032,310 @@ def process_terminate(pid, pidfile = None, tag = None,
             rm_f(pidfile)
 
 
+class process_waiter_c:
+    """
+    Wait for events that tell a process we started might be ready
+
+    Instead of polling, wait for:
+
+    - the process exiting (with a PID file descriptor)
+
+    - files being created or modified in some directories (with
+      *inotify*), since most daemons signal they are ready by
+      creating a PID file, a UNIX socket, a log file...
+
+    - the process notifying it is ready with the *sd_notify()*
+      protocol, if *notify* is *True*; the process has to be started
+      with the environment variable *NOTIFY_SOCKET* set to
+      :data:`notify_address`.
+
+    Each of them is used only if available in the system; otherwise
+    :meth:`wait` just times out, so callers keep polling.
+
+    >>> waiter = commonl.process_waiter_c([ "/some/dir" ], notify = True)
+    >>> env[NOTIFY_SOCKET] = waiter.notify_address
+    >>> p = subprocess.Popen(..., env = env)
+    >>> waiter.popen_watch(p)
+    >>> pid = commonl.process_started(..., waiter = waiter)
+    >>> waiter.close()
+
+    :param list(str) paths: (optional) directories to watch for
+      files being created or modified
+
+    :param bool notify: (optional; default *False*) receive
+      *sd_notify()* notifications
+    """
+    _IN_MODIFY = 0x00000002
+    _IN_ATTRIB = 0x00000004
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_NONBLOCK = os.O_NONBLOCK
+    _IN_CLOEXEC = os.O_CLOEXEC
+    _libc = None
+
+    def __init__(self, paths = None, notify = False):
+        assert paths == None or isinstance(paths, list)
+        assert isinstance(notify, bool)
+        self.poll = select.poll()
+        self.popen = None
+        self.pidfd = None
+        self.inotify_fd = None
+        #: *sd_notify()* socket; its address is :data:`notify_address`
+        self.notify_socket = None
+        #: address to set in the process's environment as
+        #: *NOTIFY_SOCKET* (*None* if not notifying)
+        self.notify_address = None
+        #: exit code if the process exited, *None* otherwise
+        self.returncode = None
+        #: *True* once the process has notified with *READY=1*
+        self.ready = False
+        #: PID the process notified with *MAINPID=*
+        self.mainpid = None
+        if paths:
+            self._inotify_setup(paths)
+        if notify:
+            self._notify_setup()
+
+
+    def _inotify_setup(self, paths):
+        try:
+            if process_waiter_c._libc == None:
+                process_waiter_c._libc = ctypes.CDLL(None, use_errno = True)
+            libc = process_waiter_c._libc
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        except ( OSError, AttributeError ) as e:
+            logging.info("inotify not available, will poll: %s", e)
+            return
+        if fd < 0:
+            logging.info("inotify_init1() failed, will poll: errno %d",
+                         ctypes.get_errno())
+            return
+        self.inotify_fd = fd
+        mask = self._IN_CREATE | self._IN_MOVED_TO | self._IN_CLOSE_WRITE \
+            | self._IN_MODIFY | self._IN_ATTRIB
+        for path in set(paths):
+            if libc.inotify_add_watch(fd, path.encode('utf-8'), mask) < 0:
+                logging.info("%s: can't inotify watch, will poll", path)
+        self.poll.register(fd, select.POLLIN)
+
+
+    def _notify_setup(self):
+        # abstract socket, so there are no path length limits or
+        # files to cleanup
+        name = "ttbd-notify-%d-%s" % (os.getpid(), mkid(str(random.random()), 8))
+        self.notify_socket = socket.socket(
+            socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+        self.notify_socket.setsockopt(socket.SOL_SOCKET, socket.SO_PASSCRED, 1)
+        self.notify_socket.bind(b"\0" + name.encode('utf-8'))
+        self.notify_address = "@" + name
+        self.poll.register(self.notify_socket.fileno(), select.POLLIN)
+
+
+    def popen_watch(self, popen):
+        """
+        Watch for a process to exit
+
+        :param subprocess.Popen popen: process to watch
+        """
+        self.popen = popen
+        try:
+            self.pidfd = os.pidfd_open(popen.pid)
+            self.poll.register(self.pidfd, select.POLLIN)
+        except ( AttributeError, OSError ) as e:
+            # can't, so we'll check every time we wake up
+            logging.info("PID %d: can't open pidfd, will poll: %s",
+                         popen.pid, e)
+
+
+    def _notify_read(self):
+        while True:
+            try:
+                data, ancdata, _flags, _address = self.notify_socket.recvmsg(
+                    4096, socket.CMSG_SPACE(struct.calcsize("3i")),
+                    socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return
+            uid = None
+            for level, _type, cdata in ancdata:
+                if level == socket.SOL_SOCKET \
+                   and _type == socket.SCM_CREDENTIALS:
+                    _pid, uid, _gid = struct.unpack("3i", cdata[:12])
+            if uid != os.getuid():
+                # anyone can write to an abstract socket
+                logging.warning("ignoring notification from UID %s", uid)
+                continue
+            for line in data.decode('utf-8', errors = 'replace').splitlines():
+                if line == "READY=1":
+                    self.ready = True
+                elif line.startswith("MAINPID="):
+                    try:
+                        self.mainpid = int(line[len("MAINPID="):])
+                    except ValueError:
+                        pass
+
+
+    def wait(self, timeout: float):
+        """
+        Wait for something to happen to the process
+
+        :param float timeout: maximum time to wait (in seconds)
+
+        :returns bool: *True* if something happened (the process
+          exited, files were created or modified, the process
+          notified), *False* on timeout
+        """
+        events = self.poll.poll(timeout * 1000)
+        for fd, _event in events:
+            if fd == self.pidfd:
+                self.poll.unregister(self.pidfd)
+                os.close(self.pidfd)
+                self.pidfd = None
+            elif fd == self.inotify_fd:
+                try:
+                    while os.read(self.inotify_fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            elif self.notify_socket and fd == self.notify_socket.fileno():
+                self._notify_read()
+        if self.popen and self.returncode == None:
+            self.returncode = self.popen.poll()
+        return bool(events)
+
+
+    def close(self):
+        if self.pidfd != None:
+            os.close(self.pidfd)
+            self.pidfd = None
+        if self.inotify_fd != None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        if self.notify_socket:
+            self.notify_socket.close()
+            self.notify_socket = None
+
+
+
 def process_started(pidfile, path,
                     tag = None, log = None,
                     verification_f = None,
                     verification_f_args = None,
-                    timeout = 5, poll_period = 0.3):
+                    timeout = 5, poll_period = 0.3,
+                    waiter: process_waiter_c = None,
+                    settle: float = 0.05):
+    """
+    Wait for a process to start
+
+    A process is considered started when it is alive (as reported by
+    :func:`process_alive`), the verification function returns
+    *True* and, if using *sd_notify()* (see :class:`process_waiter_c`),
+    it has notified it is ready.
+
+    We check every time *waiter* reports something happened; if
+    nothing does, we check every *poll_period* seconds (starting
+    faster). If *waiter* is watching the process and it exits with a
+    non-zero code, we give up right away. Before declaring it
+    started, we check once more it is still alive, *settle* seconds
+    after we started waiting at least.
+
+    :param str pidfile: file with the PID of the process (or PID, see
+      :func:`process_alive`)
+
+    :param str path: path to the binary the process has to be running
+
+    :param callable verification_f: (optional) function to call to
+      verify the process is ready, with the arguments in
+      *verification_f_args*; shall return *True* when ready
+
+    :param float timeout: (optional; default 5s) maximum time to wait
+
+    :param float poll_period: (optional; default 0.3s) maximum time
+      to wait in between checks
+
+    :param process_waiter_c waiter: (optional) events to wait for
+
+    :param float settle: (optional; default 0.05s) minimum time the
+      process has to be alive to be considered started
+
+    :returns int: PID of the process or *None* if it didn't start
+    """
     if log == None:
         log = logging
     if tag == None:
         tag = path
+    if waiter == None:
+        waiter = process_waiter_c()
     t0 = time.time()		# Verify it came up
+    pid = None
+    verified = False
+    wait = min(0.02, poll_period)
     while True:
         t = time.time()
-        if t - t0 > timeout:
-            log.error("%s: timed out (%ss) starting process", tag, timeout)
-            return None
-        time.sleep(poll_period)		# Give it .1s to come up
-        pid = process_alive(pidfile, path)
         if pid == None:
-            log.debug("%s: no %s PID yet (+%.2f/%ss), re-checking pidfile %s",
-                      tag, path, t - t0, timeout, pidfile)
-            continue
-        # PID found, if there is a verification function, let's run it
-        break
-    if verification_f:
-        log.debug("%s: pid %d found at +%.2f/%ss), verifying",
-                  tag, pid, t - t0, timeout)
-        while True:
-            if t - t0 > timeout:
-                log.error("%s: timed out (%ss) verifying process pid %d",
-                          tag, timeout, pid)
-                return None
-            if verification_f(*verification_f_args):
+            pid = process_alive(pidfile, path)
+            if pid == None and waiter.mainpid:
+                pid = process_alive(waiter.mainpid, path)
+            if pid == None:
+                log.debug("%s: no %s PID yet (+%.2f/%ss), re-checking pidfile %s",
+                          tag, path, t - t0, timeout, pidfile)
+            elif verification_f:
+                log.debug("%s: pid %d found at +%.2f/%ss), verifying",
+                          tag, pid, t - t0, timeout)
+        if pid != None and not verified:
+            verified = verification_f == None \
+                or verification_f(*verification_f_args)
+        if pid != None and verified \
+           and ( waiter.notify_socket == None or waiter.ready ):
+            # give it at least *settle* seconds to fail (eg: right
+            # after writing the pidfile or notifying) and take a last
+            # look before declaring it started
+            while waiter.returncode == None:
+                settle_left = t0 + settle - time.time()
+                if settle_left <= 0:
+                    break
+                waiter.wait(settle_left)
+            waiter.wait(0)
+            if waiter.returncode in ( None, 0 ) \
+               and process_alive(pid, path) != None:
                 log.debug("%s: started (pid %d) and verified at +%.2f/%ss",
                           tag, pid, t - t0, timeout)
                 return pid
-            time.sleep(poll_period)		# Give it .1s to come up
-            t = time.time()
-    else:
-        log.debug("%s: started (pid %d) at +%.2f/%ss)",
-                  tag, pid, t - t0, timeout)
-        return pid
+            if waiter.returncode in ( None, 0 ):
+                log.error("%s: process pid %d died while starting (+%.2fs)",
+                          tag, pid, t - t0)
+                return None
+        if waiter.returncode not in ( None, 0 ):
+            # exit code zero is ok; it might be going background
+            log.error("%s: process exited with %d while starting (+%.2fs)",
+                      tag, waiter.returncode, t - t0)
+            return None
+        if t - t0 > timeout:
+            if pid == None:
+                log.error("%s: timed out (%ss) starting process", tag, timeout)
+            elif not verified:
+                log.error("%s: timed out (%ss) verifying process pid %d",
+                          tag, timeout, pid)
+            else:
+                log.error("%s: timed out (%ss) waiting for process pid %d"
+                          " to notify it is ready", tag, timeout, pid)
+            return None
+        if waiter.wait(min(wait, max(timeout - (t - t0), 0))):
+            # something happened, things might be moving
+            wait = min(0.02, poll_period)
+        else:
+            # nothing happened, poll slower next time
+            wait = min(wait * 2, poll_period)
 
 def origin_get(depth = 1):
     """
     Return the name of the file and line from which this was called
     """
-    o = inspect.stack()[depth]
-    return "%s:%s" % (o[1], o[2])
+    # sys._getframe() vs inspect.stack(): the latter loads the
+    # source context of every frame in the stack, which is very
+    # expensive and this is called a lot (eg: when setting keywords)
+    frame = sys._getframe(depth)
+    return "%s:%s" % (frame.f_code.co_filename, frame.f_lineno)
 
 
 def origin_get_object_path(o):
@@ -2091,7 +2349,7 @@ def origin_fn_get(depth = 1, sep = ":"):
     """
     Return the name of the function and line from which this was called
     """
-    frame = inspect.stack()[depth][0]
+    frame = sys._getframe(depth)
     return frame.f_code.co_name + sep + "%d" % frame.f_lineno
 
 def kws_update_type_string(kws, rt, kws_origin = None, origin = None,
@@ -3191,6 +3449,40 @@ def factory_from_specs(specs: dict, scheme_map: dict = None,
 
 
 
+@functools.lru_cache(maxsize = 256)
+def _projections_compile(projections: tuple):
+    # a single regex that matches a field if field_needed() would
+    # match it for any of the projections
+    regexes = []
+    for projection in projections:
+        regexes.append(fnmatch.translate(projection))
+        # match projection a to fields a.[x.[y.[...]]]
+        regexes.append(re.escape(projection + "."))
+    return re.compile("|".join("(?:" + regex + ")" for regex in regexes),
+                      re.DOTALL).match
+
+
+def projections_matcher(projections):
+    """
+    Compile a list of projections into a function that checks if a
+    field is needed
+
+    Same as calling :func:`field_needed` for each field, but the
+    patterns are compiled only once (and cached), which is way
+    faster when checking many fields.
+
+    :param list(str) projections: list of :mod:`fnmatch` patterns
+      against which to check fields. Can be *None* and *[ ]* (empty).
+
+    :returns: *None* if there are no projections (all fields are
+      needed), otherwise a function that given a field name returns
+      non-false if any projection matches it.
+    """
+    if not projections:
+        return None
+    return _projections_compile(tuple(projections))
+
+
 def field_needed(field, projections):
     """
     Check if the name *field* matches any of the *patterns* (ala
@@ -3206,7 +3498,9 @@ def field_needed(field, projections):
        - *None* if the field should not be included
     """
     if projections:
-        # there is a list of must haves, check here first
+        if not _projections_compile(tuple(projections))(field):
+            return None		# we do not need this field
+        # there is a list of must haves, find which one matched
         for projection in projections:
             if fnmatch.fnmatch(field, projection):
                 return projection	# we need this field
@@ -3219,6 +3513,89 @@ def field_needed(field, projections):
 
 
 
+def _dict_to_flat_iter(d, prefix, match, empty_dict, add_dict,
+                       depth_limit):
+    # test dictionary emptiness with 'len(d) == 0' vs 'd == {}', since they
+    # could be ordereddicts and stuff
+    for key, val in d.items():
+        field_flat = key if prefix == None else prefix + str(key)
+        if isinstance(val, collections.abc.Mapping):
+            if len(val) == 0:
+                if add_dict and empty_dict \
+                   and (match == None or match(field_flat)):
+                    # yield an empty dictionary; do not yield VAL --
+                    # why? because otherwise it might be modified
+                    # later by somebody else and modify our SOURCE
+                    # dictionary, and we do not want that.
+                    yield field_flat, dict()
+            elif depth_limit > 0:	# dict to dig in
+                count = 0
+                for item in _dict_to_flat_iter(val, field_flat + ".", match,
+                                               empty_dict, add_dict,
+                                               depth_limit - 1):
+                    count += 1
+                    yield item
+                # finally, add the field some.field.that.is.a.dict =
+                # THEDICT it self; this allows doing things like
+                # "'somestring' in some.field.that.is.a.dict"; we only
+                # do it if this is a flattened dictionary, since
+                # otherwise, it is already done
+                #
+                # Longer: when we are creating the flat version of a dictionary
+                #
+                # - A:
+                #   - i:
+                #     - x: 2
+                #     - y: 4
+                #
+                # we were expanding as
+                #
+                # a.i.x: 2
+                # a.i.y: 4
+                # a: { i: { x: 2, y: 4 } }
+                #
+                # this adds
+                #
+                # a.i: { x: 2, y: 4 }
+                #
+                # so we have
+                #
+                # a.i.x: 2
+                # a.i.y: 4
+                # a.i: { x: 2, y: 4 }
+                # a: { i: { x: 2, y: 4 } }
+                #
+                # We only add it if something deeper than us passed
+                # the filters (count) and the field itself is
+                # required; note we do the checks from most simple to
+                # most complex.
+                if count \
+                   and add_dict \
+                   and '.' in field_flat \
+                   and (match == None or match(field_flat)):
+                    yield field_flat, val
+        elif match == None or match(field_flat):
+            yield field_flat, val
+
+
+def dict_to_flat_iter(d, projections = None, empty_dict = False,
+                      add_dict: bool = True):
+    """
+    Iterate over a nested dictionary as tuples *( KEY, VALUE )*
+
+    Same as :func:`dict_to_flat`, but it yields the tuples in the
+    natural order of the dictionaries as they are generated, so the
+    caller can consume them as they come (eg: feeding them to
+    :func:`flat_slist_to_dict`) without building a list.
+
+    Note that if *add_dict* is *True*, the tuple for a dictionary
+    comes after the tuples for its fields.
+    """
+    assert isinstance(d, collections.abc.Mapping)
+    return _dict_to_flat_iter(d, None, projections_matcher(projections),
+                              empty_dict, add_dict, 10)
+
+
 def dict_to_flat(d, projections = None, sort = True, empty_dict = False,
                  add_dict: bool = True):
     """Convert a nested dictionary to a sorted list of tuples *( KEY, VALUE )*
@@ -3259,128 +3636,42 @@ def dict_to_flat(d, projections = None, sort = True, empty_dict = False,
 
     :returns list: sorted list of tuples *KEY, VAL*
 
+    See :func:`dict_to_flat_iter` to avoid creating the list.
     """
-    assert isinstance(d, collections.abc.Mapping)
-    fl = []
-    def _add(field_flat, val):
-        if sort:
-            bisect.insort(fl, ( field_flat, val ))
-        else:
-            fl.append(( field_flat, val ))
-
-    # test dictionary emptiness with 'len(d) == 0' vs 'd == {}', since they
-    # could be ordereddicts and stuff
-
-    def __update_recursive(val, field, field_flat, projections = None,
-                           depth_limit = 10, prefix = "  ", sort = True,
-                           empty_dict = False):
-        # Merge d into dictionary od with a twist
-        #
-        # projections is a list of fields to include, if empty, means all
-        # of them
-        # a field X.Y.Z means od['X']['Y']['Z']
+    fl = list(dict_to_flat_iter(d, projections, empty_dict = empty_dict,
+                                add_dict = add_dict))
+    if sort:
+        # keys are unique, no need to compare the values
+        fl.sort(key = operator.itemgetter(0))
+    return fl
 
-        # GRRRR< has to dig deep first, so that a.a3.* goes all the way
-        # deep before evaluating if keepers or not -- I think we need to
-        # change it like that and maybe the evaluation can be done before
-        # the assignment.
 
-        if isinstance(val, collections.abc.Mapping):
-            if len(val) == 0 and add_dict and empty_dict == True \
-               and field_needed(field_flat, projections):
-                # append an empty dictionary; do not append VAL --
-                # why? because otherwise it might be modified later by
-                # somebody else and modify our SOURCE dictionary, and
-                # we do not want that.
-                _add(field_flat, dict())
-            elif depth_limit > 0:	# dict to dig in
-                len_before = len(fl)
-                for key, value in val.items():
-                    __update_recursive(value, key, field_flat + "." + str(key),
-                                       projections, depth_limit - 1,
-                                       prefix = prefix + "    ",
-                                       sort = sort, empty_dict = empty_dict)
-                len_after = len(fl)
-                # finally, add the field some.field.that.is.a.dict =
-                # THEDICT it self; this allows doing things like
-                # "'somestring' in some.field.that.is.a.dict"; we only
-                # do it if this is a flattened dictionary, since
-                # otherwise, it is already done
-                #
-                # Longer: when we are creating the flat version of a dictionary
-                #
-                # - A:
-                #   - i:
-                #     - x: 2
-                #     - y: 4
-                #
-                # we were expanding as
-                #
-                # a.i.x: 2
-                # a.i.y: 4
-                # a: { i: { x: 2, y: 4 } }
-                #
-                # this adds
-                #
-                # a.i: { x: 2, y: 4 }
-                #
-                # so we have
-                #
-                # a.i.x: 2
-                # a.i.y: 4
-                # a.i: { x: 2, y: 4 }
-                # a: { i: { x: 2, y: 4 } }
-                #
-                # Now, this check is messy -- we know we added fields
-                # using the len_after/before checks, meaning deeper
-                # than us there were things that checked the filters,
-                # so they had to be added; then we also need to check
-                # the field is required. -- note we do the checks from
-                # most simple to most complex.
-                if len_before < len_after \
-                   and add_dict \
-                   and '.' in field_flat \
-                   and val \
-                   and field_needed(field_flat, projections): \
-                    _add(field_flat, val)
-
-        elif field_needed(field_flat, projections):
-            _add(field_flat, val)
-
-    if len(d) == 0 and empty_dict == True:
-        # empty dict, insert it if we want them
-        # append an empty dictionary; do not append VAL --
-        # why? because otherwise it might be modified later by
-        # somebody else and modify our SOURCE dictionary, and
-        # we do not want that.
-        _add(field_flat, dict())
-    for key, _val in d.items():
-        __update_recursive(d[key], key, key, projections, 10, sort = sort,
-                           empty_dict = empty_dict)
-
-    return fl
+def _flat_to_dict(fl, tr, container):
+    # put each val in tr[key] if key is already fully expanded (it has
+    # no periods); otherwise walk down the key's sublevels, creating
+    # them with container() if missing or not a dictionary
+    for key, val in fl:
+        if '.' not in key:
+            tr[key] = val
+            continue
+        *path, key_last = key.split('.')
+        r = tr
+        for lhs in path:
+            rl = r.get(lhs, None)
+            if not isinstance(rl, dict):
+                rl = r[lhs] = container()
+            r = rl
+        r[key_last] = val
+    return tr
 
-def _key_rep(r, key, key_flat, val):
-    # put val in r[key] if key is already fully expanded (it has no
-    # periods); otherwise expand it recursively
-    if '.' in key:
-        # this key has sublevels, iterate over them
-        lhs, rhs = key.split('.', 1)
-        if lhs not in r:
-            r[lhs] = collections.OrderedDict()
-        elif not isinstance(r[lhs], dict):
-            r[lhs] = collections.OrderedDict()
-
-        _key_rep(r[lhs], rhs, key_flat, val)
-    else:
-        r[key] = val
 
 def flat_slist_to_dict(fl):
     """
     Given a sorted list of flat keys and values, convert them to a
     nested dictionary
 
-    :param list((str,object)): list of tuples of key and any value
+    :param list((str,object)): list (or any iterable, like
+      :func:`dict_to_flat_iter`) of tuples of key and any value
       alphabetically sorted by tuple; same sorting rules as in
       :func:`flat_keys_to_dict`.
 
@@ -3389,10 +3680,8 @@ def flat_slist_to_dict(fl):
     """
     # maintain the order in which we add things, we depend on this for
     # multiple things later on
-    tr = collections.OrderedDict()
-    for key, val in fl:
-        _key_rep(tr, key, key, val)
-    return tr
+    return _flat_to_dict(fl, collections.OrderedDict(),
+                         collections.OrderedDict)
 
 
 def flat_keys_to_dict(d):
@@ -3431,12 +3720,8 @@ def flat_keys_to_dict(d):
     :param dict d: dictionary of keys/values
     :returns dict: (nested) dictionary
     """
-    tr = {}
-
-    for key in sorted(d.keys()):
-        _key_rep(tr, key, key, d[key])
-
-    return tr
+    return _flat_to_dict(( ( key, d[key] ) for key in sorted(d) ), {},
+                         collections.OrderedDict)
 
 
 
@@ -4716,10 +5001,26 @@ class fsdb_symlink_c(fsdb_c):
             self.uuid = use_uuid
 
         self.location = dirname
+        # see _index_get()
+        self._index = None
+        self._index_mtime_ns = None
+
+    #: Seconds after the last modification of the directory for which
+    #: a key index can't be trusted
+    #:
+    #: Filesystems timestamp modifications with a coarse clock, so a
+    #: key added right after an index was built could leave the
+    #: directory's modification time unchanged; indexes built less
+    #: than this after the last modification are not reused.
+    index_mtime_margin = 0.05
 
     def _raw_valid(self, location):
         return os.path.islink(location)
 
+    def _raw_valid_entry(self, entry):
+        # same as _raw_valid(), for an os.DirEntry
+        return entry.is_symlink()
+
     def _raw_read(self, location):
         # we default to bytes so we return bytes
         value = os.readlink(location.encode())
@@ -4792,41 +5093,72 @@ class fsdb_symlink_c(fsdb_c):
                         l.append(filename)
         return l
 
+    def _index_get(self):
+        # Return a sorted list of the keys in the database and a list
+        # of ( KEY, RAWNAME ) in the same order
+        #
+        # Cached until the directory is modified; we don't need to
+        # lock, since in the worst case somebody modified it while we
+        # were reading it, so the modification time will differ next
+        # time and we'll read it again.
+        st = os.stat(self.location)
+        if self._index != None and st.st_mtime_ns == self._index_mtime_ns:
+            return self._index
+        ts_ns = time.time_ns()
+        index = []
+        with os.scandir(self.location) as entries:
+            for entry in entries:
+                if entry.name.endswith("##field_creation##") \
+                   or not self._raw_valid_entry(entry):
+                    continue
+                index.append(( urllib.parse.unquote(entry.name), entry.name ))
+        index.sort()
+        keys = [ key for key, _ in index ]
+        if ts_ns - st.st_mtime_ns > self.index_mtime_margin * 1000000000:
+            self._index = ( keys, index )
+            self._index_mtime_ns = st.st_mtime_ns
+        else:
+            self._index = None
+        return keys, index
+
+    _glob_prefix_regex = re.compile(r"[^*?[]*")
+
+    def _index_lookup(self, patterns):
+        # Return the ( KEY, RAWNAME ) of keys needed by the patterns
+        # (as in field_needed()), sorted by key
+        #
+        # A key can only match a pattern if it starts with the
+        # pattern's literal prefix (up to the first wildcard), so for
+        # each we only look at the range of the sorted key index
+        # that starts with it; only patterns that start with a
+        # wildcard need to look at all the keys.
+        keys, index = self._index_get()
+        if not patterns:
+            return index
+        match = projections_matcher(patterns)
+        positions = set()
+        for pattern in patterns:
+            prefix = self._glob_prefix_regex.match(pattern).group(0)
+            if not prefix:
+                return [ item for item in index if match(item[0]) ]
+            position = bisect.bisect_left(keys, prefix)
+            while position < len(keys) and keys[position].startswith(prefix):
+                if position not in positions and match(keys[position]):
+                    positions.add(position)
+                position += 1
+        return [ index[position] for position in sorted(positions) ]
+
     def get_as_slist(self, *patterns):
         fl = []
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
-            filenames = {}
-            for filename in filenames_raw:
-                filenames[urllib.parse.unquote(filename)] = filename
-            if patterns:	# that means no args given
-                use = {}
-                for filename, filename_raw in filenames.items():
-                    if field_needed(filename, patterns):
-                        use[filename] = filename_raw
-            else:
-                use = filenames
-            for filename, filename_raw in use.items():
-                if self._raw_valid(os.path.join(self.location, filename_raw)):
-                    bisect.insort(fl, ( filename, self._get_raw(filename_raw) ))
+        for key, key_raw in self._index_lookup(patterns):
+            value = self._get_raw(key_raw)
+            if value == None:	# removed since we listed it
+                continue
+            fl.append(( key, value ))
         return fl
 
     def get_as_dict(self, *patterns):
-        d = {}
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
-            filenames = {}
-            for filename in filenames_raw:
-                filenames[urllib.parse.unquote(filename)] = filename
-            if patterns:	# that means no args given
-                use = {}
-                for filename, filename_raw in filenames.items():
-                    if field_needed(filename, patterns):
-                        use[filename] = filename_raw
-            else:
-                use = filenames
-            for filename, filename_raw in use.items():
-                if self._raw_valid(os.path.join(self.location, filename_raw)):
-                    d[filename] = self._get_raw(filename_raw)
-        return d
+        return dict(self.get_as_slist(*patterns))
 
 
     def set(self, key, value, force = True,
@@ -5053,7 +5385,8 @@ class fsdb_symlink_c(fsdb_c):
 
 
     def set_keys(self, key_list, force = True,
-                 nested_flat_keyspace: bool = True):
+                 nested_flat_keyspace: bool = True,
+                 keys_index: dict = None):
         """
         Set multiple keys/values
 
@@ -5067,10 +5400,17 @@ class fsdb_symlink_c(fsdb_c):
           This ensures some cleanup in the key space is done that
           allows mapping nested dictionaries to flat key/values
 
+        :param dict keys_index: (optional; default scan the database)
+          index of the keys in the database as generated by
+          :meth:`_mkindex`, if the caller knows it (eg: *{}* for a
+          database that is known to be empty).
+
         Note this version optimizes the cleaning up of key space
         """
 
-        if nested_flat_keyspace:
+        if nested_flat_keyspace and keys_index != None:
+            all_keys_index = keys_index
+        elif nested_flat_keyspace:
             # because we'll set multiple fields, generate this index
             # only on the first run and use it for them all--this cuts
             # a lot of time
@@ -5145,6 +5485,9 @@ class fsdb_file_c(fsdb_symlink_c):
     def _raw_valid(self, location):
         return os.path.isfile(location)
 
+    def _raw_valid_entry(self, entry):
+        return entry.is_file()
+
     def _raw_read(self, location):
         with open(location, "rb") as f:
             return f.read()
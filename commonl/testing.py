@@ -220,6 +220,8 @@ class test_tcf_mixin(object):
         args.tags_spec = []
         args.repeat_evaluation = 1
         args.max_permutations = 10
+        args.permutations_seed = None
+        args.plan_only = False
         args.not_found_mismatch = False
         args.remove_tmpdir = True
         args.shard = None
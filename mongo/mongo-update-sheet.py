@@ -47,6 +47,13 @@ added/updated to a summary database called
 URL:DB:CID_summary_per_run. If none specifed, no summary DB updates
 will be done.
 
+The summaries are made from the run counters that
+tcfl.report_mongodb keeps updated in
+URL:DB:CID_counters_per_run as it inserts testcase records, so they
+don't need to aggregate over all the records in the run. For runs that
+have no counters (made before they were kept) the records are
+aggregated. Use --rebuild-counters to backfill them.
+
 If a Google Sheet id is specified with -i (along with other needed
 auth data in -c and -s) then the sheet will be updated with data from
 the summary DB.
@@ -71,9 +78,12 @@ main
   _mongo_mk_indexes()
 
   _summary_refresh()
-     _runids_postprocess_summary_per_run()
-     _runids_postprocess_blocked_per_target()
-     _runids_postprocess_failures_per_target_type()
+     _counters_rebuild()                      # --rebuild-counters
+     _summary_from_counters()                 # if counters for the run
+     _summary_from_raw()                      # otherwise
+       _runids_postprocess_summary_per_run()
+       _runids_postprocess_blocked_per_target()
+       _runids_postprocess_failures_per_target_type()
 
   sheet_update()
     URL:DB:COLLECTION_summary_by_run.find()
@@ -110,6 +120,7 @@ import mongol
 
 db = None
 summary_collection = None
+counters_collection = None
 
 class timestamp_c(object):
     def __init__(self):
@@ -171,7 +182,8 @@ def _mongo_mk_indexes():
     for collection_name in db.list_collection_names():
         if collection_name == "system.profile":
             continue
-        if collection_name.endswith("summary_per_run"):
+        if collection_name.endswith("summary_per_run") \
+           or collection_name.endswith("counters_per_run"):
             continue
         try:
             _mongo_mk_indexes_collection(db[collection_name])
@@ -918,6 +930,36 @@ def _summary_runids_redo():
     t.tick("cached RUNIDs in from raw database, got %d" % len(raw_runids))
     return raw_runids
 
+def _summary_stats(doc):
+    # doc has total/pass/errr/fail/blck/skip counters, either from an
+    # aggregation or from the run counters
+    passed = int(doc.get('pass', 0))
+    blocked = int(doc.get('blck', 0))
+    skipped = int(doc.get('skip', 0))
+    errored = int(doc.get('errr', 0))
+    failed = int(doc.get('fail', 0))
+    total = int(doc.get('total', 0))
+    if passed + errored + failed:
+        passed_percent = float(passed) / (passed + errored + failed)
+    else:
+        passed_percent = 1
+    if total:
+        blocked_percent = float(blocked) / total
+    else:
+        blocked_percent = 1
+
+    return {
+        'pass': passed,
+        'pass%': passed_percent,
+        'blck': blocked,
+        'blck%': blocked_percent,
+        'skip': skipped,
+        'fail': failed,
+        'errr': errored,
+        'total': total
+    }
+
+
 def _summary_refresh_per_component(runid_raw, runid_doc):
 
     t.tick("%s: summarizing per component" % runid_raw)
@@ -926,33 +968,8 @@ def _summary_refresh_per_component(runid_raw, runid_doc):
     # back computing here
     runid_doc['components'] = dict()
     for doc in _runids_postprocess_summary_per_component(runid_raw):
-        runid = doc['_id']['runid']
         component = doc['_id']['component']
-        passed = int(doc.get('pass', 0))
-        blocked = int(doc.get('blck', 0))
-        skipped = int(doc.get('skip', 0))
-        errored = int(doc.get('errr', 0))
-        failed = int(doc.get('fail', 0))
-        total = int(doc['total'])
-        if passed + errored + failed:
-            passed_percent = float(passed) / (passed + errored + failed)
-        else:
-            passed_percent = 1
-        if total:
-            blocked_percent = float(blocked) / total
-        else:
-            blocked_percent = 1
-
-        runid_doc['components'][component] = {
-            'pass': passed,
-            'pass%': passed_percent,
-            'blck': blocked,
-            'blck%': blocked_percent,
-            'skip': skipped,
-            'fail': failed,
-            'errr': errored,
-            'total': total
-        }
+        runid_doc['components'][component] = _summary_stats(doc)
     t.tick("%s: summarized per component" % runid_raw)
 
 
@@ -964,48 +981,17 @@ def _summary_refresh_per_target_types(runid_raw, runid_doc):
     # back computing here
     runid_doc['target_types_stats'] = dict()
     for doc in _runids_postprocess_summary_per_target_types(runid_raw):
-        runid = doc['_id']['runid']
         target_types = doc['_id']['target_types']
-        passed = int(doc.get('pass', 0))
-        blocked = int(doc.get('blck', 0))
-        skipped = int(doc.get('skip', 0))
-        errored = int(doc.get('errr', 0))
-        failed = int(doc.get('fail', 0))
-        total = int(doc['total'])
-        if passed + errored + failed:
-            passed_percent = float(passed) / (passed + errored + failed)
-        else:
-            passed_percent = 1
-        if total:
-            blocked_percent = float(blocked) / total
-        else:
-            blocked_percent = 1
-
-        runid_doc['target_types_stats'][target_types] = {
-            'pass': passed,
-            'pass%': passed_percent,
-            'blck': blocked,
-            'blck%': blocked_percent,
-            'skip': skipped,
-            'fail': failed,
-            'errr': errored,
-            'total': total
-        }
+        runid_doc['target_types_stats'][target_types] = _summary_stats(doc)
     t.tick("%s: summarized per target types" % runid_raw)
 
 
-def _summary_refresh(runid_raw):
-    runid = _runid_from_raw(runid_raw)
+def _summary_from_raw(runid_raw):
+    # Summarize aggregating over all the testcase documents in the run
     t.tick("%s: summarizing" % runid_raw)
     doc = None
     for doc in _runids_postprocess_summary_per_run(runid_raw):
         assert runid_raw == doc["_id"]
-        if args.url:
-            doc['url'] = args.url
-        if args.build_no:
-            doc['build_no'] = args.build_no
-        if args.runid_extra:
-            doc['runid_extra'] = args.runid_extra
         _summary_refresh_per_target_types(runid_raw, doc)
         _summary_refresh_per_component(runid_raw, doc)
         # This will (should) actually only run once, for this RUNID
@@ -1013,8 +999,7 @@ def _summary_refresh(runid_raw):
         break
 
     if doc == None:
-        t.tick("%s: runid not found" % runid_raw)
-        return
+        return None
     t.tick("%s: summarizing done" % runid_raw)
 
     doc_data = doc['data']
@@ -1053,6 +1038,154 @@ def _summary_refresh(runid_raw):
         doc.pop("_id")
         _doc.update(doc)
     t.tick("%s: failures per target type" % runid_raw)
+    return _doc
+
+
+def _counters_items(counters, name):
+    # counters[name] is a dict of escaped names and counters (which
+    # might have dropped to zero when testcases were replaced)
+    for key, value in counters.get(name, {}).items():
+        if isinstance(value, dict):
+            if value.get('total', 0) <= 0:
+                continue
+        elif value <= 0:
+            continue
+        yield urllib.parse.unquote(key), value
+
+
+def _summary_from_counters(runid_raw, counters):
+    # Summarize from the run counters tcfl.report_mongodb keeps as it
+    # inserts testcase documents; produces the same fields as
+    # _summary_from_raw(), minus the names of the testcases that
+    # failed/errored per target type.
+    t.tick("%s: summarizing from counters" % runid_raw)
+    _doc = _summary_stats(counters)
+    del _doc['pass%']		# different definition for the whole run
+    del _doc['blck%']
+    total_ran = _doc['pass'] + _doc['errr'] + _doc['fail'] + _doc['blck']
+    _doc['total_ran'] = total_ran
+    if _doc['pass'] + _doc['errr'] + _doc['fail']:
+        _doc['pass%'] = _doc['pass'] \
+            / (_doc['pass'] + _doc['errr'] + _doc['fail'])
+    else:
+        _doc['pass%'] = 0
+    for field in [ 'fail', 'errr', 'blck' ]:
+        _doc[field + '%'] = _doc[field] / total_ran if total_ran else 0
+
+    _doc['tcs'] = [ tc_name for tc_name, _ in _counters_items(counters, 'tcs') ]
+    _doc['total_tcs'] = len(_doc['tcs'])
+    for field in [ 'fail_tc_names', 'errr_tc_names' ]:
+        _doc[field] = []
+        for tc_name, count in _counters_items(counters, field):
+            _doc[field] += [ tc_name ] * count
+    for field in [ 'used_target_types', 'used_target_servers' ]:
+        _doc[field] = [ name for name, _ in _counters_items(counters, field) ]
+        _doc['number_' + field] = len(_doc[field])
+
+    _doc['components'] = {
+        component: _summary_stats(stats)
+        for component, stats in _counters_items(counters, 'components')
+    }
+    _doc['target_types_stats'] = {
+        target_types: _summary_stats(stats)
+        for target_types, stats in _counters_items(counters,
+                                                   'target_types_stats')
+    }
+
+    # same reduction _runids_postprocess_failures_per_target_type()
+    # and _runids_postprocess_error_per_target_type() do
+    failed = collections.defaultdict(int)
+    errored = collections.defaultdict(int)
+    for target_types, stats in _doc['target_types_stats'].items():
+        target_type = target_types.split(":")[0]
+        failed[target_type] += stats['fail']
+        errored[target_type] += stats['errr']
+    _doc['target_types'] = [
+        { 'failed_target_type': target_type, 'failed': count }
+        for target_type, count in failed.items() if count
+    ]
+    _doc['error_per_target_type'] = [
+        { 'error_target_type': target_type, 'error': count }
+        for target_type, count in errored.items() if count
+    ]
+
+    for field, result, name in [
+            ( 'targets_blocked', 'blck', 'blocked' ),
+            ( 'targets_failed', 'fail', 'failed' ),
+            ( 'targets_errored', 'errr', 'errors' ),
+    ]:
+        _doc[field] = []
+        for target_name, stats in _counters_items(counters, 'targets'):
+            if not stats.get(result, 0):
+                continue
+            # server URLs have slashes, target IDs don't
+            server, targetid = target_name.rsplit("/", 1)
+            _doc[field].append({
+                'targets': { 'target': { 'server': server, 'id': targetid } },
+                name: stats[result],
+            })
+
+    # data is not counted, get just that from the testcase documents
+    _doc['data'] = []
+    _doc['data-v2'] = []
+    for doc in db[args.collection_id].find(
+            {
+                # match on both fields so the runid-hash index is used
+                "runid": runid_raw,
+                "hashid": { "$exists": True },
+                "data": { "$exists": True, "$ne": {} },
+            },
+            { "data": 1, "data-v2": 1 }):
+        _doc['data'].append(doc['data'])
+        if doc.get('data-v2', None):
+            _doc['data-v2'].append(doc['data-v2'])
+    t.tick("%s: summarized from counters" % runid_raw)
+    return _doc
+
+
+def _counters_rebuild(runid_raw):
+    # Backfill: recompute the run counters from the testcase documents
+    t.tick("%s: rebuilding counters" % runid_raw)
+    inc = {}
+    for doc in db[args.collection_id].find(
+            {
+                # match on both fields so the runid-hash index is used
+                "runid": runid_raw,
+                "hashid": { "$exists": True },
+            },
+            {
+                'result': 1, 'components': 1, 'target_types': 1,
+                'target_servers': 1, 'targets': 1, 'tc_name': 1,
+            }):
+        mongol.counters_inc(inc, doc, 1)
+    counters_collection.delete_one({ '_id': runid_raw })
+    if inc:
+        counters_collection.update_one(
+            { '_id': runid_raw }, { "$inc": inc }, upsert = True)
+    t.tick("%s: rebuilt counters" % runid_raw)
+
+
+def _summary_refresh(runid_raw):
+    runid = _runid_from_raw(runid_raw)
+    if args.rebuild_counters:
+        _counters_rebuild(runid_raw)
+    counters = None
+    if not args.summary_from_raw:
+        counters = counters_collection.find_one({ '_id': runid_raw })
+    if counters:
+        _doc = _summary_from_counters(runid_raw, counters)
+    else:
+        # no counters for this run (older than the counters?)
+        _doc = _summary_from_raw(runid_raw)
+    if _doc == None:
+        t.tick("%s: runid not found" % runid_raw)
+        return
+    if args.url:
+        _doc['url'] = args.url
+    if args.build_no:
+        _doc['build_no'] = args.build_no
+    if args.runid_extra:
+        _doc['runid_extra'] = args.runid_extra
 
     summary_collection.update_one(
         { '_id': runid }, { "$set": _doc }, upsert = True)
@@ -2202,6 +2335,18 @@ if __name__ == "__main__":
     arg_parser.add_argument("--mk-indexes", action = "store_true",
                             default = False,
                             help = "Create indexes (in background)")
+    arg_parser.add_argument("--summary-from-raw", action = "store_true",
+                            default = False,
+                            help = "Summarize aggregating all the testcase"
+                            " documents of each run instead of from the"
+                            " run counters (slow)")
+    arg_parser.add_argument("--rebuild-counters", action = "store_true",
+                            default = False,
+                            help = "Recompute the run counters from the"
+                            " testcase documents before summarizing each"
+                            " run (for backfilling runs made before they"
+                            " were kept or fixing them); use with"
+                            " --runid redo to rebuild all")
     arg_parser.add_argument("--runid-summary-list", action = "store_true",
                             default = False,
                             help = "List runids available in summary")
@@ -2228,6 +2373,7 @@ if __name__ == "__main__":
     if not args.collection_id:
         raise ValueError("Please specify --collection-id")
     summary_collection = db[args.summary_collection_id]
+    counters_collection = db[args.counters_collection_id]
 
     t = timestamp_c()
     if args.mk_indexes:
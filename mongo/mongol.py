@@ -6,6 +6,8 @@
 
 import ssl
 
+import tcfl.report_mongodb
+
 def arg_parse_add(arg_parser):
     arg_parser.add_argument("--mongo-url", action = "store",
                             default = "http://localhost:7061/database",
@@ -22,6 +24,11 @@ def arg_parse_add(arg_parser):
                             type = str, default = None,
                             help = "Default collection to use (defaults "
                             "to COLLECTION-ID_summary_per_run")
+    arg_parser.add_argument("--counters-collection-id", action = "store",
+                            type = str, default = None,
+                            help = "Collection with the run counters kept by"
+                            " tcfl.report_mongodb (defaults to"
+                            " COLLECTION-ID_counters_per_run")
     arg_parser.add_argument("--mongo-cert", action = "store",
                             default = None,
                             help = "Pointer to certificate file bundle "
@@ -48,3 +55,11 @@ def args_chew(args, extra_params):
             extra_params["ssl_cert_reqs"] = ssl.CERT_NONE
     if not args.summary_collection_id:
         args.summary_collection_id = args.collection_id + "_summary_per_run"
+    if not args.counters_collection_id:
+        args.counters_collection_id = args.collection_id + "_counters_per_run"
+
+
+# the driver keeps the run counters as it inserts testcase documents;
+# we use the same to rebuild them from the testcase documents
+counters_key = tcfl.report_mongodb.counters_key
+counters_inc = tcfl.report_mongodb.counters_inc
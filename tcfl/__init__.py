@@ -2409,7 +2409,7 @@ class server_c:
                 # empty, the presence of the key might be used by
                 # clients to tell things about the remote target
                 server_rts_flat[fullid].update(
-                    commonl.dict_to_flat(rt, empty_dict = True))
+                    commonl.dict_to_flat_iter(rt, empty_dict = True))
 
             if projections:
                 if isinstance(projections, set):
@@ -7,14 +7,20 @@
 
 import codecs
 import errno
+import fnmatch
 import hashlib
 import inspect
+import json
 import logging
 import math
 import os
 import re
 import shutil
 import subprocess
+import threading
+import time
+
+import filelock
 
 import commonl
 import tcfl.tc
@@ -26,6 +32,299 @@ import __main__
 #: boot Zephyr
 boot_delay = {}
 
+class build_cache_c:
+    """
+    Cache of Zephyr builds
+
+    When the same Zephyr App is built for the same board with the same
+    configuration (eg: a testcase running on many target groups with
+    the same type of targets), it is built only once; any other
+    testcase building it at the same time waits for the first build
+    to complete and then all of them copy the artifacts from a cache
+    kept in disk (at :data:`path`) with the least recently used
+    builds removed when it grows over :data:`size_max`.
+
+    The cache key is a hash of:
+
+    - the App's source tree (paths, sizes and modification times)
+    - the Zephyr tree (*ZEPHYR_BASE*, its git revision and
+      uncommitted changes, if any)
+    - board, BSP and extra build arguments
+    - configuration fragments written to the build directory
+    - toolchain selection and SDK version
+
+    - the run: the *RunID* given to *tcf run* or, if none, the run
+      itself, so images tagged with a run are never used by another
+
+    The cache is disabled by default: when enabled, the *TC_RUNID*
+    define an App is built with is the *RunID* given to *tcf run* vs
+    *RUNID:TG_HASH*, since the binaries have to be the same for all
+    the target groups; Apps or testcases that expect the *:TG_HASH*
+    suffix (eg: to verify which target group a target is running
+    in) won't find it.
+
+    Enable and configure in any :ref:`TCF configuration file
+    <tcf_client_configuration>` with:
+
+    >>> tcfl.app_zephyr.build_cache_c.enabled = True
+    >>> tcfl.app_zephyr.build_cache_c.size_max = 10 * 1024 * 1024 * 1024
+    """
+
+    #: Use the build cache? (changes *TC_RUNID*, see above)
+    enabled = False
+
+    #: Where to keep the build cache
+    path = os.path.join(os.path.expanduser("~"), ".cache", "tcf",
+                        "zephyr-build")
+
+    #: Maximum size in bytes of the builds kept in the cache
+    size_max = 2 * 1024 * 1024 * 1024
+
+    #: Files (relative to the build directory, *fnmatch* patterns) to
+    #: keep in the cache for each build; these are what is needed to
+    #: evaluate filters, get the kernel's symbols and deploy
+    artifacts = [
+        ".config", "*.elf", "*.bin", "*.hex", "*.map",
+        "zephyr/.config", "zephyr/*.elf", "zephyr/*.bin", "zephyr/*.hex",
+        "zephyr/*.map",
+    ]
+
+    #: Environment variables that select the toolchain
+    environment_keys = [
+        'ESPRESSIF_TOOLCHAIN_PATH',
+        'ISSM_INSTALLATION_PATH',
+        'XTENSA_SDK',
+        'ZEPHYR_GCC_VARIANT',
+        'ZEPHYR_SDK_INSTALL_DIR',
+        'ZEPHYR_TOOLCHAIN_VARIANT',
+    ]
+
+    # Version of the Zephyr tree, keyed by ZEPHYR_BASE; it is
+    # expensive to compute and doesn't change during a run
+    _zephyr_base_versions = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _zephyr_base_version(cls, zephyr_base):
+        with cls._lock:
+            version = cls._zephyr_base_versions.get(zephyr_base, None)
+            if version != None:
+                return version
+            h = hashlib.sha256()
+            h.update(zephyr_base.encode('utf-8'))
+            try:
+                h.update(subprocess.check_output(
+                    [ 'git', '-C', zephyr_base, 'rev-parse', 'HEAD' ],
+                    stderr = subprocess.DEVNULL))
+                h.update(subprocess.check_output(
+                    [ 'git', '-C', zephyr_base, 'diff', 'HEAD' ],
+                    stderr = subprocess.DEVNULL))
+            except (OSError, subprocess.CalledProcessError):
+                # not a git tree, use what version it declares
+                version_file = os.path.join(zephyr_base, "VERSION")
+                if os.path.exists(version_file):
+                    commonl.hash_file(h, version_file)
+            version = h.hexdigest()
+            cls._zephyr_base_versions[zephyr_base] = version
+            return version
+
+    @staticmethod
+    def _tree_hash(h, path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                h.update(("%s %d %d\n" % (
+                    os.path.relpath(filepath, path),
+                    st.st_size, st.st_mtime_ns)).encode('utf-8'))
+
+    @classmethod
+    def key(cls, target, build_cmds):
+        """
+        Compute the cache key for the current build of a target
+
+        :param tcfl.tc.target_c target: target whose active BSP is
+          being built
+        :param str build_cmds: build command templates, so changes
+          in how we build invalidate the cache
+        :returns str: cache key
+        """
+        kws = target.kws
+        h = hashlib.sha256()
+        h.update(build_cmds.encode('utf-8'))
+        for key in [ 'zephyr_board', 'bsp', 'zephyr_extra_args',
+                     'zephyr_is_cmake', 'zephyr_runid' ]:
+            h.update(("%s=%s\n" % (key, kws.get(key, None))).encode('utf-8'))
+        # the binaries are tagged with the RunID (TC_RUNID), which
+        # is empty if none was given; then only this run can use them
+        h.update(("runid=%s\n" % (kws.get('runid', None)
+                                   or tcfl.tc.tc_c.tmpdir)).encode('utf-8'))
+        for key in cls.environment_keys:
+            h.update(("%s=%s\n" % (key, os.environ.get(key, None)))
+                     .encode('utf-8'))
+        sdk_dir = os.environ.get('ZEPHYR_SDK_INSTALL_DIR', None)
+        if sdk_dir:
+            sdk_version = os.path.join(sdk_dir, "sdk_version")
+            if os.path.exists(sdk_version):
+                commonl.hash_file(h, sdk_version)
+        zephyr_base = os.environ.get('ZEPHYR_BASE', None)
+        if zephyr_base:
+            h.update(cls._zephyr_base_version(zephyr_base).encode('utf-8'))
+        cls._tree_hash(h, kws['zephyr_srcdir'])
+        # configuration fragments written by config_file_write()
+        objdir = kws['zephyr_objdir']
+        for filename in sorted(os.listdir(objdir)):
+            if filename.endswith(".conf"):
+                h.update(filename.encode('utf-8'))
+                commonl.hash_file(h, os.path.join(objdir, filename))
+        return h.hexdigest()
+
+    @classmethod
+    def lock(cls, key):
+        """
+        Return a lock to hold while building or restoring a build
+        (across threads and processes)
+        """
+        commonl.makedirs_p(cls.path)
+        return filelock.FileLock(os.path.join(cls.path, key + ".lock"))
+
+    @classmethod
+    def restore(cls, key, objdir):
+        """
+        Copy a cached build's artifacts to a build directory
+
+        Must be called with :meth:`lock` held.
+
+        :returns float: seconds the original build took or *None* if
+          not in the cache
+        """
+        entry = os.path.join(cls.path, key)
+        try:
+            with open(os.path.join(entry, "metadata.json")) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for dirpath, _dirnames, filenames in os.walk(entry):
+            for filename in filenames:
+                src = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(src, entry)
+                if relpath == "metadata.json":
+                    continue
+                dst = os.path.join(objdir, relpath)
+                commonl.makedirs_p(os.path.dirname(dst))
+                shutil.copy2(src, dst)
+        # mark as recently used, so it is evicted last
+        os.utime(entry)
+        return metadata['build_seconds']
+
+    @classmethod
+    def store(cls, key, objdir, build_seconds):
+        """
+        Save a build's artifacts in the cache
+
+        Must be called with :meth:`lock` held.
+        """
+        entry = os.path.join(cls.path, key)
+        entry_tmp = entry + ".tmp-%d" % os.getpid()
+        shutil.rmtree(entry_tmp, ignore_errors = True)
+        size = 0
+        for dirpath, _dirnames, filenames in os.walk(objdir):
+            for filename in filenames:
+                src = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(src, objdir)
+                for pattern in cls.artifacts:
+                    if fnmatch.fnmatchcase(relpath, pattern):
+                        break
+                else:
+                    continue
+                dst = os.path.join(entry_tmp, relpath)
+                commonl.makedirs_p(os.path.dirname(dst))
+                shutil.copy2(src, dst)
+                size += os.path.getsize(dst)
+        commonl.makedirs_p(entry_tmp)
+        with open(os.path.join(entry_tmp, "metadata.json"), "w") as f:
+            json.dump({ 'build_seconds': build_seconds, 'size': size }, f)
+        shutil.rmtree(entry, ignore_errors = True)
+        os.rename(entry_tmp, entry)
+        cls.trim()
+
+    @classmethod
+    def trim(cls):
+        """
+        Remove the least recently used builds until the cache is
+        smaller than :data:`size_max`
+        """
+        entries = []
+        size_total = 0
+        for entry in os.scandir(cls.path):
+            if not entry.is_dir() or ".tmp-" in entry.name:
+                continue
+            try:
+                with open(os.path.join(entry.path, "metadata.json")) as f:
+                    size = json.load(f)['size']
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append(( entry.stat().st_mtime, size, entry.path ))
+            size_total += size
+        entries.sort()
+        for _mtime, size, path in entries:
+            if size_total <= cls.size_max:
+                break
+            shutil.rmtree(path, ignore_errors = True)
+            size_total -= size
+
+    @staticmethod
+    def _stats_file():
+        return os.path.join(tcfl.tc.tc_c.tmpdir, "zephyr-build-cache.stats")
+
+    @classmethod
+    def stats_record(cls, hit, build_seconds):
+        """
+        Record a build cache hit or miss for the run summary
+
+        Testcases might run in multiple processes, so each one
+        appends a line to a file in the run's temporary directory.
+        """
+        # small appends are atomic, no need to lock
+        with open(cls._stats_file(), "a") as f:
+            f.write("%d %f\n" % (hit, build_seconds))
+
+    @classmethod
+    def stats_report(cls, tc_global, _result):
+        """
+        Report build cache hit rate and seconds saved for the run
+
+        Registered in :data:`tcfl.tc.tc_c.hook_run_post`.
+        """
+        try:
+            with open(cls._stats_file()) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        hits = 0
+        seconds_saved = 0
+        for line in lines:
+            hit, build_seconds = line.split()
+            if hit == "1":
+                hits += 1
+                seconds_saved += float(build_seconds)
+        tc_global.report_info(
+            "Zephyr build cache: %d/%d builds reused (%.0f%%), saved %.1fs"
+            % (hits, len(lines), 100.0 * hits / len(lines), seconds_saved),
+            dict(hits = hits, builds = len(lines),
+                 seconds_saved = seconds_saved),
+            level = 0)
+        tc_global.report_data("Zephyr build cache", "builds", len(lines))
+        tc_global.report_data("Zephyr build cache", "hits", hits)
+        tc_global.report_data("Zephyr build cache", "seconds saved",
+                              seconds_saved)
+
+tcfl.tc.tc_c.hook_run_post.append(build_cache_c.stats_report)
+
 class app_zephyr(tcfl.app.app_c):
     """
     Support for configuring, building, deploying and evaluating a Zephyr-OS
@@ -282,6 +581,14 @@ CONFIG_BOOT_DELAY=0
         # Set MAKE to mirror environ's, in case we are being called
         # under a Makefile, so we get the right setting for jobserver
         target.kw_set('MAKE', os.environ.get('MAKE', 'make'), bsp = target.bsp)
+        # When caching, all the target groups shall build the same
+        # binary, so the RunID tag can't be specific to one
+        if build_cache_c.enabled:
+            target.kw_set('zephyr_runid', '%(runid)s' % target.kws,
+                          bsp = target.bsp)
+        else:
+            target.kw_set('zephyr_runid', '%(runid)s:%(tg_hash)s' % target.kws,
+                          bsp = target.bsp)
         # Newer Zephyr SDKs provide prebuilt host tools we can use; if
         # we don't have access to it, then we re-build them
         if target.kws['zephyr_is_cmake']:
@@ -296,27 +603,101 @@ CONFIG_BOOT_DELAY=0
                 raise tcfl.tc.blocked_e(
                     "Can't find kconfig tool in ZEPHYR_SDK_INSTALL_DIR (%s)"
                     % zephyr_sdk_install_dir)
+
+        if not build_cache_c.enabled:
+            app_zephyr._build(testcase, target)
+        else:
+            key = build_cache_c.key(
+                target, app_zephyr._cmd_configure_cmake
+                + app_zephyr._cmd_configure + app_zephyr._cmd_build)
+            # if someone else is building this, we'll wait for them
+            # to be done and get it from the cache
+            with build_cache_c.lock(key):
+                build_seconds = build_cache_c.restore(
+                    key, target.kws['zephyr_objdir'])
+                if build_seconds != None:
+                    target.report_info(
+                        "reusing cached build %s, saved %.1fs"
+                        % (key[:10], build_seconds), dlevel = 1)
+                    build_cache_c.stats_record(True, build_seconds)
+                    app_zephyr._filter(testcase, target)
+                else:
+                    ts0 = time.time()
+                    app_zephyr._build(testcase, target)
+                    build_seconds = time.time() - ts0
+                    build_cache_c.store(
+                        key, target.kws['zephyr_objdir'], build_seconds)
+                    build_cache_c.stats_record(False, build_seconds)
+
+        # Explicitly say which BSP to work with, so when building a
+        # stub we don't get the config file from the non-stub BSPs
+        config = target.zephyr.config_file_read(bsp = target.bsp)
+        # unicode -> so weird chars don't make us panic
+        kernelname = str(config['CONFIG_KERNEL_BIN_NAME'])
+        if target.kws['zephyr_is_cmake']:
+            elf = os.path.join(
+                target.kws['zephyr_objdir'], "zephyr", kernelname + ".elf")
+        else:
+            elf = os.path.join(
+                target.kws['zephyr_objdir'], kernelname + ".elf")
+        symbols = subprocess.check_output([ 'nm', elf ], encoding = 'utf-8',
+                                          errors = 'replace')
+        for line in symbols.splitlines():
+            token = line.split()
+            if len(token) == 3 and token[2] == '__start':
+                target.kw_set('__start', '0x' + token[0])
+                break
+        else:
+            raise tcfl.tc.error_e("Cannot find Zephyr's __start!",
+                                  { "symbols": symbols } )
+
+    _cmd_configure_cmake = \
+        'cmake' \
+        ' -DBOARD=%(zephyr_board)s -DARCH=%(bsp)s' \
+        ' -DEXTRA_CPPFLAGS="-DTC_RUNID=%(zephyr_runid)s"' \
+        ' -DEXTRA_CFLAGS="-Werror -Wno-error=deprecated-declarations"' \
+        ' -DEXTRA_AFLAGS=-Wa,--fatal-warnings' \
+        ' -DEXTRA_LDFLAGS=-Wl,--fatal-warnings' \
+        ' %(zephyr_extra_args)s' \
+        ' -B"%(zephyr_objdir)s" -H"%(zephyr_srcdir)s"'
+
+    _cmd_configure = \
+        '%(MAKE)s -C %(zephyr_srcdir)s/' \
+        ' EXTRA_CFLAGS="-Werror -Wno-error=deprecated-declarations"' \
+        ' KCPPFLAGS=-DTC_RUNID=%(zephyr_runid)s' \
+        ' BOARD=%(zephyr_board)s ARCH=%(bsp)s %(zephyr_extra_args)s' \
+        ' O=%(zephyr_objdir)s initconfig'
+
+    _cmd_build = \
+        '%(MAKE)s -C %(zephyr_srcdir)s' \
+        ' EXTRA_CFLAGS="-Werror -Wno-error=deprecated-declarations"' \
+        ' KCPPFLAGS=-DTC_RUNID=%(zephyr_runid)s' \
+        ' BOARD=%(zephyr_board)s ARCH=%(bsp)s %(zephyr_extra_args)s' \
+        ' O=%(zephyr_objdir)s'
+
+    @staticmethod
+    def _build(testcase, target):
+        # Configure, filter and build the kernel
+        if target.kws['zephyr_is_cmake']:
             # Generate initial config, so we can filter on it
-            target.shcmd_local(
-                'cmake'
-                ' -DBOARD=%(zephyr_board)s -DARCH=%(bsp)s'
-                ' -DEXTRA_CPPFLAGS="-DTC_RUNID=%(runid)s:%(tg_hash)s"'
-                ' -DEXTRA_CFLAGS="-Werror -Wno-error=deprecated-declarations"'
-                ' -DEXTRA_AFLAGS=-Wa,--fatal-warnings'
-                ' -DEXTRA_LDFLAGS=-Wl,--fatal-warnings'
-                ' %(zephyr_extra_args)s'
-                ' -B"%(zephyr_objdir)s" -H"%(zephyr_srcdir)s"')
+            target.shcmd_local(app_zephyr._cmd_configure_cmake)
             target.shcmd_local(
                 '%(MAKE)s -C %(zephyr_objdir)s'
                 ' config-sanitycheck')
         else:
+            target.shcmd_local(app_zephyr._cmd_configure)
+
+        app_zephyr._filter(testcase, target)
+
+        # Build the kernel
+        if target.kws['zephyr_is_cmake']:
             target.shcmd_local(
-                '%(MAKE)s -C %(zephyr_srcdir)s/'
-                ' EXTRA_CFLAGS="-Werror -Wno-error=deprecated-declarations"'
-                ' KCPPFLAGS=-DTC_RUNID=%(runid)s:%(tg_hash)s'
-                ' BOARD=%(zephyr_board)s ARCH=%(bsp)s %(zephyr_extra_args)s'
-                ' O=%(zephyr_objdir)s initconfig')
+                '%(MAKE)s -C %(zephyr_objdir)s')
+        else:
+            target.shcmd_local(app_zephyr._cmd_build)
 
+    @staticmethod
+    def _filter(testcase, target):
         # If we have a filter and we are not building a stub, filter
         # for config options, which define the method). Will
         # raise an skip exception if it doesn't have to be run.
@@ -338,44 +719,6 @@ CONFIG_BOOT_DELAY=0
                 _filter, _filter_origin
             )
 
-        # Explicitly say which BSP to work with, so when building a
-        # stub we don't get the config file from the non-stub BSPs
-        config = target.zephyr.config_file_read(bsp = target.bsp)
-        # unicode -> so weird chars don't make us panic
-        kernelname = str(config['CONFIG_KERNEL_BIN_NAME'])
-        # Build the kernel
-        if target.kws['zephyr_is_cmake']:
-            target.shcmd_local(
-                '%(MAKE)s -C %(zephyr_objdir)s')
-            symbols = subprocess.check_output([
-                'nm',
-                os.path.join(
-                    target.kws['zephyr_objdir'],
-                    "zephyr",
-                    kernelname + ".elf")
-                ])
-        else:
-            target.shcmd_local(
-                '%(MAKE)s -C %(zephyr_srcdir)s'
-                ' EXTRA_CFLAGS="-Werror -Wno-error=deprecated-declarations"'
-                ' KCPPFLAGS=-DTC_RUNID=%(runid)s:%(tg_hash)s'
-                ' BOARD=%(zephyr_board)s ARCH=%(bsp)s %(zephyr_extra_args)s'
-                ' O=%(zephyr_objdir)s')
-            symbols = subprocess.check_output([
-                'nm',
-                os.path.join(
-                    target.kws['zephyr_objdir'],
-                    kernelname + ".elf")
-            ])
-        for line in symbols.splitlines():
-            token = line.split()
-            if len(token) == 3 and token[2] == '__start':
-                target.kw_set('__start', '0x' + token[0])
-                break
-        else:
-            raise tcfl.tc.error_e("Cannot find Zephyr's __start!",
-                                  { "symbols": symbols } )
-
     @staticmethod
     def deploy(images, testcase, target, app_src):
         if target.kws['zephyr_is_cmake']:
@@ -130,6 +130,14 @@ values that are inherit to the BIOS:
   defaults to *UEFI PXEv4 (MAC:MACADDR)): name of the boot entry that
   boots PXE.
 
+- *bios.screen_model* (bool; default *False*): navigate menus looking
+  at a model of the whole screen (see :class:`screen_c`) instead of
+  pressing one key at a time and waiting for the highlighted entry.
+
+- *bios.screen_columns* and *bios.screen_rows* (positive integers;
+  defaults 132 and 50): size of the screen model; has to be at
+  least as large as what the BIOS draws.
+
 .. _biosl_ansi_shortref:
 
 ANSI short reference
@@ -181,12 +189,17 @@ Always use :meth:`tcfl.tc.target_c.console_tx` vs *target.console.write()*
 Otherwise the send/expect gets out of sync and things don't work as expected.
 
 """
+import codecs
 import collections
+import functools
 import math
 import numbers
+import os
 import re
 import time
 
+import pyte
+
 import commonl
 import tcfl.tc
 import tcfl.tl
@@ -310,13 +323,369 @@ def scroll_updown(target,
 
 
 
+@functools.lru_cache(maxsize = None)
+def _ansi_attrs(highlight_string: str):
+    # Render a highlight sequence (a Python regex, as the
+    # *highlight_string* arguments) to get the attributes pyte
+    # assigns to the text that follows it
+    s = re.sub(r"\\x([0-9a-fA-F]{2})",
+               lambda m: chr(int(m.group(1), 16)), highlight_string)
+    s = re.sub(r"\\([^0-9a-zA-Z])", r"\1", s)
+    screen = pyte.Screen(10, 1)
+    pyte.Stream(screen).feed(s + "X")
+    char = screen.buffer[0][0]
+    return char.fg, char.bg, char.bold, char.reverse
+
+
+class screen_c:
+    """
+    Model of what is displayed on a console, as a terminal would
+    render it
+
+    BIOS menus redraw parts of the screen in any order, placing text
+    with ANSI sequences; by feeding everything received from the
+    console to a terminal emulator (:mod:`pyte`, as
+    :func:`tcfl.tl.ansi_render_approx`) we can look at the whole
+    menu at once, see which entry is highlighted and compute how many
+    keystrokes away is the one we want.
+
+    >>> screen = tcfl.biosl.screen_get(target)
+    >>> screen.update(target)
+    >>> entries = screen.menu_entries(4, tcfl.biosl.normal_white_fg_black_bg)
+
+    :param int width: (optional) screen width; make it larger than
+      what the BIOS uses, so text positioned on the last columns is
+      not wrapped.
+
+    :param int height: (optional) screen height; same as *width*
+    """
+    def __init__(self, width: int = 132, height: int = 50):
+        assert isinstance(width, int) and width > 20
+        assert isinstance(height, int) and height > 20
+        self.screen = pyte.Screen(width, height)
+        self.stream = pyte.Stream(self.screen)
+        self.decoder = codecs.getincrementaldecoder('utf-8')(
+            errors = 'replace')
+        # where we are in the console capture file
+        self.offset = 0
+        self.inode = None
+
+    def reset(self):
+        self.screen.reset()
+        self.decoder.reset()
+
+    def feed(self, data: bytes):
+        """
+        Feed data received from the console
+        """
+        self.stream.feed(self.decoder.decode(data))
+
+    def update(self, target, console: str = None):
+        """
+        Feed what has been received from the console since the last
+        update
+
+        This reads the console capture file kept by the expect engine
+        (see :meth:`tcfl.target_ext_console.extension.text_capture_file`),
+        so it is usually called after
+        :meth:`tcfl.target_ext_console.extension.wait_for_no_output`
+        or :meth:`tcfl.tc.target_c.expect` have read from the console.
+        """
+        of = target.console.text_capture_file(console)
+        if of == None:
+            return
+        stat_info = os.stat(of.name)
+        if stat_info.st_ino != self.inode or stat_info.st_size < self.offset:
+            # new capture file, start from scratch
+            self.reset()
+            self.inode = stat_info.st_ino
+            self.offset = 0
+        with open(of.name, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        self.feed(data)
+
+    def display(self):
+        """
+        :returns list(str): text of each row of the screen
+        """
+        return self.screen.display
+
+    # an entry's text finishes at two spaces or a box drawing line
+    _entry_end_regex = re.compile(r"\s{2,}|[|│║]")
+
+    def entry_at(self, row: int, column: int):
+        """
+        Return the text of the menu entry starting at a position
+
+        :param int row: row (zero based)
+        :param int column: column (zero based)
+        :returns str: text of the entry (which might start with
+          spaces) or *None* if there is no entry starting there
+        """
+        line = self.screen.display[row]
+        # text starting before the column is something else (titles...)
+        if column > 0 and line[column - 1].isalnum():
+            return None
+        text = line[column:]
+        stripped = text.lstrip()
+        if not stripped or len(text) - len(stripped) > 1:
+            return None
+        m = self._entry_end_regex.search(stripped)
+        if m:
+            stripped = stripped[:m.start()]
+        if not stripped:
+            return None
+        return text[:len(text) - len(text.lstrip())] + stripped
+
+    def runs_with_attrs(self, row: int, attrs: tuple):
+        """
+        Return the runs of non-blank text in a row that are displayed
+        with the given attributes
+
+        :param int row: row (zero based)
+        :param tuple attrs: attributes (as returned by
+          :func:`_ansi_attrs`)
+        :returns list: list of *(COLUMN, TEXT)*
+        """
+        runs = []
+        column_start = None
+        text = ""
+        line = self.screen.buffer[row]
+        for column in range(self.screen.columns):
+            char = line[column]
+            if ( char.fg, char.bg, char.bold, char.reverse ) == attrs:
+                if column_start == None:
+                    column_start = column
+                text += char.data
+                continue
+            if column_start != None and text.strip():
+                runs.append(( column_start, text ))
+            column_start = None
+            text = ""
+        if column_start != None and text.strip():
+            runs.append(( column_start, text ))
+        return runs
+
+    def menu_entries(self, column_key: int, highlight_string: str,
+                     rows = None):
+        """
+        Return the menu entries displayed on a column
+
+        :param int column_key: column (one based, as in ANSI sequences)
+          where the entries' names are displayed
+        :param str highlight_string: ANSI sequence that highlights an
+          entry (see :func:`menu_scroll_to_entry`)
+        :param rows: (optional; default all) rows (zero based) to look
+          into
+        :returns list(dict): for each entry, sorted by row, a
+          dictionary with fields *row*, *column*, *key*, *highlighted*
+          and, if the highlight is on a value rather than on the key,
+          *column_value* and *value*
+        """
+        attrs = _ansi_attrs(highlight_string)
+        column = column_key - 1
+        if rows == None:
+            rows = range(self.screen.lines)
+        entries = []
+        for row in rows:
+            key = self.entry_at(row, column)
+            if key == None:
+                continue
+            entry = dict(row = row, column = column, key = key.strip(),
+                         highlighted = False)
+            for column_run, text in self.runs_with_attrs(row, attrs):
+                if column_run + len(text) <= column:
+                    continue		# something on the left
+                entry['highlighted'] = True
+                if column_run > column + len(key):
+                    entry['column_value'] = column_run
+                    entry['value'] = text.strip()
+                break
+            entries.append(entry)
+        return entries
+
+
+def menu_keystrokes(entries: list, entry_regex: re.Pattern,
+                    direction: str = "down"):
+    """
+    Compute how to move from the highlighted menu entry to one matching
+    a regular expression
+
+    :param list entries: menu entries, as returned by
+      :meth:`screen_c.menu_entries`
+    :param re.Pattern entry_regex: regular expression (on strings)
+      the entry's name has to match
+    :param str direction: direction to go to if the entry is not
+      displayed (*up* or *down*)
+    :returns tuple: *( INDEX, DIRECTION, COUNT )*:
+
+      - *INDEX* is the index in *entries* of the highlighted entry if
+        it matches *entry_regex*; *None* otherwise
+
+      - *DIRECTION*, *COUNT*: keys (*up*, *down*) to press and how many
+        times to get to the entry; if not displayed, to scroll past
+        the last one displayed; if no entry is highlighted, *None, 0*
+    """
+    highlighted = None
+    for index, entry in enumerate(entries):
+        if entry['highlighted']:
+            highlighted = index
+            break
+    if highlighted == None:
+        return None, None, 0
+    if entry_regex.search(entries[highlighted]['key']):
+        return highlighted, None, 0
+    matches = [
+        index for index, entry in enumerate(entries)
+        if entry_regex.search(entry['key'])
+    ]
+    if matches:
+        index = min(matches, key = lambda index: abs(index - highlighted))
+        if index > highlighted:
+            return None, "down", index - highlighted
+        return None, "up", highlighted - index
+    if direction == "down":
+        return None, "down", len(entries) - highlighted
+    return None, "up", highlighted + 1
+
+
+_screens = {}
+
+def screen_get(target, console: str = None):
+    """
+    Get the screen model for a target's console
+
+    There is one per console and testcase (as the console capture
+    files the screen is fed from); the size is taken from the
+    target's inventory *bios.screen_columns* and *bios.screen_rows*
+    (defaults 132x50).
+
+    :param tcfl.tc.target_c target: target on which to operate
+    :param str console: (optional; default's target's default)
+    :returns screen_c: screen model
+    """
+    if console == None:
+        console = target.console.default
+    filename = target.console.capture_filename(console)
+    screen = _screens.get(filename, None)
+    if screen == None:
+        screen = screen_c(target.kws.get("bios.screen_columns", 132),
+                          target.kws.get("bios.screen_rows", 50))
+        _screens[filename] = screen
+    return screen
+
+
+def _screen_model_use(target, screen_model):
+    if screen_model == None:
+        return target.kws.get("bios.screen_model", False)
+    return screen_model
+
+
+def _keys_send(target, direction, count):
+    terminal = target.kws.get("bios.terminal_emulation", "vt100")
+    # USE CONSOLE_TX!!! see file header
+    target.console_tx(ansi_key_code("arrow_" + direction, terminal) * count)
+
+
+def _screen_settle(target, screen, reason):
+    # wait for the menu to be redrawn, then update the screen model
+    console = target.console.default
+    target.console.wait_for_no_output(
+        console, silence_period = 0.6, poll_period = 0.2, reason = reason)
+    screen.update(target, console)
+
+
+def _menu_scroll_to_entry_screen(
+        target, entry_string, max_scrolls, direction,
+        highlight_string, column_key, name):
+    # menu_scroll_to_entry() using the screen model: look at the
+    # whole menu, send all the keystrokes needed to get to the entry
+    # and verify once.
+    screen = screen_get(target)
+    if isinstance(entry_string, bytes):
+        entry_string = entry_string.decode('utf-8')
+    entry_regex = re.compile(entry_string)
+    seen_entries = collections.defaultdict(int)
+    keys_sent = 0
+    # static text in the menu's column looks like an entry but the
+    # highlight skips it, so a burst might overshoot (and wrap
+    # around); each time one misses, send smaller ones
+    burst_max = max_scrolls
+    aiming = False
+    _screen_settle(target, screen,
+                   f"display to settle before scrolling '{entry_string}'")
+    while keys_sent <= max_scrolls:
+        entries = screen.menu_entries(column_key, highlight_string)
+        index, key_direction, count = \
+            menu_keystrokes(entries, entry_regex, direction)
+        if index != None:
+            entry = entries[index]
+            target.report_info("%s: highlighted entry found" % name)
+            # expectations from now on look at what comes next
+            target.console.send_expect_sync(target.console.default)
+            row = b"%02d" % (entry['row'] + 1)
+            key = entry['key'].encode('utf-8')
+            r = dict(row_value = None, column_value = None, value = None,
+                     column_value_key = None, key_value = None,
+                     row_novalue = None, column_novalue_key = None,
+                     key_novalue = None)
+            if 'value' in entry:
+                r['row_value'] = row
+                r['column_value'] = b"%02d" % (entry['column_value'] + 1)
+                r['value'] = entry['value'].encode('utf-8')
+                r['column_value_key'] = b"%02d" % column_key
+                r['key_value'] = key
+            else:
+                r['row_novalue'] = row
+                r['column_novalue_key'] = b"%02d" % column_key
+                r['key_novalue'] = key
+            # as the regular path, report what the regex found as bytes
+            r.update(re.search(entry_string.encode('utf-8'), key).groupdict())
+            return r
+        if count == 0:
+            # nothing highlighted; wiggle the cursor so the entry we
+            # are on is redrawn
+            target.report_info(f"{name}: no highlighted entry, wiggling")
+            _keys_send(target, "up" if direction == "down" else "down", 1)
+            _keys_send(target, direction, 1)
+            keys_sent += 2
+        else:
+            if aiming:
+                burst_max = max(1, burst_max // 2)
+            aiming = any(entry_regex.search(entry['key'])
+                         for entry in entries)
+            highlighted = [ entry['key'] for entry in entries
+                            if entry['highlighted'] ][0]
+            seen_entries[highlighted] += 1
+            if seen_entries[highlighted] > 3:
+                target.report_info(
+                    f"{name}: scrolled through all entries;"
+                    f" did not find '{entry_string}'", dlevel = 1)
+                return None
+            if aiming:
+                count = min(count, burst_max)
+                burst_max = count
+            count = min(count, max(max_scrolls - keys_sent, 1))
+            target.report_info(
+                f"{name}: on '{highlighted}', pressing {key_direction}"
+                f" {count} times", dlevel = 1)
+            _keys_send(target, key_direction, count)
+            keys_sent += count
+        _screen_settle(target, screen,
+                       f"menu to render, scrolling for entry '{entry_string}'")
+    return None
+
+
+
 def menu_scroll_to_entry(
         target, entry_string, has_value = False,
         max_scrolls = 30, direction = "down",
         highlight_string = normal_white_fg_black_bg,
         normal_string = normal_black_fg_white_bg,
         level = "top", column_key = 4,
-        timeout = 10):
+        timeout = 10, screen_model: bool = None):
     """Scroll in an ANSI menu until the entry is highlighted
 
     Menus have two type of entries:
@@ -389,6 +758,13 @@ def menu_scroll_to_entry(
     :param int timeout: (optional; defaults to *10*) seconds to wait
       for an expected output, otherwise we retry.
 
+    :param bool screen_model: (optional; default from the target's
+      inventory *bios.screen_model*, *False* if not there) find the
+      entry looking at a model of the whole screen (see
+      :class:`screen_c`) and send all the keystrokes needed to get to
+      it at once, instead of one keystroke at a time waiting for the
+      menu to be redrawn and looking for the highlighted entry.
+
     :returns dict: None if the entry is not found; otherwise a
       dictionary with values found in the text from the regular
       expressions:
@@ -425,6 +801,10 @@ def menu_scroll_to_entry(
                        dlevel = 1)
     # FIXME: thus should not have the entry_string, gets repetitive
     name = "BIOS:%s/%s" % (level, entry_string)
+    if _screen_model_use(target, screen_model):
+        return _menu_scroll_to_entry_screen(
+            target, entry_string, max_scrolls, direction,
+            highlight_string, column_key, name)
     # FIXME: This won't work when we have multi line values in key/values
     # :/ latch on the first line of the entry and be happy with
     # it... but we'll loose the value on multiline values
@@ -623,7 +1003,8 @@ def menu_dig_to(
         canary_end_menu_redrawn = "F10=Save Changes and Exit",
         highlight_string = normal_white_fg_black_bg,
         dig_last = True,
-        level = "top", do_flush: bool = True):
+        level = "top", do_flush: bool = True,
+        screen_model: bool = None):
     """Dig all the way down a list of nested menus
 
     Given a nested menu hierarchy, select the each entry from the
@@ -690,6 +1071,9 @@ def menu_dig_to(
 
     :param str level: (optional; default *top*) name of the top level menu
 
+    :param bool screen_model: (optional) find entries using a model
+      of the screen; see :func:`menu_scroll_to_entry`.
+
     """
     assert isinstance(target, tcfl.tc.target_c)
     commonl.assert_list_of_types(entries, "entries", "entry",
@@ -727,7 +1111,8 @@ def menu_dig_to(
         r = menu_scroll_to_entry(
             target, entry_next,
             has_value = has_value, direction = "down",
-            highlight_string = highlight_string)
+            highlight_string = highlight_string,
+            screen_model = screen_model)
         if not r:
             raise tcfl.tc.error_e(
                 "BIOS:%s: can't find entry '%s'" % (_menu_name, entry_next))
@@ -851,7 +1236,7 @@ def multiple_entry_select_one(
         wait = 0.5, timeout = 10,
         highlight_string = "\x1b\\[1m\x1b\\[37m\x1b\\[46m",
         skip_first_scroll: bool = True,
-        level = ""):
+        level = "", screen_model: bool = None):
     """
     In a simple menu, wait for it to be drown and select a given entry
 
@@ -868,6 +1253,9 @@ def multiple_entry_select_one(
 
     :param str level: (optional; default *top*) name of the top level menu
 
+    :param bool screen_model: (optional) find the entry using a model
+      of the screen; see :func:`menu_scroll_to_entry`.
+
     The menu is usually printed like (blue background, white foreground,
     yellow highlight, like::
 
@@ -910,6 +1298,10 @@ def multiple_entry_select_one(
     assert isinstance(timeout, numbers.Real) and timeout > 0
     assert isinstance(level, str)
 
+    if _screen_model_use(target, screen_model):
+        return _multiple_entry_select_one_screen(
+            target, select_entry, max_scrolls, highlight_string, level)
+
     # so this assumes the whole box is redrawn every time we move the
     # cursor -- hence why we look for /---- ANSICRUFT+KEYSANSI+CRUFT
     # HIGHLIGHT KEY ANSICRUFT ----/
@@ -1007,6 +1399,72 @@ def multiple_entry_select_one(
                           % (select_entry, max_scrolls))
 
 
+def _multiple_entry_select_one_screen(
+        target, select_entry, max_scrolls, highlight_string, level):
+    # multiple_entry_select_one() using the screen model
+    screen = screen_get(target)
+    attrs = _ansi_attrs(highlight_string)
+    select_entry_regex = re.compile(select_entry)
+    keys_sent = 0
+    # bursts might overshoot static text, as in
+    # _menu_scroll_to_entry_screen(); send smaller ones each time
+    burst_max = max_scrolls
+    aiming = False
+    _screen_settle(target, screen, f"multiple/entry: display to settle"
+                   f" before scrolling to '{select_entry}'")
+    while keys_sent <= max_scrolls:
+        highlighted = None
+        for row in range(screen.screen.lines):
+            runs = screen.runs_with_attrs(row, attrs)
+            if runs:
+                highlighted = row, runs[0][0]
+                break
+        entries = []
+        if highlighted:
+            # the entries are in the same column, in consecutive rows
+            row, column = highlighted
+            row_top = row
+            while row_top > 0 and screen.entry_at(row_top - 1, column):
+                row_top -= 1
+            row_bottom = row
+            while row_bottom < screen.screen.lines - 1 \
+                  and screen.entry_at(row_bottom + 1, column):
+                row_bottom += 1
+            entries = screen.menu_entries(column + 1, highlight_string,
+                                          range(row_top, row_bottom + 1))
+        index, direction, count = \
+            menu_keystrokes(entries, select_entry_regex, "down")
+        if index != None:
+            target.report_info("BIOS: %s: entry '%s' found"
+                               % (level, select_entry))
+            target.console.send_expect_sync(target.console.default)
+            key = entries[index]['key'].encode('utf-8')
+            return key, dict(key = key)
+        if count == 0:
+            target.report_info("BIOS: %s: %s: didn't find a highlighted"
+                               " entry, retrying" % (level, select_entry))
+            _keys_send(target, "up", 1)
+            _keys_send(target, "down", 1)
+            keys_sent += 2
+        else:
+            if aiming:
+                burst_max = max(1, burst_max // 2)
+            aiming = any(select_entry_regex.search(entry['key'])
+                         for entry in entries)
+            if aiming:
+                count = min(count, burst_max)
+                burst_max = count
+            count = min(count, max(max_scrolls - keys_sent, 1))
+            _keys_send(target, direction, count)
+            keys_sent += count
+        _screen_settle(target, screen, f"multiple/entry: display to settle"
+                       f" before scrolling to '{select_entry}'")
+
+    # nothing found, raise it
+    raise tcfl.tc.error_e("%s: can't find entry option after %d entries"
+                          % (select_entry, max_scrolls))
+
+
 def menu_escape_to_main(target, esc_first = True):
     """
     At any submenu, press ESC repeatedly until we go back to the main
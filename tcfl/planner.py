@@ -0,0 +1,337 @@
+#! /usr/bin/env python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Run planner
+-----------
+
+When *tcf run* has to run many testcases that compete for the same
+targets, submitting them in the order they were discovered means
+they serialize behind each other (each job holds an execution slot
+while it waits for its targets to be allocated) while other targets
+sit idle.
+
+This module plans the execution of all the jobs (a testcase on a
+target group) of a run before they are submitted:
+
+- :class:`durations_c` keeps a history of how long each testcase
+  takes to run on a given combination of target types
+
+- :func:`plan` simulates the execution of the jobs on a limited
+  number of execution slots and exclusive targets and orders them
+  so the expected wall time is minimized (greedy list scheduling:
+  always the job that can start the earliest, longest first); it
+  also selects which target groups to use when a testcase is limited
+  to run in less target groups than it has available.
+
+The jobs are then submitted in the planned order.
+"""
+
+import collections
+import heapq
+import json
+import logging
+import os
+import tempfile
+
+import filelock
+
+import commonl
+
+logger = logging.getLogger("tcfl.planner")
+
+
+class job_c:
+    """
+    Describe a job: a testcase that has to be run on a target group
+
+    :param str tc_name: name of the testcase
+
+    :param set rt_fullids: full IDs of the remote targets the job
+      uses (exclusively, including interconnects)
+
+    :param str types_key: string describing the types of the targets
+      in the group, used as a key to the duration history (see
+      :meth:`durations_c.get`)
+
+    :param str group_str: description of the target group, for
+      reporting
+
+    :param data: (optional) anything the caller needs to start the
+      job
+    """
+    def __init__(self, tc_name, rt_fullids, types_key, group_str,
+                 data = None):
+        assert isinstance(tc_name, str)
+        assert isinstance(types_key, str)
+        assert isinstance(group_str, str)
+        self.tc_name = tc_name
+        self.rt_fullids = set(rt_fullids)
+        self.types_key = types_key
+        self.group_str = group_str
+        self.data = data
+        #: Expected duration of the job in seconds
+        self.duration = None
+        #: Planned start time, in seconds since the run starts
+        self.ts_start = None
+        #: Planned end time, in seconds since the run starts
+        self.ts_end = None
+
+    def __repr__(self):
+        return f"{self.tc_name} @{self.group_str}"
+
+
+class durations_c:
+    """
+    History of testcase durations on target types
+
+    Durations are kept as an exponentially weighted moving average in
+    a JSON file, keyed by testcase name and a string describing the
+    target types used.
+
+    :param str path: (optional; default
+      *~/.cache/tcf/durations.json*) file where to keep the history
+    """
+
+    #: Duration (in seconds) assumed for testcases with no history
+    default = 60
+
+    #: Weight of a new sample in the moving average
+    weight = 0.3
+
+    def __init__(self, path = None):
+        if path == None:
+            path = os.path.join(os.path.expanduser("~"), ".cache", "tcf",
+                                "durations.json")
+        self.path = path
+        self.durations = self._load()
+        self.samples = {}
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                durations = json.load(f)
+            if not isinstance(durations, dict):
+                raise ValueError("not a dictionary")
+            return durations
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("%s: ignoring bad duration history: %s",
+                           self.path, e)
+            return {}
+
+    @staticmethod
+    def _key(tc_name, types_key):
+        return tc_name + " " + types_key
+
+    def get(self, tc_name, types_key):
+        """
+        Get the expected duration of a testcase on a set of target types
+
+        :param str tc_name: testcase name
+        :param str types_key: target types (as in :data:`job_c.types_key`)
+        :returns float: expected duration in seconds; if there is no
+          history for this combination of types, the average for the
+          testcase on any target types; if none, :data:`default`.
+        """
+        duration = self.durations.get(self._key(tc_name, types_key), None)
+        if duration != None:
+            return duration
+        prefix = tc_name + " "
+        durations = [
+            duration for key, duration in self.durations.items()
+            if key.startswith(prefix)
+        ]
+        if durations:
+            return sum(durations) / len(durations)
+        return self.default
+
+    def update(self, tc_name, types_key, duration):
+        """
+        Add a new duration sample for a testcase on some target types
+
+        Call :meth:`save` to store the samples.
+        """
+        self.samples[self._key(tc_name, types_key)] = duration
+
+    def save(self):
+        """
+        Store the new samples in the history file
+
+        The file is reloaded under a lock, so samples stored by other
+        runs since we loaded are not lost.
+        """
+        if not self.samples:
+            return
+        dirname = os.path.dirname(self.path)
+        try:
+            commonl.makedirs_p(dirname)
+            with filelock.FileLock(self.path + ".lock"):
+                durations = self._load()
+                for key, duration in self.samples.items():
+                    previous = durations.get(key, None)
+                    if previous == None:
+                        durations[key] = duration
+                    else:
+                        durations[key] = self.weight * duration \
+                            + (1 - self.weight) * previous
+                with tempfile.NamedTemporaryFile(
+                        "w", dir = dirname, delete = False,
+                        prefix = os.path.basename(self.path) + ".") as f:
+                    json.dump(durations, f, indent = 1, sort_keys = True)
+                os.replace(f.name, self.path)
+            self.durations = durations
+            self.samples = {}
+        except OSError as e:
+            logger.warning("%s: can't save duration history: %s",
+                           self.path, e)
+
+
+def simulate(jobs, parallelism):
+    """
+    Simulate running jobs in the given order
+
+    Each job is started, in order, in the first execution slot that
+    becomes available, as soon as all its targets are free (as
+    submitting them to a pool of *parallelism* threads does).
+
+    :param list(job_c) jobs: jobs to run, with :data:`job_c.duration`
+      set
+    :param int parallelism: number of execution slots
+    :returns float: time at which the last job finishes
+    """
+    assert parallelism > 0
+    slots = [ 0.0 ] * parallelism
+    free_at = collections.defaultdict(float)
+    ts_end_max = 0.0
+    for job in jobs:
+        ts_slot = heapq.heappop(slots)
+        ts_start = max([ ts_slot ] + [ free_at[i] for i in job.rt_fullids ])
+        ts_end = ts_start + job.duration
+        for rt_fullid in job.rt_fullids:
+            free_at[rt_fullid] = ts_end
+        heapq.heappush(slots, ts_end)
+        ts_end_max = max(ts_end_max, ts_end)
+    return ts_end_max
+
+
+def plan(jobs_by_tc, parallelism, durations, quotas = None):
+    """
+    Plan the order in which to submit jobs
+
+    Using greedy list scheduling, repeatedly pick, for the first
+    execution slot to be free, the job that can start the earliest
+    (because its targets are free the earliest); ties are broken
+    running the longest first.
+
+    :param dict jobs_by_tc: dictionary keyed by testcase name of
+      lists of :class:`job_c` (one per target group the testcase can
+      run on)
+
+    :param int parallelism: number of jobs that can be run at the
+      same time (execution slots)
+
+    :param durations_c durations: history of durations, used to fill
+      out :data:`job_c.duration`
+
+    :param dict quotas: (optional) dictionary keyed by testcase name
+      of how many jobs to pick (at most) for said testcase; if
+      missing, all the jobs are picked. The jobs whose targets are
+      available the earliest are picked.
+
+    :returns list(job_c): jobs in the order they shall be submitted,
+      with :data:`job_c.ts_start` and :data:`job_c.ts_end` set to
+      the planned times (in seconds since start).
+    """
+    assert parallelism > 0
+    if quotas == None:
+        quotas = {}
+    remaining = {}
+    for tc_name, jobs in jobs_by_tc.items():
+        for job in jobs:
+            job.duration = durations.get(job.tc_name, job.types_key)
+        quota = quotas.get(tc_name, None)
+        if quota == None:
+            quota = len(jobs)
+        if jobs and quota > 0:
+            remaining[tc_name] = quota
+
+    slots = [ 0.0 ] * parallelism
+    free_at = collections.defaultdict(float)
+
+    def _targets_free(job):
+        ts_free = 0.0
+        for rt_fullid in job.rt_fullids:
+            if free_at[rt_fullid] > ts_free:
+                ts_free = free_at[rt_fullid]
+        return ts_free
+
+    # Jobs whose targets are free when the first slot is free can
+    # start then, so the longest goes first: they are kept in the
+    # *ready* heap as ( -DURATION, TCNAME, GROUPSTR, COUNT, JOB )
+    # (tc_name and group_str make it deterministic, count makes it
+    # never compare jobs). The rest wait in the *waiting* heap for
+    # their targets to be free, as ( TSFREE, -DURATION, ... ).
+    #
+    # As jobs are planned, targets only get busy until later, so
+    # when a job's targets are free can only grow; entries are
+    # checked when they reach the top of a heap and moved to the
+    # other or pushed back if they went stale.
+    ready = []
+    waiting = []
+    for tc_name in remaining:
+        for job in jobs_by_tc[tc_name]:
+            waiting.append(( 0.0, -job.duration, tc_name, job.group_str,
+                             len(waiting), job ))
+    heapq.heapify(waiting)
+    planned = []
+    while remaining:
+        ts_slot = slots[0]
+        while waiting and waiting[0][0] <= ts_slot:
+            entry = heapq.heappop(waiting)
+            if entry[2] not in remaining:
+                continue		# testcase's quota used up
+            ts_free = _targets_free(entry[-1])
+            if ts_free > entry[0]:
+                heapq.heappush(waiting, ( ts_free, ) + entry[1:])
+            else:
+                heapq.heappush(ready, entry[1:])
+        while ready:
+            entry = heapq.heappop(ready)
+            if entry[1] not in remaining:
+                continue		# testcase's quota used up
+            ts_free = _targets_free(entry[-1])
+            if ts_free > ts_slot:	# targets got busy
+                heapq.heappush(waiting, ( ts_free, ) + entry)
+                continue
+            ts_start = ts_slot
+            break
+        else:
+            # nothing can start when the slot is free, take what can
+            # start the earliest after
+            while True:
+                entry = heapq.heappop(waiting)
+                if entry[2] not in remaining:
+                    continue
+                ts_free = _targets_free(entry[-1])
+                if ts_free > entry[0]:
+                    heapq.heappush(waiting, ( ts_free, ) + entry[1:])
+                    continue
+                ts_start = ts_free
+                entry = entry[1:]
+                break
+        _, tc_name, _, _, job = entry
+        job.ts_start = ts_start
+        job.ts_end = job.ts_start + job.duration
+        for rt_fullid in job.rt_fullids:
+            free_at[rt_fullid] = job.ts_end
+        heapq.heapreplace(slots, job.ts_end)
+        planned.append(job)
+        remaining[tc_name] -= 1
+        if remaining[tc_name] == 0:
+            del remaining[tc_name]
+    return planned
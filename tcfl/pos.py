@@ -2014,6 +2014,150 @@ EOF""")
                 tl.linux_rsync_cache_lru_cleanup(target, location,
                                                  megs_top * 1024)
 
+    #: Name of the file manifest in the image tree
+    #:
+    #: Generated by *tcf-image-setup.sh* next to
+    #: *.tcf.metadata.yaml*; each line describes a regular file or
+    #: symlink in the image as::
+    #:
+    #:   TYPE SIZE MTIME HASH PATH
+    #:
+    #: (sorted by *PATH*, which might contain spaces; *HASH* is the
+    #: SHA256 of the file's contents or of the symlink's destination).
+    manifest_name = ".tcf.manifest"
+
+    def _rootfs_rsync_manifest(self, target, kws, timeout):
+        # Transfer the image using the precomputed manifests
+        #
+        # The image tree carries a manifest of its files
+        # (:data:`manifest_name`) and after a succesful deploy we
+        # keep a copy of it in the partition's persistent area; when
+        # both are available, we know exactly which files changed
+        # from the content deployed, so instead of having rsync
+        # checksum (-c) every single file in both sides (which takes
+        # minutes in multi-GiB images), we:
+        #
+        # 1. force transfer the files whose manifest entry changed,
+        #    --files-from the list of differences; this covers files
+        #    that changed contents but kept size and mtime, which is
+        #    why -c was used in the first place
+        #
+        # 2. run a quick-check rsync (size + mtime, no -c) to remove
+        #    files no longer in the image and catch any file
+        #    modified locally after the last deployment
+        #
+        # Returns the number of seconds it took, or *None* if
+        # there is no manifest to work with (and thus a full,
+        # checksummed rsync has to be done).
+        manifest_old = "/mnt" + persistent_tcf_d + "/tcf.manifest"
+        output = target.shell.run(
+            "rm -f /tmp/tcf.manifest /tmp/deploy.changed;"
+            # see _metadata_load() on why no -AX
+            " rsync -Ha --numeric-ids --inplace -L"
+            " --ignore-missing-args"
+            " %s/%s /tmp/tcf.manifest;"
+            " test -r /tmp/tcf.manifest -a -r %s || echo MANIFEST""_NA"
+            % (kws['rsync_image'], self.manifest_name, manifest_old),
+            output = True)
+        if 'MANIFEST_NA' in output:
+            target.report_info(
+                "POS: no image or deployed manifest, full rsync", dlevel = 1)
+            return None
+
+        # lines are the whole description of each file, so any line
+        # in the image manifest not present in the deployed one is a
+        # file that changed or is new -- print just the path
+        output = target.shell.run(
+            "awk 'NR == FNR { old[$0] = 1; next }"
+            " !($0 in old) { sub(/^[^ ]+ [^ ]+ [^ ]+ [^ ]+ /, \"\"); print }'"
+            " %s /tmp/tcf.manifest > /tmp/deploy.changed;"
+            " echo changed $(wc -l < /tmp/deploy.changed)"
+            " total $(wc -l < /tmp/tcf.manifest)"
+            % manifest_old, output = True)
+        m = self._manifest_count_regex.search(output)
+        if not m:
+            raise tc.error_e(
+                "Can't find regex %s in output"
+                % self._manifest_count_regex.pattern,
+                dict(output = output))
+        files_changed = int(m.groupdict()['changed'])
+        files_total = int(m.groupdict()['total'])
+        domain = "Deployment stats image %(image)s" % kws
+        target.report_data(domain, "image files changed (manifest) to %s"
+                           % target.fullid, files_changed)
+        target.report_data(domain, "image files total (manifest) to %s"
+                           % target.fullid, files_total)
+        target.report_info("POS: manifest: %d/%d files changed"
+                           % (files_changed, files_total), dlevel = 1)
+
+        # the deployed manifest is valid only once the deployment is
+        # complete, so wipe it in case we fail mid way
+        target.shell.run("rm -f " + manifest_old)
+        seconds = 0
+        if files_changed:
+            # -I: transfer even if size and mtime match; the image
+            # might carry files in the paths we keep (persistent
+            # area, caches), don't override them
+            output = target.shell.run(
+                "time -p rsync -aHAX --numeric-ids -I"
+                " --files-from=/tmp/deploy.changed"
+                " --exclude-from=/tmp/deploy.ex"
+                " %(rsync_image)s/. /mnt/." % kws,
+                timeout = timeout, output = True)
+            seconds += self._time_p_seconds(output)
+        output = target.shell.run(
+            "time -p rsync -aHAX --numeric-ids --delete "
+            " --exclude-from=/tmp/deploy.ex"
+            " %(rsync_image)s/. /mnt/." % kws,
+            timeout = timeout, output = True)
+        seconds += self._time_p_seconds(output)
+        return seconds
+
+    _manifest_count_regex = re.compile(
+        r"^changed (?P<changed>[0-9]+) total (?P<total>[0-9]+)",
+        re.MULTILINE)
+
+    _time_p_regex = re.compile(r"^real[ \t]+(?P<seconds>[\.0-9]+)$",
+                               re.MULTILINE)
+
+    def _time_p_seconds(self, output):
+        # parse the output of *time -p* for the real time
+        m = self._time_p_regex.search(output)
+        if not m:
+            raise tc.error_e(
+                "Can't find regex %s in output" % self._time_p_regex.pattern,
+                dict(output = output))
+        return float(m.groupdict()['seconds'])
+
+    def _rootfs_manifest_save(self, target, kws, seconds, full):
+        # Keep the manifest of what we just deployed, so next time we
+        # can just transfer the differences; if this is a full
+        # deployment, also keep how long it took, as a reference to
+        # report how much time we saved in incremental ones.
+        mk_persistent_tcf_d(target)
+        manifest_old = "/mnt" + persistent_tcf_d + "/tcf.manifest"
+        seconds_full_file = manifest_old + ".full-seconds"
+        if full:
+            target.shell.run(
+                "[ -r /tmp/tcf.manifest ]"
+                " && cp -f /tmp/tcf.manifest %s"
+                " && echo %.2f > %s || true"
+                % (manifest_old, seconds, seconds_full_file))
+            return
+        output = target.shell.run(
+            "cp -f /tmp/tcf.manifest %s;"
+            " cat %s 2> /dev/null || true"
+            % (manifest_old, seconds_full_file),
+            output = True, trim = True)
+        m = re.search(r"^(?P<seconds>[\.0-9]+)$", output, re.MULTILINE)
+        if not m:
+            return
+        target.report_data(
+            "Deployment stats image %(image)s" % kws,
+            "image rsync time saved (manifest) to %s (s)" % target.fullid,
+            float(m.groupdict()['seconds']) - seconds)
+
+
 
     def deploy_image(self, ic, image,
                      boot_dev = None, root_part_dev = None,
@@ -2237,30 +2381,26 @@ cat > /tmp/deploy.ex
                     " (base %s, per GiB %s, %s GiB)" % (
                         timeout, timeout_base, timeout_per_gib, size_gib),
                     dlevel = 1)
-                # \x04 is EOF, like pressing Ctrl-D in the shell
-                # DO NOT use --inplace to sync the image; this might
-                # break certain installations that rely on hardlinks
-                # to share files and then updating one pushes the same
-                # content to all.
-                output = target.shell.run(
-                    "time -p rsync -acHAX --numeric-ids --delete "
-                    " --exclude-from=/tmp/deploy.ex"
-                    " %(rsync_image)s/. /mnt/." % kws,
-                    # 500s bc rsync takes a long time, but FIXME, we need
-                    # to break this up and just increase timeout on the
-                    # rsyncs -- and maybe guesstimate from the image size?
-                    timeout = timeout, output = True)
-                # see above on time -p
-                kpi_regex = re.compile(r"^real[ \t]+(?P<seconds>[\.0-9]+)$",
-                                       re.MULTILINE)
-                m = kpi_regex.search(output)
-                if not m:
-                    raise tc.error_e(
-                        "Can't find regex %s in output" % kpi_regex.pattern,
-                        dict(output = output))
+                seconds = self._rootfs_rsync_manifest(target, kws, timeout)
+                full = seconds == None
+                if full:
+                    # no manifests, so we need to check everything
+                    # \x04 is EOF, like pressing Ctrl-D in the shell
+                    # DO NOT use --inplace to sync the image; this might
+                    # break certain installations that rely on hardlinks
+                    # to share files and then updating one pushes the same
+                    # content to all.
+                    output = target.shell.run(
+                        "rm -f /mnt%s/tcf.manifest;"
+                        " time -p rsync -acHAX --numeric-ids --delete "
+                        " --exclude-from=/tmp/deploy.ex"
+                        " %s/. /mnt/." % (persistent_tcf_d, kws['rsync_image']),
+                        timeout = timeout, output = True)
+                    seconds = self._time_p_seconds(output)
                 target.report_data("Deployment stats image %(image)s" % kws,
                                    "image rsync to %s (s)" % target.fullid,
-                                   float(m.groupdict()['seconds']))
+                                   seconds)
+                self._rootfs_manifest_save(target, kws, seconds, full)
                 target.report_info("POS: rsynced %(rsync_image)s"
                                    " to %(root_part_dev)s" % kws)
 
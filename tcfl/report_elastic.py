@@ -5,9 +5,12 @@ Report data to Elastic Search
 
 Simple driver to report each message we receive to an ES database.
 
-Each report is submitted individually, to take advantage of elastic
-indexing capabilities, thus, we do not report everything related to a
-single testcase as a batch.
+Each report is submitted as an individual document, to take advantage
+of elastic indexing capabilities, thus, we do not report everything
+related to a single testcase as a single document.
+
+Documents are queued and shipped in bulk by a background thread (see
+:class:`driver` for details), so testcases don't wait for the network.
 
 This driver uses the :ref:`python3-elasticsearch
 <https://elasticsearch-py.readthedocs.io>` package to connect to an
@@ -28,11 +31,6 @@ Elastic Search cluster.
     >>>          'MYINDEXNAME', verify_certs = False),
     >>>      name = "elasticsearch1")
 
-**Pending**
-
-- Submit asynchronously, through a non-blocking pipe for performance.
-
-
 **Utils**
 
 - Deleting an index and all its docs from Elastic::
@@ -40,10 +38,19 @@ Elastic Search cluster.
     $ curl http[s]://USERNAME[:PASSWORD]@HOSTNAME:5601/INDEXNAME -X DELETE
 
 """
+import atexit
+import collections
+import glob
+import json
 import logging
+import os
+import threading
+import time
 import types
 
 import elasticsearch
+import elasticsearch.helpers
+import filelock
 
 import commonl
 import tcfl.tc
@@ -68,8 +75,61 @@ class driver(tcfl.tc.report_driver_c):
 
       >>> verify_certs = False
 
+    :param str spool_path: (optional; default
+      *~/.cache/tcf/report-elastic-spool-INDEXNAME.jsonl*) file where
+      to store documents that can't be shipped because the cluster
+      is unreachable.
+
+    *Shipping*
+
+    :meth:`report` just queues the documents; a background thread
+    ships them with the bulk API when :data:`flush_docs` are queued,
+    every :data:`flush_period` seconds or when :meth:`flush` is
+    called (which happens when each testcase completes and at
+    exit). :meth:`close` ships what is left and stops the thread.
+
+    Transient errors are retried :data:`retry_max` times with
+    exponential backoff. If the cluster still can't be reached, the
+    documents are appended to the spool file and the cluster is
+    considered down for :data:`retry_backoff_max` seconds, during
+    which documents are spooled without trying to ship them. Once
+    documents are shipped again, the spool file is replayed.
+
+    If a process dies while replaying, the documents it was replaying
+    are put back in the spool when the shipper thread of another
+    process starts (some might be shipped twice).
+
+    At most :data:`queue_max` documents are kept in memory; if the
+    cluster can't keep up, newer documents are spooled too.
     """
-    def __init__(self, es_hosts, index_name, **es_args):
+
+    #: Ship queued documents when there are this many
+    flush_docs = 500
+
+    #: Ship queued documents after they have been queued this many
+    #: seconds
+    flush_period = 2
+
+    #: Maximum number of documents to keep queued in memory
+    queue_max = 20000
+
+    #: How many times to retry shipping a batch of documents
+    retry_max = 5
+
+    #: Initial time to wait (in seconds) before retrying to ship a
+    #: batch of documents; it is doubled on each retry.
+    retry_backoff = 0.5
+
+    #: Maximum time to wait (in seconds) before retrying to ship a
+    #: batch of documents; also time we consider the cluster down
+    #: after failing all the retries
+    retry_backoff_max = 30
+
+    #: Maximum time (in seconds) to wait for the queued documents to
+    #: be shipped when exiting; what is not shipped by then is spooled
+    flush_timeout = 60
+
+    def __init__(self, es_hosts, index_name, spool_path = None, **es_args):
         assert isinstance(index_name, str), \
             f"index_name: expected str; got {type(index_name)}"
         assert index_name.islower(), \
@@ -84,16 +144,275 @@ class driver(tcfl.tc.report_driver_c):
         self.index_name = index_name
         self.es_args = es_args
         self.es = None
+        if spool_path == None:
+            spool_path = os.path.join(
+                os.path.expanduser("~"), ".cache", "tcf",
+                f"report-elastic-spool-{index_name}.jsonl")
+        self.spool_path = spool_path
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._flush_now = False
+        self._stop = False
+        self._inflight = 0
+        self._thread = None
+        self._thread_pid = None
+        # until when we consider the cluster unreachable
+        self._down_until = 0
+        #: Number of documents shipped, failed and spooled
+        self.docs_shipped = 0
+        self.docs_failed = 0
+        self.docs_spooled = 0
+        # where to move the spool to replay it; unique per driver, as
+        # there might be more than one for the same spool
+        self._replay_path = self.spool_path + f".replay-%d-{id(self):x}"
+        atexit.register(self._atexit)
 
     def _connect(self):
         # create/update a connection
         self.es = elasticsearch.Elasticsearch(self.es_hosts, **self.es_args)
 
-    def report(self, testcase, target, tag, ts, delta,
-               level, message, alevel, attachments):
+    def _thread_start(self):
+        # start the shipper thread if not running in this process
+        # (eg: if we are running in a process forked from where it
+        # was started); call with self._cond held
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(
+            target = self._shipper, daemon = True,
+            name = f"report-elastic-{self.index_name}")
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _enqueue(self, doc):
+        with self._cond:
+            self._thread_start()
+            if len(self._queue) < self.queue_max:
+                self._queue.append(doc)
+                if len(self._queue) >= self.flush_docs:
+                    self._cond.notify_all()
+                return
+        # we can't keep up, don't take more memory
+        self._spool([ doc ])
+
+    def flush(self, timeout = None):
+        """
+        Wait for the queued documents to be shipped (or spooled)
+
+        :param float timeout: (optional; default forever) maximum
+          seconds to wait
+        :returns bool: *True* if all were shipped or spooled, *False*
+          if the timeout expired
+        """
+        with self._cond:
+            if self._thread_pid != os.getpid():
+                # no thread in this process, nothing queued
+                return not self._queue
+            self._flush_now = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._inflight, timeout)
+
+    def close(self, timeout = None):
+        """
+        Ship the queued documents and stop the shipper thread
+
+        What can't be shipped before *timeout* is spooled. Reporting
+        again restarts the thread.
+
+        :param float timeout: (optional; default :data:`flush_timeout`)
+          maximum seconds to wait
+        """
+        if timeout == None:
+            timeout = self.flush_timeout
+        with self._cond:
+            thread = self._thread
+            if self._thread_pid != os.getpid() or not thread.is_alive():
+                thread = None
+            self._stop = True
+            self._cond.notify_all()
+        if thread:
+            thread.join(timeout)
+        with self._cond:
+            docs = list(self._queue)
+            self._queue.clear()
+        self._spool(docs)
+
+    def _atexit(self):
+        self.close()
+
+    def _shipper(self):
+        self._orphans_adopt()
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._queue) >= self.flush_docs
+                    or self._flush_now or self._stop,
+                    self.flush_period)
+                if self._stop and not self._queue:
+                    self._cond.notify_all()
+                    return
+                self._flush_now = False
+                docs = list(self._queue)
+                self._queue.clear()
+                self._inflight = len(docs)
+            try:
+                if docs:
+                    self._ship(docs)
+                elif os.path.exists(self.spool_path) and not self._stop:
+                    self._replay()
+            except Exception as e:
+                # never let the thread die
+                logging.error("Elastic: error shipping %d documents: %s",
+                              len(docs), e, exc_info = True)
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _transient(e):
+        # Connection errors and timeouts, or overload HTTP codes
+        status = getattr(e, "status_code", None) \
+            or getattr(e, "meta", None) and getattr(e.meta, "status", None)
+        if status in ( 429, 502, 503, 504 ):
+            return True
+        return isinstance(e, elasticsearch.exceptions.TransportError) \
+            and not isinstance(status, int)
+
+    def _bulk(self, docs):
+        # Ship documents with the bulk API, retrying those the
+        # cluster rejects because it is busy (429); returns how many
+        # documents were processed (shipped or failed) before an
+        # exception was raised
         if not self.es:
             self._connect()
+        done = 0
+        try:
+            for ok, item in elasticsearch.helpers.streaming_bulk(
+                    self.es,
+                    ( { "_index": self.index_name, "_source": doc }
+                      for doc in docs ),
+                    chunk_size = self.flush_docs,
+                    raise_on_error = False,
+                    max_retries = self.retry_max,
+                    initial_backoff = self.retry_backoff,
+                    max_backoff = self.retry_backoff_max):
+                done += 1
+                if ok:
+                    self.docs_shipped += 1
+                else:
+                    self.docs_failed += 1
+                    # bad document (eg: mapping error), retrying
+                    # won't fix it
+                    logging.error("Elastic: document rejected: %s", item)
+        except Exception as e:
+            e.done = done
+            raise
+        return done
+
+    def _ship(self, docs):
+        if time.time() < self._down_until:
+            self._spool(docs)
+            return
+        backoff = self.retry_backoff
+        for retry in range(self.retry_max + 1):
+            try:
+                self._bulk(docs)
+                break
+            except Exception as e:
+                docs = docs[getattr(e, "done", 0):]
+                if not self._transient(e) or retry == self.retry_max:
+                    logging.error("Elastic: can't ship %d documents,"
+                                  " spooling to %s: %s",
+                                  len(docs), self.spool_path, e)
+                    self._down_until = time.time() + self.retry_backoff_max
+                    self._spool(docs)
+                    return
+                logging.warning("Elastic: retrying to ship %d documents"
+                                " in %.1fs: %s", len(docs), backoff, e)
+                time.sleep(backoff)
+                backoff = min(2 * backoff, self.retry_backoff_max)
+        # we are shipping; anything spooled from before?
+        if os.path.exists(self.spool_path):
+            self._replay()
+
+    def _spool_lock(self):
+        return filelock.FileLock(self.spool_path + ".lock")
+
+    def _spool(self, docs):
+        if not docs:
+            return
+        try:
+            commonl.makedirs_p(os.path.dirname(self.spool_path))
+            with self._spool_lock(), open(self.spool_path, "a") as f:
+                for doc in docs:
+                    f.write(json.dumps(doc, default = str) + "\n")
+            self.docs_spooled += len(docs)
+        except OSError as e:
+            logging.error("Elastic: can't spool %d documents to %s,"
+                          " dropping them: %s", len(docs), self.spool_path, e)
+
+    def _orphans_adopt(self):
+        # A process that died while replaying leaves its replay file
+        # behind (SPOOL.replay-PID-ID); if PID is no longer alive,
+        # put them back in the spool so they are replayed again
+        # (some documents might be shipped twice)
+        try:
+            with self._spool_lock():
+                for path in glob.glob(glob.escape(self.spool_path)
+                                      + ".replay-*"):
+                    pid = path[len(self.spool_path + ".replay-"):]
+                    pid = pid.split("-", 1)[0]
+                    if not pid.isdigit() or int(pid) == os.getpid() \
+                       or commonl.process_alive(int(pid)):
+                        continue
+                    logging.warning("Elastic: adopting %s, left behind by"
+                                    " dead process %s", path, pid)
+                    with open(path) as fr, open(self.spool_path, "a") as fw:
+                        for line in fr:
+                            if line.endswith("\n"):	# skip partial writes
+                                fw.write(line)
+                    os.unlink(path)
+        except OSError as e:
+            logging.error("Elastic: can't adopt orphaned replay files"
+                          " of %s: %s", self.spool_path, e)
+
+    def _replay(self):
+        # ship what was spooled; take it out of the way first, so
+        # spooling from others goes to a new file
+        if time.time() < self._down_until:
+            return
+        replay_path = self._replay_path % os.getpid()
+        try:
+            with self._spool_lock():
+                os.rename(self.spool_path, replay_path)
+        except FileNotFoundError:
+            return
+        logging.info("Elastic: replaying spooled documents from %s",
+                     self.spool_path)
+        with open(replay_path) as f:
+            while True:
+                docs = []
+                for line in f:
+                    docs.append(json.loads(line))
+                    if len(docs) >= self.queue_max:
+                        break
+                if not docs:
+                    break
+                try:
+                    self._bulk(docs)
+                except Exception as e:
+                    logging.error("Elastic: can't replay spooled documents,"
+                                  " spooling back: %s", e)
+                    self._down_until = time.time() + self.retry_backoff_max
+                    self._spool(docs[getattr(e, "done", 0):])
+                    self._spool([ json.loads(line) for line in f ])
+                    break
+        os.unlink(replay_path)
 
+    def report(self, testcase, target, tag, ts, delta,
+               level, message, alevel, attachments):
         doc = dict(
             timestamp = ts,
             delta = delta,
@@ -171,11 +490,12 @@ class driver(tcfl.tc.report_driver_c):
                 else:
                     doc['attachments'][name] = attachment
 
-        try:
-            # submit; see note about batching on top level
-            self.es.index(index = self.index_name, body = doc)
-        except elasticsearch.exceptions.ElasticsearchException as e:
-            logging.error("can't push record to Elastic: %s", e)
-            # just log it and keep going, so we don't hold a hold run
-            # while we find all these issues
-            #raise
+        # queue for the background thread to ship it; any errors are
+        # logged there, so we don't hold a run while we find all
+        # these issues
+        self._enqueue(doc)
+        if message.startswith("COMPLETION"):
+            # the testcase is done, make sure everything is shipped;
+            # testcases might run in worker processes which exit
+            # without running atexit handlers
+            self.flush(self.flush_timeout)
@@ -9,9 +9,12 @@ connector)
 Reports execution data into a set of SQL tables in a database.
 
 """
+import atexit
+import collections
 import functools
 import os
 import threading
+import time
 
 import logging
 import mariadb
@@ -73,9 +76,26 @@ class driver_summary(tcfl.tc.report_driver_c):
 
     The driver will accumulate all the data in memory until a
     *COMPLETION* message is received, marking the ned of the testcase
-    execution and then it will flush it to the database. This is done
-    like that to avoid it causing impact in testcase timing due to
-    possible networking issues.
+    execution and then it will queue it to be written to the
+    database. This is done like that to avoid it causing impact in
+    testcase timing due to possible networking issues.
+
+    Rows queued with :meth:`table_row_update` and
+    :meth:`table_row_inc` are merged by table and index value (so
+    the updates a testcase does to the same row become a single
+    one) and written by :meth:`flush` when more than
+    :data:`flush_rows` are pending, every :data:`flush_period`
+    seconds, when each testcase completes (as they might run in
+    worker processes that exit without running *atexit* handlers)
+    and when the run completes. Each flush:
+
+    - creates any missing tables and columns first, once per table
+      for the whole batch
+
+    - writes all the rows with one *executemany()* per table and
+      column set, in a single transaction; if that fails, it writes
+      them one by one so only the rows that fail are lost (or
+      retried later, if the connection failed)
 
     The reporting will take data from the testcase execution and put it in
     different tables in the SQL database.
@@ -199,7 +219,32 @@ class driver_summary(tcfl.tc.report_driver_c):
         self.table_name_prefix_raw = table_name_prefix
         self.table_name_prefix = self._sql_id_esc(table_name_prefix)
         self.docs = {}
+        # rows pending to be written, see _row_queue()
+        self._rows_update = {}
+        self._rows_inc = {}
+        self._rows_pending = 0
+        self._rows_lock = threading.Lock()
+        # only one flush at the same time, so rows are written in order
+        self._flush_lock = threading.Lock()
+        self._flush_ts = time.time()
+        # how many times we failed to write a row, see _rows_requeue()
+        self._rows_retries = {}
+        # columns we know exist in each table, so we don't check again
+        self._table_columns = {}
         tcfl.tc.report_driver_c.__init__(self)
+        atexit.register(self.flush)
+
+    #: Flush pending rows to the database when there are more than
+    #: this many
+    flush_rows = 1000
+
+    #: Flush pending rows to the database when this many seconds have
+    #: passed since the last flush
+    flush_period = 30
+
+    #: Times to try writing a row that fails because the connection
+    #: to the database does before dropping it
+    flush_retries = 3
 
 
     @staticmethod
@@ -355,7 +400,7 @@ class driver_summary(tcfl.tc.report_driver_c):
         fields_wanted = fields.keys()
         columns_missing = fields_wanted - columns
         if not columns_missing:
-            return
+            return columns
 
         # add new missing new columns
         if defaults:
@@ -374,6 +419,7 @@ class driver_summary(tcfl.tc.report_driver_c):
                     for column in columns_missing
                 ) + " );"
         cursor.execute(cmd)
+        return columns | columns_missing
 
 
     def _table_row_insert(self, cursor, table_name, **fields):
@@ -426,208 +472,319 @@ class driver_summary(tcfl.tc.report_driver_c):
         return _table_name.strip()	# table names can't start/end w space
 
 
+    def _row_queue(self, inc, table_name, index_column, index_value,
+                   prefix_bare, fields):
+        _table_name = self._table_name_prepare(table_name, prefix_bare)
+        with self._rows_lock:
+            # note flush() might replace these, so get them locked
+            rows = self._rows_inc if inc else self._rows_update
+            table = rows.setdefault(( _table_name, index_column ), {})
+            row = table.get(index_value, None)
+            if row == None:
+                row = table[index_value] = {}
+                self._rows_pending += 1
+            if inc:
+                for field in fields:
+                    row[field] = row.get(field, 0) + 1
+            else:
+                row.update(fields)
+            flush = self._rows_pending >= self.flush_rows \
+                or time.time() - self._flush_ts >= self.flush_period
+        if flush:
+            self.flush()
+
+
     def table_row_update(self, table_name, index_column, index_value,
                          prefix_bare = "", **fields):
-        # insert/update fields in a table
-        #
-        # Use the index value of the index column to find the row to
-        # update or insert a new one if not present.
-        #
-        # If the table does not exist, create it; if any column is
-        # missing, add them.
-        _table_name = self._table_name_prepare(table_name, prefix_bare)
+        """
+        Queue inserting or updating fields in a table
 
-        connection = self._connection_get()
-        with connection.cursor() as cursor:
+        Use the index value of the index column to find the row to
+        update or insert a new one if not present. If the table does
+        not exist, create it; if any column is missing, add them.
 
-            while True:
-                # Now try to insert the row
-                #
-                # - if the primary key is duplicated, update the
-                #   values
-                #
-                #   Seriously this SQL thing...
-                #
-                #   insert into TABLENAME (
-                #       INDEX_COLUMN, FIELD1,  FIELD2 ...)
-                #   values ( INDEX_VALUE, VALUE1, VALUE2 ...  )
-                #   on duplicate key update
-                #      FIELD1 = value(FIELD1),
-                #      FIELD2 = value(FIELD2),
-                #      ...;
-                #
-                #   If there is no row with INDEX_COLUMN with
-                #   INDEX_VALUE, insert it with those FIELDs,
-                #   otherwise, update it. Clear as mud--especially the
-                #   code.
-                #
-                #   Thanks https://stackoverflow.com/a/41894298
-                #
-                # - if we get errors because the table or columns
-                #   still do not exist, fix'em and
-                #   try again
-                try:
-                    cmd = \
-                        f"insert into `{_table_name}` (`{index_column}`, " \
-                        + ", ".join(
-                            f"`{self._sql_id_esc(column)}`"
-                            for column in fields
-                        ) \
-                        + " ) values ( ?, " + ", ".join(
-                            "?"
-                            for column in fields
-                        ) + " ) on duplicate key update " \
-                        + ", ".join(
-                            f"`{self._sql_id_esc(column)}` = values(`{self._sql_id_esc(column)}`)"
-                            for column in fields
-                        ) + ";"
-                    values = ( index_value, ) + tuple(fields.values())
-                    cursor.execute(cmd, values)
-                    # In theory python MariaDB does autocommit, but I
-                    # guess not?
-                    connection.commit()
-                    break	# success, get out of the retry loop
-
-                except mariadb.ProgrammingError as e:
-                    # if the database doesn't exist, the error will read
-                    #
-                    ## mariadb.ProgrammingError: Table 'DBNAME.TABLENAME table' doesn't exist
-                    #
-                    # if there is a better way, I am all ears
-                    if not str(e).endswith(f"Table '{self.database}.{_table_name}' doesn't exist"):
-                        raise
-                    # ops, the table does not exist, create it with
-                    # these fields; guess the types from the field
-                    # values and retry; but we want to have FIRST the
-                    # index column -- we rely on python3 keeping
-                    # insertion order for dictionaries
-                    f = { index_column: index_value }
-                    f.update(fields)
-                    try:
-                        self._table_create(cursor, _table_name,
-                                           defaults = True,
-                                           index_column = index_column,
-                                           **f)
-                        connection.commit()
-                    except mariadb.OperationalError as e:
-                        if str(e).endswith(f"Table '{_table_name}' already exists"):
-                            # someone did it already, retry
-                            continue
-                        raise
-                    continue	# now try to insert/update again
-
-                except mariadb.OperationalError as e:
-                    # If any column does not exist, we'll get
-                    #
-                    ## mariadb.OperationalError: Unknown column ...blablah
-                    #
-                    # if there is a better way, I am all ears
-                    if not str(e).startswith("Unknown column"):
-                        raise
-                    self._table_columns_update(cursor, _table_name, **fields)
-                    f = { index_column: index_value }
-                    f.update(fields)
-                    continue
+        Rows are written by :meth:`flush`; multiple updates to the
+        same row before are merged, the last value set for each field
+        is written.
+        """
+        self._row_queue(False, table_name,
+                        index_column, index_value, prefix_bare, fields)
 
 
     def table_row_inc(self, table_name, index_column, index_value,
                       prefix_bare = "", **fields):
-        # Increment by one the listed fileds in the row matching
-        # index_value
+        """
+        Queue incrementing by one the listed fields in the row
+        matching *index_value*
+
+        If the row does not exist, add it with the given fields set
+        to one.
+
+        Rows are written by :meth:`flush`; multiple increments to the
+        same row before are added up.
+        """
+        fields = dict(fields)
+        fields.pop(index_column, None)	# no need to increase this field
+        self._row_queue(True, table_name,
+                        index_column, index_value, prefix_bare, fields)
+
+
+    def _table_ensure(self, cursor, table_name, index_column, fields,
+                      defaults):
+        # Make sure a table exists and has all the given columns
         #
-        # If the row does not exist, add it with the given fields set
-        # to one.
-        _table_name = self._table_name_prepare(table_name, prefix_bare)
+        # fields is a dict keyed by column name with a sample value
+        # (to guess the type), index_column first.
+        columns = self._table_columns.get(table_name, None)
+        if columns != None and fields.keys() <= columns:
+            return
+        if columns == None:
+            # note we create with defaults so incrementing columns
+            # in rows created by other columns works
+            self._table_create(cursor, table_name, defaults = True,
+                               index_column = index_column, **fields)
+        try:
+            columns = self._table_columns_update(
+                cursor, table_name, defaults = defaults, **fields)
+        except mariadb.OperationalError as e:
+            # someone else added them at the same time? check again
+            if not str(e).startswith("Duplicate column"):
+                raise
+            columns = self._table_columns_update(
+                cursor, table_name, defaults = defaults, **fields)
+        self._table_columns[table_name] = columns
 
-        connection = self._connection_get()
-        with connection.cursor() as cursor:
 
-            while True:
-                # Now try to inser the row; if we get errors because
-                # the table or columns still do not exist, fix'em and
-                # try again
-                try:
-                    f = list(fields.keys())
-                    f.remove(index_column) # no need to increase this field
-                    # increase by one values of the specified columns in the row
-                    # whose primary key (index_column) has the given index_value
-                    #
-                    ## insert into TABLENAME (INDEX_COLUMN, FIELD1, FIELD2...)
-                    ## values (INDEX_VALUE, 1, 1, ...)
-                    ## on duplicate key update
-                    ##   FIELD1 = value(FIELD1) + 1,
-                    ##   FIELD2 = value(FIELD2) + 1,
-                    ##   ...;
-                    #
-                    # note we use %s placeholders for the values, to let the
-                    # python itnerface type them properly and pass execute() a
-                    # tuple with the values
-                    cmd = \
-                        f"insert into `{_table_name}` (`{index_column}`, " \
-                        + ", ".join(f"`{column}`" for column in f) \
-                        + " ) values ( ?" + ", 1" * len(f) \
-                        + " ) on duplicate key update " \
-                        + ", ".join(
-                            f"`{column}` = `{column}` + 1"
-                            for column in f
-                        ) + ";"
-                    cursor.execute(cmd, (index_value, ))
-
-                    # In theory python MariaDB does autocommit, but I
-                    # guess not?
-                    connection.commit()
-                    break	# success, get out of the retry loop
-
-                except mariadb.ProgrammingError as e:
-                    # if the database doesn't exist, the error will read
-                    #
-                    ## mariadb.ProgrammingError: Table 'DBNAME.TABLENAME table' doesn't exist
-                    #
-                    # if there is a better way, I am all ears
-                    if not str(e).endswith(f"Table '{self.database}.{_table_name}' doesn't exist"):
-                        raise
-                    # ops, the table does not exist, create it with
-                    # these fields; guess the types from the field
-                    # values and retry
-                    try:
-                        self._table_create(cursor, _table_name,
-                                           index_column = index_column,
-                                           **fields)
-                        connection.commit()
-                    except mariadb.OperationalError as e:
-                        if str(e).endswith(f"Table '{_table_name}' already exists"):
-                            # someone did it already, retry
+    @staticmethod
+    def _rows_by_columns(rows):
+        # group rows (dict keyed by index value of dicts of fields)
+        # by the columns they set, so each group can be written with
+        # a single executemany() statement
+        groups = collections.defaultdict(list)
+        for index_value, row in rows.items():
+            columns = tuple(row.keys())
+            groups[columns].append(( index_value, ) + tuple(row.values()))
+        return groups
+
+
+    def _cmd_row_update(self, table_name, index_column, columns):
+        # insert or update a row
+        #
+        #   insert into TABLENAME (
+        #       INDEX_COLUMN, FIELD1,  FIELD2 ...)
+        #   values ( INDEX_VALUE, VALUE1, VALUE2 ...  )
+        #   on duplicate key update
+        #      FIELD1 = value(FIELD1),
+        #      FIELD2 = value(FIELD2),
+        #      ...;
+        #
+        #   If there is no row with INDEX_COLUMN with
+        #   INDEX_VALUE, insert it with those FIELDs,
+        #   otherwise, update it. Clear as mud--especially the
+        #   code.
+        #
+        #   Thanks https://stackoverflow.com/a/41894298
+        columns = [ self._sql_id_esc(column) for column in columns ]
+        return \
+            f"insert into `{table_name}` (`{index_column}`, " \
+            + ", ".join(f"`{column}`" for column in columns) \
+            + " ) values ( ?, " + ", ".join("?" for _ in columns) \
+            + " ) on duplicate key update " \
+            + ", ".join(
+                f"`{column}` = values(`{column}`)"
+                for column in columns
+            ) + ";"
+
+
+    def _cmd_row_inc(self, table_name, index_column, columns):
+        # increase by N values of the specified columns in the row
+        # whose primary key (index_column) has the given index_value
+        #
+        ## insert into TABLENAME (INDEX_COLUMN, FIELD1, FIELD2...)
+        ## values (INDEX_VALUE, N1, N2, ...)
+        ## on duplicate key update
+        ##   FIELD1 = FIELD1 + value(FIELD1),
+        ##   FIELD2 = FIELD2 + value(FIELD2),
+        ##   ...;
+        columns = [ self._sql_id_esc(column) for column in columns ]
+        return \
+            f"insert into `{table_name}` (`{index_column}`, " \
+            + ", ".join(f"`{column}`" for column in columns) \
+            + " ) values ( ?, " + ", ".join("?" for _ in columns) \
+            + " ) on duplicate key update " \
+            + ", ".join(
+                f"`{column}` = `{column}` + values(`{column}`)"
+                for column in columns
+            ) + ";"
+
+
+    def _rows_requeue(self, rows_update, rows_inc):
+        # Queue again rows that couldn't be written, merging them
+        # under whatever was queued since; rows retried too many
+        # times are dropped
+        with self._rows_lock:
+            for rows, queue, inc in (
+                    ( rows_update, self._rows_update, False ),
+                    ( rows_inc, self._rows_inc, True ) ):
+                for table_key, table in rows.items():
+                    queued_table = queue.setdefault(table_key, {})
+                    for index_value, row in table.items():
+                        retries = self._rows_retries.get(
+                            ( table_key, index_value ), 0) + 1
+                        if retries > self.flush_retries:
+                            logging.error(
+                                "%s: dropping row %s, failed to write"
+                                " %d times", table_key[0], index_value,
+                                retries)
+                            del self._rows_retries[( table_key, index_value )]
                             continue
-                        raise
-                    # now insert the row, we can't increase because we
-                    # know there was nothing -- FIXME: what about if
-                    # someone tried before us?
+                        self._rows_retries[( table_key, index_value )] = \
+                            retries
+                        queued = queued_table.get(index_value, None)
+                        if queued == None:
+                            queued_table[index_value] = row
+                            self._rows_pending += 1
+                        elif inc:
+                            for field, value in row.items():
+                                queued[field] = queued.get(field, 0) + value
+                        else:
+                            queued_table[index_value] = { **row, **queued }
+
+
+    def _flush_batch(self, connection, rows_update, rows_inc):
+        # Write all the rows in a single transaction
+        with connection.cursor() as cursor:
+            # First update the schema: note DDL statements
+            # commit implicitly, so we do them before
+            # starting to write
+            for rows, defaults in ( ( rows_update, False ),
+                                    ( rows_inc, True ) ):
+                for ( table_name, index_column ), table \
+                        in rows.items():
+                    fields = { index_column: next(iter(table)) }
+                    for row in table.values():
+                        for column, value in row.items():
+                            if fields.get(column, None) == None:
+                                fields[column] = value
+                    self._table_ensure(cursor, table_name,
+                                       index_column, fields,
+                                       defaults)
+            for rows, cmd_maker in (
+                    ( rows_update, self._cmd_row_update ),
+                    ( rows_inc, self._cmd_row_inc ) ):
+                for ( table_name, index_column ), table \
+                        in rows.items():
+                    for columns, values \
+                        in self._rows_by_columns(table).items():
+                        cursor.executemany(
+                            cmd_maker(table_name, index_column,
+                                      columns),
+                            values)
+        connection.commit()
+
+
+    def _flush_row_by_row(self, rows_update, rows_inc):
+        # Write each row in its own transaction, so the ones that
+        # fail don't take the rest with them
+        #
+        # Rows that fail because the connection did are queued
+        # again for the next flush (and so are all the rest, no
+        # point on trying them now); rows the database rejects are
+        # dropped.
+        requeue_update = {}
+        requeue_inc = {}
+        connection_failed = False
+        for rows, requeue, inc in ( ( rows_update, requeue_update, False ),
+                                    ( rows_inc, requeue_inc, True ) ):
+            cmd_maker = self._cmd_row_inc if inc else self._cmd_row_update
+            for table_key, table in rows.items():
+                table_name, index_column = table_key
+                for index_value, row in table.items():
+                    if connection_failed:
+                        requeue.setdefault(table_key, {})[index_value] = row
+                        continue
+                    connection = None
                     try:
-                        self._table_row_insert(cursor, _table_name, **fields)
+                        connection = self._connection_get()
+                        with connection.cursor() as cursor:
+                            self._table_ensure(
+                                cursor, table_name, index_column,
+                                { index_column: index_value, **row }, inc)
+                            cursor.execute(
+                                cmd_maker(table_name, index_column,
+                                          tuple(row.keys())),
+                                ( index_value, ) + tuple(row.values()))
                         connection.commit()
-                    except mariadb.OperationalError as e:
-                        # see next, it is the same
-                        if not str(e).startswith("Unknown column"):
-                            raise
-                        continue	# just retry and let if fail
-                    # note we break vs continue, because we already inserted
-                    break
-
-                except mariadb.OperationalError as e:
-                    # If any column does not exist, we'll get
-                    #
-                    ## mariadb.OperationalError: Unknown column ...blablah
-                    #
-                    # if there is a better way, I am all ears
-                    if not str(e).startswith("Unknown column"):
-                        raise
-                    # note we set defauls to True; this will take
-                    # the defaults based on the field name from
-                    # defaults_map defined above.
-                    self._table_columns_update(cursor, _table_name,
-                                               defaults = True, **fields)
-                    connection.commit()
-                    continue
+                        self._rows_retries.pop(( table_key, index_value ),
+                                               None)
+                    except ( mariadb.InterfaceError,
+                             mariadb.OperationalError ) as e:
+                        logging.error("MariaDB error writing row %s to"
+                                      " %s, will retry: %s",
+                                      index_value, table_name, e)
+                        self._rollback(connection)
+                        requeue.setdefault(table_key, {})[index_value] = row
+                        connection_failed = True
+                    except mariadb.Error as e:
+                        logging.error("MariaDB error writing row %s to"
+                                      " %s, dropping it: %s",
+                                      index_value, table_name, e)
+                        self._rollback(connection)
+                        self._rows_retries.pop(( table_key, index_value ),
+                                               None)
+        if requeue_update or requeue_inc:
+            self._rows_requeue(requeue_update, requeue_inc)
+
+
+    @staticmethod
+    def _rollback(connection):
+        if connection == None:
+            return
+        try:
+            connection.rollback()
+        except mariadb.Error as e:
+            logging.warning("MariaDB error rolling back: %s", e)
+
+
+    def flush(self):
+        """
+        Write to the database all the rows queued with
+        :meth:`table_row_update` and :meth:`table_row_inc`
+
+        All the missing tables and columns are created first; then
+        all the rows are written in a single transaction.
+
+        If that fails, each row is written in its own transaction:
+        rows the database rejects are logged and dropped, rows that
+        fail because the connection did are queued again to be
+        retried on the next flush (at most :data:`flush_retries`
+        times).
+        """
+        with self._flush_lock:
+            with self._rows_lock:
+                rows_update = self._rows_update
+                rows_inc = self._rows_inc
+                self._rows_update = {}
+                self._rows_inc = {}
+                rows_pending = self._rows_pending
+                self._rows_pending = 0
+                self._flush_ts = time.time()
+            if not rows_pending:
+                return
+            connection = None
+            try:
+                connection = self._connection_get()
+                self._flush_batch(connection, rows_update, rows_inc)
+                if self._rows_retries:
+                    self._rows_retries.clear()
+                return
+            except mariadb.Error as e:
+                logging.warning("MariaDB error flushing %d rows, writing"
+                                " them one by one: %s", rows_pending, e)
+                self._rollback(connection)
+                # maybe the tables changed under us, check again
+                self._table_columns.clear()
+            self._flush_row_by_row(rows_update, rows_inc)
 
 
     def report(self, testcase, target, tag, ts, delta,
@@ -643,8 +800,11 @@ class driver_summary(tcfl.tc.report_driver_c):
         # data or testcase completions
         if tag != "DATA" and not message.startswith("COMPLETION"):
             return
-        # skip global reporter, not meant to be used here
+        # skip global reporter, not meant to be used here; but its
+        # COMPLETION means the run is done, so write what is pending
         if testcase == tcfl.tc.tc_global:
+            if message.startswith("COMPLETION"):
+                self.flush()
             return
 
         runid = testcase.kws.get('runid', "no RunID")
@@ -782,3 +942,8 @@ class driver_summary(tcfl.tc.report_driver_c):
                         **{ self._id_maybe_encode(runid, max_len = 63): result })
                 except mariadb.Error as e:
                     logging.error(f"History: {tc_name}:{hashid}: MariaDB error: {str(e)}")
+
+            # Testcases might run in worker processes that exit
+            # without running atexit handlers, so write this
+            # testcase's rows now
+            self.flush()
@@ -65,6 +65,39 @@ Notes:
   none present
 
 
+Run counters
+^^^^^^^^^^^^
+
+As each testcase document is inserted, the result counters for its
+run are updated in a second collection (by default
+*COLLECTIONNAME_counters_per_run*), so summaries don't need to
+aggregate over all the testcase documents in a run. There is one
+document per run, keyed by *runid* and structured as:
+
+- total, pass, errr, fail, blck, skip: number of testcases that
+  completed with each result
+
+- components: dict keyed by component, each with the same counters
+
+- target_types_stats: dict keyed by the target types a testcase ran
+  on (*target_types* above), each with the same counters
+
+- targets: dict keyed by *SERVER/TARGETID*, each with the same counters
+
+- used_target_types, used_target_servers: dict keyed by target type
+  and server, the number of testcases that used them
+
+- tcs, fail_tc_names, errr_tc_names: dict keyed by testcase name,
+  the number of times it was executed, failed and errored
+
+Keys are escaped with :func:`counters_key` since MongoDB field names
+can't contain periods or start with dollar signs.
+
+When a testcase document is replaced (same *runid:hashid*), the
+counters for the previous one are subtracted. If updating the counters
+fails, they will be out of sync with the testcase documents; they can
+be rebuilt with ``mongo-update-sheet.py --rebuild-counters``.
+
 Troubleshooting
 ^^^^^^^^^^^^^^^
 
@@ -96,6 +129,72 @@ import commonl
 import tcfl
 import tcfl.tc
 
+def counters_key(name):
+    """
+    Escape a name so it can be used as a MongoDB field name
+
+    Escapes percent signs, periods and dollar signs as *%XX*; undo
+    with :func:`urllib.parse.unquote`.
+    """
+    return name.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+_counters_results = [ "PASS", "ERRR", "FAIL", "BLCK", "SKIP" ]
+
+def counters_inc(inc, doc, count):
+    """
+    Add to a MongoDB *$inc* dictionary the run counters for a testcase
+    document
+
+    *mongo/mongo-update-sheet.py* uses this too, to rebuild the
+    counters from the testcase documents.
+
+    :param dict inc: dictionary of *FIELD: COUNT* to update
+    :param dict doc: testcase document (as described in
+      :mod:`tcfl.report_mongodb`)
+    :param int count: how much to add (*1*) or subtract (*-1*)
+    """
+    result = doc.get('result', None)
+    if result not in _counters_results:
+        return
+    field = result.lower()
+
+    def _inc(prefix):
+        for name in [ "total", field ]:
+            inc[prefix + name] = inc.get(prefix + name, 0) + count
+
+    _inc("")
+    for component in doc.get('components', []):
+        _inc("components." + counters_key(component) + ".")
+    target_types = doc.get('target_types', None)
+    if target_types:
+        _inc("target_types_stats." + counters_key(target_types) + ".")
+        for target_type in set(target_types.split(",")):
+            key = "used_target_types." + counters_key(target_type)
+            inc[key] = inc.get(key, 0) + count
+    target_servers = doc.get('target_servers', None)
+    if target_servers:
+        for target_server in set(target_servers.split(",")):
+            key = "used_target_servers." + counters_key(target_server)
+            inc[key] = inc.get(key, 0) + count
+    for target in doc.get('targets', {}).values():
+        _inc("targets." + counters_key(target['server'] + "/" + target['id'])
+             + ".")
+    tc_name = counters_key(doc.get('tc_name', "n/a"))
+    names = [ "tcs" ]
+    if field in ( "fail", "errr" ):
+        names.append(field + "_tc_names")
+    for name in names:
+        key = name + "." + tc_name
+        inc[key] = inc.get(key, 0) + count
+
+
+# fields counters_inc() needs from a testcase document
+_counters_projection = {
+    'result': 1, 'components': 1, 'target_types': 1, 'target_servers': 1,
+    'targets': 1, 'tc_name': 1,
+}
+
 class driver(tcfl.tc.report_driver_c):
     """
     Report results of testcase execution into a MongoDB database
@@ -131,6 +230,11 @@ class driver(tcfl.tc.report_driver_c):
     :param str collection_name: name of the collection in the database
       to fill out
 
+    :param str counters_collection_name: (optional) name of the
+      collection where to keep the run counters (see
+      :mod:`tcfl.report_mongodb`); defaults to
+      *COLLECTIONNAME_counters_per_run*; *False* disables them.
+
     :param dict extra_params: MongoDB client extra params, as described in
        :class:`pymongo.mongo_client.MongoClient`; this you want to use
        to configure SSL, such as:
@@ -143,11 +247,14 @@ class driver(tcfl.tc.report_driver_c):
               ssl_ca_certs = PATH_TO_CA_FILE,
           )
     """
-    def __init__(self, url, db_name, collection_name, extra_params = None):
+    def __init__(self, url, db_name, collection_name, extra_params = None,
+                 counters_collection_name = None):
         assert isinstance(url, str)
         assert isinstance(db_name, str)
         assert isinstance(collection_name, str)
         assert extra_params == None or isinstance(extra_params, dict)
+        assert counters_collection_name in ( None, False ) \
+            or isinstance(counters_collection_name, str)
 
         tcfl.tc.report_driver_c.__init__(self)
         # Where we keep all the file descriptors to the different
@@ -156,6 +263,7 @@ class driver(tcfl.tc.report_driver_c):
         self.mongo_client = None
         self.db = None
         self.results = None
+        self.counters = None
         # It might happen dep on the version of pymongo that we get
         # this if we pass the data structure over forks and then it
         # doesn't work:
@@ -179,6 +287,11 @@ class driver(tcfl.tc.report_driver_c):
         self.db_name = db_name
         #: Name of the collection in :attr:url and :attr:db_name
         self.collection_name = collection_name
+        if counters_collection_name == None:
+            counters_collection_name = collection_name + "_counters_per_run"
+        #: Name of the collection in :attr:url and :attr:db_name where
+        #: the run counters are kept (*False* if disabled)
+        self.counters_collection_name = counters_collection_name
         self.extra_params = extra_params if extra_params else dict()
 
         #: List of functions to run when a document is completed before
@@ -364,6 +477,8 @@ class driver(tcfl.tc.report_driver_c):
         self.mongo_client = pymongo.MongoClient(self.url, **self.extra_params)
         self.db = self.mongo_client[self.db_name]
         self.results = self.db[self.collection_name]
+        if self.counters_collection_name:
+            self.counters = self.db[self.counters_collection_name]
         self.made_in_pid = os.getpid()
 
     def _complete(self, testcase, runid, hashid, tc_name, doc):
@@ -416,8 +531,7 @@ class driver(tcfl.tc.report_driver_c):
         for complete_hook in self.complete_hooks:
             complete_hook(_tc, runid, hashid, tc_name, doc)
 
-        # FIXME: update summaries
-            
+        doc_previous = None
         retry_count = 1
         while retry_count <= 3:
             if self.results == None or self.made_in_pid != os.getpid():
@@ -444,8 +558,10 @@ class driver(tcfl.tc.report_driver_c):
                     return doc
                 doc_json = _convert_unsupported_types(doc)
 
-                self.results.find_one_and_replace({ '_id': doc['_id'] },
-                                                  doc_json, upsert = True)
+                # get back what we replaced to fix the counters
+                doc_previous = self.results.find_one_and_replace(
+                    { '_id': doc['_id'] }, doc_json, upsert = True,
+                    projection = _counters_projection)
                 break
             except Exception as e:
                 # broad exception, could be almost anything, but we
@@ -461,6 +577,32 @@ class driver(tcfl.tc.report_driver_c):
                     testcase.log.warning(
                         f"{tc_name}:{hashid}: MongoDB error, retrying"
                         " ({retry_count}/3): {str(e)}")
+        else:
+            return		# never made it to the database
+        self._counters_update(testcase, runid, hashid, tc_name,
+                              doc, doc_previous)
+
+    def _counters_update(self, testcase, runid, hashid, tc_name,
+                         doc, doc_previous):
+        if not runid or self.counters == None:
+            return
+        inc = {}
+        counters_inc(inc, doc, 1)
+        if doc_previous:
+            counters_inc(inc, doc_previous, -1)
+        # same result as before? nothing to change
+        inc = { key: value for key, value in inc.items() if value != 0 }
+        if not inc:
+            return
+        try:
+            self.counters.update_one({ '_id': runid }, { "$inc": inc },
+                                     upsert = True)
+        except Exception as e:
+            # broad exception, same as in _complete()
+            testcase.log.error(
+                f"{tc_name}:{hashid}: MongoDB error updating run counters,"
+                f" rebuild them with mongo-update-sheet.py"
+                f" --rebuild-counters: {str(e)}")
 
 # backwards compat	# COMPAT
 report_mongodb_c = driver
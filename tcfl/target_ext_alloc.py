@@ -16,6 +16,7 @@ import os
 import pprint
 import sys
 import socket
+import threading
 import time
 import uuid
 
@@ -44,13 +45,224 @@ def _delete(server, allocid):
         # already wiped
 
 
+class _allocator_c:
+    """
+    Per server batching of allocation requests and watching of
+    allocation states
+
+    Threads requesting allocations from the same server (eg:
+    testcases running in parallel) hand them to the server's
+    allocator; requests made within :attr:`batch_period` seconds of
+    each other are sent in a single *allocation/batch* call. A single
+    thread waits for state changes of all the allocations being
+    waited for with *allocation/watch* calls, which also keep them
+    alive.
+
+    Servers that don't support these calls get an *allocation* call
+    per request and the waiters send *keepalive* calls.
+    """
+    #: Seconds to wait for more requests to send in a single batch
+    batch_period = 0.2
+
+    #: Maximum seconds each *allocation/watch* call waits for changes
+    #: (the server might cap it)
+    watch_timeout = 10
+
+    #: Seconds to keep retrying *allocation/watch* on connection errors
+    retry_timeout = 40
+
+    _allocators = {}
+    _allocators_lock = threading.Lock()
+
+    def __init__(self, server):
+        self.server = server
+        self.batch_supported = True
+        self.watch_supported = True
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        # [ DATA, EVENT, RESULT, EXCEPTION ] waiting to be sent
+        self.pending = []
+        self.batcher = None
+        # ALLOCID: STATE the waiters know about
+        self.states = {}
+        # ALLOCID: { 'state': STATE, ... } reported by the server
+        self.changes = {}
+        self.watcher = None
+        self.watch_exception = None
+
+    @classmethod
+    def get(cls, server):
+        # one per process, since the threads don't survive a fork
+        key = ( server.url, os.getpid() )
+        with cls._allocators_lock:
+            allocator = cls._allocators.get(key, None)
+            if allocator == None:
+                allocator = cls(server)
+                cls._allocators[key] = allocator
+            return allocator
+
+    def request(self, data):
+        """
+        Request an allocation, batched with others
+
+        :param dict data: request, as for the *allocation* call
+        :returns dict: server's response, as for the *allocation* call
+        """
+        if not self.batch_supported:
+            return self.server.send_request("PUT", "allocation", json = data)
+        slot = [ data, threading.Event(), None, None ]
+        with self.lock:
+            self.pending.append(slot)
+            if self.batcher == None:
+                self.batcher = threading.Thread(
+                    target = self._batch_run, daemon = True,
+                    name = f"alloc-batcher-{self.server.aka}")
+                self.batcher.start()
+        slot[1].wait()
+        if slot[3]:
+            raise slot[3]
+        return slot[2]
+
+    def _batch_run(self):
+        time.sleep(self.batch_period)
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            self.batcher = None
+        results = None
+        try:
+            r = self.server.send_request(
+                "PUT", "allocation/batch",
+                json = dict(requests = [ slot[0] for slot in pending ]))
+            results = r['results']
+        except requests.exceptions.HTTPError as e:
+            if getattr(e, "status_code", None) not in ( 404, 405 ):
+                for slot in pending:
+                    slot[3] = e
+            else:
+                logging.info("%s: no allocation/batch support, using"
+                             " single requests", self.server.aka)
+                self.batch_supported = False
+        except Exception as e:
+            for slot in pending:
+                slot[3] = e
+        for index, slot in enumerate(pending):
+            if results != None:
+                slot[2] = results[index]
+            elif not self.batch_supported:
+                try:
+                    slot[2] = self.server.send_request(
+                        "PUT", "allocation", json = slot[0])
+                except Exception as e:
+                    slot[3] = e
+            slot[1].set()
+
+    def wait(self, allocid, state, timeout):
+        """
+        Wait for an allocation to change state
+
+        :param str allocid: allocation ID
+        :param str state: state the allocation is known to be in
+        :param float timeout: maximum seconds to wait
+
+        :returns dict: *None* if the state did not change in *timeout*
+          seconds (or the server does not support watching, see
+          :attr:`watch_supported`), otherwise the new state as
+          reported by the server (*state* and *group_allocated*
+          fields).
+        """
+        ts0 = time.time()
+        with self.condition:
+            self.states[allocid] = state
+            if self.watcher == None:
+                self.watch_exception = None
+                self.watcher = threading.Thread(
+                    target = self._watch_run, daemon = True,
+                    name = f"alloc-watcher-{self.server.aka}")
+                self.watcher.start()
+            try:
+                while allocid not in self.changes and self.watch_supported:
+                    if self.watch_exception:
+                        raise RuntimeError(
+                            f"alloc/watch failed: {self.watch_exception}") \
+                            from self.watch_exception
+                    remaining = timeout - (time.time() - ts0)
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                return self.changes.pop(allocid, None)
+            finally:
+                del self.states[allocid]
+
+    def _watch_run(self):
+        # if the watcher dies, the waiters have to know or they'd wait
+        # for nothing while their allocations are not kept alive
+        try:
+            self._watch_loop()
+        except Exception as e:
+            logging.error("%s: alloc/watch failed: %s", self.server.aka, e,
+                          exc_info = True)
+            with self.condition:
+                self.watch_exception = e
+                self.watcher = None
+                self.condition.notify_all()
+
+    def _watch_loop(self):
+        retry_ts = None
+        while True:
+            with self.condition:
+                allocids = {
+                    allocid: state for allocid, state in self.states.items()
+                    if allocid not in self.changes
+                }
+                if not allocids:
+                    self.watcher = None
+                    return
+            try:
+                r = self.server.send_request(
+                    "PUT", "allocation/watch",
+                    json = dict(allocids = allocids,
+                                timeout = self.watch_timeout))
+                retry_ts = None
+            except requests.exceptions.HTTPError as e:
+                if getattr(e, "status_code", None) not in ( 404, 405 ):
+                    raise
+                logging.info("%s: no allocation/watch support, using"
+                             " keepalive", self.server.aka)
+                with self.condition:
+                    self.watch_supported = False
+                    self.watcher = None
+                    self.condition.notify_all()
+                return
+            except requests.exceptions.RequestException as e:
+                ts = time.time()
+                if retry_ts == None:
+                    retry_ts = ts
+                elif ts - retry_ts > self.retry_timeout:
+                    raise RuntimeError(
+                        f"giving up after {self.retry_timeout}s retrying"
+                        f" connection errors: {e}") from e
+                logging.warning(
+                    f"retrying for {self.retry_timeout - (ts - retry_ts):.0f}s"
+                    f" alloc/watch after connection error {type(e)}: {e}")
+                time.sleep(1)
+                continue
+            with self.condition:
+                for allocid, change in r.items():
+                    if allocid in self.states:
+                        self.changes[allocid] = change
+                if r:
+                    self.condition.notify_all()
+
+
 # FIXME: what happens if the target is disabled / removed while we wait
 # FIXME: what happens if the conn
 def _alloc_targets(server, groups, obo = None,
                    keepalive_period = 4,
                    queue_timeout = None, priority = 700, preempt = False,
                    queue = True, reason = None, wait_in_queue = True,
-                   register_at = None, extra_data = None, endtime = None):
+                   register_at = None, extra_data = None, endtime = None,
+                   batch = False):
     """:param set register_at: (optional) if given, this is a set where
       we will add the allocation ID created only if ACTIVE or QUEUED
       inmediately as we get it before doing any waiting.
@@ -58,6 +270,10 @@ def _alloc_targets(server, groups, obo = None,
       This is used for being able to cleanup on the exit path if the
       client is cancelled.
 
+    :param bool batch: (optional, default *False*) send the request
+      in a batch with others made at the same time by other threads
+      to the same server (see :class:`_allocator_c`).
+
     :param dict extra_data: dict of scalars with extra data, for
       implementation use; this extra data is client specifc, the
       server will record it in the allocation and some drivers might
@@ -108,7 +324,11 @@ def _alloc_targets(server, groups, obo = None,
                                      (bool, int, float, str))
         data['extra_data'] = extra_data
     data['groups'] = groups
-    r = server.send_request("PUT", "allocation", json = data)
+    allocator = _allocator_c.get(server)
+    if batch:
+        r = allocator.request(data)
+    else:
+        r = server.send_request("PUT", "allocation", json = data)
 
     ts0 = time.time()
     state = r['state']
@@ -138,25 +358,31 @@ def _alloc_targets(server, groups, obo = None,
                 raise tcfl.tc.blocked_e(
                     "can't acquire targets, still busy after %ds"
                     % queue_timeout, dict(targets = groups))
-            time.sleep(keepalive_period)
-            ts = time.time()
             state = data[allocid]
-            try:
-                #print(f"DEBUG: alloc/keepalive", file = sys.stderr)
-                r = server.send_request("PUT", "keepalive", json = data)
-            except requests.exceptions.RequestException as e:
+            if allocator.watch_supported:
+                # waiting for changes also keeps it alive
+                change = allocator.wait(allocid, state,
+                                        allocator.watch_timeout)
                 ts = time.time()
-                if retry_ts == None:
-                    retry_ts = ts
-                else:
-                    if ts - retry_ts > retry_timeout:
-                        raise RuntimeError(
-                            f"alloc/keepalive giving up after {retry_timeout}s"
-                            f" retrying connection errors") from e
-                logging.warning(
-                    f"retrying for {retry_timeout - (ts - retry_ts):.0f}s"
-                    f" alloc/keepalive after connection error {type(e)}: {e}")
-                continue
+                r = { allocid: change } if change else {}
+            else:
+                time.sleep(keepalive_period)
+                ts = time.time()
+                try:
+                    r = server.send_request("PUT", "keepalive", json = data)
+                except requests.exceptions.RequestException as e:
+                    ts = time.time()
+                    if retry_ts == None:
+                        retry_ts = ts
+                    else:
+                        if ts - retry_ts > retry_timeout:
+                            raise RuntimeError(
+                                f"alloc/keepalive giving up after {retry_timeout}s"
+                                f" retrying connection errors") from e
+                    logging.warning(
+                        f"retrying for {retry_timeout - (ts - retry_ts):.0f}s"
+                        f" alloc/keepalive after connection error {type(e)}: {e}")
+                    continue
         except KeyboardInterrupt:
             # HACK: if we are interrupted, cancel this allocation so
             # it is not left hanging and makes it all confusing
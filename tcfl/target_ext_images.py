@@ -101,7 +101,7 @@ class extension(tc.target_extension_c):
 
 
     def flash(self, images, upload = True, timeout = None, soft = False,
-              hash_target_name = True):
+              hash_target_name = True, job = False):
         """Flash images onto target
 
         >>> target.images.flash({
@@ -145,6 +145,12 @@ class extension(tc.target_extension_c):
           image type (or if there is no record of anything having been
           flashed).
 
+        :param bool job: (optional, default *False*) if *True*, ask
+          the server to run the flashing as a background job and wait
+          for it to complete polling its state (vs keeping the HTTP
+          request open for the whole flashing operation); progress is
+          reported as the server provides it.
+
         """
         if isinstance(images, dict):
             for k, v in images.items():
@@ -233,7 +239,13 @@ class extension(tc.target_extension_c):
                     continue
                 _images[img_type] = img_name
 
-        if _images:
+        if _images and job:
+            target.report_info("flashing (job): " + images_str, dlevel = 2)
+            r = target.ttbd_iface_call("images", "flash", images = _images,
+                                       job = True)
+            self._job_wait(r['job_id'], timeout)
+            target.report_info("flashed: " + images_str, dlevel = 1)
+        elif _images:
             # We don't do retries here, we leave it to the server
             target.report_info("flashing: " + images_str, dlevel = 2)
             target.ttbd_iface_call("images", "flash", images = _images,
@@ -242,6 +254,43 @@ class extension(tc.target_extension_c):
         else:
             target.report_info("flash: all images soft flashed", dlevel = 1)
 
+    #: When waiting for a flash job to complete, maximum number of
+    #: seconds to ask the server to hold each poll request
+    job_wait_period = 30
+
+    def _job_wait(self, job_id, timeout):
+        # Long-poll the server for the state of a flash job until it
+        # is done or we run out of time
+        target = self.target
+        ts0 = time.time()
+        while True:
+            wait = max(1, min(self.job_wait_period,
+                              timeout - (time.time() - ts0)))
+            r = target.ttbd_iface_call(
+                "images", "flash_job", method = "GET",
+                job_id = job_id, wait = wait,
+                # give the server some slack to reply
+                timeout = wait + 30)
+            state = r['state']
+            if state == "completed":
+                return
+            if state == "failed":
+                raise tc.error_e(
+                    "%s: flash job %s failed: %s"
+                    % (target.id, job_id, r.get('message', "n/a")),
+                    dict(target = target, job = r))
+            eta = r.get('eta', None)
+            target.report_info(
+                "flash job %s: %s %d%% (ETA %s)"
+                % (job_id, state, r.get('progress', 0),
+                   "n/a" if eta == None else "%.0fs" % eta),
+                dlevel = 2)
+            if time.time() - ts0 > timeout:
+                raise tc.error_e(
+                    "%s: flash job %s: timed out after %ds waiting"
+                    " for it to complete" % (target.id, job_id, timeout),
+                    dict(target = target, job = r))
+
     # match: [no-]upload [no-]soft IMGTYPE1:IMGFILE1 IMGTYPE2:IMGFILE2 ...
     _image_flash_regex = re.compile(
         r"((no-)?(soft|upload)\s+)*((\S+:)?\S+\s*)+")
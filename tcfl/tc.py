@@ -98,6 +98,7 @@ import functools
 import importlib
 import importlib.util
 import inspect
+import itertools
 import json
 import logging
 import numbers
@@ -190,6 +191,7 @@ from . import app
 import commonl
 import commonl.expr_parser
 from . import msgid_c
+from . import planner
 
 # discovered by the importer
 version = None
@@ -528,7 +530,6 @@ class report_driver_c(object):
         """
         assert isinstance(obj, cls)
         if origin == None:
-            o = inspect.stack()[1]
             origin = commonl.origin_get(2)
         setattr(obj, "origin", origin)
 
@@ -2715,8 +2716,7 @@ class target_c(reporter_c):
             "keyword %s: value type %s not allowed (str, int, float, bool): %s" % (
                 kw, type(value), value)
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            origin = commonl.origin_get(2)
         else:
             assert isinstance(origin, str)
         self._kws[kw] = value
@@ -3543,17 +3543,13 @@ def _target_app_setup(obj, cls_name, target_want_name):
             # Note how we cast with the instance set to None, so in
             # __method_trampoline_call() we can tell we need to bind it.
             value = eval(dest_method_name)
+        elif isinstance(obj, type):
+            # We are binding to a class (with a metaclass)
+            value = eval(dest_method_name)
         else:
-            # Bind to an object, force not binding to an instance,
-            # setting it to None, so in __method_trampoline_call() we
-            # can tell we need to bind it.
-            if isinstance(obj, type):
-                # We are binding to a class
-                value = types.MethodType(eval(dest_method_name), None, obj)
-            else:
-                # We are binding to a object instance
-                value = types.MethodType(eval(dest_method_name), None,
-                                         type(obj))
+            # We are binding to a object instance; when it is cloned
+            # with deepcopy(), the method is bound to the copy
+            value = types.MethodType(eval(dest_method_name), obj)
         setattr(obj, method_name, value)
 
 def _target_app_add(obj, target_want_name, app_name, app_src):
@@ -4511,6 +4507,17 @@ class tc_c(reporter_c, metaclass=_tc_mc):
     #: limitations until the improved orchestrator is ready.
     max_runs_per_tc = 0
 
+    #: Seed for generating target group permutations
+    #:
+    #: Target groups are formed picking remote targets in a random
+    #: order, so the load spreads among equivalent targets. When
+    #: set, that order is a function of this seed and the testcase
+    #: name, so a run's target groups can be reproduced. If *None*,
+    #: the RunID is used if given, otherwise it is random.
+    #:
+    #: Set with the *--permutations-seed* command line option.
+    permutations_seed = None
+
     #: reporting hooks on exception keyed by callable, value origin
     _report_exception_hooks = {}
 
@@ -5190,8 +5197,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         if origin != None:
             assert isinstance(origin, str)
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            origin = commonl.origin_get(2)
         cls._ignore_regexs.append((re.compile(regex), origin))
 
     @classmethod
@@ -5209,8 +5215,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         if origin != None:
             assert isinstance(origin, str)
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            origin = commonl.origin_get(2)
         cls._ignore_directory_regexs.append((re.compile(regex), origin))
 
     @classmethod
@@ -5232,8 +5237,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         assert issubclass(_cls, tc_c), \
             f"{_cls}: shall be a type, got {type(_cls)}"
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            origin = commonl.origin_get(2)
         setattr(_cls, "origin", origin)
         logger.info("%s: Added test case driver %s", origin, _cls)
         tcd_setup = getattr(_cls, "setup", None)
@@ -5293,6 +5297,22 @@ class tc_c(reporter_c, metaclass=_tc_mc):
     #:      testcases or testcase driver code.
     hook_pre = []
 
+    #: Functions to call when *tcf run* has completed all testcases,
+    #: before reporting the summary
+    #:
+    #: >>> def _my_hook_fn(tc_global, result):
+    #: >>>     tc_global.report_info("something to say about this run",
+    #: >>>                           level = 0)
+    #: >>>
+    #: >>> tcfl.tc.tc_c.hook_run_post.append(_my_hook_fn)
+    #:
+    #: *tc_global* is the toplevel testcase used for reporting and
+    #: *result* the :class:`result_c` accumulated for all the
+    #: testcases. Note these are called in the toplevel process;
+    #: testcases might have run in other processes, so any data has
+    #: to be passed via files (eg: in :data:`tmpdir`).
+    hook_run_post = []
+
     #: (dict) a dictionary to translate target type names, from
     #: *TYPE[:BSP]* to another name to use when reporting as it is
     #: useful/convenient to your application (eg: if what you are
@@ -5460,6 +5480,97 @@ class tc_c(reporter_c, metaclass=_tc_mc):
     # List of available testcase drivers
     _tc_drivers = []
 
+    #: Directory where testcase discovery results are cached
+    #:
+    #: For each directory scanned, :meth:`find_in_path` keeps a file
+    #: in here recording which testcase driver (if any) recognized
+    #: each file and the testcases it found (as described by
+    #: :meth:`discovery_describe`), keyed by the file's modification
+    #: time and size and the drivers' versions. In the next scan,
+    #: files that did not change are not given to the drivers: their
+    #: testcases are created from the descriptions with
+    #: :meth:`discovery_create`--so most files in a big source tree
+    #: (which are not testcases) are only *stat()*ed. Files whose
+    #: testcases can't be described are only given to the driver
+    #: that recognized them before.
+    discovery_cache_dir = os.path.join(
+        os.path.expanduser("~"), ".cache", "tcf", "testcase-discovery")
+
+    #: Number of processes used to probe files not in the discovery cache
+    #:
+    #: *1* disables probing in parallel.
+    discovery_processes = os.cpu_count() or 1
+
+    #: Minimum number of files not in the discovery cache for them to
+    #: be probed in parallel (otherwise it is not worth the overhead)
+    discovery_parallel_min = 64
+
+    #: Can the results of this driver's :meth:`is_testcase` be cached?
+    #:
+    #: Drivers whose :meth:`is_testcase` depends on more than the
+    #: path and contents of the file given shall set this to *False*
+    #: so they are always called.
+    discovery_cacheable = True
+
+    #: Version of this driver's :meth:`is_testcase`
+    #:
+    #: The discovery cache is invalidated when the source file of a
+    #: driver is modified; bump this to invalidate it when the
+    #: driver's results change for any other reason.
+    discovery_version = 0
+
+    @classmethod
+    def discovery_main_only(cls, path):
+        """
+        Shall this driver be given a file only in the main process?
+
+        Files not in the discovery cache might be probed in a pool of
+        processes (see :data:`discovery_processes`); drivers that
+        would have to do the same work again in the main process to
+        create the testcases they find in *path* (because they can't
+        be described with :meth:`discovery_describe`) return *True*,
+        so it is done only once.
+
+        The default Python driver does so for the files it would
+        consider: its testcases are classes defined in the file, so
+        the main process has to import it anyway to run them.
+
+        :param str path: path and filename of the file to consider
+        :returns bool: *True* if the file has to be scanned in the
+          main process
+        """
+        return cls.is_testcase.__func__ is tc_c.is_testcase.__func__ \
+            and bool(cls.file_regex.search(os.path.basename(path)))
+
+    def discovery_describe(self):
+        """
+        Describe this testcase so it can be recreated without scanning
+        its file again
+
+        The discovery cache (see :data:`discovery_cache_dir`) keeps
+        this description instead of asking the driver to scan the
+        file again when it has not changed;
+        :meth:`discovery_create` creates the testcase from it.
+
+        :returns: data that can be serialized to JSON or *None* if this
+          testcase can't be described (default), in which case the
+          file will be given to the driver to scan again.
+        """
+        return None
+
+    @classmethod
+    def discovery_create(cls, descriptor):
+        """
+        Create a testcase from a description made by
+        :meth:`discovery_describe`
+
+        :param descriptor: description of the testcase
+        :returns tcfl.tc.tc_c: testcase instance
+        """
+        raise NotImplementedError(
+            f"{cls}: discovery_describe() implemented but not"
+            f" discovery_create()")
+
     # Will targets be released at the end of the testcase
     release = True
 
@@ -6475,8 +6586,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         """
         assert isinstance(d, dict)
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            origin = commonl.origin_get(2)
         else:
             assert isinstance(origin, str)
         for key, value in d.items():
@@ -7279,8 +7389,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         assert isinstance(value, (str, int)), \
                 "value: expected str|int, got %s: %s" % (type(value).__name__, value)
         if origin == None:
-            o = inspect.stack()[1]
-            origin = "%s:%s" % (o[1], o[2])
+            origin = commonl.origin_get(2)
         else:
             assert isinstance(origin, str)
         self.kws[kw] = value
@@ -7386,7 +7495,9 @@ class tc_c(reporter_c, metaclass=_tc_mc):
             priority = self.priority,
             queue_timeout = timeout,
             reason = self.reason % commonl.dict_missing_c(self.kws),
-            register_at = register_allocids)
+            register_at = register_allocids,
+            # testcases running in parallel share the calls
+            batch = True)
         if state != 'active':
             # FIXME: this need sto carry more data, we've lost a lot
             # on the way here
@@ -7487,7 +7598,7 @@ class tc_c(reporter_c, metaclass=_tc_mc):
     #
     # Remote target selection
     #
-    # Given all the list of available, this helps _run_on_targets() to
+    # Given all the list of available, this helps _jobs_make() to
     # generate the minimum set of unique permutations of interconnects
     # and targets where we can / need to run the TC for optimal
     # coverage.
@@ -7851,44 +7962,131 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                 s += "%s=%s:%s " % (twn, rt_full_id, bsp_model)
         return s[:-1]
 
-    def _target_wants_list_permutations(self, target_want_candidates, n,
-                                        tag = "target", name_prefix = ""):
+    @staticmethod
+    def _target_wants_permutations_iter(target_want_candidates,
+                                        candidate_types, rng):
+        """
+        Lazily generate assignments of remote targets to target wants
 
-        # Compute how many unique candidates we have
-        candidates = set()
-        for c in list(target_want_candidates.values()):
-            candidates |= c
+        :param dict target_want_candidates: dictionary keyed by target
+          want name of sets of candidates (*(RTFULLID, BSPMODEL)*)
+          that can be assigned to it
 
-        # max_repeats is how many repetitions we will allow before we
-        # call it quits
-        #
-        # A repetition is when we have to reject a candidate target
-        # group because:
-        #
-        #  - we have already considered that type
+        :param dict candidate_types: dictionary keyed by target want
+          name of dictionaries keyed by candidate of the type key of
+          said candidate; assignments that would give each target
+          want a candidate of the same type key as an assignment
+          already generated are not generated.
+
+        :param random.Random rng: randomizer used to sort the
+          candidates and types, so different targets of the same
+          type get used in different runs
+
+        :returns: iterator of dictionaries keyed by target want name
+          of the candidate assigned; no remote target is assigned to
+          more than one target want.
+        """
+        # For each target want, group the candidates by type key; we
+        # then enumerate combinations of type keys and, for each,
+        # look for one assignment of remote targets--so we never
+        # consider two assignments of the same types.
         #
-        #  - it involves an invalid combination of targets
+        # The target wants with less candidates go first, so we find
+        # the impossible assignments sooner.
+        twns = sorted(target_want_candidates,
+                      key = lambda twn: (len(target_want_candidates[twn]),
+                                         twn))
+        buckets = []
+        type_keys = []
+        for twn in twns:
+            bucket = collections.defaultdict(list)
+            for candidate in sorted(target_want_candidates[twn],
+                                    key = str):
+                bucket[candidate_types[twn][candidate]].append(candidate)
+            for candidates in bucket.values():
+                rng.shuffle(candidates)
+            keys = sorted(bucket, key = str)
+            rng.shuffle(keys)
+            buckets.append(bucket)
+            type_keys.append(keys)
+
+        def _assign(combination, index, rts_taken, perm):
+            # depth first search of an assignment of remote targets
+            # for the given combination of type keys
+            if index == len(twns):
+                return True
+            twn = twns[index]
+            for candidate in buckets[index][combination[index]]:
+                rt_fullid = candidate[0]
+                if rt_fullid in rts_taken:
+                    continue
+                rts_taken.add(rt_fullid)
+                perm[twn] = candidate
+                if _assign(combination, index + 1, rts_taken, perm):
+                    return True
+                rts_taken.remove(rt_fullid)
+                del perm[twn]
+            return False
+
+        # Enumerate the combinations of type key indexes by level
+        # (the highest index in the combination), so we get to see
+        # every type in each target want as early as possible,
+        # instead of exhausting the types of the last target want
+        # before changing the first one. In each level, the
+        # combinations with the highest index L, in the first
+        # position that has it, p, are:
         #
-        # Now, this algorithm is anything but efficient now and this
-        # is a hack that will be rid of when we make this algorithm
-        # proper.
+        #   [0, L) x ... x [0, L) x {L} x [0, L] x ... x [0, L]
+        #    ^ positions < p               ^ positions > p
         #
-        # As we have more candidates, we need more chances to find it
-        max_repeats = max(100, 5 * len(candidates))
+        # (any index out of the range of a target want's types is
+        # skipped)
+        level_max = max([ len(keys) for keys in type_keys ] + [ 0 ])
+        for level in range(level_max):
+            for p in range(len(twns)):
+                if level >= len(type_keys[p]):
+                    continue
+                ranges = []
+                for i, keys in enumerate(type_keys):
+                    if i < p:
+                        ranges.append(range(min(level, len(keys))))
+                    elif i == p:
+                        ranges.append(( level, ))
+                    else:
+                        ranges.append(range(min(level + 1, len(keys))))
+                for indexes in itertools.product(*ranges):
+                    combination = [
+                        type_keys[i][index] for i, index in enumerate(indexes)
+                    ]
+                    perm = {}
+                    if _assign(combination, 0, set(), perm):
+                        yield perm
+
+    def _target_wants_list_permutations(self, target_want_candidates, n,
+                                        tag = "target", name_prefix = ""):
 
         # Limited evaluation: this means to only do one target of each
         # type. This can be general (set on the command line, applies to all
         # targets) or per per target (declared by the target
         # decorator. _types_seen decides which is applied to each.
+        #
+        # For each target want, we compute then the type key of each
+        # candidate:
+        #
+        # - one-per-type: (TYPE, BSPMODEL), so we only consider once
+        #   each combination of types
+        #
+        # - any: always the same, so we only consider once
+        #
+        # - all: the candidate itself, so they are all considered
         _types_seen = {}
+        candidate_types = {}
         for twn in target_want_candidates:
             target_want = self._targets[twn]
             mode = target_want['kws'].get('mode', None)
             if mode == None:
                 mode = self._mode
-            if mode == "one-per-type":
-                _types_seen[twn] = 'one-per-type'
-            elif mode == "any":
+            if mode == "any":
                 _types_seen[twn] = 'any'
             elif mode == "all":
                 _types_seen[twn] = 'all'
@@ -7907,12 +8105,19 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                         _n += bsp_model_count
                     if _n > n:
                         n = _n
-                        max_repeats = 3 * _n
             else:
-                assert True, "Unknown mode in self._mode (%s) "\
-                    "or target_want['kws']['mode'] (%s)" \
-                    % (self._mode, target_want['kws']['mode'])
-
+                # one-per-type is the default
+                _types_seen[twn] = 'one-per-type'
+            candidate_types[twn] = {}
+            for candidate in target_want_candidates[twn]:
+                rt_fullid, bsp_model = candidate
+                if _types_seen[twn] == 'one-per-type':
+                    candidate_types[twn][candidate] = \
+                        ( self.rt_all[rt_fullid]['type'], bsp_model )
+                elif _types_seen[twn] == 'any':
+                    candidate_types[twn][candidate] = ( 'any', None )
+                else:
+                    candidate_types[twn][candidate] = candidate
 
         # We are going to generate permutations of assigning candidate remote
         # targets (A*, B* in the example below) to each target want declared by
@@ -7958,125 +8163,66 @@ class tc_c(reporter_c, metaclass=_tc_mc):
         #
         # We are left with just two groups to test
         #
-        # For tracking limited mode: for each permutation we generate,
-        # we have a string [TARGET-WANT-NAME1:TARGET-TYPE1
-        # TARGET-WANT-NAME2:TARGET-TYPE2 ...]; if the string is in the
-        # @types_seen set, then it means we already have that type
-        # covered, so we ignore it.
-        #
-        # If we generate this many groups that are repeated, we are maybe out
-        # of permutations to generate. LAME, but quick to implement
-        types_seen = set()
-
-        permutations = {}
-        itr = 0
-        target_counter = 0
-        while itr < n:
-            if max_repeats == 0:
-                # Lame way to avoid getting stuck in not being able to generate
-                # good permutations
-                self.report_info("Exiting after generating %d permutations "
-                                 "(tried to generate more, but discarded "
-                                 "too many)" % len(permutations), dlevel = 6)
-                break
-
-            # Instead of brute forcing a random number, converting it to our
-            # base and discarding the invalids, we are going to go for each
-            # target want at random order in the list and pick up a candidate
-            # at random, making sure it is not taken already
-
-            # This keeps track of which physical remote targets have already
-            # been taken, so we don't try to pick it again
-            rts_taken = set()
-            _types = dict()
-            perm = {}
-            cnt = 0
-            for target_want_name in random.sample(list(target_want_candidates.keys()), len(target_want_candidates)):
+        # _target_wants_permutations_iter() does this by enumerating
+        # combinations of the type keys computed above and finding
+        # one assignment of remote targets for each, so we never
+        # generate groups we'd have to discard.
+        for target_want_name, candidates in target_want_candidates.items():
+            if not candidates:
                 target_want = self._targets[target_want_name]
-                # Of the want's candidates, get which aren't taken already
-                rts_not_taken = set()
-                for rt_full_id, bsp_model in target_want_candidates[target_want_name]:
-                    if rt_full_id in rts_taken:
-                        continue
-                    rts_not_taken.add((rt_full_id, bsp_model))
-                if len(rts_not_taken) == 0:
-                    spec = target_want.get('spec', "")
-                    self.report_skip(
-                        "%s group %s: no remote targets (or group of) "
-                        "can satisfy the conditions [%s] for wanted target '%s'" %
-                        (tag, name_prefix, spec, target_want_name),
-                        attachments = { "length_perm": len(perm), "perm": perm },
-                        alevel = 1)
-                    perm.clear()
-                    type(self).class_result += result_c(0, 0, 0, 0, 1)
-                    break
-                # From available candidates, pick one at random and
-                # mark it taken
-                # need the sorted since in newer pythons,
-                # random.sample() requires it.
-                (rt_fullid, bsp_model) = random.sample(sorted(rts_not_taken), 1)[0]
-                rts_taken.add(rt_fullid)
-                perm[target_want_name] = (rt_fullid, bsp_model)
-                rt_type = self.rt_all[rt_fullid]['type']
-                if _types_seen[target_want_name] == 'one-per-type':
-                    _types[target_want_name] = (rt_type, bsp_model)
-                elif _types_seen[target_want_name] == 'any':
-                    # Use always the same string, so it is simplified
-                    # by the set
-                    _types[target_want_name] = ('any', None)
-                else: 	#  run in 'ALL' targets: use the sequential
-                        #  counter as a "type" so they are all
-                        #  different and thus are unique so it is not
-                        #  eliminated by the set reduction
-                    _types[target_want_name] = ("%d" % target_counter, None)
-                self.report_info(
-                    "%s group %s: target '%s': candidate %s:%s"
-                    % (tag, name_prefix, target_want_name,
-                       rt_fullid, bsp_model),
-                    dlevel = 8)
-                cnt += 1
-                target_counter += 1
+                spec = target_want.get('spec', "")
+                self.report_skip(
+                    "%s group %s: no remote targets (or group of) "
+                    "can satisfy the conditions [%s] for wanted target '%s'" %
+                    (tag, name_prefix, spec, target_want_name),
+                    alevel = 1)
+                type(self).class_result += result_c(0, 0, 0, 0, 1)
+                return {}
+
+        # See tc_c.permutations_seed
+        if self.permutations_seed != None:
+            seed = self.permutations_seed
+        elif self.runid != None:
+            seed = self.runid
+        else:
+            seed = random.random()
+        rng = random.Random(f"{seed} {self.name} {tag} {name_prefix}")
 
-            if perm == {}:
-                # This meant we don't have enough targets to assign
+        permutations = {}
+        for perm in self._target_wants_permutations_iter(
+                target_want_candidates, candidate_types, rng):
+            if len(permutations) >= n:
                 break
             perm_id = commonl.mkid(self._tg_str(perm), l = 4)
-            # Generate a unique string that lists the target want
-            # names and the type of remote target they got assigned
-            perm_types_id = " ".join([
-                twn + "=" + rt_type + \
-                  ((":" + bsp_model) if bsp_model else "")\
-                for twn, (rt_type, bsp_model) in sorted(iter(_types.items()),
-                                                        key = lambda x: x[0])])
-            # Have we seen that permutations of target wants / remote
-            # target types?
-            if perm_types_id in types_seen:
-                max_repeats -=1
-                self.report_info("%s group %s: "
-                                 "ignoring (types already considered) %s"
-                                 % (tag, perm_id, perm_types_id), dlevel = 7)
-                continue
-            elif perm_id in permutations:
+            if perm_id in permutations:
                 # We have one like this already
                 _name_prefix = "-" + name_prefix
                 self.report_info("%s group %s%s: "
                                  "ignoring (repeated)"
                                  % (tag, _name_prefix, perm_id), dlevel = 7)
-                max_repeats -=1
                 continue
-
-            itr += 1
-            types_seen.add(perm_types_id)
+            self.report_info(
+                "%s group %s: %s" % (tag, perm_id, self._tg_str(perm)),
+                dlevel = 8)
             permutations[perm_id] = perm
+        if target_want_candidates and not permutations:
+            self.report_skip(
+                "%s group %s: no remote targets (or group of) "
+                "can satisfy the conditions for all wanted targets"
+                % (tag, name_prefix),
+                attachments = { "candidates": target_want_candidates },
+                alevel = 1)
+            type(self).class_result += result_c(0, 0, 0, 0, 1)
         return permutations
 
 
     #
     # The top level testcase running interface
     #
-    # _run_on_targets() is given all the available remote targets,
-    # figures out the permutations of remote targets to wanted targets
-    # and spawns on one thread per TC/targetgroup _run(), which calls
+    # _jobs_make() is given all the available remote targets and
+    # figures out the permutations of remote targets to wanted
+    # targets; once planned (see tcfl.planner), _job_start() spawns
+    # one thread per TC/targetgroup _run(), which calls
     # _run_on_target_group()
 
     def _do_the_eval(self):
@@ -8680,15 +8826,12 @@ class tc_c(reporter_c, metaclass=_tc_mc):
 
 
     @result_c.from_exception
-    def _run_on_targets(self, tp, rt_all, rt_selected, ic_selected):
+    def _jobs_make(self, rt_all, rt_selected, ic_selected):
         """
-        Launch the test case execution, in one or more background
-        threads
+        Compute the jobs (target groups) this testcase can run on
 
-        :param dict targets: Dictionary of targets where the test
-          would have to be run. Can be empty (to indicate
-          auto-selection of targets or when unneeded--eg for static
-          test cases).
+        :param dict rt_all: Dictionary of all the remote targets
+          available, keyed by full ID.
 
         :param dict rt_selected: Dictionary keyed by
           fullid listing the BSP models that have to be run for
@@ -8701,31 +8844,21 @@ class tc_c(reporter_c, metaclass=_tc_mc):
           comes after all the filtering, and more filtering can happen
           here, target specific.
 
-        :returns: dict of thread descriptors as returned by
-          ThreadPool.apply_async(); if {}, it means that no targets
+        :returns: list of :class:`tcfl.planner.job_c` describing each
+          target group the testcase can run on, to be started with
+          :meth:`_job_start`; if empty, it means that no targets
           could be located and this TC is blocked.
 
         :exceptions: any, treat them as a blocker
 
         """
         try:
-            threads = []
+            jobs = []
 
             ic_permutations, rt_permutations = self._permutations_make(
                 rt_all, rt_selected, ic_selected)
 
-            # So now we are going to iterate over all the groups; as a
-            # hack to tie us up until the orchestrator is fix, respect
-            # the limit on how many runs of each single testcase will
-            # be run
-            permutations = rt_permutations.items()
-            if self.max_runs_per_tc > 0:
-                permutation = rt_permutations.items()
-                max_runs_per_tc = min(len(permutations), self.max_runs_per_tc)
-                permutations = random.sample(rt_permutations.items(),
-                                             max_runs_per_tc)
-
-            for (icgid, tgid), tg in permutations:
+            for (icgid, tgid), tg in rt_permutations.items():
                 if tgid == None:
                     # no targets, but interconnects
                     tg_name = icgid
@@ -8755,77 +8888,106 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                 group_str = " ".join(strs)
                 del strs
 
-                tc_for_tg = self._clone()
                 if self._dry_run:
                     self.report_info("will run on target group '%s'"
                                      % group_str, dlevel = 1)
                     continue
 
-                # FIXME: this order could be better
-                target_group = target_group_c(group_str)
-                # Ids of the interconnect targets we'll be using
-                icg_ids = set()
-                for target_want_name in reversed(list(self._targets.keys())):
-                    # iterate over the list of wanted targets to add
-                    # them in the right order to the
-                    # target_group.
-                    #
-                    # FIXME: reversed for decorator workaround
-                    if target_want_name in icg:
-                        rt_full_id, bsp_model = icg[target_want_name]
-                        icg_ids.add(rt_all[rt_full_id]['id'])
-                    elif target_want_name in tg:
-                        rt_full_id, bsp_model = tg[target_want_name]
-                    else:
-                        raise RuntimeError("BUG? target want %s neither "
-                                           "in icf or tg?" % target_want_name)
-                    target_group.target_add(
-                        target_want_name,
-                        target_c(rt_all[rt_full_id], tc_for_tg,
-                                 bsp_model, target_want_name))
-                # this should be the unique ID
-                target_group.name_set(tg_name)
-                tc_for_tg.target_group = target_group
-                tc_for_tg.targets = target_group.targets
-                for target in list(target_group.targets.values()):
-                    target._kws_update_interconnect_addrs(icg_ids)
-                    # this just updates the core keys, but later calls
-                    # to kw_set() and company will refresh the main
-                    # target.kws dict.
-
-                #
-                # Set the new tmpdir
-                #
-                # FIXME: this is bad to make these two here
-                tc_for_tg.mkticket()
-                tc_for_tg.tmpdir = os.path.join(tc_c.tmpdir, tc_for_tg.ticket)
-                commonl.makedirs_p(tc_for_tg.tmpdir)
-
-                for target_want_name, target in tc_for_tg.targets.items():
-                    target.tmpdir = os.path.join(
-                        tc_for_tg.tmpdir, "targets", target_want_name)
-                    commonl.makedirs_p(target.tmpdir)
-
-                tc_for_tg.report_info("queuing for execution", dlevel = 3)
-                thread = tp.apply_async(
-                    tc_for_tg._run,
-                    (
-                        msgid_c.current(),
-                        _simple_namespace(self.tls.__dict__)
-                    )
-                )
-                # so we can Ctrl-C easily; we don't care for the
-                # cleanup, we consider all expendable resournces
-                # and the toplevel tempdirs will be cleaned below
-                # Targets acquired will be released as idle by the
-                # daemon
-                thread.daemon = True
-                threads.append(thread)
-            self.log.info("%d jobs launched" % len(threads))
-            return threads
+                # what the planner needs to know: which targets are
+                # used and their types, to guess how long it'll take
+                rt_fullids = set()
+                types = []
+                for twn, (rt_full_id, bsp_model) in \
+                        list(icg.items()) + list(tg.items()):
+                    rt_fullids.add(rt_full_id)
+                    types.append(twn + "=" + rt_all[rt_full_id]['type']
+                                 + ((":" + bsp_model) if bsp_model else ""))
+                jobs.append(tcfl.planner.job_c(
+                    self.name, rt_fullids, " ".join(sorted(types)),
+                    group_str, data = ( self, icg, tg, tg_name )))
+            return jobs
         finally:
             self._cleanup()
 
+    def _job_start(self, tp, job, rt_all):
+        """
+        Start running this testcase on the target group described by a
+        job in a background thread
+
+        :param tp: thread pool where to run
+        :param tcfl.planner.job_c job: job returned by :meth:`_jobs_make`
+        :param dict rt_all: Dictionary of all the remote targets
+          available, keyed by full ID.
+        :returns: thread descriptor as returned by
+          *ThreadPool.apply_async()*; when complete, it returns the
+          list of results and how long it took (see :func:`_job_run`)
+        """
+        _tc, icg, tg, tg_name = job.data
+        group_str = job.group_str
+        tc_for_tg = self._clone()
+
+        # FIXME: this order could be better
+        target_group = target_group_c(group_str)
+        # Ids of the interconnect targets we'll be using
+        icg_ids = set()
+        for target_want_name in reversed(list(self._targets.keys())):
+            # iterate over the list of wanted targets to add
+            # them in the right order to the
+            # target_group.
+            #
+            # FIXME: reversed for decorator workaround
+            if target_want_name in icg:
+                rt_full_id, bsp_model = icg[target_want_name]
+                icg_ids.add(rt_all[rt_full_id]['id'])
+            elif target_want_name in tg:
+                rt_full_id, bsp_model = tg[target_want_name]
+            else:
+                raise RuntimeError("BUG? target want %s neither "
+                                   "in icf or tg?" % target_want_name)
+            target_group.target_add(
+                target_want_name,
+                target_c(rt_all[rt_full_id], tc_for_tg,
+                         bsp_model, target_want_name))
+        # this should be the unique ID
+        target_group.name_set(tg_name)
+        tc_for_tg.target_group = target_group
+        tc_for_tg.targets = target_group.targets
+        for target in list(target_group.targets.values()):
+            target._kws_update_interconnect_addrs(icg_ids)
+            # this just updates the core keys, but later calls
+            # to kw_set() and company will refresh the main
+            # target.kws dict.
+
+        #
+        # Set the new tmpdir
+        #
+        # FIXME: this is bad to make these two here
+        tc_for_tg.mkticket()
+        tc_for_tg.tmpdir = os.path.join(tc_c.tmpdir, tc_for_tg.ticket)
+        commonl.makedirs_p(tc_for_tg.tmpdir)
+
+        for target_want_name, target in tc_for_tg.targets.items():
+            target.tmpdir = os.path.join(
+                tc_for_tg.tmpdir, "targets", target_want_name)
+            commonl.makedirs_p(target.tmpdir)
+
+        tc_for_tg.report_info("queuing for execution", dlevel = 3)
+        thread = tp.apply_async(
+            _job_run,
+            (
+                tc_for_tg,
+                msgid_c.current(),
+                _simple_namespace(self.tls.__dict__)
+            )
+        )
+        # so we can Ctrl-C easily; we don't care for the
+        # cleanup, we consider all expendable resournces
+        # and the toplevel tempdirs will be cleaned below
+        # Targets acquired will be released as idle by the
+        # daemon
+        thread.daemon = True
+        return thread
+
     #
     # Testcase driver internal interface
     #
@@ -9016,7 +9178,8 @@ class tc_c(reporter_c, metaclass=_tc_mc):
 
     @classmethod
     def _create_from_file_name(cls, tcis, file_name, from_path,
-                               subcases_cmdline):
+                               subcases_cmdline, tc_drivers = None,
+                               info = None):
         """
         Given a filename that contains a possible test case, create one or
         more TC structures from it and return them in a list
@@ -9027,12 +9190,23 @@ class tc_c(reporter_c, metaclass=_tc_mc):
           scanned (this will be a parent path of this file)
         :param list subcases: list of subcase names the testcase should
           consider
+        :param list tc_drivers: (optional; default all the registered
+          drivers) list of testcase drivers to try
+        :param dict info: (optional) dictionary where to store
+          information for the discovery cache: *driver* is set to the
+          driver that recognized the file, *error* to *True* if any
+          driver failed; if the *probe* key is *True*, failures are
+          not reported (see :func:`_discovery_probe`).
         :returns: result_c with counts of tests passed/failed (zero,
           as at this stage we cannot know), blocked (due to error
           importing) or skipped(due to whichever condition).
         """
         # FIXME: not working well to ignore .git
         result = result_c(0, 0, 0, 0, 0)
+        if info == None:
+            info = {}
+        info['driver'] = None
+        info['error'] = False
         for ignore_regex, origin in cls._ignore_regexs:
             if ignore_regex.match(file_name):
                 logger.log(6, "%s: ignored by regex %s [%s]",
@@ -9071,7 +9245,9 @@ class tc_c(reporter_c, metaclass=_tc_mc):
             tc_name = file_name + "#" + "#".join(subcases_cmdline)
         else:
             tc_name = file_name
-        for _tc_driver in cls._tc_drivers:
+        if tc_drivers == None:
+            tc_drivers = cls._tc_drivers
+        for _tc_driver in tc_drivers:
             tc_instances = []
             # new one all the time, in case we use it and close it
             tc_fake = tc_c(tc_name, file_name, "builtin")
@@ -9088,11 +9264,21 @@ class tc_c(reporter_c, metaclass=_tc_mc):
 
                 # this is so ugly, need to merge better with result_c's handling
                 except subprocess.CalledProcessError as e:
+                    info['error'] = True
+                    if info.get('probe', False):
+                        # probing in a discovery worker; the main
+                        # process will scan it again and report
+                        continue
                     retval = result_c.from_exception_cpe(tc_fake, e)
                     tc_fake.finalize(retval)
                     result += retval
                     continue
                 except OSError as e:
+                    info['error'] = True
+                    if info.get('probe', False):
+                        # probing in a discovery worker; the main
+                        # process will scan it again and report
+                        continue
                     attachments = dict(
                         errno = e.errno,
                         strerror = e.strerror
@@ -9105,6 +9291,11 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                     result += retval
                     continue
                 except Exception as e:
+                    info['error'] = True
+                    if info.get('probe', False):
+                        # probing in a discovery worker; the main
+                        # process will scan it again and report
+                        continue
                     retval = result_c.report_from_exception(tc_fake, e)
                     tc_fake.finalize(retval)
                     result += retval
@@ -9120,17 +9311,245 @@ class tc_c(reporter_c, metaclass=_tc_mc):
             if not tc_instances:
                 continue
 
-            for _tc in tc_instances:
-                for testcase_patcher in cls.testcase_patchers:
-                    testcase_patcher(_tc)
-                _tc._components_fixup()
+            cls._testcases_fixup(tc_instances)
             tcis += tc_instances
+            info['driver'] = _tc_driver
             break
         else:
             logger.log(7, "%s: no testcase driver got it", file_name)
 
         return result
 
+    @classmethod
+    def _testcases_fixup(cls, tc_instances):
+        for _tc in tc_instances:
+            for testcase_patcher in cls.testcase_patchers:
+                testcase_patcher(_tc)
+            _tc._components_fixup()
+
+    @staticmethod
+    def _discovery_driver_id(tc_driver):
+        return tc_driver.__module__ + "." + tc_driver.__qualname__
+
+    @classmethod
+    def _discovery_fingerprint(cls):
+        # What determines the results of the drivers: which they are,
+        # in which order they are called, their declared version and
+        # when their source was last modified
+        fingerprint = []
+        for tc_driver in cls._tc_drivers:
+            try:
+                mtime = os.stat(inspect.getsourcefile(tc_driver)).st_mtime_ns
+            except (TypeError, OSError):
+                mtime = None
+            fingerprint.append([
+                cls._discovery_driver_id(tc_driver),
+                tc_driver.discovery_version,
+                tc_driver.discovery_cacheable,
+                mtime
+            ])
+        return fingerprint
+
+    @classmethod
+    def _discovery_cache_load(cls, cache_file, fingerprint):
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("%s: ignoring bad discovery cache: %s",
+                           cache_file, e)
+            return {}
+        if not isinstance(data, dict) \
+           or data.get('fingerprint', None) != fingerprint:
+            logger.info("%s: testcase drivers changed, discarding "
+                        "discovery cache", cache_file)
+            return {}
+        return data.get('files', {})
+
+    @classmethod
+    def _discovery_cache_save(cls, cache_file, fingerprint, files):
+        try:
+            commonl.makedirs_p(cls.discovery_cache_dir)
+            # write and rename, so other processes reading it always
+            # see a complete file
+            with tempfile.NamedTemporaryFile(
+                    "w", dir = cls.discovery_cache_dir, delete = False,
+                    prefix = os.path.basename(cache_file) + ".") as f:
+                try:
+                    json.dump(dict(fingerprint = fingerprint, files = files),
+                              f)
+                except (TypeError, ValueError):
+                    # a driver described a testcase with something
+                    # that is not JSON
+                    os.unlink(f.name)
+                    raise
+            os.replace(f.name, cache_file)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("%s: can't save discovery cache: %s",
+                           cache_file, e)
+
+    @staticmethod
+    def _discovery_describe(tc_instances):
+        # Describe testcases for the discovery cache; None if any
+        # can't be described
+        descriptors = []
+        for _tc in tc_instances:
+            descriptor = _tc.discovery_describe()
+            if descriptor == None:
+                return None
+            descriptors.append(descriptor)
+        return descriptors
+
+    @classmethod
+    def _discovery_probe_parallel(cls, file_names, from_path,
+                                  subcases_cmdline):
+        # Probe files in a pool of processes to find out which driver
+        # recognizes each one, if any, and the descriptions of the
+        # testcases it found (see discovery_describe()), since the
+        # testcase instances can't be brought back from the workers.
+        #
+        # Returns a dictionary keyed by file name of [ DRIVERID,
+        # DESCRIPTORS ]; DRIVERID is None if no driver recognized the
+        # file, DESCRIPTORS None if the testcases can't be
+        # described. Files that failed or have to be scanned in the
+        # main process (see discovery_main_only()) are not included.
+        import multiprocessing	# pylint: disable = import-outside-toplevel
+        logger.info("%s: probing %d files with %d processes", from_path,
+                    len(file_names), cls.discovery_processes)
+        count = len(file_names)
+        known = {}
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers = cls.discovery_processes,
+                    mp_context = multiprocessing.get_context("fork")) \
+                    as executor:
+                for file_name, entry in executor.map(
+                        _discovery_probe, file_names,
+                        [ from_path ] * count, [ subcases_cmdline ] * count,
+                        chunksize = 16):
+                    if entry != None:
+                        known[file_name] = entry
+        except concurrent.futures.process.BrokenProcessPool as e:
+            logger.warning("%s: parallel probing failed, scanning "
+                           "serially: %s", from_path, e)
+        return known
+
+    @classmethod
+    def _discovery_create(cls, tc_instances, file_name, tc_driver,
+                          descriptors):
+        # Create the testcases of a file from their descriptions in
+        # the discovery cache; False if it can't be done and the file
+        # has to be scanned
+        try:
+            for descriptor in descriptors:
+                tc_instances.append(tc_driver.discovery_create(descriptor))
+        except Exception as e:
+            logger.warning("%s: can't create testcases from discovery "
+                           "cache, scanning: %s", file_name, e)
+            del tc_instances[:]
+            return False
+        for _tc in tc_instances:
+            logger.info("testcase found @ %s by %s (cached)",
+                        _tc.origin, tc_driver)
+        cls._testcases_fixup(tc_instances)
+        return True
+
+    @classmethod
+    def _discovery_scan(cls, tcs, path, file_names, subcases_cmdline):
+        # Scan a list of files found under path for testcases, using
+        # the discovery cache (see :data:`discovery_cache_dir`)
+        result = result_c(0, 0, 0, 0, 0)
+        fingerprint = cls._discovery_fingerprint()
+        cache_file = os.path.join(
+            cls.discovery_cache_dir,
+            commonl.mkid(os.path.abspath(path), 10) + ".json")
+        # what drivers find depends on the subcases given, so cache
+        # only scans that give none (the most common)
+        use_cache = not subcases_cmdline
+        if use_cache:
+            cache = cls._discovery_cache_load(cache_file, fingerprint)
+        else:
+            cache = {}
+        drivers_by_id = {}
+        for tc_driver in cls._tc_drivers:
+            drivers_by_id[cls._discovery_driver_id(tc_driver)] = tc_driver
+        uncacheable = any(not tc_driver.discovery_cacheable
+                          for tc_driver in cls._tc_drivers)
+
+        stats = {}	# file name -> [ mtime, size ]
+        known = {}	# file name -> [ driver ID or None, descriptors or None ]
+        for file_name in file_names:
+            try:
+                st = os.stat(file_name)
+            except OSError:
+                continue		# dangling symlink? let drivers say
+            stats[file_name] = [ st.st_mtime_ns, st.st_size ]
+            entry = cache.get(file_name, None)
+            if entry and len(entry) == 4 and entry[:2] == stats[file_name] \
+               and (entry[2] == None or entry[2] in drivers_by_id):
+                known[file_name] = entry[2:]
+        unknown = [
+            file_name for file_name in file_names if file_name not in known
+        ]
+        logger.info("%s: %d files, %d found in discovery cache",
+                    path, len(file_names), len(known))
+        if cls.discovery_processes > 1 \
+           and len(unknown) >= cls.discovery_parallel_min:
+            known.update(cls._discovery_probe_parallel(
+                unknown, path, subcases_cmdline))
+
+        cache_new = {}
+        for file_name in file_names:
+            tc_instances = []
+            info = {}
+            driver_id, descriptors = known.get(file_name, ( None, None ))
+            if driver_id != None and descriptors != None \
+               and not uncacheable \
+               and cls._discovery_create(tc_instances, file_name,
+                                         drivers_by_id[driver_id],
+                                         descriptors):
+                # we know what testcases are in this file without
+                # asking the driver
+                info = dict(driver = drivers_by_id[driver_id],
+                            error = False)
+            else:
+                if file_name in known:
+                    # we know which driver (if any) recognizes this
+                    # file, so just ask that one (and any that can't
+                    # be cached)
+                    tc_drivers = [
+                        tc_driver for tc_driver in cls._tc_drivers
+                        if not tc_driver.discovery_cacheable
+                        or cls._discovery_driver_id(tc_driver) == driver_id
+                    ]
+                else:
+                    tc_drivers = None
+                result += cls._create_from_file_name(
+                    tc_instances, file_name, path, subcases_cmdline,
+                    tc_drivers = tc_drivers, info = info)
+                descriptors = None
+            for _tc in tc_instances:
+                tcs[_tc.name] = _tc
+            if info['error'] or file_name not in stats:
+                continue
+            tc_driver = info['driver']
+            if tc_driver == None:
+                if driver_id != None:
+                    # it was recognized before, not now? don't cache
+                    continue
+                cache_new[file_name] = stats[file_name] + [ None, None ]
+            elif tc_driver.discovery_cacheable:
+                if descriptors == None:
+                    descriptors = cls._discovery_describe(tc_instances)
+                cache_new[file_name] = stats[file_name] + [
+                    cls._discovery_driver_id(tc_driver), descriptors
+                ]
+        if use_cache:
+            cls._discovery_cache_save(cache_file, fingerprint, cache_new)
+        return result
+
     @classmethod
     def find_in_path(cls, tcs, path, subcases_cmdline):
         """
@@ -9150,14 +9569,12 @@ class tc_c(reporter_c, metaclass=_tc_mc):
           importing) or skipped(due to whichever condition).
         """
         assert isinstance(tcs, dict)
-        # FIXME this should cache stuff so we don't have to rescan all the
-        # times--if the ctime hasn't changed since our cache entry, then
-        # we use the cached value
         result = result_c(0, 0, 0, 0, 0)
         logger.info("%s: scanning argument", path)
         tc_global.report_info("%s: scanning directory from arguments" % path,
                               dlevel = 4)
         if os.path.isdir(path):
+            file_names = []
             for tc_path, _dirnames, _filenames in os.walk(path):
                 logger.log(5, "%s: scanning directory", tc_path)
                 tc_global.report_info("%s: scanning directory" % tc_path,
@@ -9174,12 +9591,9 @@ class tc_c(reporter_c, metaclass=_tc_mc):
                 del _dirnames[:]
                 _dirnames.extend(keep_dirs)
                 for filename in sorted(_filenames):
-                    tc_instances = []
-                    file_name = os.path.join(tc_path, filename)
-                    result += cls._create_from_file_name(
-                        tc_instances, file_name, path, subcases_cmdline)
-                    for _tc in tc_instances:
-                        tcs[_tc.name] = _tc
+                    file_names.append(os.path.join(tc_path, filename))
+            result += cls._discovery_scan(tcs, path, file_names,
+                                          subcases_cmdline)
         elif os.path.isfile(path):
             tc_instances = []
             result += cls._create_from_file_name(
@@ -9196,6 +9610,26 @@ class tc_c(reporter_c, metaclass=_tc_mc):
 
 tc_c.driver_add(tc_c)
 
+
+def _discovery_probe(file_name, from_path, subcases_cmdline):
+    # Runs in a process of the discovery pool, see
+    # tc_c._discovery_probe_parallel()
+    for tc_driver in tc_c._tc_drivers:
+        if tc_driver.discovery_main_only(file_name):
+            return file_name, None
+    tc_instances = []
+    info = { 'probe': True }
+    tc_c._create_from_file_name(tc_instances, file_name, from_path,
+                                subcases_cmdline, info = info)
+    if info['error']:
+        return file_name, None
+    if info['driver'] == None:
+        return file_name, [ None, None ]
+    return file_name, [
+        tc_c._discovery_driver_id(info['driver']),
+        tc_c._discovery_describe(tc_instances)
+    ]
+
 class subtc_c(tc_c):
     """Helper for reporting sub testcases
 
@@ -9318,6 +9752,14 @@ def _testcase_match_tags(tc, tags_spec, origin = None):
                    (tags_spec, origin), dlevel = 4)
 
 
+def _job_run(tc, msgid, tls_parent):
+    # Run a testcase on its target group (see tc_c._job_start()),
+    # timing it for the planner's duration history
+    ts0 = time.time()
+    results = tc._run(msgid, tls_parent)
+    return results, time.time() - ts0
+
+
 def testcases_discover(tcs_filtered, args):
     result = result_c(0, 0, 0, 0, 0)
 
@@ -9704,6 +10146,7 @@ def _run(args):
         tc_c.runid_extra[key] = value
 
     tc_c.max_permutations = args.max_permutations
+    tc_c.permutations_seed = args.permutations_seed
     tc_c.max_runs_per_tc = args.max_runs_per_tc
 
     # Establish what is our log directory
@@ -9963,32 +10406,68 @@ def _run(args):
         tp = _multiprocessing_tc_pool_c(processes = threads_no)
 
         # So now run as many testcases as possible
+        #
+        # First gather all the target groups each testcase can run
+        # on, then plan which ones to run in which order so we
+        # minimize the time we wait for targets (see tcfl.planner)
         threads = []
         time_start = time.time()
         tc_c.jobs = len(tcs_filtered)
+        durations = tcfl.planner.durations_c()
+        jobs_by_tc = {}
+        quotas = {}
         for tc in list(tcs_filtered.values()):
             tc.mkticket()
             tc.report_info("queuing for pairing", dlevel = 3)
             with msgid_c() as _msgid:
-                _threads = tc._run_on_targets(tp, rt_all,
-                                              rt_selected, ic_selected)
-                del tc	# we don't need it anymore
-            if isinstance(_threads, result_c):
-                result += _threads
-            elif _threads == []:
+                jobs = tc._jobs_make(rt_all, rt_selected, ic_selected)
+            if isinstance(jobs, result_c):
+                result += jobs
+            elif jobs == []:
                 # No targets could be found, SKIPPED
                 result += result_c(0, 0, 0, 0, 1)
             else:
-                threads += _threads
+                jobs_by_tc[tc.name] = jobs
+                if tc.max_runs_per_tc > 0:
+                    quotas[tc.name] = tc.max_runs_per_tc
+            del tc	# we don't need it anymore
+        jobs = tcfl.planner.plan(jobs_by_tc, threads_no, durations, quotas)
+        if jobs:
+            jobs_unplanned = []
+            for tc_name, _jobs in jobs_by_tc.items():
+                jobs_unplanned += _jobs[:quotas.get(tc_name, len(_jobs))]
+            tc_global.report_info(
+                "plan: %d jobs, expected to take %s (vs %s unplanned)" % (
+                    len(jobs),
+                    datetime.timedelta(0, int(max(job.ts_end for job in jobs))),
+                    datetime.timedelta(0, int(tcfl.planner.simulate(
+                        jobs_unplanned, threads_no)))),
+                dlevel = 0 if args.plan_only else 2)
+        for job in jobs:
+            if args.plan_only:
+                tc_global.report_info(
+                    "plan: +%s..+%s %s @%s" % (
+                        datetime.timedelta(0, int(job.ts_start)),
+                        datetime.timedelta(0, int(job.ts_end)),
+                        job.tc_name, job.group_str),
+                    level = 0)
+                continue
+            tc = job.data[0]
+            with msgid_c() as _msgid:
+                threads.append(( job, tc._job_start(tp, job, rt_all) ))
+        del jobs_by_tc
         tp.close()
         # FIXME: maybe we can use tp.imap_iter stuff
         tp.join()
-        for thread in threads:
-            for cls, retval in thread.get():
+        for job, thread in threads:
+            results, duration = thread.get()
+            durations.update(job.tc_name, job.types_key, duration)
+            for cls, retval in results:
                 # Note we do this here vs. in tc_c._run() because that
                 # will be running in a different process.
                 cls.class_result += retval
                 result += retval
+        durations.save()
         time_end = time.time()
         # Run the class' teardown processes, if any -- mostly used for
         # self-testing. Note this is run in the top level process.
@@ -10002,6 +10481,8 @@ def _run(args):
                 with msgid_c(depth = 0,
                              phase = "class_teardown") as _msgid:
                     result += tc._class_teardowns_run()
+        for hook in tc_c.hook_run_post:
+            hook(tc_global, result)
         # If something failed or blocked, report totals verbosely
         tc_global.report_tweet(
             "%d tests (%d passed, %d error, %d failed, "
@@ -10185,6 +10666,15 @@ def argp_setup(arg_subparsers):
         action = "store", type = int, default = 10,
         help = "Maximum number of permutuations of targets for a "
         "single test that shall be considered")
+    ap.add_argument(
+        "--permutations-seed", metavar = "SEED",
+        action = "store", type = str, default = None,
+        help = "Seed the selection of target permutations, so "
+        "they can be reproduced (defaults to the RunID, if given)")
+    ap.add_argument(
+        "--plan-only", action = "store_true", default = False,
+        help = "Print the plan of which testcases would run on which"
+        " target groups and when, but do not run them")
     ap.add_argument(
         "--max-runs-per-tc",
         action = "store", type = int, default = 0,
@@ -412,6 +412,24 @@ def _stc_scan_path_source(path):
             subcases += _subcases
     return subcases, warnings,
 
+def _tc_dict_describe(tc_dict):
+    # testcase.ini data to JSON for the discovery cache: sets become
+    # sorted lists, listed in '_sets' so _tc_dict_create() can undo it
+    d = { '_sets': [] }
+    for key, value in tc_dict.items():
+        if isinstance(value, set):
+            d['_sets'].append(key)
+            value = sorted(value)
+        d[key] = copy.deepcopy(value)
+    return d
+
+def _tc_dict_create(descriptor):
+    tc_dict = dict(descriptor)
+    for key in tc_dict.pop('_sets'):
+        tc_dict[key] = set(tc_dict[key])
+    return tc_dict
+
+
 class tc_zephyr_subsanity_c(tcfl.tc.tc_c):
     """Subtestcase of a Zephyr Sanity Check
 
@@ -601,6 +619,8 @@ class tc_zephyr_sanity_c(tcfl.tc.tc_c):
         #: system, as it runs local, but from a local file.
         self.unit_test_output = None
         self.zephyr_depends_on = []
+        # see discovery_describe()
+        self._discovery_descriptor = None
 
     @classmethod
     def __sanity_check_list_tests(cls, path):
@@ -703,7 +723,7 @@ class tc_zephyr_sanity_c(tcfl.tc.tc_c):
     #
     # Why? because once we create an instance of this testcase,
     # instead of creating a new one for each target it has to run on
-    # in tcfl.tc.tc_c._run_on_targets(), we deepcopy() it in
+    # in tcfl.tc.tc_c._job_start(), we deepcopy() it in
     # _clone(). So the constructor is never called again -- yeah, that
     # has to change.
     def configure_00(self):	# pylint: disable = missing-docstring
@@ -1548,9 +1568,13 @@ class tc_zephyr_sanity_c(tcfl.tc.tc_c):
             except ConfigurationError as e:
                 raise tcfl.tc.blocked_e("can't parse: %s @%s" % (e[1], e[0]),
                                    { "trace": traceback.format_exc() })
-            _tc = cls(origin, path, origin, section)
+            _tc = cls(origin, path, origin, section, [])
             _tc.log.debug("Original testcase.ini data for section '%s'\n%s"
                           % (section, pprint.pformat(tc_dict)))
+            # _dict_init() modifies tc_dict, so describe it before
+            _tc._discovery_descriptor = dict(
+                path = path, section = section,
+                tc_dict = _tc_dict_describe(tc_dict))
             _tc._dict_init(tc_dict, path, section)
             tcs.append(_tc)
         return tcs
@@ -1764,6 +1788,29 @@ class tc_zephyr_sanity_c(tcfl.tc.tc_c):
             tcs.append(_tc)
         return tcs
 
+    def discovery_describe(self):
+        """
+        Describe this testcase for the discovery cache (see
+        :meth:`tcfl.tc.tc_c.discovery_describe`)
+
+        Only testcases from *testcase.ini* files can be described:
+        they are fully defined by the section of the file they come
+        from. Those from *testcase|sample.yaml* files also depend on
+        the subcases found in the source by Zephyr's *sanitycheck*,
+        so they are scanned every time.
+        """
+        return self._discovery_descriptor
+
+    @classmethod
+    def discovery_create(cls, descriptor):
+        path = descriptor['path']
+        section = descriptor['section']
+        origin = path + "#" + section
+        _tc = cls(origin, path, origin, section, [])
+        _tc._discovery_descriptor = descriptor
+        _tc._dict_init(_tc_dict_create(descriptor['tc_dict']), path, section)
+        return _tc
+
     @classmethod
     def is_testcase(cls, path, _from_path, tc_name, subcases_cmdline):
         if cls.filename_regex.match(os.path.basename(path)):
@@ -5,11 +5,22 @@
 # Set of code that other projects can also import to do things on
 # Zephyr's sanity check testcases.
 
+import hashlib
+import json
 import logging
+import os
+import pickle
+import tempfile
+import threading
+
 import yaml
 
 log = logging.getLogger("tcfl.tc_zephyr_scl")
 
+# libyaml's loader is much faster than the pure Python one; use it if
+# available
+_yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 #
 #
 def yaml_load(filename):
@@ -26,7 +37,7 @@ def yaml_load(filename):
     """
     try:
         with open(filename, 'r') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader = _yaml_loader)
     except yaml.scanner.ScannerError as e:	# For errors parsing schema.yaml
         mark = e.problem_mark
         cmark = e.context_mark
@@ -53,11 +64,81 @@ except ImportError as e:
     def _yaml_validate(data, schema):
         pass
 
+#: Directory where to keep the cache of loaded and verified YAML
+#: documents between runs; set to *None* to disable (see
+#: :func:`yaml_load_verify`)
+yaml_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "tcf",
+                              "zephyr-yaml")
+
+# Process-wide cache of documents loaded and verified, keyed by
+# filename; values are ( mtime_ns, size, schema hash, pickled data )
+_yaml_cache = {}
+# Hash of schemas, keyed by id(); we keep a reference to the schema
+# so the id is not reused
+_yaml_schema_hashes = {}
+_yaml_cache_lock = threading.Lock()
+
+def _yaml_schema_hash(schema):
+    with _yaml_cache_lock:
+        entry = _yaml_schema_hashes.get(id(schema), None)
+        if entry and entry[0] is schema:
+            return entry[1]
+    schema_hash = hashlib.sha256(json.dumps(
+        schema, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+    with _yaml_cache_lock:
+        _yaml_schema_hashes[id(schema)] = ( schema, schema_hash )
+    return schema_hash
+
+def _yaml_cache_path(filename):
+    return os.path.join(
+        yaml_cache_dir,
+        hashlib.sha256(filename.encode('utf-8')).hexdigest() + ".pickle")
+
+def _yaml_cache_get(filename, key):
+    with _yaml_cache_lock:
+        entry = _yaml_cache.get(filename, None)
+    if entry and entry[0] == key:
+        return entry[1]
+    if not yaml_cache_dir:
+        return None
+    try:
+        with open(_yaml_cache_path(filename), "rb") as f:
+            disk_key, data_pickled = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:	# corrupted, whatever, just ignore it
+        log.debug("%s: ignoring bad YAML cache entry: %s", filename, e)
+        return None
+    if disk_key != key:
+        return None
+    with _yaml_cache_lock:
+        _yaml_cache[filename] = ( key, data_pickled )
+    return data_pickled
+
+def _yaml_cache_set(filename, key, data_pickled):
+    with _yaml_cache_lock:
+        _yaml_cache[filename] = ( key, data_pickled )
+    if not yaml_cache_dir:
+        return
+    try:
+        os.makedirs(yaml_cache_dir, exist_ok = True)
+        with tempfile.NamedTemporaryFile(
+                "wb", dir = yaml_cache_dir, delete = False) as f:
+            pickle.dump(( key, data_pickled ), f)
+        os.replace(f.name, _yaml_cache_path(filename))
+    except OSError as e:
+        log.warning("%s: can't save YAML cache entry: %s", filename, e)
+
 def yaml_load_verify(filename, schema):
     """
     Safely load a testcase/sample yaml document and validate it
     against the YAML schema, returing in case of success the YAML data.
 
+    Documents that load and validate are cached in memory and in
+    :data:`yaml_cache_dir` keyed by the file's modification time and
+    size and the schema; if they do not change, the document is not
+    parsed or validated again.
+
     :param str filename: name of the file to load and process
     :param dict schema: loaded YAML schema (can load with :func:`yaml_load`)
 
@@ -65,7 +146,15 @@ def yaml_load_verify(filename, schema):
     :raises yaml.scanner.ScannerError: on YAML parsing error
     :raises pykwalify.errors.SchemaError: on Schema violation error
     """
+    filename = os.path.abspath(filename)
+    st = os.stat(filename)
+    key = ( st.st_mtime_ns, st.st_size, _yaml_schema_hash(schema) )
+    data_pickled = _yaml_cache_get(filename, key)
+    if data_pickled != None:
+        # unpickle so each caller gets its own copy to modify
+        return pickle.loads(data_pickled)
     # 'document.yaml' contains a single YAML document.
     y = yaml_load(filename)
     _yaml_validate(y, schema)
+    _yaml_cache_set(filename, key, pickle.dumps(y))
     return y
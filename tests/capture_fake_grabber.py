@@ -0,0 +1,36 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Fake frame grabber for test_capture_grabber.py
+#
+# Arguments: [--once] FILENAME PERIOD:FLOAT SETUP:FLOAT
+#
+# Waits SETUP seconds (as a real device would to open and negotiate)
+# and then writes a frame to FILENAME every PERIOD seconds, replacing
+# it atomically; with --once, writes a single frame and exits.
+
+import os
+import sys
+import time
+
+once = sys.argv[1] == "--once"
+if once:
+    del sys.argv[1]
+filename = sys.argv[1]
+period = float(sys.argv[2])
+setup = float(sys.argv[3])
+
+print(f"fake grabber {os.getpid()} started", flush = True)
+time.sleep(setup)
+count = 0
+while True:
+    with open(filename + ".tmp", "w") as f:
+        f.write(f"FRAME {os.getpid()} {count} {time.time()}\n")
+    os.rename(filename + ".tmp", filename)
+    if once:
+        break
+    count += 1
+    time.sleep(period)
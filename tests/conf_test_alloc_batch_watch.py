@@ -0,0 +1,13 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+import ttbl.config
+
+ttbl.config.target_add(ttbl.test_target('local_test'))
+
+for n in range(8):
+    ttbl.config.target_add(ttbl.test_target('batch%02d' % n))
@@ -0,0 +1,16 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+import ttbl.config
+
+# the client keeps alive the testcase's allocation every 10s
+ttbl.config.target_max_idle = 15
+
+ttbl.config.target_add(ttbl.test_target('local_test'))
+
+for n in range(10):
+    ttbl.config.target_add(ttbl.test_target('ka%02d' % n))
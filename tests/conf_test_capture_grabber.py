@@ -0,0 +1,31 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import ttbl.capture
+
+fake_grabber = os.path.join(os.path.dirname(ttbl.__file__),
+                            "..", "..", "tests", "capture_fake_grabber.py")
+
+target = ttbl.test_target("t0")
+ttbl.config.target_add(target)
+target.interface_add(
+    "capture", ttbl.capture.interface(
+        # a new grabber for each snapshot, 0.5s to set up
+        c_oneshot = ttbl.capture.generic_snapshot(
+            "fake one shot",
+            f"{fake_grabber} --once %(output_file_name)s 0 0.5",
+            mimetype = "text/plain", extension = ".txt"),
+        # a persistent grabber, 0.5s to set up, a frame every 0.1s
+        c_grabber = ttbl.capture.generic_snapshot(
+            "fake persistent",
+            f"{fake_grabber} --once %(output_file_name)s 0 0.5",
+            mimetype = "text/plain", extension = ".txt",
+            grabber_cmdline = f"{fake_grabber} %(_impl.frame_filename)s 0.1 0.5",
+            grabber_idle_timeout = 3),
+    )
+)
@@ -0,0 +1,34 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+import ttbl.config
+import ttbl.power
+
+for n in range(20):
+    target = ttbl.test_target('t%02d' % n)
+    target.interface_add("power", ttbl.power.interface(*[
+        ( 'component%d' % c, ttbl.power.fake_c() ) for c in range(8)
+    ]))
+    ttbl.config.target_add(
+        target,
+        tags = {
+            'bsp_models': { 'x86_64': [ 'x86_64' ] },
+            'bsps': {
+                'x86_64': { 'linux': True, 'zephyr_board': 'qemu_x86_64' },
+            },
+            'dict': {
+                'a': { 'b': { 'c': 'abc' }, 'empty': {} },
+                'list': [ 1, 2, 3 ],
+            },
+        })
+    target.add_to_interconnect(
+        'nwa', dict(
+            mac_addr = "02:00:00:00:00:%02x" % n,
+            ipv4_addr = '192.168.97.%d' % (n + 2),
+            ipv4_prefix_len = 24,
+        ))
+    target.property_set("instrumentation.%04x.name" % n, "instrument %d" % n)
@@ -0,0 +1,45 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2026 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import ttbl.images
+import ttbl.store
+
+# we flash /dev/null, nothing to upload
+ttbl.store.paths_allowed['/dev/null'] = '/dev/null'
+
+# only one flash at the same time can use this resource
+ttbl.images.resource_limits['fake-usb-hub'] = 1
+
+for target_name in [ "t0", "t1" ]:
+    target = ttbl.test_target(target_name)
+    ttbl.config.target_add(target)
+    target.interface_add(
+        "images", ttbl.images.interface(
+            image0 = ttbl.images.flash_shell_cmd_c(
+                cmdline = [
+                    "/usr/bin/bash",
+                    "-c",
+                    "for ((count = 0; count < 5; count++)); do date; sleep 1s; done"
+                ],
+                estimated_duration = 10,
+            ),
+            image_fast = ttbl.images.flash_shell_cmd_c(
+                cmdline = [ "/usr/bin/sleep", "1" ],
+                # the process finishes in a second; if we were
+                # polling every check_period, it'd take longer
+                check_period = 8,
+                estimated_duration = 20,
+            ),
+            image_shared = ttbl.images.flash_shell_cmd_c(
+                cmdline = [
+                    "/usr/bin/bash",
+                    "-c",
+                    "for ((count = 0; count < 5; count++)); do date; sleep 1s; done"
+                ],
+                resources = [ 'fake-usb-hub' ],
+                estimated_duration = 10,
+            ),
+        ))
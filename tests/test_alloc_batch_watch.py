@@ -0,0 +1,208 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+"""
+Test the *allocation/batch* and *allocation/watch* calls and the
+client allocator that uses them (tcfl.target_ext_alloc._allocator_c)
+"""
+import concurrent.futures
+import os
+import time
+
+import requests.exceptions
+
+import commonl.testing
+import tcfl
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "Traceback",
+        "DEBUG[",
+        # eval_00_batch() sends a bad request
+        "error creating allocation",
+        "TypeError: '<' not supported",
+    ]
+)
+
+
+@tcfl.tc.target(ttbd.url_spec + ' and local_test')
+class _test(tcfl.tc.tc_c):
+
+    def eval_00_batch(self, target):
+        # one allocation per target, then one more for each queued
+        # behind them, plus one for a target that does not exist and
+        # one that makes the server choke (invalid priority type)
+        allocation_requests = [
+            dict(groups = { 'group': [ 'batch%02d' % n ] }, queue = True,
+                 reason = f"batch request {n}")
+            for n in list(range(8)) * 2
+        ]
+        allocation_requests.append(
+            dict(groups = { 'group': [ 'nonexistent' ] }, queue = True))
+        allocation_requests.append(
+            dict(groups = { 'group': [ 'batch00' ] }, queue = True,
+                 priority = "high"))
+        r = target.server.send_request(
+            "PUT", "allocation/batch",
+            json = dict(requests = allocation_requests))
+        results = r['results']
+        if len(results) != len(allocation_requests):
+            raise tcfl.tc.failed_e(
+                f"expected {len(allocation_requests)} results,"
+                f" got {len(results)}: {r}")
+        # same priority and timestamp, either of each pair can get it
+        states = [ result['state'] for result in results ]
+        for n in range(8):
+            if sorted([ states[n], states[n + 8] ]) != [ 'active', 'queued' ]:
+                raise tcfl.tc.failed_e(
+                    f"batch{n:02d}: expected one active, one queued: {states}")
+        if states[-2:] != [ 'rejected', 'rejected' ]:
+            raise tcfl.tc.failed_e(f"expected last two rejected: {states}")
+        r = target.server.send_request(
+            "GET", "allocation/" + results[3]['allocid'])
+        if r.get('reason', None) != "batch request 3":
+            raise tcfl.tc.failed_e(f"reason not recorded: {r}")
+        self.allocids = [
+            result['allocid'] for result in results if 'allocid' in result
+        ]
+        if states[0] == 'active':
+            self.allocid_active, self.allocid_queued = self.allocids[0::8]
+        else:
+            self.allocid_queued, self.allocid_active = self.allocids[0::8]
+
+    def eval_10_watch(self, target):
+        allocid_active = self.allocid_active
+        allocid_queued = self.allocid_queued	# queued behind it
+
+        # no changes, times out
+        ts0 = time.time()
+        r = target.server.send_request(
+            "PUT", "allocation/watch",
+            json = dict(timeout = 1, allocids = { allocid_queued: 'queued' }))
+        if r != {}:
+            raise tcfl.tc.failed_e(f"expected no changes, got {r}")
+        if time.time() - ts0 < 1:
+            raise tcfl.tc.failed_e("watch returned before the timeout")
+
+        # state different from the expected is reported right away
+        r = target.server.send_request(
+            "PUT", "allocation/watch",
+            json = dict(timeout = 5, allocids = {
+                allocid_active: 'queued',
+                "nonexistent": 'queued'
+            }))
+        if r.get(allocid_active, {}).get('state', None) != 'active' \
+           or r.get("nonexistent", {}).get('state', None) != 'invalid':
+            raise tcfl.tc.failed_e(f"unexpected changes: {r}")
+
+        # release the first one while we wait for the queued one
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            future = executor.submit(
+                target.server.send_request, "PUT", "allocation/watch",
+                json = dict(timeout = 10,
+                            allocids = { allocid_queued: 'queued' }))
+            time.sleep(1)
+            target.server.send_request("DELETE", "allocation/" + allocid_active)
+            r = future.result()
+        if r.get(allocid_queued, {}).get('state', None) != 'active' \
+           or r[allocid_queued].get('group_allocated', None) != 'batch00':
+            raise tcfl.tc.failed_e(f"expected queued -> active: {r}")
+
+    def eval_20_allocator(self, target):
+        # many threads allocating from the same server, as testcases
+        # do when running in parallel; they get batched and wait for
+        # the targets to be freed watching
+        for allocid in self.allocids:
+            if allocid == self.allocid_active:
+                continue	# already removed
+            target.server.send_request("DELETE", "allocation/" + allocid)
+        from tcfl import target_ext_alloc
+
+        def _alloc(n):
+            return target_ext_alloc._alloc_targets(
+                target.server, { 'group': [ 'batch%02d' % (n % 8) ] },
+                queue_timeout = 60, batch = True)
+
+        ts0 = time.time()
+        with concurrent.futures.ThreadPoolExecutor(16) as executor:
+            futures = [ executor.submit(_alloc, n) for n in range(16) ]
+            # the first eight get their targets; the rest wait
+            for _ in range(40):
+                if sum(future.done() for future in futures) >= 8:
+                    break
+                time.sleep(0.5)
+            time.sleep(1)	# in case more than eight get them
+            allocids = []
+            for future in futures:
+                if future.done():
+                    allocid, state, _group_allocated = future.result()
+                    if state != 'active':
+                        raise tcfl.tc.failed_e(
+                            f"{allocid}: expected active, got {state}")
+                    allocids.append(allocid)
+            if len(allocids) != 8:
+                raise tcfl.tc.failed_e(
+                    f"expected 8 allocations active, got {len(allocids)}")
+            for allocid in allocids:
+                target.server.send_request("DELETE", "allocation/" + allocid)
+            for future in futures:
+                allocid, state, group_allocated = future.result()
+                if allocid in allocids:
+                    continue
+                if state != 'active':
+                    raise tcfl.tc.failed_e(
+                        f"{allocid}: expected active, got {state}")
+                target.server.send_request("DELETE", "allocation/" + allocid)
+        ts = time.time() - ts0
+        allocator = target_ext_alloc._allocator_c.get(target.server)
+        if not allocator.batch_supported or not allocator.watch_supported:
+            raise tcfl.tc.failed_e("server reported as not supporting"
+                                   " allocation/batch or allocation/watch")
+        self.report_info(f"16 allocations from 16 threads over 8 targets"
+                         f" in {ts:.1f}s", level = 0)
+
+    def eval_30_watch_error(self, target):
+        # the watcher gets an error it can't retry; the waiters have
+        # to know instead of waiting for nothing
+        from tcfl import target_ext_alloc
+
+        class _server_c:
+            aka = "fake"
+            url = "http://fake"
+            def __init__(self, exception):
+                self.exception = exception
+            def send_request(self, method, url, **kwargs):
+                raise self.exception
+
+        http_error = requests.exceptions.HTTPError("400 bad request")
+        http_error.status_code = 400
+        for exception in [ http_error, ValueError("bad JSON reply") ]:
+            allocator = target_ext_alloc._allocator_c(_server_c(exception))
+            ts0 = time.time()
+            try:
+                allocator.wait("someallocid", "queued", 5)
+                raise tcfl.tc.failed_e(
+                    f"{exception}: watch failure not reported")
+            except RuntimeError as e:
+                if e.__cause__ is not exception:
+                    raise tcfl.tc.failed_e(
+                        f"{exception}: unexpected error reported: {e}")
+            if time.time() - ts0 >= 5:
+                raise tcfl.tc.failed_e(
+                    f"{exception}: waited for the timeout")
+            if allocator.watcher != None:
+                raise tcfl.tc.failed_e(
+                    f"{exception}: dead watcher still registered")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
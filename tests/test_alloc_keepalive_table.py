@@ -0,0 +1,169 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+"""
+Test keepalives recorded in the shared keepalive table
+(ttbl.allocation.keepalive_table_c) and idle allocations expired from
+the deadline heap (ttbl.allocation.expire())
+
+- allocations kept alive (through any of the server's processes)
+  stay, those that are not are removed shortly after the idle timeout
+
+- measure how many keepalive calls per second the server takes
+
+- removed allocations don't leave the table full of tombstones that
+  lookups have to probe past, and lookups done while the table is
+  being rehashed to clear them still find the allocations
+"""
+import datetime
+import os
+import time
+
+import commonl.testing
+import tcfl
+import tcfl.tc
+import ttbl.allocation
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "Traceback",
+        "DEBUG[",
+    ]
+)
+
+_max_idle = 15		# see conf_test_alloc_keepalive_table.py
+
+
+@tcfl.tc.target(ttbd.url_spec + ' and local_test')
+class _test(tcfl.tc.tc_c):
+
+    def _allocate(self, target, n):
+        r = target.server.send_request("PUT", "allocation", json = dict(
+            groups = { 'group': [ 'ka%02d' % n ] }, queue = True))
+        if r['state'] != 'active':
+            raise tcfl.tc.failed_e(f"ka{n:02d}: can't allocate: {r}")
+        return r['allocid']
+
+    def eval_00_expire(self, target):
+        allocid_kept = self._allocate(target, 0)
+        allocid_idle = self._allocate(target, 1)
+        ts0 = time.time()
+        ts_expired = None
+        while time.time() - ts0 < _max_idle + 5:
+            r = target.server.send_request(
+                "PUT", "keepalive-v2", json = { allocid_kept: 'active' })
+            if r:
+                raise tcfl.tc.failed_e(
+                    f"{allocid_kept}: unexpected change: {r}")
+            r = target.server.send_request(
+                "GET", "allocation/" + allocid_kept)
+            ts = datetime.datetime.strptime(r['timestamp'], "%Y%m%d%H%M%S")
+            if time.mktime(ts.timetuple()) < time.time() - 2:
+                raise tcfl.tc.failed_e(
+                    f"{allocid_kept}: keepalive not reflected in the"
+                    f" timestamp: {r['timestamp']}")
+            if ts_expired == None:
+                try:
+                    target.server.send_request(
+                        "GET", "allocation/" + allocid_idle)
+                except tcfl.tc.exception as e:
+                    raise
+                except Exception:
+                    ts_expired = time.time() - ts0
+            time.sleep(0.5)
+        if ts_expired == None:
+            raise tcfl.tc.failed_e(
+                f"{allocid_idle}: not expired after {_max_idle + 5}s idle")
+        if ts_expired < _max_idle:
+            raise tcfl.tc.failed_e(
+                f"{allocid_idle}: expired after {ts_expired:.1f}s,"
+                f" before the idle timeout")
+        self.report_info(f"idle allocation expired after {ts_expired:.1f}s"
+                         f" (idle timeout {_max_idle}s)", level = 0)
+        target.server.send_request("DELETE", "allocation/" + allocid_kept)
+
+    def eval_10_benchmark(self, target):
+        allocids = [ self._allocate(target, n) for n in range(10) ]
+        data = { allocid: 'active' for allocid in allocids }
+        count = 500
+        ts0 = time.time()
+        for _ in range(count):
+            r = target.server.send_request("PUT", "keepalive-v2", json = data)
+            if r:
+                raise tcfl.tc.failed_e(f"unexpected change: {r}")
+        ts = time.time() - ts0
+        self.report_data("Allocation keepalive",
+                         "keepalive calls (10 allocations) per second",
+                         count / ts)
+        self.report_info(f"{count} keepalive calls for 10 allocations:"
+                         f" {count / ts:.0f} calls/s", level = 0)
+        for allocid in allocids:
+            target.server.send_request("DELETE", "allocation/" + allocid)
+
+    def eval_20_tombstones(self):
+        table = ttbl.allocation.keepalive_table_c(
+            os.path.join(self.tmpdir, "keepalive.table"), 64)
+        # an allocation removed with nothing after it leaves no tombstone
+        table.touch("single", 1)
+        table.remove("single")
+        if table.tombstones() != 0 or table.get("single") != None:
+            raise tcfl.tc.failed_e(
+                f"removing lone allocation left {table.tombstones()}"
+                " tombstones")
+
+        # allocations that stay, while others come and go
+        kept = { f"kept{n}": float(n) for n in range(16) }
+        for allocid, ts in kept.items():
+            table.touch(allocid, ts)
+        # a reader looking them up all the time from another process
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                ts0 = time.time()
+                while time.time() - ts0 < 3:
+                    for allocid, ts in kept.items():
+                        if table.get(allocid) != ts:
+                            code = 1
+            finally:
+                os._exit(code)
+        rehashes = 0
+        for n in range(5000):
+            table.touch(f"churn{n}", n)
+            if n >= 16:
+                rehashes_before = table._counter(table._offset_rehashes)
+                table.remove(f"churn{n - 16}")
+                if table._counter(table._offset_rehashes) != rehashes_before:
+                    rehashes += 1
+            if table.tombstones() > table.tombstones_max * table.slots:
+                raise tcfl.tc.failed_e(
+                    f"{table.tombstones()} tombstones after {n} allocations")
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise tcfl.tc.failed_e(
+                "reader didn't find kept allocations while the table"
+                " was being changed")
+        for allocid, ts in kept.items():
+            if table.get(allocid) != ts:
+                raise tcfl.tc.failed_e(f"{allocid}: lost or changed")
+        allocids = set(allocid for allocid, _ in table.items())
+        expected = set(kept) | set(f"churn{n}" for n in range(5000 - 16, 5000))
+        if allocids != expected:
+            raise tcfl.tc.failed_e(
+                f"unexpected allocations in the table: {allocids ^ expected}")
+        if rehashes == 0:
+            raise tcfl.tc.failed_e("table was never rehashed")
+        self.report_info(f"5000 allocations through a 64 slot table:"
+                         f" {rehashes} rehashes", level = 0)
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
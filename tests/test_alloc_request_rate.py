@@ -0,0 +1,94 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+"""
+Benchmark how many allocation requests per second a server can take
+for large groups of targets and check all the fields requested are
+recorded.
+"""
+import os
+import time
+
+import commonl.testing
+import tcfl
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ],
+    errors_ignore = [
+        "Traceback",
+        "DEBUG[",
+    ]
+)
+
+
+@tcfl.tc.target(ttbd.url_spec + ' and local_test')
+class _test(tcfl.tc.tc_c):
+
+    def eval_00(self, target):
+        group = [ 'bench%02d' % n for n in range(48) ]
+        count = 50
+        ts_total = 0
+        allocids = []
+        for i in range(count):
+            ts0 = time.time()
+            r = target.server.send_request("PUT", "allocation", json = dict(
+                groups = { 'group': group },
+                queue = True,
+                reason = f"benchmark request {i}",
+                guests = [ "guest1", "guest2" ],
+                extra_data = { "index": i, "benchmark": True },
+            ))
+            ts_total += time.time() - ts0
+            if r['state'] not in ( 'queued', 'active' ):
+                raise tcfl.tc.failed_e(f"allocation #{i} failed: {r}")
+            allocids.append(r['allocid'])
+
+        # check the last one, which has been queued behind the rest
+        r = target.server.send_request("GET", "allocation/" + allocids[-1])
+        if r['state'] != 'queued':
+            raise tcfl.tc.failed_e(f"expected last allocation queued: {r}")
+        for field, value in [
+                ( 'reason', f"benchmark request {count - 1}" ),
+                ( 'extra_data.index', count - 1 ),
+                ( 'extra_data.benchmark', True ),
+                ( 'targets_all', None ),
+                ( 'guests', None ),
+        ]:
+            if value != None and r.get(field, None) != value:
+                raise tcfl.tc.failed_e(
+                    f"{field}: expected {value}, got {r.get(field, None)}")
+        if sorted(r['targets_all']) != group:
+            raise tcfl.tc.failed_e(f"targets_all: unexpected {r}")
+        if sorted(r['guests']) != [ "guest1", "guest2" ]:
+            raise tcfl.tc.failed_e(f"guests: unexpected {r}")
+
+        # releasing the first makes one of the queued ones active
+        target.server.send_request("DELETE", "allocation/" + allocids[0])
+        states = [
+            target.server.send_request("GET", "allocation/" + allocid)['state']
+            for allocid in allocids[1:]
+        ]
+        if states.count('active') != 1:
+            raise tcfl.tc.failed_e(
+                f"expected one allocation active after release: {states}")
+
+        for allocid in allocids[1:]:
+            target.server.send_request("DELETE", "allocation/" + allocid)
+
+        self.report_data("Allocation", "requests per second (48 targets)",
+                         count / ts_total)
+        self.report_info(f"{count} allocation requests for 48 targets:"
+                         f" {count / ts_total:.1f} requests/s",
+                         level = 0)
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,274 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Test the Zephyr build cache (tcfl.app_zephyr.build_cache_c)
+
+We don't need a Zephyr toolchain; fake targets run the build commands
+:meth:`tcfl.app_zephyr.app_zephyr.build` gives them by writing the
+artifacts to the build directory and we verify:
+
+- the same key is produced for different build directories with the
+  same configuration, a different one when configuration, sources or
+  the run change
+
+- concurrent builders with the same key build only once, the rest
+  reuse the artifacts
+
+- the cache is trimmed to its maximum size, least recently used first
+
+- hits are reported in the run summary
+"""
+
+import codecs
+import concurrent.futures
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+import tcfl.app_zephyr
+import tcfl.tc
+
+build_cache_c = tcfl.app_zephyr.build_cache_c
+app_zephyr = tcfl.app_zephyr.app_zephyr
+
+
+class _zephyr:
+    # the minimum of tcfl.app_zephyr.zephyr the build needs
+    def __init__(self, target):
+        self.target = target
+
+    def config_file_write(self, name, data, bsp = None):
+        outdir = self.target.kws['zephyr_objdir']
+        os.makedirs(outdir, exist_ok = True)
+        with open(os.path.join(outdir, name + ".conf"), "w") as f:
+            f.write(data)
+
+    def config_file_read(self, name = None, bsp = None):
+        config = {}
+        with codecs.open(os.path.join(self.target.kws['zephyr_objdir'],
+                                      ".config"),
+                         encoding = 'utf-8') as f:
+            for line in f:
+                key, value = line.strip().split("=", 1)
+                config[key] = value.strip('"')
+        return config
+
+
+class _target:
+    # the minimum of tcfl.tc.target_c app_zephyr needs
+    def __init__(self, test, name, tg_hash, board = "qemu_x86"):
+        self.test = test
+        self.want_name = "target"
+        self.type = "qemu-x86"
+        self.bsp = "x86"
+        self.bsp_model = "x86"
+        self.bsps_stub = {}
+        self.kws = {
+            'runid': "",
+            'tc_hash': name,
+            'tg_hash': tg_hash,
+            'zephyr_board': board,
+            'zephyr_kernelname': "zephyr.bin",
+            'bsp': "x86",
+        }
+        self.zephyr = _zephyr(self)
+
+    def kws_required_verify(self, kws):
+        for kw in kws:
+            assert kw in self.kws, f"{kw} missing"
+
+    def kw_set(self, kw, value, bsp = None):
+        self.kws[kw] = value
+
+    def kws_set(self, d, bsp = None):
+        self.kws.update(d)
+
+    def report_info(self, *args, **kwargs):
+        pass
+
+    def report_pass(self, *args, **kwargs):
+        pass
+
+    def shcmd_local(self, cmd):
+        # pretend to run the build commands app_zephyr gives us
+        cmd = cmd % self.kws
+        objdir = self.kws['zephyr_objdir']
+        if cmd.startswith("mkdir"):
+            subprocess.check_call(cmd, shell = True)
+        elif cmd.endswith(" initconfig"):
+            with open(os.path.join(objdir, ".config"), "w") as f:
+                f.write('CONFIG_KERNEL_BIN_NAME="zephyr"\n')
+        else:
+            m = re.search(r"TC_RUNID=(\S*)", cmd)
+            self.test._build_record(m.group(1))
+            time.sleep(0.5)
+            subprocess.check_call([ "cp", self.test.elf,
+                                    os.path.join(objdir, "zephyr.elf") ])
+            for name in [ "zephyr.bin", "main.o" ]:
+                with open(os.path.join(objdir, name), "w") as f:
+                    f.write(name + "\n" * 1000)
+
+
+class _testcase:
+    # the minimum of tcfl.tc.tc_c app_zephyr needs
+    build_only = False
+
+    def __init__(self, tmpdir):
+        self.tmpdir = tmpdir
+        self._targets = { "target": { 'kws': {} } }
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        # disabled by default
+        build_cache_c.enabled = True
+        build_cache_c.path = os.path.join(self.tmpdir, "cache")
+        self.srcdir = os.path.join(self.tmpdir, "src")
+        os.makedirs(self.srcdir)
+        with open(os.path.join(self.srcdir, "main.c"), "w") as f:
+            f.write("void __start(void) { }\n")
+        # what the build produces, an ELF with a __start symbol
+        self.elf = os.path.join(self.tmpdir, "zephyr.elf")
+        subprocess.check_call([ "cc", "-c", "-o", self.elf,
+                                os.path.join(self.srcdir, "main.c") ])
+        # not a cmake Zephyr, so app_zephyr uses the make commands
+        self.zephyr_base = os.environ.get('ZEPHYR_BASE', None)
+        os.environ['ZEPHYR_BASE'] = self.tmpdir
+        self.builds = []
+        self.builds_lock = threading.Lock()
+
+    def teardown_90(self):
+        build_cache_c.enabled = False
+        if self.zephyr_base == None:
+            del os.environ['ZEPHYR_BASE']
+        else:
+            os.environ['ZEPHYR_BASE'] = self.zephyr_base
+
+    def _build_record(self, runid):
+        with self.builds_lock:
+            self.builds.append(runid)
+
+    def _target(self, name, tg_hash, board = "qemu_x86"):
+        target = _target(self, name, tg_hash, board)
+        testcase = _testcase(self.tmpdir)
+        app_zephyr.configure(testcase, target, [ self.srcdir ])
+        target.testcase = testcase
+        return target
+
+    def _build(self, target):
+        app_zephyr.build(target.testcase, target, [ self.srcdir ])
+        return target
+
+    def eval_00_key(self):
+        target1 = self._target("tc1", "tg1")
+        target2 = self._target("tc2", "tg2")
+        key1 = build_cache_c.key(target1, "build commands")
+        if key1 != build_cache_c.key(target2, "build commands"):
+            raise tcfl.tc.failed_e("same build, different keys")
+        target2.zephyr.config_file_write("600_extra", "CONFIG_SOMETHING=y\n")
+        if key1 == build_cache_c.key(target2, "build commands"):
+            raise tcfl.tc.failed_e("config change, same keys")
+        target3 = self._target("tc3", "tg3", "frdm_k64f")
+        if key1 == build_cache_c.key(target3, "build commands"):
+            raise tcfl.tc.failed_e("board change, same keys")
+        # with no RunID, builds are not shared with other runs
+        tmpdir = tcfl.tc.tc_c.tmpdir
+        try:
+            tcfl.tc.tc_c.tmpdir = os.path.join(tmpdir, "other-run")
+            if key1 == build_cache_c.key(target1, "build commands"):
+                raise tcfl.tc.failed_e("no RunID, other run, same keys")
+        finally:
+            tcfl.tc.tc_c.tmpdir = tmpdir
+        target1.kws['runid'] = "RUN1"
+        if key1 == build_cache_c.key(target1, "build commands"):
+            raise tcfl.tc.failed_e("RunID change, same keys")
+        with open(os.path.join(self.srcdir, "main.c"), "a") as f:
+            f.write("/* modified */\n")
+        target1.kws['runid'] = ""
+        if key1 == build_cache_c.key(target1, "build commands"):
+            raise tcfl.tc.failed_e("source change, same keys")
+
+    def eval_10_concurrent(self):
+        # the same testcase in 10 target groups
+        targets = [
+            self._target("tc", f"tg{i:02d}") for i in range(10)
+        ]
+        self.builds = []
+        ts0 = time.time()
+        with concurrent.futures.ThreadPoolExecutor(10) as executor:
+            list(executor.map(self._build, targets))
+        ts = time.time() - ts0
+        if self.builds != [ "" ]:
+            raise tcfl.tc.failed_e(
+                f"expected 1 build, got {len(self.builds)}",
+                dict(builds = self.builds))
+        for target in targets:
+            elf = os.path.join(target.kws['zephyr_objdir'], "zephyr.elf")
+            if not os.path.exists(elf):
+                raise tcfl.tc.failed_e(f"{elf}: artifact missing")
+            if target.kws['__start'] == None:
+                raise tcfl.tc.failed_e(f"{elf}: __start not found")
+        main_o = [
+            os.path.join(target.kws['zephyr_objdir'], "main.o")
+            for target in targets
+        ]
+        if sum(os.path.exists(i) for i in main_o) != 1:
+            raise tcfl.tc.failed_e("main.o not an artifact, but cached")
+        self.report_info(f"10 concurrent builds of the same app: 1 build,"
+                         f" 9 reused, {ts:.1f}s", level = 0)
+
+    def eval_15_runid(self):
+        # with the cache disabled, TC_RUNID is RUNID:TG_HASH as
+        # documented
+        build_cache_c.enabled = False
+        try:
+            target = self._build(self._target("tc", "tg1"))
+        finally:
+            build_cache_c.enabled = True
+        if target.kws['zephyr_runid'] != ":tg1":
+            raise tcfl.tc.failed_e(
+                f"cache disabled: expected TC_RUNID ':tg1', got"
+                f" '{target.kws['zephyr_runid']}'")
+        target = self._build(self._target("tc", "tg1"))
+        if target.kws['zephyr_runid'] != "":
+            raise tcfl.tc.failed_e(
+                f"cache enabled: expected TC_RUNID '', got"
+                f" '{target.kws['zephyr_runid']}'")
+
+    def eval_20_trim(self):
+        for i in range(5):
+            self._build(self._target("tc", "tg", f"board{i}"))
+        entries = [
+            entry for entry in os.listdir(build_cache_c.path)
+            if not entry.endswith(".lock")
+        ]
+        # all the builds are the same size; leave room for the two
+        # most recent
+        with open(os.path.join(build_cache_c.path, entries[0],
+                               "metadata.json")) as f:
+            size = json.load(f)['size']
+        size_max_saved = build_cache_c.size_max
+        try:
+            build_cache_c.size_max = 2 * size + size // 2
+            build_cache_c.trim()
+        finally:
+            build_cache_c.size_max = size_max_saved
+        entries_left = [
+            entry for entry in os.listdir(build_cache_c.path)
+            if not entry.endswith(".lock")
+        ]
+        if len(entries_left) != 2:
+            raise tcfl.tc.failed_e(
+                f"expected 2 entries left of {len(entries)},"
+                f" got {len(entries_left)}")
+        self.builds = []
+        self._build(self._target("tc2", "tg2", "board4"))
+        if self.builds:
+            raise tcfl.tc.failed_e("most recent build was evicted")
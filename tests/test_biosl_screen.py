@@ -0,0 +1,292 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test BIOS menu navigation with the screen model (tcfl.biosl.screen_c)
+
+Replay console captures of EDK2 style menus (as the BIOS draws them,
+with ANSI sequences) and verify:
+
+- the screen model finds the menu entries, which is highlighted and
+  the values of key/value entries
+
+- navigation sends the keystrokes to get to an entry in bursts,
+  waiting for the menu to be redrawn once per burst instead of once
+  per keystroke
+
+- entries that are not in the menu are reported as not found
+
+- selecting from a list of options (multiple_entry_select_one())
+  scrolls to the option
+"""
+
+import os
+import re
+
+import tcfl.biosl
+import tcfl.tc
+
+_highlight = "\x1b[0m\x1b[37m\x1b[40m"
+_normal = "\x1b[0m\x1b[30m\x1b[47m"
+
+# from the multiple_entry_select_one() documentation
+_popup_capture = (
+    "\x1b[23;27H<Enter>=Complete Entry"
+    "\x1b[23;03H^v=Move Highlight"
+    "\x1b[22;03H"
+    "\x1b[22;53H"
+    "\x1b[22;27H"
+    "\x1b[23;53HEsc=Exit Entry"
+    "\x1b[0m\x1b[37m\x1b[44m\x1b[10;34H"
+    "\x1b[11;34H"
+    "\x1b[12;34H"
+    "\x1b[13;34H"
+    "\x1b[10;34H\x1b[10;34H/------------\\"
+    "\x1b[11;34H|\x1b[11;47H|\x1b[12;34H|\x1b[12;47H|"
+    "\x1b[1m\x1b[37m\x1b[46m\x1b[11;36HEnable"
+    "\x1b[0m\x1b[37m\x1b[44m\x1b[12;36HDisable"
+    "\x1b[13;34H\\------------/"
+).encode('utf-8')
+
+
+class _bios_menu_c:
+    # Draws a menu as EDK2 does over the serial console: entries on
+    # column 4, highlighted white on black, the rest black on white;
+    # key/value entries have the value on column 31 and when
+    # highlighted, the value is, not the key.
+    #
+    # entries are ( KEY, VALUE, SELECTABLE ); KEY None is an empty row
+    def __init__(self, entries):
+        self.entries = entries
+        self.selected = self._selectable()[0]
+
+    def _selectable(self):
+        return [ index for index, ( key, _value, selectable )
+                 in enumerate(self.entries) if key and selectable ]
+
+    def _draw_entry(self, index):
+        key, value, _selectable = self.entries[index]
+        row = 5 + index
+        if key == None:
+            return ""
+        if index != self.selected:
+            s = _normal + f"\x1b[{row:02d};04H{key}"
+            if value:
+                s += f"\x1b[{row:02d};31H{value}"
+            return s
+        if value:
+            return _highlight + f"\x1b[{row:02d};31H{value}" \
+                + _normal + f"\x1b[{row:02d};{31 + len(value):02d}H   " \
+                + f"\x1b[{row:02d};01H   " \
+                + f"\x1b[{row:02d};04H{key}"
+        return _highlight + f"\x1b[{row:02d};04H{key}"
+
+    def draw(self):
+        s = _normal + "\x1b[2J" + "\x1b[02;30HFront Page" \
+            + "\x1b[03;03HStandard PC (i440FX + PIIX, 1996)"
+        for index in range(len(self.entries)):
+            s += self._draw_entry(index)
+        s += _normal + "\x1b[24;03H^v=Move Highlight" \
+            + "\x1b[24;27H<Enter>=Select Entry"
+        return s.encode('utf-8')
+
+    def key(self, direction):
+        # moves wrapping around, redrawing only the two entries that
+        # change
+        selectable = self._selectable()
+        position = selectable.index(self.selected)
+        previous = self.selected
+        if direction == "down":
+            self.selected = selectable[(position + 1) % len(selectable)]
+        else:
+            self.selected = selectable[(position - 1) % len(selectable)]
+        return ( self._draw_entry(previous)
+                 + self._draw_entry(self.selected) ).encode('utf-8')
+
+
+class _console_c:
+    # what tcfl.biosl's screen model uses from the console extension
+    default = "serial0"
+
+    def __init__(self, target, filename):
+        self.target = target
+        self.of = open(filename, "ba+")
+
+    def capture_filename(self, console = None):
+        return self.of.name
+
+    def text_capture_file(self, console = None):
+        return self.of
+
+    def wait_for_no_output(self, console = None, **kwargs):
+        self.target.settles += 1
+
+    def send_expect_sync(self, console, detect_context = ""):
+        pass
+
+
+class _target_c:
+    # a target with a BIOS menu on the console; keystrokes sent update
+    # the menu, whose output lands in the console capture file as the
+    # expect engine would do
+    def __init__(self, menu, filename):
+        self.menu = menu
+        self.kws = { "bios.terminal_emulation": "vt100" }
+        self.settles = 0
+        self.keystrokes = 0
+        self.console = _console_c(self, filename)
+        self.console.of.write(menu.draw())
+        self.console.of.flush()
+
+    def console_tx(self, data):
+        for key in re.findall("\x1b\\[[AB]", data):
+            self.keystrokes += 1
+            self.console.of.write(
+                self.menu.key("up" if key == "\x1b[A" else "down"))
+        self.console.of.flush()
+
+    def report_info(self, *args, **kwargs):
+        pass
+
+
+_entries = [
+    ( "Select Language", "<Standard English>", True ),
+    ( None, None, False ),
+    ( "► Device Manager", None, True ),
+    ( "► Boot Manager", None, True ),
+    ( "► Boot Maintenance Manager", None, True ),
+    ( "Memory: 1024 MB", None, False ),		# not selectable
+    ( "► Platform Configuration", None, True ),
+    ( "EFI Network", "<Disabled>", True ),
+    ( None, None, False ),
+    ( "Continue", None, True ),
+    ( "Reset", None, True ),
+]
+
+
+class _test(tcfl.tc.tc_c):
+
+    def eval_00_attrs(self):
+        for highlight_string, expected in [
+                ( tcfl.biosl.normal_white_fg_black_bg,
+                  ( "white", "black", False, False ) ),
+                ( tcfl.biosl.bold_white_fg_cyan_bg,
+                  ( "white", "cyan", True, False ) ),
+                # as given to multiple_entry_select_one()
+                ( "\x1b\\[1m\x1b\\[37m\x1b\\[46m",
+                  ( "white", "cyan", True, False ) ),
+        ]:
+            attrs = tcfl.biosl._ansi_attrs(highlight_string)
+            if attrs != expected:
+                raise tcfl.tc.failed_e(
+                    f"{highlight_string!r}: expected {expected}, got {attrs}")
+
+    def eval_10_entries(self):
+        menu = _bios_menu_c(_entries)
+        screen = tcfl.biosl.screen_c()
+        screen.feed(menu.draw())
+        entries = screen.menu_entries(4, tcfl.biosl.normal_white_fg_black_bg)
+        keys = [ entry['key'] for entry in entries ]
+        expected = [ key for key, _value, _selectable in _entries if key ]
+        # the bottom bar shows up as an entry too, harmless
+        if keys[:-1] != expected:
+            raise tcfl.tc.failed_e(f"entries: expected {expected}, got {keys}")
+        if not entries[0]['highlighted'] \
+           or entries[0].get('value', None) != "<Standard English>":
+            raise tcfl.tc.failed_e(f"first entry: unexpected {entries[0]}")
+
+        # the value is highlighted on key/value entries
+        for _ in range(5):
+            screen.feed(menu.key("down"))
+        entries = screen.menu_entries(4, tcfl.biosl.normal_white_fg_black_bg)
+        highlighted = [ entry for entry in entries if entry['highlighted'] ]
+        if len(highlighted) != 1 \
+           or highlighted[0]['key'] != "EFI Network" \
+           or highlighted[0]['value'] != "<Disabled>":
+            raise tcfl.tc.failed_e(f"highlighted: unexpected {highlighted}")
+
+        # popup, from a recorded capture
+        screen = tcfl.biosl.screen_c()
+        screen.feed(_popup_capture)
+        entries = screen.menu_entries(36, tcfl.biosl.bold_white_fg_cyan_bg,
+                                      range(10, 12))
+        if [ ( entry['key'], entry['highlighted'] ) for entry in entries ] \
+           != [ ( "Enable", True ), ( "Disable", False ) ]:
+            raise tcfl.tc.failed_e(f"popup: unexpected entries {entries}")
+        index, direction, count = tcfl.biosl.menu_keystrokes(
+            entries, re.compile("Disabled?"))
+        if ( index, direction, count ) != ( None, "down", 1 ):
+            raise tcfl.tc.failed_e(
+                f"popup: unexpected keystrokes {index} {direction} {count}")
+
+    def _navigate(self, entry_string, name):
+        menu = _bios_menu_c(_entries)
+        target = _target_c(menu, os.path.join(self.tmpdir, name + ".txt"))
+        r = tcfl.biosl._menu_scroll_to_entry_screen(
+            target, entry_string, 30, "down",
+            tcfl.biosl.normal_white_fg_black_bg, 4, name)
+        return target, menu, r
+
+    def eval_20_navigate(self):
+        settles = 0
+        keystrokes = 0
+        settles_one_by_one = 0
+        for entry_string in [ "Continue", "EFI Network", "Reset",
+                              "Boot Manager", "Select Language" ]:
+            target, menu, r = self._navigate(entry_string, entry_string)
+            if r == None:
+                raise tcfl.tc.failed_e(f"{entry_string}: not found")
+            key = r['key_value'] or r['key_novalue']
+            if not re.search(entry_string.encode('utf-8'), key) \
+               or entry_string not in _entries[menu.selected][0]:
+                raise tcfl.tc.failed_e(
+                    f"{entry_string}: ended on {_entries[menu.selected][0]}"
+                    f" reported {r}")
+            if entry_string == "EFI Network" and r['value'] != b"<Disabled>":
+                raise tcfl.tc.failed_e(f"{entry_string}: bad value {r}")
+            self.report_info(f"{entry_string}: {target.keystrokes} keystrokes,"
+                             f" {target.settles} waits for the menu")
+            settles += target.settles
+            keystrokes += target.keystrokes
+            # scrolling one keystroke at a time waits once before
+            # starting and then after each keystroke
+            settles_one_by_one += 1 + menu._selectable().index(menu.selected)
+        self.report_data("BIOS menu navigation", "waits (screen model)",
+                         settles)
+        self.report_data("BIOS menu navigation", "waits (one key at a time)",
+                         settles_one_by_one)
+        self.report_info(
+            f"5 entries reached with {keystrokes} keystrokes waiting"
+            f" {settles} times for the menu to redraw (one key at a time:"
+            f" {settles_one_by_one})", level = 0)
+        if settles >= settles_one_by_one:
+            raise tcfl.tc.failed_e("screen model didn't save waits")
+
+    def eval_30_not_found(self):
+        target, _menu, r = self._navigate("Nonexistent", "notfound")
+        if r != None:
+            raise tcfl.tc.failed_e(f"found nonexistent entry: {r}")
+        self.report_pass(f"nonexistent entry not found after"
+                         f" {target.keystrokes} keystrokes")
+
+    def eval_40_multiple_entry(self):
+        # a list of options, the first one highlighted
+        menu = _bios_menu_c([ ( f"Option {n}", None, True )
+                              for n in range(12) ])
+        target = _target_c(menu, os.path.join(self.tmpdir, "multiple.txt"))
+        key, r = tcfl.biosl._multiple_entry_select_one_screen(
+            target, "Option 9", 30, tcfl.biosl.normal_white_fg_black_bg,
+            "options")
+        if key != b"Option 9" or r != dict(key = key) \
+           or menu.entries[menu.selected][0] != "Option 9":
+            raise tcfl.tc.failed_e(
+                f"ended on {menu.entries[menu.selected][0]},"
+                f" reported {key} {r}")
+        if target.keystrokes != 9:
+            raise tcfl.tc.failed_e(
+                f"expected 9 keystrokes, sent {target.keystrokes}")
+        self.report_pass(f"option selected with {target.keystrokes}"
+                         f" keystrokes, {target.settles} waits for the menu")
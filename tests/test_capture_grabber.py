@@ -0,0 +1,154 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test and benchmark snapshots from a persistent grabber
+(ttbl.capture.generic_snapshot with *grabber_cmdline*)
+
+A fake grabber (capture_fake_grabber.py) takes 0.5s to set up, as a
+real device would to open and negotiate, and then produces a frame
+every 0.1s.
+
+- snapshots from the persistent grabber are recent frames from the
+  same grabber and take less than those starting a new one each time
+
+- the grabber is stopped when idle and restarted on the next snapshot
+
+- concurrent snapshots when the grabber is not running start only
+  one; through the API, they are serialized by the target's lock, so
+  this is checked calling the driver from multiple threads
+"""
+
+import concurrent.futures
+import logging
+import os
+import time
+
+import commonl.testing
+import tcfl.tc
+import ttbl.capture
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd'))),
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class _test(tcfl.tc.tc_c):
+
+    def _snapshot(self, target, capturer):
+        ts0 = time.time()
+        target.capture.start(capturer)
+        ts = time.time() - ts0
+        r = target.capture.get(capturer, "default",
+                               prefix = os.path.join(self.tmpdir, ""))
+        with open(r['default']) as f:
+            _frame, pid, count, ts_frame = f.read().split()
+        return ts, int(pid), int(count), float(ts_frame), ts0
+
+    def eval_00_benchmark(self, target):
+        latencies = {}
+        for capturer in [ "c_oneshot", "c_grabber" ]:
+            latencies[capturer] = []
+            pids = set()
+            for _ in range(10):
+                ts, pid, _count, ts_frame, ts0 = \
+                    self._snapshot(target, capturer)
+                latencies[capturer].append(ts)
+                pids.add(pid)
+                if ts_frame < ts0 - 1:
+                    raise tcfl.tc.failed_e(
+                        f"{capturer}: frame from {ts0 - ts_frame:.2f}s"
+                        " before the snapshot was requested")
+                time.sleep(0.2)
+            if capturer == "c_grabber" and len(pids) != 1:
+                raise tcfl.tc.failed_e(
+                    f"{capturer}: expected one grabber, frames came"
+                    f" from {len(pids)}")
+
+        # the first grabber snapshot has to wait for it to start
+        oneshot = sum(latencies['c_oneshot']) / 10
+        grabber = sum(latencies['c_grabber'][1:]) / 9
+        self.report_data("Snapshot capture", "one shot average (s)", oneshot)
+        self.report_data("Snapshot capture", "grabber average (s)", grabber)
+        self.report_data("Snapshot capture", "grabber first (s)",
+                         latencies['c_grabber'][0])
+        self.report_info(
+            f"snapshot: one shot {oneshot * 1000:.0f}ms, persistent"
+            f" grabber {grabber * 1000:.0f}ms (first"
+            f" {latencies['c_grabber'][0] * 1000:.0f}ms)", level = 0)
+        if grabber >= oneshot:
+            raise tcfl.tc.failed_e("grabber snapshots not faster")
+
+    def eval_10_idle_stop(self, target):
+        _ts, pid, _count, _ts_frame, _ts0 = self._snapshot(target, "c_grabber")
+        pidfile = os.path.join(ttbd.state_dir, "targets", "t0",
+                               "capture-c_grabber.grabber.pid")
+        if not os.path.exists(pidfile):
+            raise tcfl.tc.failed_e(f"{pidfile}: missing while grabbing")
+        # idle timeout is 3s
+        time.sleep(5)
+        if commonl.process_alive(pid):
+            raise tcfl.tc.failed_e(f"grabber {pid} not stopped when idle")
+        if os.path.exists(pidfile):
+            raise tcfl.tc.failed_e(f"{pidfile}: not removed when idle")
+        self.report_pass(f"grabber {pid} stopped when idle")
+
+        _ts, pid_new, _count, _ts_frame, _ts0 = \
+            self._snapshot(target, "c_grabber")
+        if pid_new == pid:
+            raise tcfl.tc.failed_e("grabber not restarted")
+        self.report_pass(f"grabber restarted as {pid_new}")
+
+    def _driver_snapshot(self, impl, fake_target, n):
+        # the keywords generic_snapshot.start() sets
+        prefix = os.path.join(self.tmpdir, "capture-c.grabber")
+        kws = {
+            '_impl.stream_filename': os.path.join(self.tmpdir, f"{n}.txt"),
+            '_impl.frame_filename': prefix + ".frame.txt",
+            '_impl.grabber_pidfile': prefix + ".pid",
+            '_impl.grabber_used_filename': prefix + ".used",
+            '_impl.grabber_log_filename': prefix + ".log",
+            '_impl.grabber_lock_filename': prefix + ".lock",
+        }
+        with open(os.path.join(self.tmpdir, f"{n}.log"), "w") as logf:
+            impl._grabber_snapshot(fake_target, "c", kws, logf)
+
+    def eval_20_concurrent(self):
+        fake_grabber = os.path.abspath(
+            os.path.join(srcdir, "capture_fake_grabber.py"))
+        # the pre-command leaves time for the others to try to
+        # start it too
+        impl = ttbl.capture.generic_snapshot(
+            "fake persistent", "true", mimetype = "text/plain",
+            extension = ".txt", pre_commands = [ "sleep 0.5" ],
+            grabber_cmdline = f"{fake_grabber}"
+            " %(_impl.frame_filename)s 0.1 0.5",
+            grabber_idle_timeout = 3)
+
+        class _fake_target:
+            log = logging.getLogger("fake-target")
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            futures = [
+                executor.submit(self._driver_snapshot, impl, _fake_target, n)
+                for n in range(4)
+            ]
+            for future in futures:
+                future.result()
+        # each grabber started says so in the log
+        with open(os.path.join(self.tmpdir, "capture-c.grabber.log")) as f:
+            started = [ line for line in f if line.startswith("fake grabber") ]
+        if len(started) != 1:
+            raise tcfl.tc.failed_e(
+                f"expected one grabber started, got {len(started)}",
+                dict(started = started))
+        self.report_pass("concurrent snapshots started one grabber")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,240 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test and benchmark issuing client certificates (ttbl.certs)
+
+Issue a client certificate for each of a few targets, all at the same
+time (as when many testcases allocate tunnel/VPN targets at once):
+
+- running *openssl* commands (as it was done before)
+- in process, generating the keys on the spot
+- in process, with keys from a pool filled in advance
+- in process, with EC keys
+
+and report the latency of the requests; check the files created are
+valid (as checked by *openssl*), that keys in the pool are not shared
+with forked processes and that the certificate authority is cached.
+"""
+
+import concurrent.futures
+import os
+import subprocess
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509.oid import ExtendedKeyUsageOID
+
+import tcfl.tc
+import ttbl
+import ttbl.certs
+
+_requests = 8
+
+
+def _paths(target):
+    cert_path = os.path.join(target.state_dir, "certificates")
+    cert_client_path = os.path.join(target.state_dir, "certificates_client")
+    return cert_path, cert_client_path
+
+
+def _issue(iface, target, name):
+    # what put_certificate() does, minus the allocation checks
+    cert_path, cert_client_path = _paths(target)
+    iface._setup_maybe(target, cert_path, cert_client_path)
+    iface._client_create(
+        target, name, cert_path,
+        os.path.join(cert_client_path, name + ".key"),
+        os.path.join(cert_client_path, name + ".req"),
+        os.path.join(cert_client_path, name + ".cert"))
+
+
+def _issue_openssl(target, name):
+    # as ttbl.certs.interface.put_certificate() used to do it
+    cert_path, cert_client_path = _paths(target)
+    key_path = os.path.join(cert_client_path, name + ".key")
+    req_path = os.path.join(cert_client_path, name + ".req")
+    client_cert_path = os.path.join(cert_client_path, name + ".cert")
+    for cmdline in [
+            f"openssl genrsa -out {key_path} 3072",
+            f"openssl req -new -key {key_path} -out {req_path}"
+            f" -subj /C=LC/ST=Local/L=Local/O=TCF/CN=TCF-{name}",
+            f"openssl x509 -req -in {req_path} -CA ca.cert -CAkey ca.key"
+            f" -set_serial 101 -days 365 -outform PEM -out {client_cert_path}",
+    ]:
+        subprocess.run(cmdline.split(), check = True, cwd = cert_path,
+                       capture_output = True, timeout = 30)
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        ttbl._who_daemon = "internal-test"
+        ttbl.test_target.state_path = self.tmpdir
+        ttbl.test_target.files_path = self.tmpdir
+
+    def _check(self, target, name, openssl = False):
+        cert_path, cert_client_path = _paths(target)
+        for cert in [ os.path.join(cert_path, "server.cert"),
+                      os.path.join(cert_client_path, name + ".cert") ]:
+            r = subprocess.run(
+                [ "openssl", "verify", "-CAfile",
+                  os.path.join(cert_client_path, "ca.cert"), cert ],
+                capture_output = True, text = True)
+            if r.returncode != 0:
+                raise tcfl.tc.failed_e(
+                    f"{cert}: doesn't verify with the CA: {r.stdout}")
+        subprocess.run(
+            [ "openssl", "dhparam", "-check", "-noout", "-in",
+              os.path.join(cert_path, "dh.pem") ],
+            check = True, capture_output = True)
+        with open(os.path.join(cert_client_path, name + ".key"), "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), None)
+        with open(os.path.join(cert_client_path, name + ".cert"), "rb") as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+        if key.public_key() != cert.public_key():
+            raise tcfl.tc.failed_e(f"{name}: key doesn't match certificate")
+        if openssl:		# the rest is only done in process
+            return key
+        eku = cert.extensions.get_extension_for_class(x509.ExtendedKeyUsage)
+        if ExtendedKeyUsageOID.CLIENT_AUTH not in eku.value:
+            raise tcfl.tc.failed_e(f"{name}: not a client certificate")
+        mode = os.stat(os.path.join(cert_client_path, name + ".key")).st_mode
+        if mode & 0o077:
+            raise tcfl.tc.failed_e(f"{name}: key readable by others")
+        return key
+
+    def eval_00_benchmark(self):
+        timings = {}
+        for scheme, key_type, pool_size in [
+                ( "openssl commands", None, 0 ),
+                ( "in process, RSA", "rsa", 0 ),
+                ( "in process, RSA, key pool", "rsa", _requests ),
+                ( "in process, EC", "ec", 0 ),
+        ]:
+            iface = ttbl.certs.interface(key_type = key_type or "rsa",
+                                         key_pool_size = pool_size)
+            targets = []
+            for count in range(_requests):
+                target = ttbl.test_target(
+                    f"{scheme.replace(' ', '_').replace(',', '')}-{count}")
+                # the certificate authority is set up before timing
+                cert_path, cert_client_path = _paths(target)
+                iface._setup_maybe(target, cert_path, cert_client_path)
+                targets.append(target)
+            if pool_size:
+                # filled in the background, wait for it
+                iface.key_pool.start()
+                ts0 = time.time()
+                while len(iface.key_pool.keys) < pool_size:
+                    if time.time() - ts0 > 120:
+                        raise tcfl.tc.error_e("key pool not filling up")
+                    time.sleep(0.1)
+
+            def _request(target):
+                ts0 = time.time()
+                if key_type == None:
+                    _issue_openssl(target, "client")
+                else:
+                    _issue(iface, target, "client")
+                return time.time() - ts0
+
+            ts0 = time.time()
+            with concurrent.futures.ThreadPoolExecutor(_requests) as executor:
+                latencies = list(executor.map(_request, targets))
+            ts = time.time() - ts0
+            for target in targets:
+                self._check(target, "client", openssl = key_type == None)
+            mean = sum(latencies) / len(latencies)
+            timings[scheme] = ( mean, max(latencies) )
+            self.report_data("Certificate issuance", f"{scheme}: mean (ms)",
+                             mean * 1000)
+            self.report_data("Certificate issuance", f"{scheme}: max (ms)",
+                             max(latencies) * 1000)
+            self.report_info(
+                f"{scheme}: {_requests} concurrent requests in {ts:.2f}s;"
+                f" latency mean {mean * 1000:.0f}ms"
+                f" max {max(latencies) * 1000:.0f}ms", level = 0)
+        if timings["in process, RSA, key pool"][1] \
+           >= timings["openssl commands"][0]:
+            raise tcfl.tc.failed_e(
+                "issuing with a key pool is not faster than openssl")
+
+    def eval_10_files(self):
+        iface = ttbl.certs.interface(key_type = "ec", key_pool_size = 0)
+        target = ttbl.test_target("files")
+        _issue(iface, target, "openvpn")
+        self._check(target, "openvpn")
+        cert_path, cert_client_path = _paths(target)
+        for filename in [ "ca.key", "ca.cert", "server.key", "server.req",
+                          "server.cert", "dh.pem" ]:
+            if not os.path.isfile(os.path.join(cert_path, filename)):
+                raise tcfl.tc.failed_e(f"{filename}: not created")
+        if sorted(os.listdir(cert_client_path)) \
+           != [ "ca.cert", "openvpn.cert", "openvpn.key", "openvpn.req" ]:
+            raise tcfl.tc.failed_e(
+                f"unexpected client files {os.listdir(cert_client_path)}")
+
+    def eval_20_ca_cache(self):
+        iface = ttbl.certs.interface(key_type = "ec", key_pool_size = 0)
+        target = ttbl.test_target("ca_cache")
+        cert_path, cert_client_path = _paths(target)
+        iface._setup_maybe(target, cert_path, cert_client_path)
+        ca_key, _ca_cert = iface._ca_get(cert_path)
+        if iface._ca_get(cert_path)[0] is not ca_key:
+            raise tcfl.tc.failed_e("CA not cached")
+        # released and set up again: new CA
+        iface._release_hook(target, True)
+        iface._setup_maybe(target, cert_path, cert_client_path)
+        if iface._ca_get(cert_path)[0] is ca_key:
+            raise tcfl.tc.failed_e("stale CA used")
+
+    def eval_30_fork(self):
+        pool = ttbl.certs.key_pool_c("ec", 256, 4)
+        pool.start()
+        ts0 = time.time()
+        while len(pool.keys) < 4:
+            if time.time() - ts0 > 10:
+                raise tcfl.tc.error_e("key pool not filling up")
+            time.sleep(0.05)
+        pooled = [ key.private_numbers().private_value for key in pool.keys ]
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                key = pool.get()
+                os.write(write_fd,
+                         b"%d" % key.private_numbers().private_value)
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            value = int(f.read())
+        os.waitpid(pid, 0)
+        if value in pooled:
+            raise tcfl.tc.failed_e("forked process got a key from the"
+                                   " parent's pool")
+        if pool.get().private_numbers().private_value != pooled[0]:
+            raise tcfl.tc.failed_e("parent didn't get a key from its pool")
+
+    def eval_40_shared(self):
+        # targets share a pool per type and size of key, started only
+        # when a certificate is requested
+        iface1 = ttbl.certs.interface(key_type = "ec", key_size = 384,
+                                      key_pool_size = 2)
+        iface2 = ttbl.certs.interface(key_type = "ec", key_size = 384,
+                                      key_pool_size = 3)
+        pool = iface1.key_pool
+        if iface2.key_pool is not pool:
+            raise tcfl.tc.failed_e("interfaces not sharing the key pool")
+        if pool.size != 3:
+            raise tcfl.tc.failed_e(f"expected pool size 3, got {pool.size}")
+        if pool.thread != None:
+            raise tcfl.tc.failed_e("key pool started before needed")
+        _issue(iface1, ttbl.test_target("shared"), "client")
+        if pool.thread == None:
+            raise tcfl.tc.failed_e("key pool not started when needed")
@@ -0,0 +1,139 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test and benchmark the serial console logger (ttbl.cm_logger)
+
+Fake a hundred serial consoles with pseudo terminals, log them all and
+write to them as fast as we can:
+
+- what is written to each console is found in its log file
+
+- time how many bytes per second the logger writes to the log files
+
+- time how long control operations (writing to a console, resetting
+  its log) take while all the consoles are busy
+"""
+
+import os
+import threading
+import time
+
+import tcfl.tc
+import ttbl.cm_logger
+
+_consoles = 100
+_size = 256 * 1024
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        ttbl.cm_logger.setup()
+        self.consoles = []
+        for i in range(_consoles + 1):
+            master, slave = os.openpty()
+            logfile_name = os.path.join(self.tmpdir, f"console-{i:03d}.log")
+            ttbl.cm_logger.spec_add(logfile_name, {
+                "port": os.ttyname(slave),
+                "baudrate": 921600,
+            })
+            # the logger opened it, keep it open so the pty doesn't
+            # hang up on it
+            self.consoles.append(( master, slave, logfile_name ))
+
+    @staticmethod
+    def _data_make(i):
+        line = b"console %03d: 0123456789abcdefghijklmnopqrstuvwxyz\n" % i
+        return (line * (_size // len(line) + 1))[:_size]
+
+    @staticmethod
+    def _writer(master, data):
+        while data:
+            written = os.write(master, data[:4096])
+            data = data[written:]
+
+    def _log_wait(self, logfile_name, size, timeout):
+        ts0 = time.time()
+        while time.time() - ts0 < timeout:
+            if os.path.getsize(logfile_name) >= size:
+                return
+            time.sleep(0.05)
+        raise tcfl.tc.failed_e(
+            f"{logfile_name}: {os.path.getsize(logfile_name)}B logged,"
+            f" expected {size}")
+
+    def eval_00_throughput(self):
+        threads = []
+        ts0 = time.time()
+        for i, ( master, _slave, _logfile_name ) \
+                in enumerate(self.consoles[:_consoles]):
+            thread = threading.Thread(target = self._writer,
+                                      args = ( master, self._data_make(i) ),
+                                      daemon = True)
+            thread.start()
+            threads.append(thread)
+
+        # while they are busy, control the spare console
+        master, _slave, logfile_name = self.consoles[_consoles]
+        latencies = []
+        for i in range(20):
+            ts = time.time()
+            ttbl.cm_logger.spec_write(logfile_name, data = b"ping %02d\n" % i)
+            latencies.append(time.time() - ts)
+            ts = time.time()
+            ttbl.cm_logger.spec_reset(logfile_name)
+            latencies.append(time.time() - ts)
+        # what we wrote made it to the console
+        data = b""
+        while len(data) < len(b"ping 00\n") * 20:
+            data += os.read(master, 4096)
+        if not data.startswith(b"ping 00\n") or b"ping 19\n" not in data:
+            raise tcfl.tc.failed_e(f"unexpected data on console: {data}")
+
+        for thread in threads:
+            thread.join()
+        for _master, _slave, logfile_name in self.consoles[:_consoles]:
+            self._log_wait(logfile_name, _size, 30)
+        ts = time.time() - ts0
+        for i, ( _master, _slave, logfile_name ) \
+                in enumerate(self.consoles[:_consoles]):
+            with open(logfile_name, "rb") as f:
+                if f.read() != self._data_make(i):
+                    raise tcfl.tc.failed_e(
+                        f"{logfile_name}: logged data differs from written")
+
+        throughput = _consoles * _size / ts
+        latency_max = max(latencies)
+        latency_avg = sum(latencies) / len(latencies)
+        self.report_data("Console logger", "bytes logged per second",
+                         throughput)
+        self.report_data("Console logger", "control latency average (s)",
+                         latency_avg)
+        self.report_data("Console logger", "control latency max (s)",
+                         latency_max)
+        self.report_info(
+            f"{_consoles} consoles: {throughput / 1024 / 1024:.1f}MiB/s"
+            f" logged; control operations {latency_avg * 1000:.1f}ms"
+            f" average, {latency_max * 1000:.1f}ms max", level = 0)
+
+    def eval_10_reset(self):
+        master, _slave, logfile_name = self.consoles[0]
+        ttbl.cm_logger.spec_reset(logfile_name)
+        if os.path.getsize(logfile_name) != 0:
+            raise tcfl.tc.failed_e(f"{logfile_name}: not truncated on reset")
+        os.write(master, b"after reset\n")
+        self._log_wait(logfile_name, len(b"after reset\n"), 5)
+        with open(logfile_name, "rb") as f:
+            data = f.read()
+        if data != b"after reset\n":
+            raise tcfl.tc.failed_e(f"{logfile_name}: unexpected {data}")
+
+    def teardown_90(self):
+        for master, slave, logfile_name in self.consoles:
+            ttbl.cm_logger.spec_rm(logfile_name)
+            os.close(master)
+            os.close(slave)
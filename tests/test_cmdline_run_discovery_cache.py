@@ -0,0 +1,183 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+
+import os
+import re
+
+import tcfl
+import tcfl.tc
+
+# A driver whose testcases can be described, so files that did not
+# change are not given to it again; it tells us in the marker when it
+# scans a file
+_conf_driver = """
+import os
+
+class discovery_desc_c(tcfl.tc.tc_c):
+
+    def eval(self):
+        self.report_pass("DESC RAN", level = 0)
+
+    @classmethod
+    def is_testcase(cls, path, _from_path, tc_name, _subcases_cmdline):
+        if not path.endswith(".tcdesc"):
+            return []
+        with open({marker!r}, "a") as f:
+            f.write("d" + os.path.basename(path)[:-7] + "\\n")
+        return [ cls(tc_name, path, path + ":1") ]
+
+    def discovery_describe(self):
+        return [ self.name, self.kws['thisfile'], self.origin ]
+
+    @classmethod
+    def discovery_create(cls, descriptor):
+        return cls(*descriptor)
+
+tcfl.tc.tc_c.driver_add(discovery_desc_c)
+tcfl.tc.tc_c.discovery_processes = {processes}
+"""
+
+# Tell us in the marker when the Zephyr driver parses a testcase.ini
+_conf_zephyr = """
+import tcfl.tc_zephyr_sanity
+
+_parser_init = tcfl.tc_zephyr_sanity.SanityConfigParser.__init__
+
+def _parser_init_marked(self, filename):
+    with open({marker!r}, "a") as f:
+        f.write("ini\\n")
+    _parser_init(self, filename)
+
+tcfl.tc_zephyr_sanity.SanityConfigParser.__init__ = _parser_init_marked
+"""
+
+class _test(tcfl.tc.tc_c):
+    """
+    Files that do not change are not scanned again by the testcase
+    drivers that did not recognize them, both when probed serially or
+    in parallel; testcases that can be described are created from the
+    cache without scanning their files and each file is scanned only
+    once.
+    """
+
+    def configure_00(self):
+        self.tree = os.path.join(self.tmpdir, "tree")
+        self.marker = os.path.join(self.tmpdir, "marker")
+        os.makedirs(self.tree)
+        # these are found by the python driver (test_*.py) but they
+        # have no testcases; when imported, they tell us in the marker
+        for i in range(70):
+            with open(os.path.join(self.tree, f"test_dummy_{i:02d}.py"),
+                      "w") as f:
+                f.write(f"with open('{self.marker}', 'a') as f:\n"
+                        f"    f.write('{i:02d}\\n')\n")
+        for i in range(3):
+            with open(os.path.join(self.tree, f"{i:02d}.tcdesc"), "w") as f:
+                f.write("\n")
+        with open(os.path.join(self.tree, "test_real.py"), "w") as f:
+            f.write(f"with open('{self.marker}', 'a') as f:\n"
+                    f"    f.write('real\\n')\n")
+            f.write("""\
+import tcfl.tc
+class _test(tcfl.tc.tc_c):
+    def eval(self):
+        self.report_pass("REAL RAN", level = 0)
+""")
+
+    def _run_cmdline(self, home):
+        tcf_path = os.path.join(self.kws['srcdir_abs'], os.path.pardir, "tcf")
+        # the discovery cache is in $HOME/.cache/tcf
+        self.run_local(f"HOME={home} {tcf_path} run {self.tree}",
+                       expect = re.compile(
+                           "(?s)^(?=.*REAL RAN)(?=.*DESC RAN)"))
+        if not os.path.exists(self.marker):
+            return []
+        with open(self.marker) as f:
+            imported = f.read().split()
+        os.unlink(self.marker)
+        return imported
+
+    def _check(self, processes):
+        home = os.path.join(self.tmpdir, f"home-{processes}")
+        os.makedirs(os.path.join(home, ".tcf"))
+        with open(os.path.join(home, ".tcf", "conf_discovery.py"), "w") as f:
+            f.write(_conf_driver.format(marker = self.marker,
+                                        processes = processes))
+
+        # the Python testcase has to be imported to run it, but only
+        # once
+        imported = self._run_cmdline(home)
+        expected = sorted([ f"{i:02d}" for i in range(70) ]
+                          + [ "d00", "d01", "d02", "real" ])
+        if sorted(imported) != expected:
+            raise tcfl.tc.failed_e(
+                f"cold scan: expected {len(expected)} files scanned once,"
+                f" got {len(imported)}",
+                dict(imported = imported, expected = expected))
+
+        imported = self._run_cmdline(home)
+        if imported != [ "real" ]:
+            raise tcfl.tc.failed_e(
+                "warm scan: expected only the Python testcase imported",
+                dict(imported = imported))
+
+        with open(os.path.join(self.tree, "test_dummy_05.py"), "a") as f:
+            f.write("# modified\n")
+        with open(os.path.join(self.tree, "01.tcdesc"), "a") as f:
+            f.write("# modified\n")
+        imported = self._run_cmdline(home)
+        if sorted(imported) != [ "05", "d01", "real" ]:
+            raise tcfl.tc.failed_e(
+                "after modification: expected only 05 and d01 scanned",
+                dict(imported = imported))
+
+    def eval_00_serial(self):
+        self._check(1)
+
+    def eval_10_parallel(self):
+        self._check(4)
+
+    def eval_20_zephyr(self):
+        # the Zephyr sanity check driver describes its testcase.ini
+        # testcases, so they are not parsed again
+        tree = os.path.join(self.tmpdir, "tree-zephyr")
+        os.makedirs(os.path.join(tree, "kernel", "src"))
+        with open(os.path.join(tree, "kernel", "src", "main.c"), "w") as f:
+            f.write("void main(void) { }\n")
+        with open(os.path.join(tree, "kernel", "testcase.ini"), "w") as f:
+            f.write("""\
+[test]
+tags = core kernel
+hw_requires = fixture_a
+
+[test_other]
+extra_args = CONF_FILE=prj_other.conf
+""")
+        home = os.path.join(self.tmpdir, "home-zephyr")
+        os.makedirs(os.path.join(home, ".tcf"))
+        with open(os.path.join(home, ".tcf", "conf_discovery.py"), "w") as f:
+            f.write(_conf_zephyr.format(marker = self.marker))
+        tcf_path = os.path.join(self.kws['srcdir_abs'], os.path.pardir, "tcf")
+        for scan in [ "cold", "warm" ]:
+            # no targets for them, but they are found as they were
+            # defined
+            self.run_local(
+                f"HOME={home} {tcf_path} run -v {tree}",
+                expect = re.compile(
+                    r"(?s)^(?=.*testcase.ini#test @.*\( fixture_a \))"
+                    r"(?=.*testcase.ini#test_other @)"))
+            parsed = []
+            if os.path.exists(self.marker):
+                with open(self.marker) as f:
+                    parsed = f.read().split()
+                os.unlink(self.marker)
+            expected = [ "ini" ] if scan == "cold" else []
+            if parsed != expected:
+                raise tcfl.tc.failed_e(
+                    f"{scan} scan: expected testcase.ini parsed"
+                    f" {len(expected)} times, got {len(parsed)}")
@@ -0,0 +1,123 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable = missing-docstring
+"""
+Benchmark commonl.dict_to_flat(), flat_slist_to_dict() and
+flat_keys_to_dict() over inventory dumps from a server
+
+The inventories of the server's targets are replicated to simulate
+a large server; we time converting them from nested to flat and back
+and verify:
+
+- the projections return the same fields as filtering the full list
+  with commonl.field_needed()
+
+- converting flat to nested gives the same inventory
+"""
+import os
+import time
+
+import commonl
+import commonl.testing
+import tcfl
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(config_files = [
+    # strip to remove the compiled/optimized version -> get source
+    os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+])
+
+_projections = [ "interfaces.power.*.instrument", "interconnects.*", "id",
+                 "bsps.*.linux" ]
+
+
+def _empty_dicts_strip(d):
+    # flattening doesn't keep empty dictionaries unless they are
+    # added as values, so we can't expect them back
+    r = {}
+    for key, val in d.items():
+        if isinstance(val, dict):
+            val = _empty_dicts_strip(val)
+            if not val:
+                continue
+        r[key] = val
+    return r
+
+
+@tcfl.tc.target(ttbd.url_spec + " and t00")
+class _test(tcfl.tc.tc_c):
+
+    def eval_00(self, target):
+        server = tcfl.server_c.servers[target.rt['server']]
+        rts, _rts_flat, _inventory_keys = server.targets_get()
+        inventories = [
+            # the client adds keys with other types
+            { key: val for key, val in rt.items() if isinstance(key, str) }
+            for rt in rts.values()
+        ]
+        # a big server: many copies of them
+        inventories = inventories * (2000 // len(inventories))
+        inventory_server = {
+            f"target{n:04d}": inventory
+            for n, inventory in enumerate(inventories)
+        }
+        fields = len(commonl.dict_to_flat(inventory_server))
+
+        ts = {}
+        ts0 = time.time()
+        for inventory in inventories:
+            commonl.dict_to_flat(inventory, empty_dict = True)
+        ts['dict_to_flat() per target'] = time.time() - ts0
+
+        ts0 = time.time()
+        fl = commonl.dict_to_flat(inventory_server, add_dict = False)
+        ts['dict_to_flat() whole server'] = time.time() - ts0
+
+        ts0 = time.time()
+        for inventory in inventories:
+            commonl.dict_to_flat(inventory, _projections, sort = False,
+                                 add_dict = False)
+        ts['dict_to_flat() per target with projections'] = time.time() - ts0
+
+        ts0 = time.time()
+        d = commonl.flat_slist_to_dict(fl)
+        ts['flat_slist_to_dict() whole server'] = time.time() - ts0
+
+        ts0 = time.time()
+        d2 = commonl.flat_keys_to_dict(dict(fl))
+        ts['flat_keys_to_dict() whole server'] = time.time() - ts0
+
+        for name, value in ts.items():
+            self.report_data("Flat dictionary conversion",
+                             f"{len(inventories)} targets, {name} (s)", value)
+        self.report_info(
+            f"{len(inventories)} targets, {fields} fields: "
+            + ", ".join(f"{name} {value:.3f}s" for name, value in ts.items()),
+            level = 0)
+
+        inventory_expected = _empty_dicts_strip(inventory_server)
+        if d != inventory_expected:
+            raise tcfl.tc.failed_e("flat_slist_to_dict(): mismatch")
+        if d2 != inventory_expected:
+            raise tcfl.tc.failed_e("flat_keys_to_dict(): mismatch")
+
+        inventory = inventories[0]
+        keys_all = [
+            key for key, _ in commonl.dict_to_flat(inventory,
+                                                   add_dict = False)
+        ]
+        keys_expected = [
+            key for key in keys_all if commonl.field_needed(key, _projections)
+        ]
+        keys = [
+            key for key, _ in commonl.dict_to_flat(inventory, _projections,
+                                                   add_dict = False)
+        ]
+        if not keys or keys != keys_expected:
+            raise tcfl.tc.failed_e(
+                f"projections: expected {keys_expected}, got {keys}")
@@ -0,0 +1,144 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test how ttbl.power.daemon_c detects daemons are ready
+
+Start daemons that:
+
+- die right away: powering on fails without waiting for the timeout
+
+- die right away, but need no verification: powering on fails too
+
+- get ready by creating a file after a while: powering on finishes
+  right after the file is created, with no polling latency
+
+- get ready by notifying with the sd_notify() protocol
+
+and report how long it took to notice in each case.
+"""
+
+import os
+import sys
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.power
+
+_python = os.path.realpath(sys.executable)
+
+# pretend to be a daemon that gets ready after 0.5s
+_script_file = """
+import sys, time
+time.sleep(0.5)
+with open(sys.argv[1], "w") as f:
+    f.write(repr(time.time()))
+time.sleep(100)
+"""
+
+_script_notify = """
+import os, socket, sys, time
+time.sleep(0.5)
+with open(sys.argv[1], "w") as f:
+    f.write(repr(time.time()))
+address = os.environ["NOTIFY_SOCKET"].replace("@", "\\0", 1)
+s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+s.sendto(b"STATUS=almost\\nREADY=1", address)
+time.sleep(100)
+"""
+
+
+class _daemon_c(ttbl.power.daemon_c):
+
+    def __init__(self, cmdline, ready_filename = None, **kwargs):
+        ttbl.power.daemon_c.__init__(self, cmdline, **kwargs)
+        self.ready_filename = ready_filename
+
+    def verify(self, target, component, cmdline_expanded):
+        if self.ready_filename == None:
+            return True
+        return os.path.exists(os.path.join(target.state_dir,
+                                           self.ready_filename))
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        ttbl._who_daemon = "internal-test"
+        ttbl.test_target.state_path = self.tmpdir
+        ttbl.test_target.files_path = self.tmpdir
+        self.target = ttbl.test_target("t0")
+        # as ttbl.config.target_add() does
+        self.target.tags_update(dict(id = self.target.id,
+                                     path = self.target.state_dir))
+
+    def _ready_latency(self, name, impl):
+        target = self.target
+        ready_filename = os.path.join(target.state_dir, f"{name}.ready")
+        impl.on(target, name)
+        ts = time.time()
+        try:
+            with open(ready_filename) as f:
+                ts_ready = float(f.read())
+            if not impl.get(target, name):
+                raise tcfl.tc.failed_e(f"{name}: daemon not running")
+        finally:
+            impl.off(target, name)
+        latency = ts - ts_ready
+        self.report_data("Daemon readiness", f"{name}: latency (ms)",
+                         latency * 1000)
+        self.report_info(f"{name}: noticed ready after {latency * 1000:.1f}ms",
+                         level = 0)
+        return latency
+
+    def eval_00_early_death(self):
+        impl = _daemon_c([ "/bin/sh", "-c", "echo dying; exit 3" ],
+                         ready_filename = "never")
+        ts0 = time.time()
+        try:
+            impl.on(self.target, "dies")
+            raise tcfl.tc.failed_e("daemon that died was reported started")
+        except impl.power_on_e:
+            pass
+        ts = time.time() - ts0
+        self.report_data("Daemon readiness", "early death: detected (s)", ts)
+        self.report_info(f"early death noticed after {ts:.2f}s", level = 0)
+        if ts >= 1:
+            raise tcfl.tc.failed_e(
+                f"took {ts:.2f}s to notice the daemon died")
+
+    def eval_05_early_death_unverified(self):
+        # nothing to verify, so it looks started as soon as it runs;
+        # but it dies a few ms later
+        impl = _daemon_c([ "/bin/sh", "-c", "sleep 0.01; exit 3" ])
+        try:
+            impl.on(self.target, "dies-unverified")
+            raise tcfl.tc.failed_e("daemon that died was reported started")
+        except impl.power_on_e:
+            pass
+
+    def eval_10_file(self):
+        impl = _daemon_c(
+            [ _python, "-c", _script_file,
+              "%(path)s/file.ready" ],
+            ready_filename = "file.ready")
+        latency = self._ready_latency("file", impl)
+        if latency > 0.1:
+            raise tcfl.tc.failed_e(
+                f"took {latency:.2f}s to notice the file being created")
+
+    def eval_20_notify(self):
+        impl = _daemon_c(
+            [ _python, "-c", _script_notify,
+              "%(path)s/notify.ready" ],
+            notify = True)
+        latency = self._ready_latency("notify", impl)
+        if latency < 0:
+            raise tcfl.tc.failed_e("reported ready before it notified")
+        if latency > 0.1:
+            raise tcfl.tc.failed_e(
+                f"took {latency:.2f}s to notice the notification")
@@ -0,0 +1,99 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test and benchmark projection reads of the symlink database
+(commonl.fsdb_symlink_c.get_as_slist()) using its key index
+
+- projections return the same as filtering all the keys with
+  commonl.field_needed()
+
+- keys added or removed are seen right away
+
+- time narrow projections (literal prefixes) vs those that need to
+  look at all the keys
+"""
+
+import os
+import time
+
+import commonl
+import tcfl.tc
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        dirname = os.path.join(self.tmpdir, "db")
+        commonl.makedirs_p(dirname)
+        self.fsdb = commonl.fsdb_symlink_c(dirname)
+        for component in range(200):
+            for field in [ "state", "instrument", "name :/%" ]:
+                self.fsdb.set(
+                    f"interfaces.power.c{component:03d}.{field}",
+                    component)
+        self.fsdb.set("owner", "someone")
+        self.fsdb.set("instrumentation.1.name", "something")
+
+    def _get_as_slist_expected(self, *patterns):
+        return sorted(
+            ( key, self.fsdb.get(key) ) for key in self.fsdb.keys()
+            if commonl.field_needed(key, patterns)
+        )
+
+    def eval_00_projections(self):
+        for patterns in [
+                (),
+                ( "owner", ),
+                ( "interfaces.power.c010", ),
+                ( "interfaces.power.c01*", "owner" ),
+                ( "interfaces.power.c1?0.state", ),
+                ( "*.name :/%", ),
+                ( "interfaces.power.c00[0-3].state", "instrumentation" ),
+                ( "nonexistent", ),
+        ]:
+            expected = self._get_as_slist_expected(*patterns)
+            r = self.fsdb.get_as_slist(*patterns)
+            if r != expected:
+                raise tcfl.tc.failed_e(
+                    f"{patterns}: expected {expected}, got {r}")
+            if self.fsdb.get_as_dict(*patterns) != dict(expected):
+                raise tcfl.tc.failed_e(f"{patterns}: get_as_dict() mismatch")
+
+    def eval_10_modifications(self):
+        # right after reading, so the index is considered fresh
+        for _ in range(3):
+            self.fsdb.get_as_slist("owner")
+            self.fsdb.set("owner.new", "value")
+            if ( "owner.new", "value" ) not in self.fsdb.get_as_slist("owner"):
+                raise tcfl.tc.failed_e("new key not seen")
+            self.fsdb.set("owner.new", None)
+            if ( "owner.new", "value" ) in self.fsdb.get_as_slist("owner"):
+                raise tcfl.tc.failed_e("removed key still seen")
+            time.sleep(self.fsdb.index_mtime_margin)
+
+    def eval_20_benchmark(self):
+        count = 200
+        time.sleep(self.fsdb.index_mtime_margin)
+        ts = {}
+        for name, patterns in [
+                ( "one key", ( "interfaces.power.c010.state", ) ),
+                ( "literal prefix", ( "interfaces.power.c01*", ) ),
+                ( "leading wildcard", ( "*.state", ) ),
+        ]:
+            ts0 = time.time()
+            for _ in range(count):
+                self.fsdb.get_as_slist(*patterns)
+            ts[name] = (time.time() - ts0) / count
+            self.report_data("fsdb projections",
+                             f"602 keys, {name} (ms)", ts[name] * 1000)
+        self.report_info(
+            "602 keys: " + ", ".join(f"{name} {value * 1000:.2f}ms"
+                                     for name, value in ts.items()),
+            level = 0)
+        if ts["one key"] > ts["leading wildcard"]:
+            raise tcfl.tc.failed_e(
+                "reading one key is slower than looking at all")
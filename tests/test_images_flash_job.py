@@ -0,0 +1,130 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2026 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+import os
+import re
+import threading
+import time
+
+import commonl.testing
+import tcfl.tc
+
+srcdir = os.path.dirname(__file__)
+ttbd = commonl.testing.test_ttbd(
+    config_files = [
+        # strip to remove the compiled/optimized version -> get source
+        os.path.join(srcdir, "conf_%s" % os.path.basename(__file__.rstrip('cd')))
+    ])
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class flash_job(tcfl.tc.tc_c):
+    """
+    Flash as a background job and poll the server for its progress
+    """
+    @staticmethod
+    def eval(target):
+        r = target.ttbd_iface_call("images", "flash", job = True,
+                                   images = { "image0": "/dev/null" })
+        job_id = r['job_id']
+        target.report_info(f"started flash job {job_id}")
+        r = target.ttbd_iface_call("images", "flash_job", method = "GET",
+                                   job_id = job_id)
+        if r['state'] in ( "completed", "failed" ):
+            raise tcfl.tc.failed_e(
+                "flash job reported finished right after being started",
+                dict(job = r))
+        if r['eta'] == None or r['eta'] > 10:
+            raise tcfl.tc.failed_e(
+                f"flash job ETA expected to be <= 10s, got {r['eta']}",
+                dict(job = r))
+        # while the job runs, nothing else can be flashed
+        for job in [ False, True ]:
+            try:
+                target.ttbd_iface_call("images", "flash", job = job,
+                                       images = { "image_fast": "/dev/null" })
+                raise tcfl.tc.failed_e(
+                    f"flashing (job {job}) not refused while flash job"
+                    f" {job_id} runs")
+            except tcfl.tc.error_e as e:
+                if "still running" not in str(e):
+                    raise
+        ttbd.errors_ignore.append(re.compile("still running"))
+        # might mask others, but the per line search has no context
+        ttbd.errors_ignore.append("raise RuntimeError(")
+        # long poll until done
+        r = target.ttbd_iface_call("images", "flash_job", method = "GET",
+                                   job_id = job_id, wait = 15, timeout = 30)
+        if r['state'] != "completed" or r['progress'] != 100:
+            raise tcfl.tc.failed_e(
+                f"flash job expected to complete, got {r['state']}",
+                dict(job = r))
+        target.report_pass(f"flash job completed in {r['elapsed']:.1f}s")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
+
+
+@tcfl.tc.target(ttbd.url_spec + " and t0")
+class flash_completion_not_polled(tcfl.tc.tc_c):
+    """
+    A flasher that completes right away is noticed right away and
+    not after its check period
+    """
+    @staticmethod
+    def eval(target):
+        # flash as a job so we can use how long the server says it
+        # took, free of HTTP and client scheduling delays
+        r = target.ttbd_iface_call("images", "flash", job = True,
+                                   images = { "image_fast": "/dev/null" })
+        r = target.ttbd_iface_call("images", "flash_job", method = "GET",
+                                   job_id = r['job_id'], wait = 15,
+                                   timeout = 30)
+        if r['state'] != "completed":
+            raise tcfl.tc.failed_e(
+                f"image_fast flash job expected to complete, got {r['state']}",
+                dict(job = r))
+        # the flasher takes 1s; polled, it would be >= 8s
+        if r['elapsed'] > 6:
+            raise tcfl.tc.failed_e(
+                f"image_fast flashing took {r['elapsed']:.1f}s, expected"
+                " <6s (check_period is 8s); was it polled?", dict(job = r))
+        target.report_pass(f"image_fast flashing took {r['elapsed']:.1f}s")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
+
+
+@tcfl.tc.target(ttbd.url_spec + " and t0", name = "t0")
+@tcfl.tc.target(ttbd.url_spec + " and t1", name = "t1")
+class flash_resource_serialized(tcfl.tc.tc_c):
+    """
+    Two targets flashing images that use the same resource, limited
+    to one concurrent flash, are serialized
+    """
+    def eval(self, t0, t1):
+        ts0 = time.time()
+        threads = [
+            threading.Thread(
+                target = target.ttbd_iface_call,
+                args = ( "images", "flash" ),
+                kwargs = dict(images = { "image_shared": "/dev/null" }))
+            for target in [ t0, t1 ]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        delta = time.time() - ts0
+        # each takes ~5s; if serialized, ~10s
+        if delta < 9:
+            raise tcfl.tc.failed_e(
+                f"flashing in two targets sharing a resource took"
+                f" {delta:.1f}s, expected >= 9s; not serialized?")
+        self.report_pass(f"flashing serialized, took {delta:.1f}s")
+
+    def teardown_90_scb(self):
+        ttbd.check_log_for_issues(self)
@@ -0,0 +1,250 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test IPMI power control reusing BMC sessions (ttbl.ipmi.session_c)
+
+A fake *ipmitool* simulates BMCs (which take a while to authenticate
+each new session) and logs each session and query:
+
+- sweep the power state of a rack of targets sharing a few BMCs
+  starting *ipmitool* for each operation (as it was done before) and
+  reusing a session per BMC; report how long each sweep takes and
+  how many sessions and queries the BMCs get
+
+- power on and off reflect right away in the power state
+
+- sessions the BMC drops are reopened transparently
+
+- failures are reported (or ignored when lenient)
+
+- idle sessions are closed
+"""
+
+import os
+import sys
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.ipmi
+import ttbl.power
+
+# simulates ipmitool against a BMC whose state is kept in files in
+# the same directory as the script
+_fake_ipmitool = """
+import os, sys, time
+
+statedir = os.path.dirname(os.path.abspath(sys.argv[0]))
+args = sys.argv[1:]
+while args and args[0].startswith("-"):
+    option = args.pop(0)
+    if option == "-H":
+        host = args.pop(0)
+    elif option in ( "-N", "-R", "-U", "-I" ):
+        args.pop(0)
+
+def log(what):
+    with open(os.path.join(statedir, host + ".log"), "a") as f:
+        f.write(what + "\\n")
+
+def state_get(name, default):
+    try:
+        with open(os.path.join(statedir, host + "." + name)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return default
+
+if host == "dead":
+    time.sleep(0.05)
+    sys.stdout.write("Error: Unable to establish IPMI v2 / RMCP+ session\\n")
+    sys.exit(1)
+# authenticating a session takes a while
+time.sleep(0.05)
+ts_session = time.time()
+log("session")
+
+def run(command):
+    # returns False on error
+    if command[:1] == [ "echo" ]:	# local, doesn't talk to the BMC
+        sys.stdout.write(" ".join(command[1:]) + "\\n")
+        return True
+    if float(state_get("expire", "0")) > ts_session:
+        sys.stdout.write("Unable to send command: Invalid session\\n")
+        return False
+    if command == [ "chassis", "power", "status" ]:
+        log("status")
+        sys.stdout.write("Chassis Power is %s\\n" % state_get("power", "off"))
+    elif command[:2] == [ "chassis", "power" ]:
+        with open(os.path.join(statedir, host + ".power"), "w") as f:
+            f.write(command[2])
+        sys.stdout.write("Chassis Power Control: %s\\n"
+                         % ("Up/On" if command[2] == "on" else "Down/Off"))
+    elif command[:4] == [ "chassis", "bootparam", "set", "bootflag" ]:
+        sys.stdout.write("Set Boot Device to %s\\n" % command[4])
+    else:
+        sys.stdout.write("Invalid command: %s\\n" % " ".join(command))
+        return False
+    return True
+
+if args != [ "shell" ]:
+    sys.exit(0 if run(args) else 1)
+while True:
+    # like readline does, echo what is typed
+    sys.stdout.write("ipmitool> ")
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        break
+    sys.stdout.write(line)
+    if line.strip() in ( "exit", "quit" ):
+        break
+    run(line.split())
+    sys.stdout.flush()
+"""
+
+_bmcs = 3
+_targets_per_bmc = 4
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        ttbl._who_daemon = "internal-test"
+        ttbl.test_target.state_path = self.tmpdir
+        ttbl.test_target.files_path = self.tmpdir
+        self.ipmitool = os.path.join(self.tmpdir, "ipmitool")
+        with open(self.ipmitool, "w") as f:
+            f.write("#! " + sys.executable + "\n" + _fake_ipmitool)
+        os.chmod(self.ipmitool, 0o755)
+
+    def _impl(self, bmc, **kwargs):
+        kwargs.setdefault("session_reuse", True)
+        impl = ttbl.ipmi.pci("admin:secret@" + bmc, **kwargs)
+        impl.cmdline[0] = self.ipmitool
+        # speed up checking for stable power states, still longer
+        # than the time a status is reused
+        impl.wait = 2 * ttbl.ipmi.session_status_max_age
+        return impl
+
+    def _log_count(self, bmc, what):
+        try:
+            with open(os.path.join(self.tmpdir, bmc + ".log")) as f:
+                return f.read().split().count(what)
+        except FileNotFoundError:
+            return 0
+
+    def eval_00_sweep(self):
+        sweeps = 3
+        for name, session_reuse in [ ( "ipmitool per operation", False ),
+                                     ( "session per BMC", True ) ]:
+            targets = []
+            for bmc in range(_bmcs):
+                for count in range(_targets_per_bmc):
+                    target = ttbl.test_target(
+                        f"{'reuse' if session_reuse else 'fork'}-{bmc}-{count}")
+                    target.interface_add("power", ttbl.power.interface(
+                        ipmi = self._impl(
+                            f"{name.replace(' ', '_')}-bmc{bmc}",
+                            session_reuse = session_reuse)))
+                    targets.append(target)
+            ts = 0
+            for _ in range(sweeps):
+                # each sweep gets fresh power states
+                time.sleep(ttbl.ipmi.session_status_max_age)
+                ts0 = time.time()
+                for target in targets:
+                    if target.power.impls['ipmi'].get(target, "ipmi") != False:
+                        raise tcfl.tc.failed_e(
+                            f"{name}: {target.id}: power state not off")
+                ts += time.time() - ts0
+            ts /= sweeps
+            sessions = 0
+            queries = 0
+            for bmc in range(_bmcs):
+                sessions += self._log_count(
+                    f"{name.replace(' ', '_')}-bmc{bmc}", "session")
+                queries += self._log_count(
+                    f"{name.replace(' ', '_')}-bmc{bmc}", "status")
+            self.report_data("IPMI power state sweep", f"{name} (s)", ts)
+            self.report_info(
+                f"{name}: {len(targets)} targets on {_bmcs} BMCs: {ts:.2f}s"
+                f" per sweep; {sessions} sessions, {queries} queries for"
+                f" {sweeps} sweeps", level = 0)
+            if session_reuse:
+                if sessions != _bmcs:
+                    raise tcfl.tc.failed_e(
+                        f"expected {_bmcs} sessions, got {sessions}")
+                if queries != _bmcs * sweeps:
+                    raise tcfl.tc.failed_e(
+                        f"status queries not shared: {queries} queries")
+
+    def eval_10_on_off(self):
+        target = ttbl.test_target("on_off")
+        target.interface_add("power", ttbl.power.interface(
+            ipmi = self._impl("on_off"),
+            pos = ttbl.ipmi.pos_mode_c("admin:secret@on_off",
+                                       session_reuse = True)))
+        target.power.impls['pos'].cmdline[0] = self.ipmitool
+        for state in [ True, False, True ]:
+            impls = list(target.power.impls.items())
+            if state:
+                target.power._on(target, impls, "")
+            else:
+                target.power._off(target, impls, "")
+            if target.power.impls['ipmi'].get(target, "ipmi") != state:
+                raise tcfl.tc.failed_e(f"power state not {state}")
+
+    def eval_20_expired(self):
+        target = ttbl.test_target("expired")
+        impl = self._impl("expired")
+        impl.get(target, "ipmi")
+        # the BMC times out the session; we notice, open a new one and
+        # retry
+        with open(os.path.join(self.tmpdir, "expired.expire"), "w") as f:
+            f.write(repr(time.time()))
+        time.sleep(ttbl.ipmi.session_status_max_age)
+        impl.on(target, "ipmi")
+        if impl.get(target, "ipmi") != True:
+            raise tcfl.tc.failed_e("power state not on after new session")
+        sessions = self._log_count("expired", "session")
+        if sessions != 2:
+            raise tcfl.tc.failed_e(f"expected 2 sessions, got {sessions}")
+
+    def eval_30_error(self):
+        target = ttbl.test_target("dead")
+        impl = self._impl("dead")
+        try:
+            impl.on(target, "ipmi")
+            raise tcfl.tc.failed_e("failure to reach the BMC not reported")
+        except impl.error_e as e:
+            if "Unable to establish" not in str(e):
+                raise
+        impl = self._impl("dead", lenient = True)
+        impl.on(target, "ipmi")
+
+    def eval_40_idle(self):
+        target = ttbl.test_target("idle")
+        impl = self._impl("idle")
+        session_idle_max = ttbl.ipmi.session_idle_max
+        try:
+            ttbl.ipmi.session_idle_max = 0.5
+            impl.on(target, "ipmi")
+            session = ttbl.ipmi.session_get(impl.cmdline, impl.env,
+                                            impl.session_timeout)
+            if session.p == None:
+                raise tcfl.tc.failed_e("session not open after a command")
+            time.sleep(2 * ttbl.ipmi.session_idle_max)
+            if session.p != None:
+                raise tcfl.tc.failed_e("idle session not closed")
+            # and it is reopened when needed
+            if impl.get(target, "ipmi") != True:
+                raise tcfl.tc.failed_e("power state not on")
+            if session.sessions != 2:
+                raise tcfl.tc.failed_e(
+                    f"expected 2 sessions, got {session.sessions}")
+        finally:
+            ttbl.ipmi.session_idle_max = session_idle_max
@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Test mongo-update-sheet.py summarizing a run from the run counters
+:mod:`tcfl.report_mongodb` keeps
+
+We build the counters with :func:`tcfl.report_mongodb.counters_inc`
+for a set of testcase documents, as the driver does, and verify the
+summary produced from them by *_summary_from_counters()*, including
+runs with testcases that reported no data.
+
+Skipped if the script's dependencies (*pymongo*, Google API client)
+are not installed.
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+
+import tcfl.report_mongodb
+import tcfl.tc
+
+_mongo_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "mongo")
+
+_runid = "ci-RUN1"
+
+_target1 = { 'server': "https://server1:5000", 'id': "qemu-01",
+             'type': "qemu-x86" }
+_target2 = { 'server': "https://server2:5000", 'id': "nuc.01",
+             'type': "nuc" }
+
+# testcase documents, as tcfl.report_mongodb inserts them
+_docs = [
+    dict(runid = _runid, hashid = "h1", tc_name = "tc_a", result = "PASS",
+         components = [ "kernel" ], target_types = "qemu-x86",
+         target_servers = "server1", targets = { "target": _target1 },
+         data = { "kpi": { "boot time": 3 } }),
+    dict(runid = _runid, hashid = "h2", tc_name = "tc_b", result = "FAIL",
+         components = [ "kernel", "net" ], target_types = "nuc:qemu-x86",
+         target_servers = "server1,server2",
+         targets = { "target": _target2, "target1": _target1 },
+         data = {}),
+    dict(runid = _runid, hashid = "h3", tc_name = "tc.c", result = "ERRR",
+         components = [ "net" ], target_types = "nuc",
+         target_servers = "server2", targets = { "target": _target2 }),
+    dict(runid = _runid, hashid = "h4", tc_name = "tc_d", result = "BLCK",
+         target_types = "nuc", target_servers = "server2",
+         targets = { "target": _target2 }),
+    # another run
+    dict(runid = "ci-RUN2", hashid = "h5", tc_name = "tc_a", result = "PASS",
+         data = { "kpi": { "boot time": 5 } }),
+]
+
+
+def _match(doc, query):
+    # what the script's queries need of a MongoDB find() filter
+    for field, condition in query.items():
+        if not isinstance(condition, dict):
+            if doc.get(field, None) != condition:
+                return False
+            continue
+        for op, value in condition.items():
+            if op == "$exists" and (field in doc) != value:
+                return False
+            if op == "$ne" and field in doc and doc[field] == value:
+                return False
+    return True
+
+
+class _collection_c:
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection = None):
+        for doc in self.docs:
+            if not _match(doc, query):
+                continue
+            if projection:
+                doc = { field: value for field, value in doc.items()
+                        if field in projection }
+            yield doc
+
+
+def _counters_apply(counters, inc):
+    # $inc the dotted fields as MongoDB does
+    for key, value in inc.items():
+        d = counters
+        fields = key.split(".")
+        for field in fields[:-1]:
+            d = d.setdefault(field, {})
+        d[fields[-1]] = d.get(fields[-1], 0) + value
+
+
+def _counters_make(runid):
+    # the counters for each testcase document, as the driver keeps them
+    inc = {}
+    for doc in _docs:
+        if doc['runid'] == runid:
+            tcfl.report_mongodb.counters_inc(inc, doc, 1)
+    counters = { '_id': runid }
+    _counters_apply(counters, inc)
+    return counters
+
+
+class _test(tcfl.tc.tc_c):
+
+    def _script_load(self):
+        sys.path.insert(0, _mongo_dir)
+        try:
+            spec = importlib.util.spec_from_file_location(
+                "mongo_update_sheet",
+                os.path.join(_mongo_dir, "mongo-update-sheet.py"))
+            script = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(script)
+        except ImportError as e:
+            raise tcfl.tc.skip_e(f"can't import mongo-update-sheet.py: {e}")
+        finally:
+            sys.path.remove(_mongo_dir)
+        script.args = argparse.Namespace(collection_id = "tcs")
+        script.db = { "tcs": _collection_c(_docs) }
+        return script
+
+    def eval_00_summary(self):
+        script = self._script_load()
+        summary = script._summary_from_counters(
+            _runid, _counters_make(_runid))
+        for field, expected in [
+                ( 'total', 4 ), ( 'pass', 1 ), ( 'fail', 1 ),
+                ( 'errr', 1 ), ( 'blck', 1 ), ( 'total_ran', 4 ),
+                ( 'total_tcs', 4 ),
+                ( 'fail_tc_names', [ "tc_b" ] ),
+                ( 'errr_tc_names', [ "tc.c" ] ),
+                ( 'used_target_types', [ "qemu-x86", "nuc:qemu-x86", "nuc" ] ),
+                ( 'used_target_servers', [ "server1", "server2" ] ),
+                ( 'target_types', [
+                    { 'failed_target_type': "nuc", 'failed': 1 } ] ),
+                ( 'error_per_target_type', [
+                    { 'error_target_type': "nuc", 'error': 1 } ] ),
+                ( 'targets_failed', [
+                    { 'targets': { 'target': {
+                        'server': _target1['server'], 'id': "qemu-01" } },
+                      'failed': 1 },
+                    { 'targets': { 'target': {
+                        'server': _target2['server'], 'id': "nuc.01" } },
+                      'failed': 1 } ] ),
+                ( 'targets_blocked', [
+                    { 'targets': { 'target': {
+                        'server': _target2['server'], 'id': "nuc.01" } },
+                      'blocked': 1 } ] ),
+                # testcases with no data or empty data are not listed
+                ( 'data', [ { "kpi": { "boot time": 3 } } ] ),
+        ]:
+            if summary[field] != expected:
+                raise tcfl.tc.failed_e(
+                    f"{field}: expected {expected}, got {summary[field]}")
+        components = { component: ( stats['total'], stats['fail'] )
+                       for component, stats in summary['components'].items() }
+        if components != { "kernel": ( 2, 1 ), "net": ( 2, 1 ) }:
+            raise tcfl.tc.failed_e(f"wrong component stats {components}")
+
+    def eval_10_replaced(self):
+        # a testcase document replaced by the driver subtracts the
+        # counters of the old one; what is left at zero is ignored
+        script = self._script_load()
+        counters = _counters_make(_runid)
+        inc = {}
+        tcfl.report_mongodb.counters_inc(inc, _docs[1], -1)
+        tcfl.report_mongodb.counters_inc(
+            inc, dict(_docs[1], result = "PASS"), 1)
+        _counters_apply(counters, inc)
+        summary = script._summary_from_counters(_runid, counters)
+        if summary['fail'] != 0 or summary['pass'] != 2:
+            raise tcfl.tc.failed_e(
+                f"expected 2 passed, 0 failed; got {summary['pass']}"
+                f" passed, {summary['fail']} failed")
+        if summary['fail_tc_names'] or summary['targets_failed']:
+            raise tcfl.tc.failed_e(
+                "failures left after replacing the failed testcase: "
+                f"{summary['fail_tc_names']} {summary['targets_failed']}")
@@ -0,0 +1,240 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test the OpenOCD TCL client (ttbl.openocd_tcl) against a fake TCL
+server
+
+- responses are framed on the terminator, no matter how they are
+  split or coalesced by the transport
+- pipelined commands get their responses in order
+- connections dropped by the server are reopened, timed out
+  connections are not reused
+- report how long it takes to run a reset/halt/flash/resume like
+  sequence connecting for each operation with pexpect (as it was done
+  before), with a persistent connection and pipelining
+"""
+
+import socket
+import socketserver
+import threading
+import time
+
+import pexpect.fdpexpect
+
+import tcfl.tc
+import ttbl.openocd_tcl
+
+# command -> response
+_responses = {
+    'capture "targets"':
+        "    TargetName         Type       Endian TapName            State\n"
+        "--  ------------------ ---------- ------ ------------------ ------------\n"
+        " 0* quark_se.arc-em    arc32      little quark_se.arc-em    halted\n",
+    'capture "halt"': "target halted due to debug-request\n",
+    'capture "reset halt"': "target state: halted\n",
+    'capture "resume"': "",
+    'capture "load_image /tmp/file 0x0"': "downloaded 4096 bytes in 0.01s\n",
+}
+
+
+class _handler_c(socketserver.BaseRequestHandler):
+
+    def _respond(self, command):
+        # returns False to close the connection
+        if command == "close":		# close without answering
+            return False
+        if command == "silent":		# never answer
+            return True
+        if command == "split":		# answer in little pieces
+            for piece in [ b"spl", b"it respo", b"nse", b"\x1a" ]:
+                self.request.sendall(piece)
+                time.sleep(0.01)
+            return True
+        self.request.sendall(
+            _responses.get(command, "unknown command").encode("utf-8")
+            + b"\x1a")
+        if command == "bye":		# answer, then close
+            return False
+        return True
+
+    def handle(self):
+        self.server.connections += 1
+        # as OpenOCD does
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b""
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            buffer += data
+            while b"\x1a" in buffer:
+                command, buffer = buffer.split(b"\x1a", 1)
+                if not self._respond(command.decode("utf-8")):
+                    return
+
+
+class _server_c(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ( "localhost", 0 ), _handler_c)
+        self.connections = 0
+
+
+# a flashing-like sequence: reset halt, select target, halt, flash,
+# resume
+_sequence = [
+    'capture "reset halt"',
+    'capture "targets"',
+    'capture "halt"',
+    'capture "load_image /tmp/file 0x0"',
+    'capture "resume"',
+]
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        self.server = _server_c()
+        self.port = self.server.server_address[1]
+        threading.Thread(target = self.server.serve_forever,
+                         daemon = True).start()
+
+    def teardown_90(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _client(self, **kwargs):
+        return ttbl.openocd_tcl.tcl_client_c(self.port, **kwargs)
+
+    def _sequence_pexpect(self):
+        # as ttbl.openocd.pc used to do it: a new connection and
+        # pexpect object for each operation
+        for command in _sequence:
+            sk = socket.create_connection(( "localhost", self.port ))
+            p = pexpect.fdpexpect.fdspawn(sk.fileno(), timeout = 5)
+            p.send((command + "\x1a").encode("utf-8"))
+            p.expect("\x1a")
+            sk.shutdown(socket.SHUT_RDWR)
+            sk.close()
+
+    def eval_00_benchmark(self):
+        count = 50
+        client = self._client()
+        pipelined = self._client()
+        timings = {}
+        for name, fn in [
+                ( "reconnect and pexpect", self._sequence_pexpect ),
+                ( "persistent",
+                  lambda: [ client.command(i) for i in _sequence ] ),
+                ( "persistent, pipelined",
+                  lambda: pipelined.commands(_sequence) ),
+        ]:
+            ts0 = time.time()
+            for _ in range(count):
+                fn()
+            timings[name] = ( time.time() - ts0 ) / count
+            self.report_data("OpenOCD TCL sequence", f"{name} (ms)",
+                             timings[name] * 1000)
+            self.report_info(f"{name}: {timings[name] * 1000:.2f}ms per"
+                             f" {len(_sequence)} command sequence", level = 0)
+        if client.connections != 1 or pipelined.connections != 1:
+            raise tcfl.tc.failed_e(
+                f"persistent clients connected {client.connections} and"
+                f" {pipelined.connections} times, expected once")
+        if timings["persistent"] >= timings["reconnect and pexpect"]:
+            raise tcfl.tc.failed_e("persistent connection not faster")
+        client.close()
+        pipelined.close()
+
+    def eval_10_framing(self):
+        client = self._client()
+        r = client.command("split")
+        if r != "split response":
+            raise tcfl.tc.failed_e(f"split response: got {r!r}")
+        # responses to pipelined commands come back to back
+        r = client.commands([ 'capture "halt"', "split", 'capture "resume"',
+                              'capture "targets"' ])
+        expected = [ _responses['capture "halt"'], "split response", "",
+                     _responses['capture "targets"'] ]
+        if r != expected:
+            raise tcfl.tc.failed_e(f"pipelined responses: got {r!r}")
+        client.close()
+
+    def eval_20_reconnect(self):
+        client = self._client()
+        client.command('capture "halt"')
+        # server closes after answering; next command just reconnects
+        client.command("bye")
+        time.sleep(0.1)
+        r = client.command('capture "halt"')
+        if r != _responses['capture "halt"']:
+            raise tcfl.tc.failed_e(f"after reconnecting: got {r!r}")
+        # server closes without answering: error, then reconnect
+        try:
+            client.command("close")
+            raise tcfl.tc.failed_e("closed connection not reported")
+        except client.eof_e:
+            pass
+        r = client.command('capture "resume"')
+        if r != "":
+            raise tcfl.tc.failed_e(f"after reconnecting: got {r!r}")
+        if client.connections != 3:
+            raise tcfl.tc.failed_e(
+                f"expected 3 connections, got {client.connections}")
+        client.close()
+
+    def eval_30_timeout(self):
+        client = self._client(timeout = 0.2)
+        try:
+            client.command("silent")
+            raise tcfl.tc.failed_e("timeout not reported")
+        except client.timeout_e:
+            pass
+        r = client.command('capture "halt"')
+        if r != _responses['capture "halt"']:
+            raise tcfl.tc.failed_e(f"after timeout: got {r!r}")
+        if client.connections != 2:
+            raise tcfl.tc.failed_e("timed out connection was reused")
+        client.close()
+        # nobody listening
+        client = ttbl.openocd_tcl.tcl_client_c(1)
+        try:
+            client.command('capture "halt"')
+            raise tcfl.tc.failed_e("connection refused not reported")
+        except client.eof_e:
+            pass
+
+    def eval_40_expect_match(self):
+        response = _responses['capture "targets"']
+        for expect, expected in [
+                ( "halted", 0 ),
+                ( "running", None ),
+                ( [ "running", r" 0\* .*(halted|reset)" ], 1 ),
+                # the earliest match wins, not the first in the list
+                ( [ "halted", "TargetName" ], 1 ),
+                ( [ "could not halt target", "" ], 1 ),
+        ]:
+            r = ttbl.openocd_tcl.expect_match(response, expect)
+            if r != expected:
+                raise tcfl.tc.failed_e(
+                    f"expect {expect}: got {r}, expected {expected}")
+
+    def eval_50_client_get(self):
+        client = ttbl.openocd_tcl.client_get(self.port, pid = 10)
+        if ttbl.openocd_tcl.client_get(self.port, pid = 10) is not client:
+            raise tcfl.tc.failed_e("client not shared")
+        client.command('capture "halt"')
+        # OpenOCD restarted
+        client2 = ttbl.openocd_tcl.client_get(self.port, pid = 11)
+        if client2 is client:
+            raise tcfl.tc.failed_e("client shared with a restarted OpenOCD")
+        if client.sk != None:
+            raise tcfl.tc.failed_e("stale client not closed")
+        client2.close()
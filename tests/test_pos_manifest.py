@@ -0,0 +1,169 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test the incremental POS image deployment with file manifests
+(tcfl.pos.extension._rootfs_rsync_manifest)
+
+The commands the POS client would run in the target's Provisioning
+OS are run locally, with */tmp* and */mnt* moved to a temporary
+directory and a fake *rsync* that just logs what it is asked to
+transfer:
+
+- without a deployed manifest, a full rsync is requested
+
+- only the files whose manifest entry changed or are new are force
+  transferred, excluding the same paths as the full rsync
+
+- when nothing changed, only the quick check rsync is done
+"""
+
+import os
+import re
+import subprocess
+
+import tcfl.pos
+import tcfl.tc
+
+_rsync_fake = """\
+#! /bin/bash
+# log the arguments, the file list and fetch the manifest
+echo "$@" >> "$RSYNC_LOG"
+for arg in "$@"; do
+    case "$arg" in
+        --files-from=*)
+            sed 's/^/FILE /' "${arg#--files-from=}" >> "$RSYNC_LOG";;
+        --ignore-missing-args)
+            src="${@: -2:1}"
+            [ -e "$src" ] && cp "$src" "${@: -1}";;
+    esac
+done
+exit 0
+"""
+
+
+class _shell_fake_c:
+
+    def __init__(self, topdir, log):
+        self.topdir = topdir
+        self.env = dict(os.environ)
+        self.env['PATH'] = os.path.join(topdir, "bin") + ":" + self.env['PATH']
+        self.env['RSYNC_LOG'] = log
+
+    def run(self, cmd, output = False, timeout = None, trim = False):
+        # move /tmp and /mnt under our top level directory, then
+        # point to the image
+        cmd = re.sub(r"(?<=[ =<>])/(tmp|mnt)\b", self.topdir + r"/\1", cmd)
+        cmd = cmd.replace("IMAGE", os.path.join(self.topdir, "image"))
+        r = subprocess.run([ "bash", "-c", cmd ], env = self.env,
+                           stdout = subprocess.PIPE,
+                           stderr = subprocess.STDOUT,
+                           text = True, check = True, timeout = timeout)
+        return r.stdout
+
+
+class _target_fake_c:
+    fullid = "local/fake"
+
+    def __init__(self, topdir, log):
+        self.shell = _shell_fake_c(topdir, log)
+
+    def report_info(self, *args, **kwargs):
+        pass
+
+    def report_data(self, *args, **kwargs):
+        pass
+
+
+def _manifest_write(path, entries):
+    # NAME: ( SIZE, HASH ), as tcf-image-setup.sh would write them
+    with open(path, "w") as f:
+        for name in sorted(entries):
+            size, h = entries[name]
+            f.write(f"f {size} 1700000000 {h} {name}\n")
+
+
+class _test(tcfl.tc.tc_c):
+
+    def _deploy(self, name, manifest_old, manifest_new):
+        # returns ( SECONDS, RSYNC LOG LINES )
+        topdir = os.path.join(self.tmpdir, name)
+        for subdir in [ "bin", "tmp", "image",
+                        "mnt" + tcfl.pos.persistent_tcf_d ]:
+            os.makedirs(os.path.join(topdir, subdir))
+        rsync = os.path.join(topdir, "bin", "rsync")
+        with open(rsync, "w") as f:
+            f.write(_rsync_fake)
+        os.chmod(rsync, 0o755)
+        with open(os.path.join(topdir, "tmp", "deploy.ex"), "w") as f:
+            f.write(tcfl.pos.persistent_tcf_d + "\n")
+        if manifest_old != None:
+            _manifest_write(os.path.join(topdir, "mnt"
+                                         + tcfl.pos.persistent_tcf_d,
+                                         "tcf.manifest"), manifest_old)
+        _manifest_write(os.path.join(topdir, "image",
+                                     tcfl.pos.extension.manifest_name),
+                        manifest_new)
+        log = os.path.join(topdir, "rsync.log")
+        open(log, "w").close()
+
+        pos = tcfl.pos.extension.__new__(tcfl.pos.extension)
+        target = _target_fake_c(topdir, log)
+        seconds = pos._rootfs_rsync_manifest(
+            target, dict(image = "fake", rsync_image = "IMAGE"), 60)
+        with open(log) as f:
+            return seconds, f.read().splitlines()
+
+    _manifest = {
+        "etc/hostname": ( 5, "a" * 64 ),
+        "usr/bin/tool": ( 100, "b" * 64 ),
+        "usr/share/doc/file with spaces": ( 10, "c" * 64 ),
+        "var/old": ( 1, "d" * 64 ),
+    }
+
+    def eval_10_no_manifest(self):
+        seconds, log = self._deploy("no-manifest", None, self._manifest)
+        if seconds != None:
+            raise tcfl.tc.failed_e(
+                f"expected a full rsync to be requested; got {seconds}")
+
+    def eval_20_changed(self):
+        manifest_new = dict(self._manifest)
+        del manifest_new["var/old"]
+        # same size, different contents
+        manifest_new["usr/bin/tool"] = ( 100, "e" * 64 )
+        manifest_new["usr/share/doc/file with spaces"] = ( 11, "c" * 64 )
+        manifest_new["usr/bin/new"] = ( 3, "f" * 64 )
+        seconds, log = self._deploy("changed", self._manifest, manifest_new)
+        if seconds == None:
+            raise tcfl.tc.failed_e("full rsync requested with manifests")
+        files = sorted(line[5:] for line in log if line.startswith("FILE "))
+        expected = [ "usr/bin/new", "usr/bin/tool",
+                     "usr/share/doc/file with spaces" ]
+        if files != expected:
+            raise tcfl.tc.failed_e(
+                f"force transferred {files}, expected {expected}")
+        rsyncs = [ line for line in log if not line.startswith("FILE ") ]
+        # fetching the manifest, forced transfer, quick check
+        if len(rsyncs) != 3:
+            raise tcfl.tc.failed_e(f"expected three rsyncs, got {rsyncs}")
+        for rsync in rsyncs[1:]:
+            if "--exclude-from=" not in rsync:
+                raise tcfl.tc.failed_e(
+                    f"rsync not excluding the persistent paths: {rsync}")
+        if "-I" not in rsyncs[1].split() \
+           or "--delete" not in rsyncs[2].split():
+            raise tcfl.tc.failed_e(f"unexpected rsyncs: {rsyncs}")
+
+    def eval_30_unchanged(self):
+        seconds, log = self._deploy("unchanged", self._manifest,
+                                    self._manifest)
+        if seconds == None:
+            raise tcfl.tc.failed_e("full rsync requested with manifests")
+        if len(log) != 2 or "--delete" not in log[1].split():
+            raise tcfl.tc.failed_e(
+                f"expected only fetching the manifest and the quick"
+                f" check rsync, got {log}")
@@ -0,0 +1,228 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test and benchmark running deferred power actions in parallel
+(ttbl.power.execute_defer_list)
+
+Simulate a fleet of targets powered by a few PDUs which, as most
+embedded devices do, refuse requests when too many come at the same
+time. Power them all up at startup:
+
+- unbounded, one process per target, all at the same time (as it was
+  done before)
+
+- bounded, with a limit on how many power actions run at the same
+  time on each PDU
+
+and report how long it takes to power up the fleet, how many actions
+fail and how many are running at the same time on each PDU.
+
+*0* means no limit on actions per device, also when configured as
+*None* (as older configurations do).
+"""
+
+import fcntl
+import os
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.config
+import ttbl.power
+
+_pdus = 6
+_outlets = 24
+# how many requests a PDU serves at the same time; beyond that, it
+# refuses the connection
+_pdu_sessions_max = 4
+_delay = 0.1
+
+
+class _fake_pdu_c(ttbl.power.fake_c):
+    # an outlet in a fake PDU; keeps in a file the number of requests
+    # the PDU is serving and the maximum it ever did
+    upid_device_fields = ( "pdu", )
+
+    def __init__(self, pdu, statedir, **kwargs):
+        ttbl.power.fake_c.__init__(self, delay = _delay, **kwargs)
+        self.upid_set(f"Fake PDU {pdu}", pdu = pdu)
+        self.filename = os.path.join(statedir, f"pdu-{pdu}")
+
+    def _session(self, increment):
+        with open(self.filename, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            current, maximum, refused = \
+                [ int(i) for i in (f.read() or "0 0 0").split() ]
+            if increment > 0 and current >= _pdu_sessions_max:
+                refused += 1
+            else:
+                current += increment
+                maximum = max(maximum, current)
+            f.seek(0)
+            f.truncate()
+            f.write(f"{current} {maximum} {refused}")
+            return current <= _pdu_sessions_max
+
+    def on(self, target, component):
+        if not self._session(1):
+            raise RuntimeError("PDU refused connection")
+        try:
+            ttbl.power.fake_c.on(self, target, component)
+        finally:
+            self._session(-1)
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        ttbl._who_daemon = "internal-test"
+        ttbl.test_target.state_path = self.tmpdir
+        ttbl.test_target.files_path = self.tmpdir
+
+    def _fleet_run(self, name, max_workers, device_max):
+        statedir = os.path.join(self.tmpdir, name)
+        os.makedirs(statedir)
+        defer_list = []
+        targets = []
+        for outlet in range(_outlets):
+            for pdu in range(_pdus):
+                target = ttbl.test_target(f"{name}-pdu{pdu}-outlet{outlet}")
+                target.interface_add("power", ttbl.power.interface(
+                    outlet = _fake_pdu_c(pdu, statedir)))
+                ttbl.power.defer(target, True, defer_list)
+                targets.append(target)
+
+        ts0 = time.time()
+        ttbl.power.execute_defer_list(
+            defer_list, name, max_workers = max_workers,
+            device_max = device_max)
+        ts = time.time() - ts0
+
+        powered = 0
+        for target in targets:
+            if target.fsdb.get("interfaces.power.outlet.fake-state"):
+                powered += 1
+        sessions_max = 0
+        refused = 0
+        for pdu in range(_pdus):
+            with open(os.path.join(statedir, f"pdu-{pdu}")) as f:
+                _current, maximum, _refused = \
+                    [ int(i) for i in f.read().split() ]
+            sessions_max = max(sessions_max, maximum)
+            refused += _refused
+        self.report_data("Deferred power actions", f"{name}: seconds", ts)
+        self.report_data("Deferred power actions", f"{name}: failed",
+                         len(targets) - powered)
+        self.report_info(
+            f"{name}: {len(targets)} targets on {_pdus} PDUs in {ts:.2f}s;"
+            f" {powered} powered on, {refused} refused; up to"
+            f" {sessions_max} requests on a PDU at the same time", level = 0)
+        return len(targets), powered, sessions_max
+
+    def eval_00_unbounded(self):
+        # as it was done before, all at the same time
+        count, _powered, _sessions_max = self._fleet_run(
+            "unbounded", _pdus * _outlets, 0)
+        if count != _pdus * _outlets:
+            raise tcfl.tc.error_e("fleet not created")
+
+    def eval_10_bounded(self):
+        count, powered, sessions_max = self._fleet_run(
+            "bounded", ttbl.config.power_defer_max,
+            ttbl.config.power_defer_device_max)
+        if powered != count:
+            raise tcfl.tc.failed_e(
+                f"{count - powered} of {count} targets not powered on")
+        if sessions_max > ttbl.config.power_defer_device_max:
+            raise tcfl.tc.failed_e(
+                f"up to {sessions_max} power actions at the same time on a"
+                f" PDU, expected at most"
+                f" {ttbl.config.power_defer_device_max}")
+
+    def eval_20_order(self):
+        # the busiest devices go first, one slot each at a time
+        class _impl_c:
+            def __init__(self, device):
+                self.device = device
+            def device_key(self):
+                return self.device
+        class _target_c:
+            def __init__(self, *devices):
+                self.power = type("power", (), {})()
+                self.power.impls = {
+                    f"c{i}": _impl_c(device)
+                    for i, device in enumerate(devices)
+                }
+        defer_list = [ ( _target_c("a"), True, True ) ] * 2 \
+            + [ ( _target_c("b"), True, True ) ] * 4 \
+            + [ ( _target_c("a", "hub"), True, True ) ] \
+            + [ ( _target_c(), 3, True ) ]
+        scheduler = ttbl.power._defer_scheduler_c(defer_list, 1)
+        started = []
+        while True:
+            r = scheduler.next()
+            if r == None:
+                break
+            started.append(r[0])
+        if started != [ frozenset({ "b" }), frozenset({ "a" }), frozenset() ]:
+            raise tcfl.tc.failed_e(f"unexpected first batch {started}")
+        scheduler.done(frozenset({ "b" }))
+        r = scheduler.next()
+        if r[0] != frozenset({ "b" }):
+            raise tcfl.tc.failed_e(f"expected 'b' to be fed next, got {r}")
+        if len(scheduler) != 4:
+            raise tcfl.tc.failed_e(
+                f"expected 4 pending actions, got {len(scheduler)}")
+        # after a hard failure, what was not started is taken out
+        actions = scheduler.drain()
+        if len(actions) != 4 or len(scheduler) != 0 or scheduler.next() != None:
+            raise tcfl.tc.failed_e(
+                f"expected to drain 4 actions, got {len(actions)};"
+                f" {len(scheduler)} left")
+
+    def eval_30_no_limit(self):
+        class _impl_c:
+            def device_key(self):
+                return "pdu"
+        class _target_c:
+            def __init__(self):
+                self.power = type("power", (), {})()
+                self.power.impls = { "c0": _impl_c() }
+        defer_list = [ ( _target_c(), True, True ) ] * 3
+        scheduler = ttbl.power._defer_scheduler_c(defer_list, 0)
+        started = 0
+        while scheduler.next() != None:
+            started += 1
+        if started != 3:
+            raise tcfl.tc.failed_e(
+                f"expected 3 actions started on the same device with no"
+                f" limit, got {started}")
+
+        # older configurations use None for no limit
+        device_maxs = []
+        scheduler_c = ttbl.power._defer_scheduler_c
+        class _scheduler_c(scheduler_c):
+            def __init__(self, defer_list, device_max):
+                device_maxs.append(device_max)
+                scheduler_c.__init__(self, defer_list, device_max)
+        device_max = ttbl.config.power_defer_device_max
+        try:
+            ttbl.power._defer_scheduler_c = _scheduler_c
+            ttbl.config.power_defer_device_max = None
+            target = ttbl.test_target("no-limit")
+            target.interface_add("power", ttbl.power.interface(
+                outlet = ttbl.power.fake_c()))
+            defer_list = []
+            ttbl.power.defer(target, True, defer_list)
+            ttbl.power.execute_defer_list(defer_list, "no-limit")
+        finally:
+            ttbl.power._defer_scheduler_c = scheduler_c
+            ttbl.config.power_defer_device_max = device_max
+        if device_maxs != [ 0 ]:
+            raise tcfl.tc.failed_e(
+                f"configured None not taken as 0 (no limit): {device_maxs}")
@@ -0,0 +1,194 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test power rails whose components declare dependencies
+(ttbl.power.interface's *depends*)
+
+With a rail of fake components that take a while to power on and off:
+
+- components are powered on only after the ones they depend on are
+  on and powered off only after the ones that depend on them are off
+
+- components that fail asking for the whole rail to be retried and
+  those that recover by powering off and on again still do
+
+- report how long it takes to power cycle the rail when it is
+  sequential and when using the dependencies
+"""
+
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.power
+
+
+class _fake_c(ttbl.power.fake_c):
+    # fake component that records when it was powered on and off and
+    # that can fail a few times powering on; getting the state is
+    # instantaneous, so we time only powering on and off
+    def __init__(self, delay, fail = None, **kwargs):
+        ttbl.power.fake_c.__init__(self, delay = delay, **kwargs)
+        self.fail = fail
+
+    def on(self, target, component):
+        failures = target.fsdb.get(f"test.{component}.failures", 0)
+        if self.fail and failures > 0:
+            target.fsdb.set(f"test.{component}.failures", failures - 1)
+            raise self.fail
+        target.fsdb.set(f"test.{component}.on_start", time.time())
+        ttbl.power.fake_c.on(self, target, component)
+        target.fsdb.set(f"test.{component}.on_end", time.time())
+
+    def off(self, target, component):
+        target.fsdb.set(f"test.{component}.off_start", time.time())
+        ttbl.power.fake_c.off(self, target, component)
+        target.fsdb.set(f"test.{component}.off_end", time.time())
+
+    def get(self, target, component):
+        return target.fsdb.get(f"interfaces.power.{component}.fake-state") \
+            == True
+
+
+def _rail():
+    return [
+        ( "AC", _fake_c(0.4) ),
+        ( "USB hub", _fake_c(0.3) ),
+        ( "serial0", _fake_c(0.2) ),
+        ( "tunnel", _fake_c(0.2) ),
+        ( "daemon0", _fake_c(0.2) ),
+        ( "daemon1", _fake_c(0.2) ),
+    ]
+
+_depends = {
+    "USB hub": [],
+    "serial0": [ "USB hub" ],
+    "tunnel": [ "AC" ],
+    "daemon0": [],
+    "daemon1": [ "daemon0" ],
+}
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        ttbl._who_daemon = "internal-test"
+        ttbl.test_target.state_path = self.tmpdir
+        ttbl.test_target.files_path = self.tmpdir
+
+    @staticmethod
+    def _target_make(name, depends, rail):
+        target = ttbl.test_target(name)
+        target.interface_add("power", ttbl.power.interface(
+            *rail, depends = depends))
+        return target
+
+    @staticmethod
+    def _cycle(target):
+        impls = list(target.power.impls.items())
+        ts0 = time.time()
+        target.power._off(target, impls, " (test)")
+        ts_off = time.time()
+        target.power._on(target, impls, " (test)")
+        return ts_off - ts0, time.time() - ts_off
+
+    def eval_00_cycle(self):
+        timings = {}
+        for name, depends in [ ( "sequential", None ),
+                               ( "depends", _depends ) ]:
+            target = self._target_make(name, depends, _rail())
+            # first power on so power off has something to do
+            target.power._on(target, list(target.power.impls.items()), "")
+            off, on = self._cycle(target)
+            state, _data, _substate = target.power._get(target)
+            if state != True:
+                raise tcfl.tc.failed_e(f"{name}: rail not on after cycle")
+            timings[name] = off + on
+            self.report_data("Power rail cycle", f"{name} (s)", off + on)
+            self.report_info(f"{name}: power off {off:.2f}s, power on"
+                             f" {on:.2f}s", level = 0)
+        if timings["depends"] >= timings["sequential"]:
+            raise tcfl.tc.failed_e(
+                f"rail with dependencies took {timings['depends']:.2f}s to"
+                f" power cycle, sequential {timings['sequential']:.2f}s")
+
+    def eval_10_order(self):
+        target = self._target_make("order", _depends, _rail())
+        impls = list(target.power.impls.items())
+        target.power._on(target, impls, "")
+        target.power._off(target, impls, "")
+        fsdb = target.fsdb
+        for component, dependencies in _depends.items():
+            for dependency in dependencies:
+                if fsdb.get(f"test.{component}.on_start") \
+                   < fsdb.get(f"test.{dependency}.on_end"):
+                    raise tcfl.tc.failed_e(
+                        f"{component} powered on before {dependency} was on")
+                if fsdb.get(f"test.{dependency}.off_start") \
+                   < fsdb.get(f"test.{component}.off_end"):
+                    raise tcfl.tc.failed_e(
+                        f"{dependency} powered off before {component} was off")
+        # AC and USB hub depend on nothing, so they start together
+        if abs(fsdb.get("test.AC.on_start")
+               - fsdb.get("test.USB hub.on_start")) > 0.1:
+            raise tcfl.tc.failed_e("AC and USB hub not powered on together")
+
+    def eval_20_retry_all(self):
+        rail = _rail()
+        rail[2] = ( "serial0", _fake_c(0.2, fail = ttbl.power.impl_c.retry_all_e()) )
+        target = self._target_make("retry_all", _depends, rail)
+        target.fsdb.set("test.serial0.failures", 1)
+        impls = list(target.power.impls.items())
+        target.power._on(target, impls, "")
+        state, _data, _substate = target.power._get(target)
+        if state != True:
+            raise tcfl.tc.failed_e("rail not on after retrying")
+        if target.fsdb.get("test.AC.off_end") == None:
+            raise tcfl.tc.failed_e("rail not powered off to retry")
+
+        # if it keeps failing, we give up
+        target.fsdb.set("test.serial0.failures", 10)
+        target.power._off(target, impls, "")
+        try:
+            target.power._on(target, impls, "")
+            raise tcfl.tc.failed_e("rail powered on when it shouldn't")
+        except RuntimeError as e:
+            if "too many retries" not in str(e):
+                raise
+
+    def eval_30_recovery(self):
+        rail = _rail()
+        impl = _fake_c(0.2, fail = RuntimeError("fake failure"))
+        rail[3] = ( "tunnel", impl )
+        target = self._target_make("recovery", _depends, rail)
+        impls = list(target.power.impls.items())
+
+        # no recovery: fails
+        target.fsdb.set("test.tunnel.failures", 1)
+        try:
+            target.power._on(target, impls, "")
+            raise tcfl.tc.failed_e("rail powered on when it shouldn't")
+        except RuntimeError as e:
+            if "fake failure" not in str(e):
+                raise
+
+        # with recovery, it works
+        impl.power_on_recovery = True
+        target.fsdb.set("test.tunnel.failures", 1)
+        target.power._off(target, impls, "")
+        target.power._on(target, impls, "")
+        state, _data, _substate = target.power._get(target)
+        if state != True:
+            raise tcfl.tc.failed_e("rail not on after recovering")
+
+    def eval_40_loop(self):
+        try:
+            self._target_make("loop", { "AC": [ "tunnel" ] }, _rail())
+            raise tcfl.tc.failed_e("dependency loop not detected")
+        except AssertionError as e:
+            if "dependency loop" not in str(e):
+                raise
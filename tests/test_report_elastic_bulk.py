@@ -0,0 +1,253 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Test and benchmark the Elastic Search report driver
+(tcfl.report_elastic.driver) shipping against a local stub of the
+Elastic Search bulk API
+
+- measure how many reports per second testcases can make and how
+  many documents per second are shipped
+
+- when the stub is not reachable, documents are spooled to disk and
+  replayed once it is back; so are the documents of processes that
+  died while replaying
+
+- each testcase's completion ships what it reported
+
+Skipped if the *elasticsearch* Python package is not installed.
+"""
+
+import http.server
+import json
+import os
+import socketserver
+import subprocess
+import threading
+import time
+
+import tcfl.tc
+
+
+class _es_stub_handler_c(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply({ "version": { "number": "9.0.0" },
+                      "tagline": "You Know, for Search" })
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        data = self.rfile.read(length)
+        if not self.path.split("?")[0].endswith("/_bulk"):
+            # single document index request
+            with self.server.lock:
+                self.server.docs.append(json.loads(data))
+                self.server.requests += 1
+            self._reply({ "_index": "tcf-test", "result": "created" })
+            return
+        # bulk requests are pairs of action + document
+        docs = [ json.loads(line) for line in data.splitlines()[1::2] ]
+        with self.server.lock:
+            self.server.docs += docs
+            self.server.requests += 1
+        self._reply({
+            "took": 1, "errors": False,
+            "items": [ { "index": { "status": 201, "result": "created" } }
+                       for _ in docs ],
+        })
+
+    do_PUT = do_POST
+
+
+class _es_stub_c(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port = 0):
+        http.server.HTTPServer.__init__(self, ( "127.0.0.1", port ),
+                                        _es_stub_handler_c)
+        self.lock = threading.Lock()
+        self.docs = []
+        self.requests = 0
+        self.thread = threading.Thread(target = self.serve_forever,
+                                       daemon = True)
+        self.thread.start()
+
+
+class _fake_testcase:
+    # what the driver needs from a testcase to make a document
+    name = "fake"
+    runid = "runid"
+    ticket = "abcd"
+    target_group = None
+
+    @staticmethod
+    def ident():
+        return ""
+
+
+class _test(tcfl.tc.tc_c):
+
+    def _driver_make(self, url, name):
+        try:
+            from tcfl import report_elastic
+        except ImportError as e:
+            raise tcfl.tc.skip_e(f"can't import Elastic driver: {e}")
+        driver = report_elastic.driver(
+            url, "tcf-test",
+            spool_path = os.path.join(self.tmpdir, f"spool-{name}.jsonl"))
+        driver.retry_max = 2
+        driver.retry_backoff = 0.1
+        driver.retry_backoff_max = 0.5
+        return driver
+
+    @staticmethod
+    def _reports_make(driver, count):
+        ts0 = time.time()
+        for i in range(count):
+            driver.report(_fake_testcase, None, "INFO", time.time(), 0,
+                          1, f"message {i}", 2, { "i": i })
+        return time.time() - ts0
+
+    def eval_00_throughput(self):
+        stub = _es_stub_c()
+        url = f"http://127.0.0.1:{stub.server_address[1]}"
+        driver = self._driver_make(url, "throughput")
+        count = 20000
+        ts0 = time.time()
+        ts_report = self._reports_make(driver, count)
+        if not driver.flush(60):
+            raise tcfl.tc.failed_e("flush timed out")
+        ts_ship = time.time() - ts0
+        driver.close()
+        stub.shutdown()
+        stub.server_close()
+        if len(stub.docs) != count:
+            raise tcfl.tc.failed_e(
+                f"expected {count} documents, stub got {len(stub.docs)}")
+
+        # what it used to be: one request per document
+        stub = _es_stub_c()
+        count_single = 1000
+        from tcfl import report_elastic
+        es = report_elastic.elasticsearch.Elasticsearch(
+            f"http://127.0.0.1:{stub.server_address[1]}")
+        ts0 = time.time()
+        for i in range(count_single):
+            es.index(index = "tcf-test", document = { "message": f"{i}" })
+        ts_single = time.time() - ts0
+        stub.shutdown()
+        stub.server_close()
+
+        self.report_data("Elastic report driver",
+                         "documents indexed one by one per second",
+                         count_single / ts_single)
+        self.report_data("Elastic report driver",
+                         "reports queued per second", count / ts_report)
+        self.report_data("Elastic report driver",
+                         "documents shipped per second", count / ts_ship)
+        self.report_info(
+            f"{count} reports: queued at {count / ts_report:.0f}/s,"
+            f" shipped at {count / ts_ship:.0f}/s"
+            f" in bulk requests; one by one {count_single / ts_single:.0f}/s",
+            level = 0)
+
+    def eval_10_spool_replay(self):
+        # grab a free port, don't listen on it
+        stub = _es_stub_c()
+        port = stub.server_address[1]
+        stub.shutdown()
+        stub.server_close()
+
+        driver = self._driver_make(f"http://127.0.0.1:{port}", "replay")
+        self._reports_make(driver, 100)
+        driver.flush(60)
+        if driver.docs_spooled != 100:
+            raise tcfl.tc.failed_e(
+                f"expected 100 documents spooled, got {driver.docs_spooled}")
+
+        # back online, on the same port
+        stub = _es_stub_c(port)
+        time.sleep(driver.retry_backoff_max)	# no longer considered down
+        self._reports_make(driver, 10)
+        driver.flush(60)
+        driver.close()
+        stub.shutdown()
+        stub.server_close()
+        messages = set(doc['message'] for doc in stub.docs)
+        if len(stub.docs) != 110 or len(messages) != 100:
+            raise tcfl.tc.failed_e(
+                f"expected 110 documents after replay, got {len(stub.docs)}")
+        if os.path.exists(driver.spool_path):
+            raise tcfl.tc.failed_e("spool file not removed after replay")
+
+    def eval_20_completion(self):
+        stub = _es_stub_c()
+        driver = self._driver_make(f"http://127.0.0.1:{stub.server_address[1]}",
+                                   "completion")
+        # don't ship on our own, only when the testcase completes
+        driver.flush_docs = 1000
+        driver.flush_period = 60
+        try:
+            self._reports_make(driver, 10)
+            time.sleep(0.5)
+            if stub.docs:
+                raise tcfl.tc.failed_e(
+                    f"{len(stub.docs)} documents shipped before completion")
+            driver.report(_fake_testcase, None, "PASS", time.time(), 0,
+                          1, "COMPLETION passed", 2, {})
+            if len(stub.docs) != 11:
+                raise tcfl.tc.failed_e(
+                    f"expected 11 documents shipped on completion,"
+                    f" got {len(stub.docs)}")
+        finally:
+            driver.close()
+            stub.shutdown()
+            stub.server_close()
+        if driver._thread.is_alive():
+            raise tcfl.tc.failed_e("shipper thread still running after close")
+
+    def eval_30_orphans(self):
+        stub = _es_stub_c()
+        driver = self._driver_make(f"http://127.0.0.1:{stub.server_address[1]}",
+                                   "orphans")
+        # a process that died replaying and one that is still at it
+        pid_dead = subprocess.Popen([ "true" ]).pid
+        os.waitpid(pid_dead, 0)
+        path_dead = driver.spool_path + f".replay-{pid_dead}-1234"
+        path_alive = driver.spool_path + f".replay-{os.getppid()}-1234"
+        for path in ( path_dead, path_alive ):
+            with open(path, "w") as f:
+                for i in range(5):
+                    f.write(json.dumps({ "message": f"{path} {i}" }) + "\n")
+        try:
+            self._reports_make(driver, 1)
+            driver.flush(60)
+        finally:
+            driver.close()
+            stub.shutdown()
+            stub.server_close()
+        messages = set(doc['message'] for doc in stub.docs)
+        if len(stub.docs) != 6 \
+           or any(f"{path_dead} {i}" not in messages for i in range(5)):
+            raise tcfl.tc.failed_e(
+                f"expected 1 document + 5 orphaned replayed, got {messages}")
+        if os.path.exists(path_dead):
+            raise tcfl.tc.failed_e("orphaned replay file not removed")
+        if not os.path.exists(path_alive):
+            raise tcfl.tc.failed_e(
+                "replay file of a live process was taken over")
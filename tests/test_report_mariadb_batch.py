@@ -0,0 +1,279 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Test the batched writes of the MariaDB report driver
+(tcfl.report_mariadb.driver_summary)
+
+Needs the *mariadb* Python connector; otherwise it is skipped. With
+a fake connection, we verify that:
+
+- when writing a batch fails, the rows are written one by one and
+  only those the database rejects are dropped
+
+- rows that fail because the connection did are kept and written
+  in the next flush, merged with what was queued since
+
+- rows are written when each testcase completes
+
+Needs a MariaDB server where we can create tables, given in the
+environment as::
+
+  $ export TCF_TEST_MARIADB=USER:PASSWORD@HOST:PORT/DATABASE
+
+otherwise the rest is skipped. We queue rows for thousands of
+testcases and verify that:
+
+- increments to the same row add up
+
+- updates to the same row are merged
+
+- columns that appear in later batches are added
+
+and report how long it takes.
+"""
+
+import os
+import time
+
+import tcfl.tc
+
+
+_columns = [
+    "RunID", "Total Count", "Passed", "Failed", "Blocked",
+    "Testcase name", "run1", "RunID-TestcaseName", "HashID"
+]
+
+class _cursor:
+    # the minimum of a MariaDB cursor the driver needs; tables have
+    # all the columns in _columns and rows are written to the
+    # connection unless told to fail
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def _write(self, cmd, values):
+        mariadb = self.connection.mariadb
+        if self.connection.down:
+            raise mariadb.InterfaceError("Lost connection to server")
+        if "bad" in values:
+            raise mariadb.DataError("Incorrect value")
+        table = cmd.split("`")[1]
+        self.connection.pending.append(( table, values ))
+
+    def execute(self, cmd, values = ()):
+        if cmd.startswith("select column_name"):
+            self.results = [ ( column, ) for column in _columns ]
+        elif cmd.startswith("insert"):
+            self._write(cmd, values)
+
+    def executemany(self, cmd, values):
+        for row in values:
+            if "bad" in row:
+                raise self.connection.mariadb.DataError("Incorrect value")
+        for row in values:
+            self._write(cmd, row)
+
+
+class _connection:
+
+    def __init__(self, mariadb):
+        self.mariadb = mariadb
+        self.down = False
+        self.pending = []
+        self.rows = []
+
+    def cursor(self):
+        return _cursor(self)
+
+    def commit(self):
+        self.rows += self.pending
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+class _testcase:
+    # the minimum of tcfl.tc.tc_c the driver needs for a COMPLETION
+    def __init__(self, name):
+        self.name = name
+        self.kws = { 'runid': "run1", 'tc_hash': "abcd" }
+        self.runid_extra = None
+
+
+class _test(tcfl.tc.tc_c):
+
+    @staticmethod
+    def _driver_import():
+        try:
+            from tcfl import report_mariadb
+        except ImportError as e:
+            raise tcfl.tc.skip_e(f"can't import MariaDB driver: {e}")
+        return report_mariadb
+
+    def _driver_fake(self):
+        report_mariadb = self._driver_import()
+        driver = report_mariadb.driver_summary("user:password@host",
+                                               "database")
+        connection = _connection(report_mariadb.mariadb)
+        driver._connection_get = lambda: connection
+        # we flush by hand
+        driver.flush_rows = 1000000
+        driver.flush_period = 1000000
+        return driver, connection
+
+    def eval_00_bad_row(self):
+        driver, connection = self._driver_fake()
+        for i in range(10):
+            driver.table_row_update(
+                "History", "Testcase name", f"tc{i:02d}",
+                **{ "run1": "bad" if i == 5 else "P" })
+        driver.flush()
+        rows = [ values[0] for _table, values in connection.rows ]
+        expected = [ f"tc{i:02d}" for i in range(10) if i != 5 ]
+        if rows != expected:
+            raise tcfl.tc.failed_e(
+                "expected all rows but the bad one written",
+                dict(rows = rows, expected = expected))
+        if driver._rows_pending:
+            raise tcfl.tc.failed_e("bad row still pending")
+
+    def eval_10_connection_lost(self):
+        driver, connection = self._driver_fake()
+        driver.table_row_inc("Summary", "RunID", "run1",
+                             **{ "Total Count": 1, "Passed": 1 })
+        driver.table_row_update("History", "Testcase name", "tc1",
+                                **{ "run1": "F" })
+        connection.down = True
+        driver.flush()
+        if connection.rows or driver._rows_pending != 2:
+            raise tcfl.tc.failed_e(
+                "rows not kept when the connection failed",
+                dict(rows = connection.rows, pending = driver._rows_pending))
+        # more came in meanwhile
+        driver.table_row_inc("Summary", "RunID", "run1",
+                             **{ "Total Count": 1, "Failed": 1 })
+        driver.table_row_update("History", "Testcase name", "tc1",
+                                **{ "run1": "P" })
+        connection.down = False
+        driver.flush()
+        rows = sorted(connection.rows)
+        expected = [
+            ( "History", ( "tc1", "P" ) ),
+            ( "Summary", ( "run1", 2, 1, 1 ) ),
+        ]
+        if rows != expected:
+            raise tcfl.tc.failed_e(
+                "retried rows not merged with new ones",
+                dict(rows = rows, expected = expected))
+
+    def eval_20_completion(self):
+        driver, connection = self._driver_fake()
+        driver.report(_testcase("tc1"), None, "PASS", 0, 0, 0,
+                      "COMPLETION passed", 0, {})
+        tables = sorted(set(table for table, _values in connection.rows))
+        if tables != [ "HashIDs", "History", "Summary" ]:
+            raise tcfl.tc.failed_e(
+                "testcase's rows not written on its COMPLETION",
+                dict(rows = connection.rows))
+
+    def _driver_make(self):
+        spec = os.environ.get("TCF_TEST_MARIADB", None)
+        if not spec:
+            raise tcfl.tc.skip_e(
+                "export TCF_TEST_MARIADB=USER:PASSWORD@HOST:PORT/DATABASE"
+                " to run")
+        report_mariadb = self._driver_import()
+        hostname, database = spec.rsplit("/", 1)
+        port = 3307
+        if hostname.rsplit(":", 1)[-1].isdigit():
+            hostname, port = hostname.rsplit(":", 1)
+            port = int(port)
+        self.driver = report_mariadb.driver_summary(
+            hostname, database, port = port,
+            ssl = os.environ.get("TCF_TEST_MARIADB_SSL", "yes") == "yes",
+            table_name_prefix = f"test-{self.ticket} ")
+        # we flush by hand
+        self.driver.flush_rows = 1000000
+        self.driver.flush_period = 1000000
+
+    def _select(self, cmd):
+        connection = self.driver._connection_get()
+        with connection.cursor() as cursor:
+            cursor.execute(cmd)
+            return list(cursor)
+
+    def eval_30_server(self):
+        self._driver_make()
+        prefix = self.driver.table_name_prefix
+        ts0 = time.time()
+        for i in range(2000):
+            self.driver.table_row_inc(
+                "Summary", "RunID", "run1",
+                **{ "RunID": "run1", "Total Count": 1,
+                    "Passed" if i % 2 else "Failed": 1 })
+            self.driver.table_row_update(
+                "History", "Testcase name", f"tc{i:04d}",
+                **{ "run1": "P" if i % 2 else "F" })
+            self.driver.table_row_update(
+                "domain", "RunID", "run1", prefix_bare = "DATA ",
+                **{ f"kpi{i % 20:02d}": i })
+        self.driver.flush()
+        ts = time.time() - ts0
+        self.report_data("MariaDB report driver",
+                         "2000 testcases flush (s)", ts)
+        self.report_info(f"2000 testcases written in {ts:.2f}s", level = 0)
+
+        rows = self._select(
+            f"select `Total Count`, `Passed`, `Failed`"
+            f" from `{prefix}Summary` where `RunID` = 'run1'")
+        if rows != [ ( 2000, 1000, 1000 ) ]:
+            raise tcfl.tc.failed_e(f"Summary: unexpected {rows}")
+        rows = self._select(f"select count(*) from `{prefix}History`")
+        if rows != [ ( 2000, ) ]:
+            raise tcfl.tc.failed_e(f"History: unexpected {rows}")
+        rows = self._select(
+            f"select `kpi00`, `kpi19` from `{prefix}DATA domain`")
+        if rows != [ ( 1980, 1999 ) ]:
+            raise tcfl.tc.failed_e(f"DATA domain: unexpected {rows}")
+
+        # a second batch with new columns
+        self.driver.table_row_inc(
+            "Summary", "RunID", "run1",
+            **{ "RunID": "run1", "Total Count": 1, "Blocked": 1 })
+        self.driver.table_row_update(
+            "History", "Testcase name", "tc0000", **{ "run2": "P" })
+        self.driver.flush()
+        rows = self._select(
+            f"select `Total Count`, `Blocked`"
+            f" from `{prefix}Summary` where `RunID` = 'run1'")
+        if rows != [ ( 2001, 1 ) ]:
+            raise tcfl.tc.failed_e(f"Summary: unexpected {rows}")
+        rows = self._select(
+            f"select `run1`, `run2` from `{prefix}History`"
+            f" where `Testcase name` = 'tc0000'")
+        if rows != [ ( "F", "P" ) ]:
+            raise tcfl.tc.failed_e(f"History: unexpected {rows}")
+
+    def teardown_90(self):
+        driver = getattr(self, "driver", None)
+        if not driver:
+            return
+        prefix = driver.table_name_prefix
+        connection = driver._connection_get()
+        with connection.cursor() as cursor:
+            for table in [ "Summary", "History", "DATA domain" ]:
+                cursor.execute(f"drop table if exists `{prefix}{table}`")
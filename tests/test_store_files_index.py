@@ -0,0 +1,278 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Test the index of files in the users' storage areas
+(ttbl.store.files_index_c)
+
+- report how long it takes to find the expired files in a storage
+  with many users and files scanning all of them (as it was done
+  before) and with the index
+
+- files used recently or modified behind the index's back are not
+  removed
+
+- users over quota get their least recently used files removed
+
+- files uploaded again right after being removed stay in the index
+
+- repairing finds the files created and removed behind the index's
+  back
+
+- the journal is rewritten when it grows too much, without losing
+  records appended at the same time by other processes
+"""
+
+import glob
+import os
+import time
+
+import tcfl.tc
+import ttbl.store
+
+_users = 100
+_files_per_user = 100
+_expired = 25
+
+
+def _file_create(path, size = 0):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+class _test(tcfl.tc.tc_c):
+
+    def _files_path(self, name):
+        files_path = os.path.join(self.tmpdir, name)
+        os.makedirs(files_path)
+        return files_path
+
+    def _index(self, name):
+        return ttbl.store.files_index_c(self._files_path(name))
+
+    def eval_00_benchmark(self):
+        index = self._index("benchmark")
+        ts_now = time.time()
+        ts_old = ts_now - 2 * 86400
+        for user in range(_users):
+            user_path = os.path.join(index.files_path, f"user{user}")
+            os.makedirs(user_path)
+            for count in range(_files_per_user):
+                _file_create(os.path.join(user_path, f"file{count}"))
+        # a few files were last used long ago
+        for count in range(_expired):
+            path = os.path.join(index.files_path, f"user{count}", "file0")
+            os.utime(path, ( ts_old, ts_old ))
+        index.repair()
+
+        # as ttbd.cleanup_files() used to do it, minus the removing
+        ts0 = time.time()
+        expired = 0
+        for f in glob.iglob(index.files_path + "/*/*"):
+            if ts_now - os.stat(f).st_mtime > 86400:
+                expired += 1
+        ts_scan = time.time() - ts0
+
+        ts0 = time.time()
+        removed = index.expire(ts_now, 86400)
+        ts_index = time.time() - ts0
+        # nothing else to do the next time
+        ts0 = time.time()
+        index.expire(ts_now + 60, 86400)
+        ts_index_idle = time.time() - ts0
+
+        if expired != _expired or len(removed) != _expired:
+            raise tcfl.tc.failed_e(
+                f"expected {_expired} expired files, scan found {expired},"
+                f" index removed {len(removed)}")
+        files = _users * _files_per_user
+        for name, ts in [ ( "scanning", ts_scan ),
+                          ( "index", ts_index ),
+                          ( "index, nothing expired", ts_index_idle ) ]:
+            self.report_data("Uploaded files cleanup", f"{name} (ms)",
+                             ts * 1000)
+            self.report_info(f"{name}: {ts * 1000:.2f}ms for {files} files"
+                             f" of {_users} users", level = 0)
+        if ts_index >= ts_scan:
+            raise tcfl.tc.failed_e("the index is not faster than scanning")
+
+    def eval_10_expire(self):
+        index = self._index("expire")
+        ts_now = time.time()
+        ts_old = ts_now - 2 * 86400
+        user_path = os.path.join(index.files_path, "user")
+        os.makedirs(user_path)
+        for name in [ "unused", "used", "modified" ]:
+            _file_create(os.path.join(user_path, name))
+            os.utime(os.path.join(user_path, name), ( ts_old, ts_old ))
+            index.record(os.path.join(user_path, name), ts = ts_old)
+        # used recently (eg: flashed)
+        index.record(os.path.join(user_path, "used"), ts = ts_now)
+        # modified without telling the index
+        os.utime(os.path.join(user_path, "modified"), ( ts_now, ts_now ))
+        # not in a user's storage area, ignored
+        _file_create(os.path.join(index.files_path, "toplevel"))
+        index.record(os.path.join(index.files_path, "toplevel"), ts = ts_old)
+        index.record(os.path.join(self.tmpdir, "outside"), ts = ts_old)
+
+        removed = index.expire(ts_now, 86400)
+        if removed != [ os.path.join(user_path, "unused") ]:
+            raise tcfl.tc.failed_e(f"unexpected files removed: {removed}")
+        if sorted(os.listdir(user_path)) != [ "modified", "used" ]:
+            raise tcfl.tc.failed_e(
+                f"unexpected files left: {os.listdir(user_path)}")
+        if not os.path.exists(os.path.join(index.files_path, "toplevel")):
+            raise tcfl.tc.failed_e("file outside storage areas removed")
+        # a day later, they go
+        removed = index.expire(ts_now + 86401, 86400)
+        if len(removed) != 2 or os.listdir(user_path):
+            raise tcfl.tc.failed_e(f"files not expired: {removed}")
+        if index.files or index.usage:
+            raise tcfl.tc.failed_e(
+                f"index not empty: {index.files} {index.usage}")
+
+    def eval_20_quota(self):
+        index = self._index("quota")
+        ts_now = time.time()
+        for user in [ "user1", "user2" ]:
+            os.makedirs(os.path.join(index.files_path, user))
+            for count in range(5):
+                path = os.path.join(index.files_path, user, f"file{count}")
+                _file_create(path, 100)
+                ts = ts_now - 100 + count
+                os.utime(path, ( ts, ts ))
+                index.record(path, ts = ts)
+        # user1 used the oldest file again
+        index.record(os.path.join(index.files_path, "user1", "file0"),
+                     ts = ts_now)
+        # user2 removed some
+        for count in range(3):
+            path = os.path.join(index.files_path, "user2", f"file{count}")
+            os.unlink(path)
+            index.remove(path)
+        index.update()
+        if dict(index.usage) != { "user1": 500, "user2": 200 }:
+            raise tcfl.tc.failed_e(f"wrong usage: {index.usage}")
+
+        removed = index.quota_enforce(2.5e2)	# as in 20e9
+        expected = [ os.path.join(index.files_path, "user1", f"file{count}")
+                     for count in [ 1, 2, 3 ] ]
+        if removed != expected:
+            raise tcfl.tc.failed_e(
+                f"removed {removed}, expected least recently used"
+                f" {expected}")
+        if dict(index.usage) != { "user1": 200, "user2": 200 }:
+            raise tcfl.tc.failed_e(f"wrong usage after quota: {index.usage}")
+
+    def eval_25_reupload(self):
+        index = self._index("reupload")
+        ts_old = time.time() - 2 * 86400
+        user_path = os.path.join(index.files_path, "user")
+        os.makedirs(user_path)
+        for name in [ "file0", "file1" ]:
+            _file_create(os.path.join(user_path, name))
+            os.utime(os.path.join(user_path, name), ( ts_old, ts_old ))
+            index.record(os.path.join(user_path, name), ts = ts_old)
+
+        # file0 is uploaded again by the server after expire() removed
+        # it but before it journals it was removed
+        removed_record = index._removed_record
+        def _removed_record_reupload(removed):
+            path = os.path.join(user_path, "file0")
+            _file_create(path, 10)
+            index.record(path)
+            return removed_record(removed)
+        index._removed_record = _removed_record_reupload
+
+        removed = index.expire(time.time(), 86400)
+        if len(removed) != 2:
+            raise tcfl.tc.failed_e(f"expected two files removed: {removed}")
+        index.update()
+        if list(index.files) != [ ( "user", "file0" ) ]:
+            raise tcfl.tc.failed_e(
+                f"file uploaded again not in the index: {index.files}")
+        # reading the journal from scratch, the same
+        other = ttbl.store.files_index_c(index.files_path)
+        other.update()
+        if list(other.files) != [ ( "user", "file0" ) ] \
+           or dict(other.usage) != { "user": 10 }:
+            raise tcfl.tc.failed_e(
+                f"journal doesn't match: {other.files} {other.usage}")
+
+    def eval_30_repair(self):
+        index = self._index("repair")
+        user_path = os.path.join(index.files_path, "user")
+        os.makedirs(user_path)
+        for name in [ "known", "changed", "gone" ]:
+            _file_create(os.path.join(user_path, name), 10)
+            index.record(os.path.join(user_path, name))
+        index.update()
+        # behind the index's back
+        _file_create(os.path.join(user_path, "new"), 10)
+        _file_create(os.path.join(user_path, "changed"), 20)
+        os.unlink(os.path.join(user_path, "gone"))
+        r = index.repair()
+        if r != dict(added = 1, updated = 1, removed = 1, files = 3):
+            raise tcfl.tc.failed_e(f"unexpected repair result {r}")
+        if dict(index.usage) != { "user": 40 }:
+            raise tcfl.tc.failed_e(f"wrong usage: {index.usage}")
+        # as ttbd --files-index-repair would do it while the server's
+        # cleanup process follows the journal
+        other = ttbl.store.files_index_c(index.files_path)
+        os.unlink(os.path.join(user_path, "new"))
+        other.repair()
+        index.update()
+        if sorted(index.files) != [ ( "user", "changed" ),
+                                    ( "user", "known" ) ]:
+            raise tcfl.tc.failed_e(
+                f"repair by someone else not seen: {index.files}")
+
+    def eval_40_journal_rewrite(self):
+        index = self._index("rewrite")
+        index.journal_records_min = 50
+        user_path = os.path.join(index.files_path, "user")
+        os.makedirs(user_path)
+        for count in range(10):
+            _file_create(os.path.join(user_path, f"file{count}"))
+        # other processes use the files while the journal is being
+        # rewritten
+        writers = 4
+        uses = 200
+        pids = []
+        for writer in range(writers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for count in range(uses):
+                        index.record(os.path.join(user_path,
+                                                  f"file{count % 10}"),
+                                     ts = 1000 * writer + count)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for _ in range(20):
+            index.update()
+            time.sleep(0.01)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        index.update()
+        # the last use of each file was by the last writer
+        expected = {
+            ( "user", f"file{count}" ): [ 0, 1000 * (writers - 1) + uses - 10
+                                          + count ]
+            for count in range(10)
+        }
+        if index.files != expected:
+            raise tcfl.tc.failed_e(f"records lost: {index.files}")
+        with open(index.journal_path) as f:
+            records = len(f.readlines())
+        if records >= writers * uses:
+            raise tcfl.tc.failed_e(f"journal not rewritten: {records} records")
+        # restarting, we read the same
+        other = ttbl.store.files_index_c(index.files_path)
+        other.update()
+        if other.files != expected:
+            raise tcfl.tc.failed_e(f"journal doesn't match: {other.files}")
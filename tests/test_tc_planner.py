@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Test and benchmark the run planner (tcfl.planner)
+
+We create a set of fake jobs for many testcases that compete for a
+few targets, while other targets are only used by some, and verify:
+
+- the planned order finishes earlier than the discovery order
+
+- no two jobs planned at the same time share targets
+
+- the quota of jobs per testcase is honored
+
+- durations are averaged and saved
+
+- planning many jobs picks the same ones as looking at all of them
+  for every slot, in a fraction of the time
+"""
+
+import collections
+import os
+import random
+import time
+
+import tcfl.planner
+import tcfl.tc
+
+
+class _test(tcfl.tc.tc_c):
+
+    @staticmethod
+    def _fake_jobs():
+        jobs_by_tc = {}
+        # 20 testcases can run on the one busy target or on one of
+        # their own; discovery order puts the busy one first
+        for i in range(20):
+            tc_name = f"tc{i:02d}"
+            jobs_by_tc[tc_name] = [
+                tcfl.planner.job_c(tc_name, [ "busy" ], "target=A",
+                                   "target=busy"),
+                tcfl.planner.job_c(tc_name, [ f"own{i:02d}" ], "target=B",
+                                   f"target=own{i:02d}"),
+            ]
+        # 20 testcases that can only run on the busy target
+        for i in range(20, 40):
+            tc_name = f"tc{i:02d}"
+            jobs_by_tc[tc_name] = [
+                tcfl.planner.job_c(tc_name, [ "busy" ], "target=A",
+                                   "target=busy"),
+            ]
+        return jobs_by_tc
+
+    @staticmethod
+    def _check_overlap(jobs):
+        for job in jobs:
+            for other in jobs:
+                if job is other or not job.rt_fullids & other.rt_fullids:
+                    continue
+                if job.ts_start < other.ts_end \
+                   and other.ts_start < job.ts_end:
+                    raise tcfl.tc.failed_e(
+                        f"{job} and {other} overlap in time and targets")
+
+    def eval_00_plan(self):
+        durations = tcfl.planner.durations_c(
+            os.path.join(self.tmpdir, "durations.json"))
+        jobs_by_tc = self._fake_jobs()
+        quotas = { tc_name: 1 for tc_name in jobs_by_tc }
+        ts0 = time.time()
+        jobs = tcfl.planner.plan(jobs_by_tc, 8, durations, quotas)
+        ts = time.time() - ts0
+        self._check_overlap(jobs)
+        if len(jobs) != 40:
+            raise tcfl.tc.failed_e(f"expected 40 jobs, got {len(jobs)}")
+        if set(job.tc_name for job in jobs) != set(jobs_by_tc):
+            raise tcfl.tc.failed_e("not all testcases planned once")
+
+        # the unplanned order: each testcase on its first group
+        jobs_unplanned = [ jobs[0] for jobs in self._fake_jobs().values() ]
+        for job in jobs_unplanned:
+            job.duration = durations.default
+        makespan = max(job.ts_end for job in jobs)
+        makespan_unplanned = tcfl.planner.simulate(jobs_unplanned, 8)
+        if makespan > tcfl.planner.simulate(jobs, 8):
+            raise tcfl.tc.failed_e("planned times do not match simulation")
+        if makespan >= makespan_unplanned:
+            raise tcfl.tc.failed_e(
+                f"planned makespan {makespan}s not better than"
+                f" unplanned {makespan_unplanned}s")
+        self.report_data("Run planner", "40 testcases, planning time (s)", ts)
+        self.report_data("Run planner", "40 testcases, makespan (s)", makespan)
+        self.report_data("Run planner", "40 testcases, unplanned makespan (s)",
+                         makespan_unplanned)
+        self.report_info(f"planned 40 testcases in {ts:.3f}s: makespan"
+                         f" {makespan}s vs {makespan_unplanned}s unplanned",
+                         level = 0)
+
+    def eval_10_no_quota(self):
+        durations = tcfl.planner.durations_c(
+            os.path.join(self.tmpdir, "durations.json"))
+        jobs = tcfl.planner.plan(self._fake_jobs(), 8, durations)
+        self._check_overlap(jobs)
+        if len(jobs) != 60:
+            raise tcfl.tc.failed_e(f"expected 60 jobs, got {len(jobs)}")
+
+    def eval_20_durations(self):
+        path = os.path.join(self.tmpdir, "durations-20.json")
+        durations = tcfl.planner.durations_c(path)
+        durations.update("tc1", "target=A", 10)
+        durations.update("tc1", "target=B", 30)
+        durations.save()
+        durations = tcfl.planner.durations_c(path)
+        if durations.get("tc1", "target=A") != 10:
+            raise tcfl.tc.failed_e("duration not saved")
+        if durations.get("tc1", "target=C") != 20:
+            raise tcfl.tc.failed_e("unknown types not averaged")
+        if durations.get("tc2", "target=A") != durations.default:
+            raise tcfl.tc.failed_e("unknown testcase not defaulted")
+        durations.update("tc1", "target=A", 20)
+        durations.save()
+        expected = durations.weight * 20 + (1 - durations.weight) * 10
+        if abs(durations.get("tc1", "target=A") - expected) > 0.001:
+            raise tcfl.tc.failed_e(
+                f"expected moving average {expected}, got"
+                f" {durations.get('tc1', 'target=A')}")
+
+    @staticmethod
+    def _plan_scan(jobs_by_tc, parallelism):
+        # pick the next job looking at all of them every time; what
+        # tcfl.planner.plan() does, only slower
+        remaining = {
+            tc_name: list(jobs) for tc_name, jobs in jobs_by_tc.items()
+        }
+        slots = [ 0.0 ] * parallelism
+        free_at = collections.defaultdict(float)
+        planned = []
+        while remaining:
+            best_key = None
+            for tc_name, jobs in remaining.items():
+                for job in jobs:
+                    ts_start = max([ slots[0] ]
+                                   + [ free_at[i] for i in job.rt_fullids ])
+                    key = ( ts_start, -job.duration, tc_name, job.group_str )
+                    if best_key == None or key < best_key:
+                        best = job
+                        best_key = key
+            for rt_fullid in best.rt_fullids:
+                free_at[rt_fullid] = best_key[0] + best.duration
+            slots[0] = best_key[0] + best.duration
+            slots.sort()
+            planned.append(best)
+            remaining[best.tc_name].remove(best)
+            if not remaining[best.tc_name]:
+                del remaining[best.tc_name]
+        return planned
+
+    def eval_30_many(self):
+        durations = tcfl.planner.durations_c(
+            os.path.join(self.tmpdir, "durations-30.json"))
+        rng = random.Random(1)
+        jobs_by_tc = {}
+        for i in range(1000):
+            tc_name = f"tc{i:04d}"
+            durations.durations[tc_name + " target=A"] = rng.randint(1, 100)
+            jobs_by_tc[tc_name] = [
+                tcfl.planner.job_c(tc_name, [ f"t{rng.randrange(50):02d}" ],
+                                   "target=A", f"group{group}")
+                for group in range(2)
+            ]
+        ts0 = time.time()
+        jobs = tcfl.planner.plan(jobs_by_tc, 16, durations)
+        ts = time.time() - ts0
+        ts0 = time.time()
+        jobs_scan = self._plan_scan(jobs_by_tc, 16)
+        ts_scan = time.time() - ts0
+        if jobs != jobs_scan:
+            raise tcfl.tc.failed_e("plan differs from scanning all the jobs")
+        self.report_data("Run planner", "2000 jobs, planning time (s)", ts)
+        self.report_data("Run planner",
+                         "2000 jobs, planning time scanning (s)", ts_scan)
+        self.report_info(f"planned 2000 jobs in {ts:.3f}s vs {ts_scan:.3f}s"
+                         " scanning all of them", level = 0)
+        if ts >= ts_scan:
+            raise tcfl.tc.failed_e("planning not faster than scanning")
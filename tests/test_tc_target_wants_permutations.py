@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Test and benchmark the generation of target groups
+(tcfl.tc.tc_c._target_wants_list_permutations())
+
+We create a fake testcase with a set of target wants and a pool of
+fake remote targets and verify the groups generated:
+
+- never assign the same remote target twice in a group
+
+- honor the *one-per-type*, *any* and *all* modes
+
+- are the same given the same seed
+
+- are generated quickly for big pools (1k targets x 4 wants)
+"""
+
+import time
+
+import tcfl.tc
+
+
+class _test(tcfl.tc.tc_c):
+
+    @staticmethod
+    def _fake_tc(wants, rt_types, mode = "one-per-type", seed = "1234"):
+        # wants: list of target want names
+        # rt_types: dict of remote target full ID -> type
+        tc = tcfl.tc.tc_c("fake", __file__, "builtin")
+        tc.mkticket()
+        tc.skip_reports = True
+        tc._targets = {}
+        for twn in wants:
+            tc._targets[twn] = { 'kws': { 'mode': mode }, 'spec': "" }
+        tc.rt_all = {}
+        for rt_fullid, rt_type in rt_types.items():
+            tc.rt_all[rt_fullid] = { 'type': rt_type }
+        tc.permutations_seed = seed
+        candidates = {}
+        for twn in wants:
+            candidates[twn] = set(( rt_fullid, None ) for rt_fullid in rt_types)
+        return tc, candidates
+
+    def _check_groups(self, tc, groups, check_types = True):
+        # no remote target used twice in a group
+        for tgid, tg in groups.items():
+            rt_fullids = [ rt_fullid for rt_fullid, _ in tg.values() ]
+            if len(set(rt_fullids)) != len(rt_fullids):
+                raise tcfl.tc.failed_e(
+                    f"group {tgid} reuses remote targets: {tg}")
+        if not check_types:
+            return
+        # no type combination repeated
+        signatures = set()
+        for tgid, tg in groups.items():
+            signature = tuple(sorted(
+                ( twn, tc.rt_all[rt_fullid]['type'] )
+                for twn, ( rt_fullid, _ ) in tg.items()))
+            if signature in signatures:
+                raise tcfl.tc.failed_e(
+                    f"group {tgid} repeats types {signature}")
+            signatures.add(signature)
+
+    def eval_00_example(self):
+        # the example in the comments of _target_wants_list_permutations()
+        tc, candidates = self._fake_tc(
+            [ "T1", "T2" ], { "A1": "A", "A2": "A", "B1": "B" })
+        groups = tc._target_wants_list_permutations(candidates, 10)
+        self._check_groups(tc, groups)
+        if len(groups) != 3:
+            raise tcfl.tc.failed_e(
+                f"one-per-type: expected 3 groups, got {len(groups)}",
+                dict(groups = groups))
+
+        tc._targets['T2']['kws']['mode'] = "any"
+        groups = tc._target_wants_list_permutations(candidates, 10)
+        if len(groups) != 2:
+            raise tcfl.tc.failed_e(
+                f"T2 any: expected 2 groups, got {len(groups)}",
+                dict(groups = groups))
+
+    def eval_10_impossible(self):
+        # four wants, three targets: no group can be formed
+        tc, candidates = self._fake_tc(
+            [ "T1", "T2", "T3", "T4" ], { "A1": "A", "A2": "A", "B1": "B" })
+        groups = tc._target_wants_list_permutations(candidates, 10)
+        if groups:
+            raise tcfl.tc.failed_e(f"expected no groups, got {groups}")
+
+    def eval_20_all(self):
+        # one want in 'all' mode shall get all the targets
+        rt_types = { f"t{i:04d}": f"type{i % 10}" for i in range(100) }
+        tc, candidates = self._fake_tc([ "T1" ], rt_types, mode = "all")
+        groups = tc._target_wants_list_permutations(candidates, 10)
+        rt_fullids = set(tg['T1'][0] for tg in groups.values())
+        if rt_fullids != set(rt_types):
+            raise tcfl.tc.failed_e(
+                f"all: expected all 100 targets, got {len(rt_fullids)}")
+
+    def eval_30_benchmark(self):
+        # 1k targets of 20 types, 4 wants
+        rt_types = { f"t{i:04d}": f"type{i % 20}" for i in range(1000) }
+        wants = [ "T1", "T2", "T3", "T4" ]
+        tc, candidates = self._fake_tc(wants, rt_types)
+        ts0 = time.time()
+        groups = tc._target_wants_list_permutations(candidates, 10)
+        ts = time.time() - ts0
+        self._check_groups(tc, groups)
+        if len(groups) != 10:
+            raise tcfl.tc.failed_e(
+                f"expected 10 groups, got {len(groups)}")
+        self.report_data("Target group permutations",
+                         "1k targets x 4 wants, 10 groups (s)", ts)
+        self.report_info(f"1k targets x 4 wants: 10 groups in {ts:.3f}s",
+                         level = 0)
+
+        # all the types get used in the first groups, not just the
+        # last target want's
+        for twn in wants:
+            types = set(tc.rt_all[tg[twn][0]]['type'] for tg in groups.values())
+            if len(types) < 2:
+                raise tcfl.tc.failed_e(
+                    f"{twn}: only got types {types} in 10 groups")
+
+        # same seed, same groups; different seed, different groups
+        tc2, _ = self._fake_tc(wants, rt_types)
+        groups2 = tc2._target_wants_list_permutations(candidates, 10)
+        if groups2 != groups:
+            raise tcfl.tc.failed_e("same seed generated different groups",
+                                   dict(groups = groups, groups2 = groups2))
+        tc3, _ = self._fake_tc(wants, rt_types, seed = "5678")
+        groups3 = tc3._target_wants_list_permutations(candidates, 10)
+        if groups3 == groups:
+            raise tcfl.tc.failed_e("different seed generated same groups")
+
+        # a lot of groups, in 'all' mode
+        tc4, _ = self._fake_tc(wants, rt_types, mode = "all")
+        ts0 = time.time()
+        groups4 = tc4._target_wants_list_permutations(candidates, 1000)
+        ts = time.time() - ts0
+        self._check_groups(tc4, groups4, check_types = False)
+        if len(groups4) != 1000:
+            raise tcfl.tc.failed_e(
+                f"all mode: expected 1000 groups, got {len(groups4)}")
+        self.report_data("Target group permutations",
+                         "1k targets x 4 wants, 1000 groups all mode (s)", ts)
+        self.report_info(f"1k targets x 4 wants, all mode: 1000 groups"
+                         f" in {ts:.3f}s", level = 0)
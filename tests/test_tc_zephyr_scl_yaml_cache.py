@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+#
+# Copyright 2024 Intel Corporation
+#
+# SPDX-License-Header: Apache 2.0
+"""
+Benchmark and test loading Zephyr sanity check YAML files
+(tcfl.tc_zephyr_scl.yaml_load_verify())
+
+Over a synthetic tree of 5k testcase.yaml files, time:
+
+- the original way (pure Python YAML loader + validation)
+- a cold scan (libyaml loader if available, validation, caching)
+- a warm scan in the same process (memory cache)
+- a warm scan in a new process (disk cache)
+
+and verify that files modified and schema changes invalidate the
+cache and that invalid files are still reported.
+"""
+
+import os
+import time
+
+import yaml
+
+import tcfl.tc
+import tcfl.tc_zephyr_scl as tc_zephyr_scl
+
+_schema = {
+    'type': 'map',
+    'mapping': {
+        'common': {
+            'type': 'map', 'required': False,
+            'mapping': { 'tags': { 'type': 'str', 'required': False } },
+        },
+        'tests': {
+            'type': 'map', 'required': True,
+            'mapping': {
+                'regex;(([a-zA-Z0-9_]+))': {
+                    'type': 'map',
+                    'mapping': {
+                        'tags': { 'type': 'str', 'required': False },
+                        'min_ram': { 'type': 'int', 'required': False },
+                        'platform_exclude': {
+                            'type': 'str', 'required': False
+                        },
+                        'extra_args': { 'type': 'str', 'required': False },
+                    },
+                },
+            },
+        },
+    },
+}
+
+_files = 5000
+
+
+class _test(tcfl.tc.tc_c):
+
+    def configure_00(self):
+        self.topdir = os.path.join(self.tmpdir, "tree")
+        self.paths = []
+        for i in range(_files):
+            dirname = os.path.join(self.topdir, f"area{i % 50:02d}",
+                                   f"test{i:04d}")
+            os.makedirs(dirname)
+            path = os.path.join(dirname, "testcase.yaml")
+            with open(path, "w") as f:
+                f.write(f"""\
+common:
+  tags: area{i % 50:02d}
+tests:
+  area{i % 50:02d}.test{i:04d}:
+    tags: kernel
+    min_ram: {16 + i % 32}
+    platform_exclude: qemu_x86 qemu_cortex_m3
+  area{i % 50:02d}.test{i:04d}.extra:
+    extra_args: CONF_FILE=prj_extra.conf
+    min_ram: 32
+""")
+            self.paths.append(path)
+        self.cache_dir_saved = tc_zephyr_scl.yaml_cache_dir
+        tc_zephyr_scl.yaml_cache_dir = os.path.join(self.tmpdir, "cache")
+
+    def _scan(self):
+        ts0 = time.time()
+        for path in self.paths:
+            y = tc_zephyr_scl.yaml_load_verify(path, _schema)
+            assert 'tests' in y
+        return time.time() - ts0
+
+    def eval_00_benchmark(self):
+        # the original way
+        ts0 = time.time()
+        for path in self.paths:
+            with open(path) as f:
+                y = yaml.safe_load(f)
+            tc_zephyr_scl._yaml_validate(y, _schema)
+        ts_original = time.time() - ts0
+
+        ts_cold = self._scan()
+        ts_warm = self._scan()
+        tc_zephyr_scl._yaml_cache.clear()	# as if a new process
+        ts_disk = self._scan()
+
+        for name, ts in [
+                ( "original", ts_original ),
+                ( "cold", ts_cold ),
+                ( "warm memory", ts_warm ),
+                ( "warm disk", ts_disk ),
+        ]:
+            self.report_data("Zephyr YAML loading",
+                             f"5k files {name} (s)", ts)
+        self.report_info(
+            f"5k testcase.yaml: original {ts_original:.2f}s,"
+            f" cold {ts_cold:.2f}s, warm memory {ts_warm:.2f}s,"
+            f" warm disk {ts_disk:.2f}s", level = 0)
+        if ts_warm > ts_original or ts_disk > ts_original:
+            raise tcfl.tc.failed_e("cached scan slower than original")
+
+    def eval_10_invalidation(self):
+        path = self.paths[0]
+        y = tc_zephyr_scl.yaml_load_verify(path, _schema)
+        # callers get their own copy
+        y['tests'].clear()
+        y = tc_zephyr_scl.yaml_load_verify(path, _schema)
+        if not y['tests']:
+            raise tcfl.tc.failed_e("cached data was modified by caller")
+
+        with open(path, "a") as f:
+            f.write("  area00.test0000.new:\n    min_ram: 8\n")
+        y = tc_zephyr_scl.yaml_load_verify(path, _schema)
+        if 'area00.test0000.new' not in y['tests']:
+            raise tcfl.tc.failed_e("modified file not reloaded")
+
+        with open(path, "a") as f:
+            f.write("  area00.test0000.bad:\n    min_ram: notanumber\n")
+        try:
+            tc_zephyr_scl.yaml_load_verify(path, _schema)
+            raise tcfl.tc.failed_e("invalid file not detected")
+        except tcfl.tc.failed_e:
+            raise
+        except Exception as e:
+            self.report_pass(f"invalid file detected: {type(e).__name__}")
+
+        # a new schema which makes min_ram a string invalidates it
+        schema = dict(_schema)
+        y = tc_zephyr_scl.yaml_load_verify(self.paths[1], _schema)
+        schema['mapping'] = dict(_schema['mapping'])
+        schema['mapping']['tests'] = { 'type': 'map', 'required': True,
+                                       'mapping': {} }
+        try:
+            tc_zephyr_scl.yaml_load_verify(self.paths[1], schema)
+            raise tcfl.tc.failed_e("schema change not detected")
+        except tcfl.tc.failed_e:
+            raise
+        except Exception as e:
+            self.report_pass(f"schema change detected: {type(e).__name__}")
+
+    def teardown_90(self):
+        tc_zephyr_scl.yaml_cache_dir = self.cache_dir_saved
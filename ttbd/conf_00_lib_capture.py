@@ -127,6 +127,24 @@ capture_screenshot_ffmpeg_v4l = ttbl.capture.generic_snapshot(
     mimetype = "image/png", extension = ".png"
 )
 
+#: A capturer to take screenshots from a v4l device, keeping
+#: *ffmpeg* running to grab frames
+#:
+#: Same setup as for :data:`capture_screenshot_ffmpeg_v4l`, but the
+#: device is kept open, which makes screenshots taken often (eg: when
+#: waiting for something to show on the screen) much faster; *ffmpeg*
+#: is stopped after a minute without screenshots.
+capture_screenshot_ffmpeg_v4l_grabber = ttbl.capture.generic_snapshot(
+    "screenshot:/dev/video-%(id)s-0",
+    "ffmpeg -i /dev/video-%(id)s-0"
+    " -ss 0.5 -frames 1 -c:v png -f image2pipe "
+    "-y %(output_file_name)s",
+    mimetype = "image/png", extension = ".png",
+    grabber_cmdline = "ffmpeg -nostdin -i /dev/video-%(id)s-0"
+    " -r 5 -c:v png -f image2 -update 1 -atomic_writing 1"
+    " -y %(_impl.frame_filename)s",
+)
+
 
 #: A capturer to take screenshots from VNC
 #:
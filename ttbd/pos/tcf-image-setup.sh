@@ -54,6 +54,11 @@ BOOT_DEV         force the boot partition to be taken from a given
 
 BOOT_MOUNTOPTS   use these boot mount options (default to empty)
 
+MANIFEST         (defaults to *yes*) generate a manifest of the image's
+                 files in .tcf.manifest, used by the TCF POS client to
+                 transfer only files that changed; set to *no* to
+                 disable.
+
 BOOT_CONF_ENTRY  if defined, this is the full file name of a file under
                  the rootfs boot/loader/entries; any file in there that
                  is not this one will be removed
@@ -1034,6 +1039,59 @@ echo "size_gib: $size_gib" >> $tmpdir/.tcf.metadata.yaml
 # move yaml to final location
 sudo mv $tmpdir/.tcf.metadata.yaml $destdir
 
+# Generate the file manifest
+#
+# The TCF POS client uses this to find which files changed between
+# what is deployed in a target and this image, so it doesn't have to
+# checksum the whole image on each deployment; one line per file or
+# symlink, sorted by path (see tcfl.pos.extension.manifest_name):
+#
+## TYPE SIZE MTIME HASH PATH
+#
+# HASH is the SHA256 of the contents (or of the symlink's destination)
+if [ "${MANIFEST:-yes}" != no ]; then
+    info generating file manifest $destdir/.tcf.manifest
+    sudo python3 - $destdir <<'MANIFEST_EOF'
+import hashlib
+import os
+import stat
+import sys
+
+topdir = sys.argv[1]
+entries = []
+for dirpath, dirnames, filenames in os.walk(topdir):
+    # do not descend into other filesystems
+    dirnames[:] = [
+        dirname for dirname in dirnames
+        if not os.path.ismount(os.path.join(dirpath, dirname))
+    ]
+    for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        relpath = os.path.relpath(path, topdir)
+        if relpath == ".tcf.manifest":
+            continue
+        st = os.lstat(path)
+        if stat.S_ISLNK(st.st_mode):
+            _type = "l"
+            h = hashlib.sha256(os.fsencode(os.readlink(path)))
+        elif stat.S_ISREG(st.st_mode):
+            _type = "f"
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+        else:
+            continue
+        entries.append((relpath, "%s %d %d %s %s" % (
+            _type, st.st_size, int(st.st_mtime), h.hexdigest(), relpath)))
+entries.sort()
+with open(os.path.join(topdir, ".tcf.manifest"), "w",
+          encoding = "utf-8", errors = "surrogateescape") as f:
+    for _relpath, line in entries:
+        f.write(line + "\n")
+MANIFEST_EOF
+fi
+
 function fix_sudo_perms() {
     # did we create files under sudo we want to restore to the caller's UID?
     if [ -z "${SUDO_UID:-}" ]; then
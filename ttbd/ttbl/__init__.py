@@ -19,6 +19,7 @@ import errno
 import filelock
 import glob
 import ipaddress
+import itertools
 import json
 import logging
 import os
@@ -1251,8 +1252,8 @@ class test_target(object):
         # because it is way easier to filter on flat triyng to keep
         # what has to be there and what not. And the performance at
         # the end might not be much more or less...
-        l = commonl.dict_to_flat(self.tags, projections,
-                                 sort = False, empty_dict = True)
+        l = commonl.dict_to_flat_iter(self.tags, projections,
+                                      empty_dict = True)
 
         # Override with changeable stuff set by users
         #
@@ -1260,8 +1261,8 @@ class test_target(object):
         # self.fsdb
         # we are unfolding the flat field list l['a.b.c'] = 3 we get
         # from fsdb to -> r['a']['b']['c'] = 3
-        l += self.fsdb.get_as_slist(*projections)
-        r = commonl.flat_slist_to_dict(l)
+        r = commonl.flat_slist_to_dict(itertools.chain(
+            l, self.fsdb.get_as_slist(*projections)))
 
         # mandatory fields, override them all
         if commonl.field_needed('owner', projections):
@@ -63,14 +63,20 @@ Preemption use cases
 import bisect
 import collections
 import datetime
+import fcntl
 import filelock
+import heapq
 import logging
+import mmap
 import os
 import re
 import shutil
+import struct
 import tempfile
+import threading
 import time
 import uuid
+import zlib
 
 
 import commonl
@@ -148,6 +154,339 @@ class lru_aged_c(object):
         elif entry in self.cache:
             del self.cache[entry]
     
+class keepalive_table_c:
+    """
+    Table of allocation keepalive timestamps shared by all the
+    server's processes
+
+    Keepalives are the most frequent operation on an allocation;
+    recording them in the fsdb means a symlink creation and rename
+    per allocation per keepalive. Instead, the timestamps (seconds
+    since the epoch) are kept in a fixed size table, memory mapped
+    from a file, indexed by a hash of the allocation ID with linear
+    probing:
+
+    - updating the timestamp of an allocation in the table is a
+      lookup and an eight byte write, no locks
+
+    - adding and removing allocations (rare) is done with the file
+      locked and bumps a generation counter in the header, so
+      :func:`expire` knows when it has to look for new allocations
+
+    - removed allocations leave a tombstone so lookups keep probing
+      past them, unless the next slot is empty. When there are more
+      than :data:`tombstones_max` of them, the table is rehashed
+      with the file locked; lookups done while it is being rehashed
+      are retried (the header has a counter that is odd while
+      rehashing).
+
+    The file is mapped before the server forks the worker
+    processes, so they all share the same pages.
+
+    :param str filename: file where to keep the table
+    :param int slots: number of allocations it can hold; see
+      :data:`ttbl.config.allocation_keepalive_slots`
+    """
+    # magic, generation, tombstones, rehashes
+    _header = struct.Struct("<8sQQQ")
+    _record = struct.Struct("<16sd")	# allocid, timestamp
+    _magic = b"TTBDKA02"
+    # header size for each known format, to read previous tables
+    _header_sizes = {
+        b"TTBDKA01": 16,
+        _magic: _header.size,
+    }
+    _offset_generation = 8
+    _offset_tombstones = 16
+    _offset_rehashes = 24
+    _empty = b"\0" * 16
+    _tombstone = b"\xff" * 16		# removed, keep probing
+
+    #: Rehash the table when more than this fraction of the slots
+    #: are tombstones
+    tombstones_max = 0.25
+
+    def __init__(self, filename, slots):
+        assert isinstance(slots, int) and slots > 0
+        self.filename = filename
+        self.slots = slots
+        self.size = self._header.size + slots * self._record.size
+        timestamps = self.read(filename)
+        # always start fresh, in case the slot count changed
+        with open(filename + ".tmp", "wb") as f:
+            f.write(self._header.pack(self._magic, 0, 0, 0))
+            f.truncate(self.size)
+        os.rename(filename + ".tmp", filename)
+        self.fd = os.open(filename, os.O_RDWR)
+        self.mmap = mmap.mmap(self.fd, self.size)
+        self._lock_pid = None
+        self.full_warned = False
+        #: Timestamps from the previous run, for :func:`init` to use
+        self.timestamps_previous = timestamps
+
+    @classmethod
+    def read(cls, filename):
+        """
+        Read a table file
+
+        :returns dict: dictionary of timestamps keyed by allocation
+          ID; empty if the file does not exist or is not valid
+        """
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        offset = cls._header_sizes.get(data[:8], None)
+        if offset == None or len(data) < offset:
+            return {}
+        timestamps = {}
+        length = len(data) - (len(data) - offset) % cls._record.size
+        for key, ts in cls._record.iter_unpack(data[offset:length]):
+            if key in ( cls._empty, cls._tombstone ):
+                continue
+            timestamps[key.rstrip(b"\0").decode()] = ts
+        return timestamps
+
+    @staticmethod
+    def _key(allocid):
+        key = allocid.encode()
+        if len(key) > 16:
+            return None
+        return key.ljust(16, b"\0")
+
+    def _offset(self, slot):
+        return self._header.size + slot * self._record.size
+
+    def _counter(self, offset):
+        return struct.unpack_from("<Q", self.mmap, offset)[0]
+
+    def _counter_set(self, offset, value):
+        struct.pack_into("<Q", self.mmap, offset, value)
+
+    def _lock(self):
+        # flock() locks belong to the open file, which is shared with
+        # the processes forked after opening it, so each process
+        # opens its own to lock; threads are serialized separately
+        if self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self.filename, os.O_RDWR)
+            self._lock_thread = threading.Lock()
+            self._lock_pid = os.getpid()
+        self._lock_thread.acquire()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        self._lock_thread.release()
+
+    def _find(self, key):
+        # return the offset of the record for the key, None if missing
+        slot = zlib.crc32(key) % self.slots
+        for _ in range(self.slots):
+            offset = self._offset(slot)
+            key_slot = self.mmap[offset:offset + 16]
+            if key_slot == key:
+                return offset
+            if key_slot == self._empty:
+                return None
+            slot = (slot + 1) % self.slots
+        return None
+
+    def _rehash_wait(self):
+        # a rehash is in progress; wait for it to finish by taking
+        # the lock it holds
+        self._lock()
+        try:
+            if self._counter(self._offset_rehashes) & 1:
+                # whoever was rehashing died before finishing
+                self._rehash()
+        finally:
+            self._unlock()
+
+    def _stable(self, fn):
+        # run fn() (which looks up the table without the lock) until
+        # it does so while the table is not being rehashed
+        while True:
+            rehashes = self._counter(self._offset_rehashes)
+            if rehashes & 1:
+                self._rehash_wait()
+                continue
+            r = fn()
+            if self._counter(self._offset_rehashes) == rehashes:
+                return r
+
+    def _rehash(self):
+        # Reinsert all the records with no tombstones; call with the
+        # file locked
+        rehashes = self._counter(self._offset_rehashes) | 1
+        self._counter_set(self._offset_rehashes, rehashes)
+        data = self.mmap[self._header.size:self.size]
+        self.mmap[self._header.size:self.size] = \
+            b"\0" * (self.size - self._header.size)
+        for key, ts in self._record.iter_unpack(data):
+            if key in ( self._empty, self._tombstone ):
+                continue
+            slot = zlib.crc32(key) % self.slots
+            while self.mmap[self._offset(slot):self._offset(slot) + 16] \
+                  != self._empty:
+                slot = (slot + 1) % self.slots
+            self._record.pack_into(self.mmap, self._offset(slot), key, ts)
+        self._counter_set(self._offset_tombstones, 0)
+        self._counter_set(self._offset_rehashes, rehashes + 1)
+
+    def _generation_bump(self):
+        self._counter_set(self._offset_generation,
+                          self._counter(self._offset_generation) + 1)
+
+    def generation(self):
+        """
+        :returns int: counter increased every time an allocation is
+          added or removed
+        """
+        return self._counter(self._offset_generation)
+
+    def tombstones(self):
+        """
+        :returns int: number of slots left by removed allocations
+          that lookups have to probe past
+        """
+        return self._counter(self._offset_tombstones)
+
+    def get(self, allocid):
+        """
+        :returns float: last keepalive timestamp of the allocation or
+          *None* if not in the table
+        """
+        key = self._key(allocid)
+        if key == None:
+            return None
+
+        def _get():
+            offset = self._find(key)
+            if offset == None:
+                return None
+            return struct.unpack_from("<d", self.mmap, offset + 16)[0]
+
+        return self._stable(_get)
+
+    def touch(self, allocid, ts = None):
+        """
+        Record a keepalive for an allocation
+
+        :param str allocid: allocation ID
+        :param float ts: (optional) timestamp, default now
+        :returns bool: *True* if recorded, *False* if the table is
+          full and the caller has to record it somewhere else
+        """
+        if ts == None:
+            ts = time.time()
+        key = self._key(allocid)
+        if key == None:
+            return False
+
+        def _touch():
+            # if the table was rehashed under us, we might have written
+            # to a slot now used by another allocation, making it look
+            # kept alive now; that's harmless, it is retried.
+            offset = self._find(key)
+            if offset != None:
+                struct.pack_into("<d", self.mmap, offset + 16, ts)
+            return offset
+
+        if self._stable(_touch) != None:
+            return True
+        return self._add(key, ts)
+
+    def _add(self, key, ts):
+        self._lock()
+        try:
+            # someone might have added it while we waited for the lock
+            offset = self._find(key)
+            if offset != None:
+                struct.pack_into("<d", self.mmap, offset + 16, ts)
+                return True
+            slot = zlib.crc32(key) % self.slots
+            for _ in range(self.slots):
+                offset = self._offset(slot)
+                key_slot = self.mmap[offset:offset + 16]
+                if key_slot in ( self._empty, self._tombstone ):
+                    # timestamp first, so nobody sees the key with
+                    # a stale timestamp
+                    struct.pack_into("<d", self.mmap, offset + 16, ts)
+                    self.mmap[offset:offset + 16] = key
+                    if key_slot == self._tombstone:
+                        self._counter_set(self._offset_tombstones,
+                                          self.tombstones() - 1)
+                    self._generation_bump()
+                    return True
+                slot = (slot + 1) % self.slots
+            if not self.full_warned:
+                logging.warning(
+                    "ALLOC: keepalive table full (%d slots), recording"
+                    " keepalives in the allocation database; consider"
+                    " increasing ttbl.config.allocation_keepalive_slots",
+                    self.slots)
+                self.full_warned = True
+            return False
+        finally:
+            self._unlock()
+
+    def remove(self, allocid):
+        """
+        Remove an allocation from the table
+        """
+        key = self._key(allocid)
+        if key == None:
+            return
+        self._lock()
+        try:
+            offset = self._find(key)
+            if offset == None:
+                return
+            slot = (offset - self._header.size) // self._record.size
+            offset_next = self._offset((slot + 1) % self.slots)
+            if self.mmap[offset_next:offset_next + 16] != self._empty:
+                # others might be probing past it
+                self.mmap[offset:offset + 16] = self._tombstone
+                self._counter_set(self._offset_tombstones,
+                                  self.tombstones() + 1)
+            else:
+                # nothing past it, so neither past the tombstones
+                # right before it
+                self.mmap[offset:offset + 16] = self._empty
+                tombstones = self.tombstones()
+                for _ in range(self.slots - 1):
+                    slot = (slot - 1) % self.slots
+                    offset = self._offset(slot)
+                    if self.mmap[offset:offset + 16] != self._tombstone:
+                        break
+                    self.mmap[offset:offset + 16] = self._empty
+                    tombstones -= 1
+                self._counter_set(self._offset_tombstones, tombstones)
+            if self.tombstones() > self.tombstones_max * self.slots:
+                self._rehash()
+            self._generation_bump()
+        finally:
+            self._unlock()
+
+    def items(self):
+        """
+        Iterate over the allocations in the table
+
+        :returns: iterator of *( ALLOCID, TIMESTAMP )*
+        """
+        data = self._stable(
+            lambda: self.mmap[self._header.size:self.size])
+        for key, ts in self._record.iter_unpack(data):
+            if key in ( self._empty, self._tombstone ):
+                continue
+            yield key.rstrip(b"\0").decode(), ts
+
+
+#: Shared table of allocation keepalive timestamps (initialized by
+#: :func:`init`)
+keepalive_table = None
+
 class allocation_c(commonl.fsdb_symlink_c):
     """
     Backed by state in disk
@@ -227,6 +566,8 @@ class allocation_c(commonl.fsdb_symlink_c):
             # to it invalid and the next _run() call will clean them
             shutil.rmtree(self.location, True)
             lru_aged_cache_allocation_c.invalidate(self.allocid)
+            if keepalive_table:
+                keepalive_table.remove(self.allocid)
         # FIXME: implement a DB of recently deleted reservations so anyone
         # trying to use it gets a state invalid/timedout/overtime/removed
         # release all queueing/owning targets to it
@@ -249,14 +590,25 @@ class allocation_c(commonl.fsdb_symlink_c):
     def state_get(self):
         return self.get('state')
 
-    def timestamp(self):
+    @staticmethod
+    def _timestamp_mk(ts = None):
         # 20200323113030 is more readable than seconds since the epoch
         # and we still can do easy arithmentic with it.
-        ts = time.strftime("%Y%m%d%H%M%S")
-        self.set('timestamp', ts, force = True)
-        return ts
+        return time.strftime("%Y%m%d%H%M%S", time.localtime(ts))
+
+    def timestamp(self):
+        ts = time.time()
+        # keepalive table first, so we don't write to disk
+        if keepalive_table == None \
+           or not keepalive_table.touch(self.allocid, ts):
+            self.set('timestamp', self._timestamp_mk(ts), force = True)
+        return self._timestamp_mk(ts)
 
     def timestamp_get(self):
+        if keepalive_table:
+            ts = keepalive_table.get(self.allocid)
+            if ts != None:
+                return self._timestamp_mk(ts)
         # if there is no timestamp, forge the Epoch
         return self.get('timestamp', "19700101000000")
 
@@ -279,9 +631,10 @@ class allocation_c(commonl.fsdb_symlink_c):
             # datetime format
             ts_endtime = datetime.datetime.strptime(endtime, "%Y%m%d%H%M%S")
             if ts_endtime > ts_now:
-                logging.info(
-                    "ALLOC: allocation %s expired @%s, deleting",
-                    self.allocid, endtime)
+                return			# not yet
+            logging.info(
+                "ALLOC: allocation %s expired @%s, deleting",
+                self.allocid, endtime)
             if audit:
                 # FIXME: this is really messy -- audit.record needs to be better
                 _auditor = audit("unused")
@@ -450,14 +803,15 @@ class allocation_c(commonl.fsdb_symlink_c):
         # of guests will be low (generally < 5) and thus a base32 ID space of
         # four digits will do more than enough to guarantee there is no
         # collissions. FLWs.
-        guestid = commonl.mkid(userid, l = 4)
-        self.set("guest." + guestid, userid)
+        self.set(self._guest_key(userid), userid)
+
+    @staticmethod
+    def _guest_key(userid):
+        return "guest." + commonl.mkid(userid, l = 4)
 
     def guest_remove(self, userid):
         # a guest is trying to delete, which just removes the user
-        guestid = commonl.mkid(userid, l = 4)
-        # same as guest_remove()
-        self.set("guest." + guestid, None)
+        self.set(self._guest_key(userid), None)
 
 
     def guest_list(self):
@@ -488,7 +842,7 @@ class allocation_c(commonl.fsdb_symlink_c):
         d['target_group'] = {}
         for group_name, group in self.groups.items():
             d['target_group'][group_name] = list(group)
-        d['timestamp'] = self.get("timestamp")
+        d['timestamp'] = self.timestamp_get()
         for key in self.keys("extra_data.*"):
             d[key] = self.get(key)
 
@@ -523,6 +877,135 @@ def init(state_path):
     commonl.makedirs_p(allocid_uuid_db_path)
     allocid_uuid_db = commonl.fs_cache_c(allocid_uuid_db_path)
 
+    # Load the existing allocations in the keepalive table with the
+    # newest timestamp we know of; this has to be done before the
+    # server forks, so all the processes share the same table
+    global keepalive_table
+    keepalive_table = keepalive_table_c(
+        os.path.join(state_path, "cache", "allocation_keepalive.table"),
+        ttbl.config.allocation_keepalive_slots)
+    timestamps_previous = keepalive_table.timestamps_previous
+    for allocid in os.listdir(path):
+        try:
+            allocdb = commonl.fsdb_symlink_c(os.path.join(path, allocid),
+                                             concept = "allocid")
+        except commonl.fsdb_symlink_c.invalid_e:
+            continue
+        ts = time.mktime(time.strptime(
+            allocdb.get('timestamp', "19700101000000"), "%Y%m%d%H%M%S"))
+        ts = max(ts, timestamps_previous.get(allocid, 0))
+        keepalive_table.touch(allocid, ts)
+    keepalive_table.timestamps_previous = None
+
+
+# Deadline heap, used by expire() in the cleanup process to know which
+# allocation might have to be expired next
+#
+# The heap is lazy: entries in the heap might be stale (the
+# allocation was kept alive or removed since); _deadlines_known has
+# the current one for each allocation, and a popped entry that doesn't
+# match is ignored.
+_deadlines = []			# [ ( DEADLINE, ALLOCID ) ]
+_deadlines_known = {}		# ALLOCID: DEADLINE (None: never idles out)
+_deadlines_generation = None	# keepalive_table's generation last scanned
+_endtimes = {}			# ALLOCID: END TIMESTAMP | "static" | None
+
+
+def _deadline_calc(allocid, ts_keepalive):
+    # when shall this allocation be looked at next?
+    if allocid not in _endtimes:
+        try:
+            allocdb = commonl.fsdb_symlink_c(os.path.join(path, allocid),
+                                             concept = "allocid")
+            _endtimes[allocid] = allocdb.get("endtime", None)
+        except commonl.fsdb_symlink_c.invalid_e:
+            return None
+    endtime = _endtimes[allocid]
+    if endtime == "static":
+        return None		# only ends when removed
+    if endtime != None:		# only ends at endtime
+        return time.mktime(time.strptime(endtime, "%Y%m%d%H%M%S"))
+    return ts_keepalive + ttbl.config.target_max_idle
+
+
+def _deadlines_rescan():
+    # refresh the deadlines from the keepalive table, since
+    # allocations have been added or removed
+    timestamps = dict(keepalive_table.items())
+    for allocid in list(_deadlines_known):
+        if allocid not in timestamps:	# removed, heap entry is now stale
+            del _deadlines_known[allocid]
+            _endtimes.pop(allocid, None)
+    for allocid, ts in timestamps.items():
+        if allocid in _deadlines_known:
+            continue
+        deadline = _deadline_calc(allocid, ts)
+        _deadlines_known[allocid] = deadline
+        if deadline != None:
+            heapq.heappush(_deadlines, ( deadline, allocid ))
+
+
+def deadline_next():
+    """
+    :returns float: time (seconds since the epoch) when the next
+      allocation might have to be expired by :func:`expire`; *None*
+      if none is known
+    """
+    while _deadlines:
+        deadline, allocid = _deadlines[0]
+        if _deadlines_known.get(allocid, None) == deadline:
+            return deadline
+        heapq.heappop(_deadlines)	# stale
+    return None
+
+
+def expire(ts_now):
+    """
+    Remove the allocations that have been idle for too long or whose
+    end time has passed
+
+    Instead of looking at every allocation, pops from a heap the
+    ones whose deadline (last keepalive plus
+    :data:`ttbl.config.target_max_idle` or the end time) has passed
+    and checks only those.
+
+    Meant to be called from the cleanup process as often as needed,
+    see :func:`deadline_next`.
+
+    :param datetime.datetime ts_now: current time
+    """
+    global _deadlines_generation
+    if keepalive_table == None:
+        return
+    generation = keepalive_table.generation()
+    if generation != _deadlines_generation:
+        _deadlines_generation = generation
+        _deadlines_rescan()
+    ts = time.mktime(ts_now.timetuple())
+    while _deadlines and _deadlines[0][0] <= ts:
+        deadline, allocid = heapq.heappop(_deadlines)
+        if _deadlines_known.get(allocid, None) != deadline:
+            continue			# stale entry
+        ts_keepalive = keepalive_table.get(allocid)
+        if ts_keepalive == None:	# removed
+            del _deadlines_known[allocid]
+            continue
+        deadline = _deadline_calc(allocid, ts_keepalive)
+        if deadline != None and deadline <= ts:
+            try:
+                allocdb = get_from_cache(allocid)
+                allocdb.maintenance(ts_now)
+            except allocation_c.invalid_e:
+                pass
+            if not os.path.isdir(os.path.join(path, allocid)):
+                continue		# gone; rescan will clean it
+            # still there? (eg: timestamps with second
+            # granularity), look again in a bit
+            deadline = ts + 1
+        _deadlines_known[allocid] = deadline
+        if deadline != None:
+            heapq.heappush(_deadlines, ( deadline, allocid ))
+
 
 
 def _waiter_validate(target, waiter_string, value):
@@ -914,6 +1397,25 @@ def request(groups, calling_user, obo_user, guests,
         >>> "20230930000000"
     """
 
+    r = _request_create(groups, calling_user, obo_user, guests,
+                        priority, preempt, queue, shared,
+                        extra_data, reason, endtime)
+    if isinstance(r, dict):		# rejected
+        return r
+    allocdb, targets_all = r
+    _run(targets_all.values(), preempt)
+    return _request_result(allocdb, queue)
+
+
+def _request_create(groups, calling_user, obo_user, guests,
+                    priority, preempt, queue, shared,
+                    extra_data, reason, endtime):
+    # Verify the request and create the allocation, queuing it on all
+    # the targets it needs; a scheduler run is still needed.
+    #
+    # returns a dictionary with a rejection or a tuple ALLOCDB,
+    # TARGETS_ALL (dictionary of target objects keyed by name).
+
     # FIXME: add other extra data
     #
     # - *timeout*: a maximum timeout (0 to disable, ACLed)
@@ -1050,35 +1552,43 @@ def request(groups, calling_user, obo_user, guests,
 
     allocdb = get_from_cache(allocid)
 
-    allocdb.set("preempt", preempt)
-    allocdb.set("priority", priority)
-    allocdb.set("user", obo_user)
-    allocdb.set("creator", calling_user.get_id())
+    ts = allocdb._timestamp_mk()
+    fields = [
+        ( "preempt", preempt ),
+        ( "priority", priority ),
+        ( "user", obo_user ),
+        ( "creator", calling_user.get_id() ),
+        ( "timestamp", ts ),
+        ( "state", "queued" ),
+        # FIXME: these is severly limited in size, we need a normal
+        # file to set this info with one target per file
+        ( "targets_all", ",".join(targets_all.keys()) ),
+    ]
     if endtime != None:
-        allocdb.set("endtime", endtime)
+        fields.append(( "endtime", endtime ))
     if reason:
         if len(reason) > ttbl.config.reason_len_max:
             reason = reason[:ttbl.config.reason_len_max]
-        allocdb.set("reason", reason)
+        fields.append(( "reason", reason ))
     for guest in guests:
-        allocdb.guest_add(guest)
-    ts = allocdb.timestamp()
+        fields.append(( allocdb._guest_key(guest), guest ))
     # The extra data is just recorded, that's it-- some drivers might
     # use it, some not
     for k, v in extra_data.items():
-        allocdb.set(f"extra_data.{k}", v)
+        fields.append(( f"extra_data.{k}", v ))
         if k == "uuid":
             with allocid_uuid_db.lock():
                 allocid_uuid_db.set_unlocked(v, ts)
                 allocid_uuid_db.lru_cleanup_unlocked(allocid_uuid_max_entries)
-
-    allocdb.state_set('queued')
-    # FIXME: these is severly limited in size, we need a normal file to
-    # set this info with one target per file
-    allocdb.set("targets_all", ",".join(targets_all.keys()))
     for group, targets in groups_clean_str.items():
-        allocdb.set("group." + group, targets)
+        fields.append(( "group." + group, targets ))
+    # The allocation was just created, so its key space is empty:
+    # nothing to overwrite (no need to write and rename) and nothing
+    # to clean up (no need to scan for an index)
+    allocdb.set_keys(fields, force = False, keys_index = {})
     allocdb.target_info_reload()
+    if keepalive_table:
+        keepalive_table.touch(allocid)
 
     # At this point the allocation record is ready -- no target can
     # see it yet, so there is no danger the _run() method will see it
@@ -1123,25 +1633,33 @@ def request(groups, calling_user, obo_user, guests,
     # share that position in the queue
     flags = "P" if preempt else "N"
     flags += "S" if shared else "E"
+    # IF there is a collision, things will get dropped randomly,
+    # so besides the second level granularity timestamp (which is
+    # not enough), add the allocation ID -- since there will be
+    # ONE entry per allocation ID only.
+    waiter_key = "_alloc.queue.%06d-%s-%s-%s" % (priority, ts, flags, allocid)
     for target in targets_all.values():
         # FIXME: policy: can we queue on this target? otherwise append to
         # rejected targets and cleanup
         # target.check_user_is_allowed(calling_user)
         # target.check_user_is_allowed(obo_user)
-        # IF there is a collision, things will get dropped randomly,
-        # so besides the second level granularity timestamp (which is
-        # not enough), add the allocation ID -- since there will be
-        # ONE entry per allocation ID only.
-        target.fsdb.set(
-            "_alloc.queue.%06d-%s-%s-%s" % (priority, ts, flags, allocid),
-            allocid)
+        #
+        # The key is unique to this allocation and _alloc.queue is
+        # never a scalar, so there is nothing to overwrite or clean
+        # up in the target's key space; just create it.
+        target.fsdb.set(waiter_key, allocid, force = False,
+                        nested_flat_keyspace = False)
+
+    return allocdb, targets_all
 
-    _run(targets_all.values(), preempt)
 
+def _request_result(allocdb, queue):
+    # once a scheduler run has been done on a new allocation, report
+    # its state (and remove it if it was not to be queued)
     state = allocdb.state_get()
     result = {
         "state": state,
-        "allocid": allocid,
+        "allocid": allocdb.allocid,
         "_message": states[state],
     }
     if queue == False:
@@ -1161,6 +1679,131 @@ def request(groups, calling_user, obo_user, guests,
     return result
 
 
+def request_batch(requests, calling_user):
+    """
+    Request multiple allocations at the same time
+
+    All the allocations are created and queued on their targets
+    before running the scheduler once on all of them, which is
+    considerably faster than calling :func:`request` for each.
+
+    :param list(dict) requests: list of requests; each is a
+      dictionary with the arguments to :func:`request` (*groups*,
+      *obo_user*, *guests*, *priority*, *preempt*, *queue*, *shared*,
+      *extra_data*, *reason*, *endtime*); *obo_user* defaults to the
+      calling user.
+
+    :returns list(dict): for each request, in the same order, the same
+      dictionary :func:`request` would have returned
+    """
+    assert isinstance(calling_user, ttbl.user_control.User)
+    assert isinstance(requests, list), \
+        f"requests: expected list of dictionaries; got {type(requests)}"
+    results = [ None ] * len(requests)
+    created = []
+    targets = {}
+    preempt_any = False
+    for index, data in enumerate(requests):
+        try:
+            assert isinstance(data, dict), \
+                f"request #{index}: expected a dictionary; got {type(data)}"
+            preempt = data.get('preempt', False)
+            queue = data.get('queue', False)
+            r = _request_create(
+                data['groups'], calling_user,
+                data.get('obo_user', calling_user.get_id()),
+                data.get('guests', []),
+                data.get('priority', None), preempt, queue,
+                data.get('shared', False),
+                data.get('extra_data', None),
+                data.get('reason', None),
+                data.get('endtime', None))
+        except ( AssertionError, KeyError ) as e:
+            results[index] = {
+                "state": "rejected",
+                "_message": f"request #{index}: {e}",
+            }
+            continue
+        except Exception as e:
+            # don't let one bad request leave the allocations already
+            # created in the batch queued but never scheduled
+            logging.exception("request #%d: error creating allocation: %s",
+                              index, e)
+            results[index] = {
+                "state": "rejected",
+                "_message": f"request #{index}: error creating"
+                f" allocation: {e}",
+            }
+            continue
+        if isinstance(r, dict):		# rejected
+            results[index] = r
+            continue
+        allocdb, targets_all = r
+        created.append(( index, allocdb, queue ))
+        targets.update(targets_all)
+        preempt_any |= preempt
+
+    _run(targets.values(), preempt_any)
+    for index, allocdb, queue in created:
+        results[index] = _request_result(allocdb, queue)
+    return results
+
+
+def watch(allocid_states, calling_user, timeout, period = 0.25):
+    """
+    Wait for any of a set of allocations to change state
+
+    This also counts as a keepalive for the allocations the calling
+    user is allowed to keep alive (see :func:`keepalive`).
+
+    :param dict allocid_states: dictionary keyed by allocation ID of
+      the state the caller knows it is in
+
+    :param float timeout: maximum time to wait for a change
+
+    :param float period: (optional) how often to check for changes
+
+    :returns dict: dictionary keyed by allocation ID of those whose
+      state is different to the one given, each a dictionary with
+      *state* and (when the allocation is *active*) *group_allocated*.
+      If nothing changed in *timeout* seconds, empty.
+    """
+    assert isinstance(calling_user, ttbl.user_control.User)
+    assert isinstance(allocid_states, dict), \
+        "allocids: expected a dictionary of ALLOCID: STATE;" \
+        f" got {type(allocid_states)}"
+    ts0 = time.time()
+    for allocid in allocid_states:
+        try:
+            allocdb = get_from_cache(allocid)
+            if allocdb.check_user_is_creator_admin(calling_user):
+                allocdb.timestamp()
+        except allocation_c.invalid_e:
+            pass			# will be reported below
+    while True:
+        result = {}
+        for allocid, state_expected in allocid_states.items():
+            try:
+                allocdb = get_from_cache(allocid)
+            except allocation_c.invalid_e:
+                state = "invalid"
+            else:
+                if allocdb.check_query_permission(calling_user):
+                    state = allocdb.state_get()
+                else:
+                    state = "rejected"
+            if state == state_expected:
+                continue
+            result[allocid] = dict(state = state)
+            if state == "active":
+                # set in calculate_stuff()
+                result[allocid]['group_allocated'] = \
+                    allocdb.get("group_allocated")
+        if result or time.time() - ts0 >= timeout:
+            return result
+        time.sleep(period)
+
+
 def query(calling_user):
     assert isinstance(calling_user, ttbl.user_control.User)
     result = {}
@@ -1307,9 +1950,13 @@ def maintenance(ts_now, calling_user, keepalive_fn = None):
     assert isinstance(calling_user, ttbl.user_control.User)
     assert keepalive_fn == None or callable(keepalive_fn)
 
-    # allocations: run maintenance (expire, check overtimes)
+    # allocations: expire those whose deadline has passed; those not
+    # in the keepalive table (eg: if it is full) are checked one by one
+    expire(ts_now)
     for _rootname, allocids, _filenames in os.walk(path):
         for allocid in allocids:
+            if allocid in _deadlines_known:
+                continue
             try:
                 allocdb = get_from_cache(allocid)
                 allocdb.maintenance(ts_now)
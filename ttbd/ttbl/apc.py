@@ -149,6 +149,8 @@ class pc(ttbl.power.impl_c):
     #: the last digit is the outlet number, 1..N.
     pdu_outlet_ctl_prefix = [ 4, 2, 1, 3 ]
 
+    upid_device_fields = ( "hostname", )
+
     def __init__(self, hostname, outlet, oid = None, **kwargs):
         ttbl.power.impl_c.__init__(self, **kwargs)
 
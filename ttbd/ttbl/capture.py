@@ -145,6 +145,7 @@ import collections
 import datetime
 import errno
 import json
+import multiprocessing
 import os
 import re
 import signal
@@ -153,6 +154,8 @@ import subprocess
 import time
 import sys
 
+import filelock
+
 import commonl
 import ttbl
 
@@ -601,14 +604,62 @@ class generic_snapshot(impl_c):
     captures the screen for *TARGETNAME*. Note it is recommended to
     call the video interface *video-SOMETHING* so that tools such as
     *ffmpeg* won't be confused.
+
+    **Persistent grabber**
+
+    Running *cmdline* for each snapshot means opening the device,
+    negotiating and waiting for a frame every time. If *grabber_cmdline*
+    is given, it is used instead to start a program that keeps
+    grabbing frames and replacing the file
+    *%(_impl.frame_filename)s* with the latest one, eg:
+
+    >>> "ffmpeg -nostdin -i /dev/video-%(id)s-0 -r 5 -c:v png"
+    >>> " -f image2 -update 1 -atomic_writing 1"
+    >>> " -y %(_impl.frame_filename)s"
+
+    The file has to be replaced atomically (written to a temporary
+    file which is then renamed), so it always contains a full frame.
+
+    The grabber is started (after running *pre_commands*) on the
+    first snapshot and each snapshot is a copy of the latest frame,
+    not older than *grabber_frame_max_age* seconds. When no snapshots
+    have been taken for *grabber_idle_timeout* seconds, the grabber
+    is stopped.
+
+    :param str grabber_cmdline: (optional) command line to start the
+      persistent grabber; *cmdline* is then not used.
+
+    :param float grabber_idle_timeout: (optional) seconds without
+      snapshots after which the grabber is stopped.
+
+    :param float grabber_frame_max_age: (optional) maximum age of a
+      frame in seconds to be returned as a snapshot; if the latest
+      frame is older, wait for a new one.
+
+    :param float grabber_timeout: (optional) maximum seconds to wait
+      for a frame not older than *grabber_frame_max_age*.
     """
     def __init__(self, name, cmdline, mimetype, pre_commands = None,
-                 extension = ""):
+                 extension = "", grabber_cmdline = None,
+                 grabber_idle_timeout = 60, grabber_frame_max_age = 1,
+                 grabber_timeout = 10):
         assert isinstance(name, str_type)
         assert isinstance(cmdline, str_type)
         assert isinstance(extension, str_type)
+        assert grabber_cmdline == None \
+            or isinstance(grabber_cmdline, str_type)
+        assert grabber_idle_timeout > 0
+        assert grabber_frame_max_age > 0
+        assert grabber_timeout > 0
         self.name = name
         self.cmdline = cmdline.split()
+        if grabber_cmdline:
+            self.grabber_cmdline = grabber_cmdline.split()
+        else:
+            self.grabber_cmdline = None
+        self.grabber_idle_timeout = grabber_idle_timeout
+        self.grabber_frame_max_age = grabber_frame_max_age
+        self.grabber_timeout = grabber_timeout
         if pre_commands:
             self.pre_commands = pre_commands
             assert all([ isinstance(command, str_type)
@@ -623,6 +674,117 @@ class generic_snapshot(impl_c):
         self.upid_set(name, serial_number = commonl.mkid(cmdline))
 
 
+    def _grabber_fn(self, target, capturer, cmdline, pidfile, usedfile,
+                    log_filename):
+        # Runs in its own process; starts the grabber and stops it
+        # when no snapshots have been taken for a while or when we
+        # are killed
+        def _sigterm(_signum, _frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, _sigterm)
+        # the server's handler would reap the grabber from under us
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        with open(log_filename, "a") as logf:
+            p = subprocess.Popen(
+                cmdline, cwd = "/tmp", shell = False, close_fds = True,
+                stdout = logf, stderr = subprocess.STDOUT)
+        try:
+            period = min(1, self.grabber_idle_timeout / 4)
+            while p.poll() == None:
+                idle = time.time() - os.stat(usedfile).st_mtime
+                if idle > self.grabber_idle_timeout:
+                    target.log.info("%s: stopping grabber, idle for %.1fs",
+                                    capturer, idle)
+                    break
+                time.sleep(period)
+            else:
+                target.log.error("%s: grabber died, exit code %s",
+                                 capturer, p.returncode)
+        finally:
+            if p.poll() == None:
+                p.terminate()
+                try:
+                    p.wait(2)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+                    p.wait()
+            if commonl.process_alive(pidfile) == os.getpid():
+                commonl.rm_f(pidfile)
+
+
+    def _grabber_start(self, target, capturer, kws, logf,
+                       pidfile, framefile, usedfile):
+        # leftovers from a grabber that was stopped
+        commonl.rm_f(pidfile)
+        commonl.rm_f(framefile)
+        for command in self.pre_commands:
+            pre_command = commonl.kws_expand(command, kws)
+            logf.write("INFO: calling pre-command: %s\n" % pre_command)
+            logf.flush()
+            subprocess.check_call(
+                pre_command,
+                shell = True, close_fds = True, cwd = "/tmp",
+                stdout = logf, stderr = subprocess.STDOUT)
+        cmdline = []
+        for i in self.grabber_cmdline:
+            cmdline.append(commonl.kws_expand(i, kws))
+        target.log.info("%s: grabber command: %s" % (
+            capturer, " ".join(cmdline)))
+        logf.write("INFO: starting grabber: %s\n" % " ".join(cmdline))
+        logf.flush()
+        p = multiprocessing.Process(
+            target = self._grabber_fn,
+            args = ( target, capturer, cmdline, pidfile, usedfile,
+                     kws['_impl.grabber_log_filename'] ))
+        p.daemon = True
+        p.start()
+        with open(pidfile, "w+") as pidf:
+            pidf.write("%s" % p.pid)
+        ttbl.daemon_pid_add(p.pid)
+
+
+    def _grabber_snapshot(self, target, capturer, kws, logf):
+        # take the snapshot from the latest frame captured by the
+        # grabber, starting it if not running
+        pidfile = kws['_impl.grabber_pidfile']
+        framefile = kws['_impl.frame_filename']
+        usedfile = kws['_impl.grabber_used_filename']
+        ts_request = time.time()
+        # the grabber stays alive as long as this keeps being touched
+        with open(usedfile, "a"):
+            os.utime(usedfile)
+        started = False
+        while True:
+            if not commonl.process_alive(pidfile):
+                # only one starts it; the rest wait for it to be
+                # started and use it
+                with filelock.FileLock(kws['_impl.grabber_lock_filename'],
+                                       timeout = self.grabber_timeout):
+                    if not commonl.process_alive(pidfile):
+                        if started:
+                            raise RuntimeError(
+                                "%s: grabber died; see %s"
+                                % (capturer,
+                                   kws['_impl.grabber_log_filename']))
+                        self._grabber_start(target, capturer, kws, logf,
+                                            pidfile, framefile, usedfile)
+                        started = True
+            try:
+                ts_frame = os.stat(framefile).st_mtime
+                if ts_frame >= ts_request - self.grabber_frame_max_age:
+                    shutil.copyfile(framefile, kws['_impl.stream_filename'])
+                    logf.write("INFO: copied frame from %.3f\n" % ts_frame)
+                    return
+            except FileNotFoundError:
+                pass
+            if time.time() - ts_request > self.grabber_timeout:
+                raise RuntimeError(
+                    "%s: grabber produced no frame in %.1fs; see %s"
+                    % (capturer, self.grabber_timeout,
+                       kws['_impl.grabber_log_filename']))
+            time.sleep(0.05)
+
+
     def start(self, target, capturer, path):
         stream_filename = capturer + self.extension
         log_filename = capturer + ".log"
@@ -634,6 +796,15 @@ class generic_snapshot(impl_c):
         kws['_impl.log_filename'] = os.path.join(path, log_filename)
         kws['_impl.capturer'] = capturer
         kws['_impl.timestamp'] = str(datetime.datetime.utcnow())
+        # the grabber outlives the capture/ directory, which is wiped
+        # on release
+        grabber_prefix = os.path.join(target.state_dir,
+                                      "capture-%s.grabber" % capturer)
+        kws['_impl.frame_filename'] = grabber_prefix + ".frame" + self.extension
+        kws['_impl.grabber_pidfile'] = grabber_prefix + ".pid"
+        kws['_impl.grabber_used_filename'] = grabber_prefix + ".used"
+        kws['_impl.grabber_log_filename'] = grabber_prefix + ".log"
+        kws['_impl.grabber_lock_filename'] = grabber_prefix + ".lock"
 
         with open(kws['_impl.log_filename'], "w+") as logf:
             logf.write(commonl.kws_expand("""\
@@ -641,6 +812,12 @@ INFO: ttbd running generic_snaphost capture for '%(_impl.capturer)s' at %(_impl.
 INFO: log_file (this file): %(_impl.log_filename)s
 INFO: stream_file: %(_impl.stream_filename)s
 """, kws))
+            if self.grabber_cmdline:
+                self._grabber_snapshot(target, capturer, kws, logf)
+                target.log.info("%s: generic snapshot taken from grabber"
+                                % capturer)
+                return False, { "default": stream_filename,
+                                "log": log_filename }
             try:
                 for command in self.pre_commands:
                     # yup, run with shell -- this is not a user level
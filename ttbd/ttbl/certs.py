@@ -4,10 +4,6 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 #
-# Timeouts: we use a common timeout of 10s for generating keys, since
-# in some older machines it might go over 5secs once we increased the
-# default key size to 4kbits
-#
 """
 Interface to manage target specific SSL certificates
 ****************************************************
@@ -42,6 +38,15 @@ Note these certificates are:
 - all client certificates, server certificates and certificate
   authority are wiped when the target is released
 
+**Performance**
+
+Keys and certificates are generated in the server process (no
+*openssl* commands are run); keys come from a pool
+(:class:`key_pool_c`) refilled in the background, so requests don't
+have to wait for a key to be generated. There is one pool per type
+and size of key in each server process (see :func:`key_pool_get`),
+started when the first certificate is requested.
+
 HTTP interface
 --------------
 
@@ -112,13 +117,239 @@ None
 
 
 """
+import datetime
 import os
 import shutil
-import subprocess
+import threading
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
 
 import commonl
 import ttbl
 
+#: Diffie-Hellman parameters written to *dh.pem* (eg: for OpenVPN)
+#:
+#: This is the *ffdhe2048* group from RFC 7919; well known groups are
+#: recommended over custom generated ones and we don't have to spend
+#: time generating them for each allocation.
+dh_params_pem = """\
+-----BEGIN DH PARAMETERS-----
+MIIBCAKCAQEA//////////+t+FRYortKmq/cViAnPTzx2LnFg84tNpWp4TZBFGQz
++8yTnc4kmz75fS/jY2MMddj2gbICrsRhetPfHtXV/WVhJDP1H18GbtCFY2VVPe0a
+87VXE15/V8k1mE8McODmi3fipona8+/och3xWKE2rec1MKzKT0g6eXq8CrGCsyT7
+YdEIqUuyyOP7uWrat2DX9GgdT0Kj3jlN9K5W7edjcrsZCwenyO4KbXCeAvzhzffi
+7MA0BM0oNC9hkXL+nOmFg/+OTxIy7vKBg8P+OxtMb61zO7X8vC7CIAXFjvGDfRaD
+ssbzSibBsu/6iGtCOGEoXJf//////////wIBAg==
+-----END DH PARAMETERS-----
+"""
+
+_ec_curves = {
+    256: ec.SECP256R1,
+    384: ec.SECP384R1,
+    521: ec.SECP521R1,
+}
+
+
+class key_pool_c:
+    """
+    Pool of pre-generated private keys, refilled in the background
+
+    Generating a key (specially RSA) can take from hundreds of
+    milliseconds to seconds; a thread keeps up to *size* keys ready so
+    requests can take one without waiting. If there are none left, a
+    key is generated on the spot.
+
+    Keys are never handed out twice; the pool is emptied in processes
+    forked after keys were generated, so parent and child can't get
+    the same keys.
+
+    :param str key_type: *rsa* or *ec*
+
+    :param int key_size: bits in the RSA key or size of the EC curve
+      (256, 384 or 521)
+
+    :param int size: maximum number of keys to keep ready; 0 to
+      disable the pool and always generate on the spot
+    """
+    def __init__(self, key_type: str, key_size: int, size: int):
+        assert key_type in ( "rsa", "ec" ), \
+            f"key_type: expected 'rsa' or 'ec', got '{key_type}'"
+        assert isinstance(key_size, int) and key_size > 0, \
+            f"key_size: expected int > 0, got [{type(key_size)}]: '{key_size}'"
+        if key_type == "ec":
+            assert key_size in _ec_curves, \
+                f"key_size: for EC keys, expected one of" \
+                f" {', '.join(str(i) for i in _ec_curves)}; got {key_size}"
+        assert isinstance(size, int) and size >= 0, \
+            f"size: expected int >= 0, got [{type(size)}]: '{size}'"
+        self.key_type = key_type
+        self.key_size = key_size
+        self.size = size
+        self._pid = None
+        self._reset()
+
+
+    def _reset(self):
+        # a forked child might inherit the lock taken, so it can't be
+        # shared with the parent
+        self._pid = os.getpid()
+        self.keys = []
+        self.condition = threading.Condition()
+        self.thread = None
+
+
+    def generate(self):
+        """
+        Generate a new key
+
+        :returns: private key
+          (:class:`cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey`
+          or
+          :class:`cryptography.hazmat.primitives.asymmetric.ec.EllipticCurvePrivateKey`)
+        """
+        if self.key_type == "ec":
+            return ec.generate_private_key(_ec_curves[self.key_size]())
+        return rsa.generate_private_key(public_exponent = 65537,
+                                        key_size = self.key_size)
+
+
+    def _refill(self):
+        while True:
+            with self.condition:
+                while len(self.keys) >= self.size:
+                    self.condition.wait()
+            key = self.generate()
+            with self.condition:
+                self.keys.append(key)
+                self.condition.notify_all()
+
+
+    def start(self):
+        """
+        Start refilling the pool in the background, if not already
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        if self.size == 0:
+            return
+        with self.condition:
+            if self.thread == None:
+                self.thread = threading.Thread(
+                    target = self._refill, daemon = True,
+                    name = f"key pool {self.key_type}/{self.key_size}")
+                self.thread.start()
+            self.condition.notify_all()
+
+
+    def get(self):
+        """
+        Get a key from the pool or, if empty, generate one
+
+        :returns: private key, as :meth:`generate`
+        """
+        self.start()
+        with self.condition:
+            if self.keys:
+                key = self.keys.pop(0)
+                self.condition.notify_all()	# refill
+                return key
+        return self.generate()
+
+
+_key_pools = {}
+_key_pools_lock = threading.Lock()
+
+def key_pool_get(key_type: str, key_size: int, size: int):
+    """
+    Return the key pool for a type and size of keys shared by all
+    the targets in this process
+
+    The pool is not started (see :meth:`key_pool_c.start`) until the
+    first key is taken from it.
+
+    :param str key_type: *rsa* or *ec*
+
+    :param int key_size: bits in the RSA key or size of the EC curve
+
+    :param int size: maximum number of keys to keep ready; if
+      different users of the pool ask for different sizes, the
+      largest is used.
+
+    :returns key_pool_c: key pool
+    """
+    with _key_pools_lock:
+        pool = _key_pools.get(( key_type, key_size ), None)
+        if pool == None:
+            pool = key_pool_c(key_type, key_size, size)
+            _key_pools[( key_type, key_size )] = pool
+        elif size > pool.size:
+            pool.size = size
+        return pool
+
+
+def _subject(target, allocid, common_name):
+    return x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "LC"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Local"),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, "Local"),
+        x509.NameAttribute(
+            NameOID.ORGANIZATION_NAME,
+            f"TCF-Signing-Authority-{target.id}-{allocid}"),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+    ])
+
+
+def _key_write(filename, key):
+    # private keys are readable only by us
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key.private_bytes(
+            encoding = serialization.Encoding.PEM,
+            format = serialization.PrivateFormat.PKCS8,
+            encryption_algorithm = serialization.NoEncryption()))
+
+
+def _pem_write(filename, obj):
+    with open(filename, "wb") as f:
+        f.write(obj.public_bytes(serialization.Encoding.PEM))
+
+
+def _certificate_issue(subject, key, issuer, ca_key, days,
+                       extended_key_usage = None, ca = False):
+    # issue a certificate for a key
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = x509.CertificateBuilder() \
+        .subject_name(subject) \
+        .issuer_name(issuer) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(minutes = 5)) \
+        .not_valid_after(now + datetime.timedelta(days = days)) \
+        .add_extension(x509.BasicConstraints(ca = ca, path_length = None),
+                       critical = True) \
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(
+            key.public_key()), critical = False) \
+        .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(
+            ca_key.public_key()), critical = False)
+    if extended_key_usage:
+        builder = builder.add_extension(
+            x509.ExtendedKeyUsage([ extended_key_usage ]), critical = False)
+    return builder.sign(ca_key, hashes.SHA256())
+
+
+def _request_create(subject, key):
+    # certificate signing requests are not really needed, but we
+    # keep creating them as the openssl command line did
+    return x509.CertificateSigningRequestBuilder() \
+        .subject_name(subject) \
+        .sign(key, hashes.SHA256())
+
+
 class interface(ttbl.tt_interface):
 
     #: Allow the certificate infomation to survive server reboots
@@ -137,20 +368,51 @@ class interface(ttbl.tt_interface):
     survive_reboots = False
 
 
-    def __init__(self, key_size: int = 3072):
+    def __init__(self, key_size: int = None, key_type: str = "rsa",
+                 key_pool_size: int = 4):
         """
-        :param int key_size: (optional; default *3072*) size of the
-          keys to generate.
+        :param int key_size: (optional; default *3072* for RSA, *256*
+          for EC) size of the keys to generate.
 
           Set to 3kbit for future proofing; was set to 4kbit in the
           past but it was way too long and didn't really help much.
-        """
-        assert isinstance(key_size, int) and key_size > 0, \
-            f"key_size: expected int > 0, got [{type(key_size)}]: '{key_size}'"
 
+        :param str key_type: (optional; default *rsa*) type of keys
+          to generate, *rsa* or *ec* (elliptic curve, way faster to
+          generate; *key_size* selects the NIST curve: 256, 384 or
+          521).
+
+        :param int key_pool_size: (optional; default *4*) how many
+          keys to keep generated in advance in the pool shared with
+          other targets using keys of the same type and size (see
+          :func:`key_pool_get`); 0 to generate them only when needed.
+        """
+        if key_size == None:
+            key_size = 256 if key_type == "ec" else 3072
         ttbl.tt_interface.__init__(self)
+        self.key_pool = key_pool_get(key_type, key_size, key_pool_size)
         self.key_size = key_size
-
+        self.key_type = key_type
+        # cert_path -> ( ( st_ino, st_mtime_ns ), ca_key, ca_cert )
+        self._ca_cache = {}
+
+
+    def _ca_get(self, cert_path):
+        # load the CA's key and certificate, if not already; the key
+        # for the cache lets us notice if it was recreated (maybe by
+        # another server process)
+        ca_cert_path = os.path.join(cert_path, "ca.cert")
+        st = os.stat(ca_cert_path)
+        stamp = ( st.st_ino, st.st_mtime_ns )
+        cached = self._ca_cache.get(cert_path, None)
+        if cached and cached[0] == stamp:
+            return cached[1], cached[2]
+        with open(os.path.join(cert_path, "ca.key"), "rb") as f:
+            ca_key = serialization.load_pem_private_key(f.read(), None)
+        with open(ca_cert_path, "rb") as f:
+            ca_cert = x509.load_pem_x509_certificate(f.read())
+        self._ca_cache[cert_path] = ( stamp, ca_key, ca_cert )
+        return ca_key, ca_cert
 
 
     def _setup_maybe(self, target, cert_path, cert_client_path):
@@ -161,7 +423,6 @@ class interface(ttbl.tt_interface):
         try:
             commonl.makedirs_p(cert_path)
             commonl.makedirs_p(cert_client_path)
-            # FIXME: do from python-openssl?
 
             # Create a Certificate authority for signing
             #
@@ -169,14 +430,12 @@ class interface(ttbl.tt_interface):
             # be killed when the target is released
 
             allocid = target.fsdb.get("_alloc.id", "UNKNOWN")
-            subprocess.run(
-                f"openssl req -nodes -newkey rsa:{self.key_size}"
-                f" -keyform PEM -keyout ca.key"
-                f" -subj /C=LC/ST=Local/L=Local/O=TCF-Signing-Authority-{target.id}-{allocid}/CN=TTBD"
-                f" -x509 -days 1000 -outform PEM -out ca.cert".split(),
-                timeout = 10,
-                check = True, cwd = cert_path,
-                stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+            subject = _subject(target, allocid, "TTBD")
+            ca_key = self.key_pool.get()
+            ca_cert = _certificate_issue(subject, ca_key, subject, ca_key,
+                                         1000, ca = True)
+            _key_write(os.path.join(cert_path, "ca.key"), ca_key)
+            _pem_write(os.path.join(cert_path, "ca.cert"), ca_cert)
             # copy the CA's certificate (not the CA's key!!!) to the
             # certificates/ directory so it can be downloaded with the
             # *store* interface (eg: for UIs, etc) -- since it only
@@ -185,44 +444,21 @@ class interface(ttbl.tt_interface):
             target.log.debug(f"created target's certificate authority in {cert_path}")
 
             # Now create a server key
-            subprocess.run(
-                f"openssl genrsa -out server.key {self.key_size}".split(),
-                stdin = None, timeout = 10,
-                capture_output = True, cwd = cert_path, check = True)
-            target.log.debug("created target's server key")
-
-            subprocess.run(
-                f"openssl req -new -key server.key -out server.req -sha256"
-                f" -subj /C=LC/ST=Local/L=Local/O=TCF-Signing-Authority-{target.id}-{allocid}/CN=TTBD".split(),
-                timeout = 10,
-                check = True, cwd = cert_path,
-                stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
-            target.log.debug("created target's server req")
-
-            subprocess.run(
-                "openssl x509 -req -in server.req -CA ca.cert -CAkey ca.key"
-                f" -set_serial 100 -extensions server -days 1460 -outform PEM"
-                f" -out server.cert -sha256".split(),
-                timeout = 10,
-                check = True, cwd = cert_path,
-                stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
-            target.log.debug("created target's server cert")
+            server_key = self.key_pool.get()
+            _key_write(os.path.join(cert_path, "server.key"), server_key)
+            _pem_write(os.path.join(cert_path, "server.req"),
+                       _request_create(subject, server_key))
+            _pem_write(os.path.join(cert_path, "server.cert"),
+                       _certificate_issue(
+                           subject, server_key, subject, ca_key, 1460,
+                           extended_key_usage = ExtendedKeyUsageOID.SERVER_AUTH))
+            target.log.debug("created target's server key and cert")
 
             # the Diffie-Helmen pem curves are used for some apps (eg:
-            # openvpn),
-            # -dsaparam: so it takes less than potentially minutes
-            # https://security.stackexchange.com/a/95184; since we
-            # create a whole new cert authority for each allocation,
-            # this shall be fine.
-            subprocess.run(
-                "openssl dhparam -dsaparam -quiet -out dh.pem 2048".split(),
-                timeout = 30,
-                check = True, cwd = cert_path,
-                stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+            # openvpn)
+            with open(os.path.join(cert_path, "dh.pem"), "w") as f:
+                f.write(dh_params_pem)
             target.log.debug("created target's server dh.pem")
-        except subprocess.CalledProcessError as e:
-            target.log.error(f"command {' '.join(e.cmd)} failed: " + e.output.decode('ascii'))
-            raise
         except:
             # wipe the dir on any error, to avoid having half
             # initialized state
@@ -263,9 +499,25 @@ class interface(ttbl.tt_interface):
         cert_client_path = os.path.join(target.state_dir, "certificates_client")
         shutil.rmtree(cert_path, ignore_errors = True)
         shutil.rmtree(cert_client_path, ignore_errors = True)
+        self._ca_cache.pop(cert_path, None)
         target.log.debug(f"wiped target's certificates in {cert_path}")
 
 
+    def _client_create(self, target, name, cert_path,
+                       client_key_path, client_req_path, client_cert_path):
+        # Issue the client certificate using the CA cert/key
+        allocid = target.fsdb.get("_alloc.id", "UNKNOWN")
+        ca_key, ca_cert = self._ca_get(cert_path)
+        subject = _subject(target, allocid, f"TCF-{name}")
+        key = self.key_pool.get()
+        _key_write(client_key_path, key)
+        _pem_write(client_req_path, _request_create(subject, key))
+        _pem_write(client_cert_path, _certificate_issue(
+            subject, key, ca_cert.subject, ca_key, 365,
+            extended_key_usage = ExtendedKeyUsageOID.CLIENT_AUTH))
+        target.log.debug(f"{name}: created client's certificate")
+
+
     def put_certificate(self, target, who, args, _files, _user_path):
         """
         Get a client certificate, maybe creating it
@@ -315,30 +567,10 @@ class interface(ttbl.tt_interface):
                     })
 
             try:
-                subprocess.run(
-                    f"openssl genrsa -out {client_key_path} {self.key_size}".split(),
-                    stdin = None, timeout = 10,
-                    capture_output = True, cwd = cert_path, check = True)
-                allocid = target.fsdb.get("_alloc.id", "UNKNOWN")
-                subprocess.run(
-                    f"openssl req -new -key {client_key_path} -out {client_req_path}"
-                    f" -subj /C=LC/ST=Local/L=Local/O=TCF-Signing-Authority-{target.id}-{allocid}/CN=TCF-{name}".split(),
-                    timeout = 10,
-                    check = True, cwd = cert_path,
-                    stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
-                target.log.debug(f"{name}: created client's certificate")
-
-                # Issue the client certificate using the cert request and the CA cert/key.
-                # note we run in the cert_path directory, so the ca.*
-                # files are there
-                subprocess.run(
-                    f"openssl x509 -req -in {client_req_path} -CA ca.cert"
-                    " -CAkey ca.key -set_serial 101 -extensions client"
-                    f" -days 365 -outform PEM -out {client_cert_path}".split(),
-                    stdin = None, timeout = 10,
-                    capture_output = True, cwd = cert_path, check = True)
-            except subprocess.CalledProcessError as e:
-                target.log.error(f"command {' '.join(e.cmd)} failed: {e.output}")
+                self._client_create(target, name, cert_path,
+                                    client_key_path, client_req_path,
+                                    client_cert_path)
+            except:
                 self._client_wipe(name, cert_client_path)	# don't leave things half there
                 raise
 
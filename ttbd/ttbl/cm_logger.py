@@ -4,18 +4,52 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 #
+"""
+Log serial consoles to files from a background process
 
+A single process (started by :func:`setup`) reads from all the serial
+ports being logged and appends what it reads to each port's log file.
+
+Other processes control it with :func:`spec_add`, :func:`spec_rm`,
+:func:`spec_reset` and :func:`spec_write`; these send a request over
+a Unix socket and wait for the reply to their request only, so a
+slow request doesn't stall other callers and requests are served in
+between reading data.
+
+Data is read in chunks of up to :data:`read_size` bytes and kept in
+a per console buffer, which is written to the log file when it grows
+past :data:`flush_size` or has been waiting for :data:`flush_period`
+seconds, so fast consoles don't cost a write system call per read.
+"""
+
+import base64
 import errno
+import json
 import logging
 import multiprocessing
 import os
 import select
+import socket
+import struct
+import threading
 import time
 import traceback
 
 import serial
 
-_spec_queue = None
+#: Maximum bytes to read from a console at once
+read_size = 65536
+
+#: Bytes buffered for a console after which they are written to the
+#: log file
+flush_size = 65536
+
+#: Maximum seconds read data waits in a buffer before being written
+#: to the log file
+flush_period = 0.05
+
+#: Address of the logger process' control socket (set by :func:`setup`)
+_control_address = None
 
 def _spec_open_one(spec):
     if isinstance(spec, str):
@@ -59,237 +93,302 @@ def _spec_open(spec):
             logging.error("cannot open '%s': %s", spec, e)
             raise
 
-reader_dict = dict()
-poller = None
 
-def _reopen(spec, logfile_name):
-    global reader_dict
-    global poller
-    logfile = open(logfile_name, "wb")	# Open truncating
+class _reader_c:
+    # A console being logged: the serial port we read from, the log
+    # file we write to and what we read and still have to write
+    def __init__(self, logfile_name, spec, descr, truncate):
+        self.logfile_name = logfile_name
+        self.spec = spec
+        self.descr = descr
+        self.fd = descr.fileno()
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if truncate:
+            flags |= os.O_TRUNC
+        self.logfile_fd = os.open(logfile_name, flags, 0o644)
+        self.buffer = bytearray()
+        self.ts_buffer = None		# when the first byte was buffered
+
+    def __str__(self):
+        return "fd %d[%s/%d]" % (self.fd, self.logfile_name, self.logfile_fd)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        try:
+            os.write(self.logfile_fd, self.buffer)
+        except OSError as e:
+            logging.error("%s: log write error: %s", self, e)
+        self.buffer.clear()
+        self.ts_buffer = None
+
+    def close(self):
+        self.flush()
+        os.close(self.logfile_fd)
+        try:
+            self.descr.close()
+        except OSError as e:
+            if e.errno != errno.EBADF:
+                raise
+            logging.debug("%s: ignoring -EBADF on close()", self)
+
+
+# State of the logger process
+_readers_by_fd = {}
+_readers_by_name = {}
+_poller = None
+_poll_flags = select.POLLIN | select.POLLPRI \
+    | select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+def _reopen(spec, logfile_name, truncate = True):
     descr = _spec_open(spec)
     if descr == None:
-        return -1
-    logging.debug("fd %d[%s/%d]: (re)opened: %s",
-                  descr.fileno(), logfile_name, logfile.fileno(), spec)
-    reader_dict[descr.fileno()] = (spec, logfile, descr)
-    poller.register(descr.fileno(),
-                    select.POLLIN | select.POLLPRI \
-                    | select.POLLERR | select.POLLHUP | select.POLLNVAL)
-    return descr.fileno()
-
-def _write(fd, data, filename):
-    global reader_dict
-    global poller
+        raise RuntimeError("%s: cannot open %s" % (logfile_name, spec))
+    reader = _reader_c(logfile_name, spec, descr, truncate)
+    _readers_by_fd[reader.fd] = reader
+    _readers_by_name[logfile_name] = reader
+    _poller.register(reader.fd, _poll_flags)
+    logging.debug("%s: (re)opened: %s", reader, spec)
+    return reader
+
+def _close(reader):
+    try:
+        _poller.unregister(reader.fd)
+    except KeyError:
+        pass
+    del _readers_by_fd[reader.fd]
+    del _readers_by_name[reader.logfile_name]
+    reader.close()
+    logging.debug("%s: removed reader", reader)
+
+def _write(reader, data, filename):
     if data:
-        logging.log(6, "fd %d: writing : \"%s\"", fd, data)
-        os.write(fd, data)
+        logging.log(6, "%s: writing : \"%s\"", reader, data)
     else:
-        logging.log(6, "fd %d: writing file contents: \"%s\"", fd, filename)
+        logging.log(6, "%s: writing file contents: \"%s\"", reader, filename)
         with open(filename, "rb") as f:
-            # FIXME: use sendfile, this won't work for big files, obvs.
-            os.write(fd, f.read())
-
-def _reset(fd):
-    global reader_dict
-    spec = reader_dict[fd][0]
-    logfile = reader_dict[fd][1]
-    logfile_name = logfile.name
-    try:
-        logfile_fileno = logfile.fileno()
-    except ValueError as e:
-        logfile_fileno = -1
+            data = f.read()
+    # the port is non blocking, so wait for room when full
+    while data:
+        try:
+            written = os.write(reader.fd, data)
+            data = data[written:]
+        except BlockingIOError:
+            select.select([], [ reader.fd ], [], 1)
+
+def _reset(reader):
     try:
         while True:
-            s = os.read(fd, 1024) 	# Flush the input channel
-            if s == None:
-                l = -1
-            else:
-                l = len(s)
-                logging.log(6, "fd %d[%s/%d]: flushed (%dB): %s",
-                            fd, logfile_name, logfile_fileno, l, s)
-                # FIXME: stop after so
-                # much stuff flushed, that
-                # means the target DID NOT
-                # stop or something is
-                # wrong
-            if s == None or l <= 0:
+            s = os.read(reader.fd, read_size)	# Flush the input channel
+            if not s:
                 break
+            logging.log(6, "%s: flushed (%dB): %s", reader, len(s), s)
+    except BlockingIOError:
+        pass				# nothing else to flush
     except OSError as e:
-        logging.info("fd %d[%s/%d]: flush error, reopening: %s",
-                     fd, logfile_name, logfile_fileno, e)
-    # It's easier to just close and re-open everyhing
-    _close(fd)
-    fd =_reopen(spec, logfile.name)
-    logfile = reader_dict[fd][1]
-    logging.debug("fd %d[%s/%d]: reset logger",
-                  fd, logfile.name, logfile.fileno())
-
-def _close(fd):
-    global reader_dict
-    global poller
-    spec = reader_dict[fd][0]
-    logfile = reader_dict[fd][1]
-    descr = reader_dict[fd][2]
-    try:
-        logfile_fileno = logfile.fileno()
-    except ValueError as e:
-        logfile_fileno = -1
-    logfile.close()
-    try:
-        poller.unregister(fd)
-    except KeyError:
-        pass
-    try:
-        descr.close()
-    except OSError as e:
-        if e.errno != errno.EBADF:
-            raise
-        logging.debug("fd %d[%s/%d]: ignoring -EBADF on close()",
-                      fd, logfile.name, logfile_fileno)
-    logging.debug("fd %d[%s/%d]: removed reader",
-                  fd, logfile.name, logfile_fileno)
-    del spec
-    del descr
-    del logfile
-    del reader_dict[fd]
-#
-# This thread reads from all the file descriptors (normally describing
-# serial consoles) given to the daemon. Note the daemon itself is the
-# one that has to open the file descriptor, otherwise it might be
-# another process.
-#
-def _reader_fn():
-    global _spec_queue
-    global reader_dict
-    global poller
+        logging.info("%s: flush error, reopening: %s", reader, e)
+    # It's easier to just close and re-open everyhing, which
+    # truncates the log file
+    reader.buffer.clear()
+    _close(reader)
+    reader = _reopen(reader.spec, reader.logfile_name)
+    logging.debug("%s: reset logger", reader)
 
-    poller = select.poll()
-    queue_fd = _spec_queue._reader.fileno()
+def _request_run(request):
+    # execute a request from a client; note the request is processed
+    # by logfile name, which is how clients know the loggers
+    action = request['action']
+    logfile_name = request['logfile_name']
+    reader = _readers_by_name.get(logfile_name, None)
+    if action == 'add':
+        if reader:
+            _close(reader)
+        _reopen(request['spec'], logfile_name)
+    elif action == 'write':
+        if reader:
+            data = request.get('data', None)
+            if data != None:
+                data = base64.b64decode(data)
+            _write(reader, data, request.get('filename', None))
+    elif action == 'rm':
+        if reader:
+            _close(reader)
+    elif action == 'reset':
+        if reader:
+            _reset(reader)
+    else:
+        raise ValueError("Unknown action '%s'" % action)
+
+def _data_read(reader, events):
+    if events & (select.POLLIN | select.POLLPRI):
+        # Data is available, read as much as we can and buffer it
+        try:
+            data = os.read(reader.fd, read_size)
+            logging.log(7, "%s: Read %dB: %s", reader, len(data), data)
+        except OSError as e:
+            logging.error("%s: log read error, reopening: %s", reader, e)
+            reader.buffer += b"[some data might have been lost]"
+            _close(reader)
+            _reopen(reader.spec, reader.logfile_name, truncate = False)
+            return
+        if not reader.buffer:
+            reader.ts_buffer = time.time()
+        reader.buffer += data
+        if len(reader.buffer) >= flush_size:
+            reader.flush()
+        if data or not events & (select.POLLERR | select.POLLHUP
+                                 | select.POLLNVAL):
+            return
+    if events & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+        # Something is wrong, let it be refreshed; be loud, normally
+        # this means something bad has happened to the HW or a
+        # lurking bug (file has been closed somehow).
+        logging.warning("BUG? %s: has to be removed: 0x%x", reader, events)
+        _close(reader)
+        try:
+            _reopen(reader.spec, reader.logfile_name, truncate = False)
+        except Exception as e:
+            # usually this means the device is gone
+            logging.info("%s: can't reopen, device disconnected? %s",
+                         reader, e)
 
-    logging.info("console logger thread")
+def _connection_read(connection, buffer):
+    # read requests from a client, run them and reply; requests and
+    # replies are JSON, one per line
+    data = connection.recv(65536)
+    if not data:
+        return False
+    buffer += data
+    while b"\n" in buffer:
+        line, _, rest = buffer.partition(b"\n")
+        buffer[:] = rest
+        try:
+            _request_run(json.loads(line))
+            reply = {}
+        except Exception as e:
+            logging.error("request %s failed: %s\n%s",
+                          line, e, traceback.format_exc())
+            reply = { "_message": str(e) }
+        connection.sendall(json.dumps(reply).encode() + b"\n")
+    return True
+
+def _reader_fn(listener):
+    global _poller
+
+    _poller = select.poll()
+    _poller.register(listener.fileno(), select.POLLIN)
+    connections = {}			# FD: ( SOCKET, BUFFER )
+    uid = os.getuid()
+
+    logging.info("console logger process")
     while True:
-        try:				# Make sure it is there (in
-            poller.register(queue_fd)	# case an error took it out)
-            rs = poller.poll(1000)          	# Wait for activity
-            for r in rs:			# Process said activity
-                fd = r[0]
-                # Handle management events first
-                if fd == queue_fd:		# Read and discard
-                    logging.log(8, "QUEUE fd %d, signalled 0x%x", fd, r[1])
-                    o = _spec_queue.get_nowait()# just used to run the
-                    if o == None:
-                        logging.warning("QUEUE: woken up, but got nothing")
+        try:
+            timeout = 1000
+            for reader in _readers_by_fd.values():
+                if reader.buffer:
+                    timeout = flush_period * 1000
+                    break
+            for fd, events in _poller.poll(timeout):
+                reader = _readers_by_fd.get(fd, None)
+                if reader:
+                    _data_read(reader, events)
+                elif fd in connections:
+                    connection, buffer = connections[fd]
+                    if not _connection_read(connection, buffer):
+                        _poller.unregister(fd)
+                        del connections[fd]
+                        connection.close()
+                elif fd == listener.fileno():
+                    connection, _ = listener.accept()
+                    # only processes of the same user can talk to us
+                    _pid, peer_uid, _gid = struct.unpack(
+                        "3i", connection.getsockopt(
+                            socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize("3i")))
+                    if peer_uid != uid:
+                        logging.error("rejecting connection from uid %d",
+                                      peer_uid)
+                        connection.close()
                         continue
-                    logfile_name = o[1]
-                    try:
-                        if o[0] == 'add':
-                            spec = o[2]
-                            _reopen(spec, logfile_name)
-                        elif o[0] == 'write':
-                            for fd in list(reader_dict.keys()):
-                                if reader_dict[fd][1].name == logfile_name:
-                                    _write(fd, o[2], o[3])
-                        elif o[0] == 'rm':
-                            for fd in list(reader_dict.keys()):
-                                if reader_dict[fd][1].name == logfile_name:
-                                    _close(fd)
-                                    break
-                        elif o[0] == 'reset':
-                            for fd in list(reader_dict.keys()):
-                                if reader_dict[fd][1].name == logfile_name:
-                                    _reset(fd)
-                                    break
-                        else:
-                            raise ValueError("Unknown action '%s'" % o[0])
-                    finally:
-                        _spec_queue.task_done()
-                        del o                    	
-                    continue			# Process next change
-                if not fd in reader_dict:
-                    logging.debug("fd %d has been removed: 0x%x", fd, r[1])
-                    continue
-                spec = reader_dict[fd][0]
-                logfile = reader_dict[fd][1]
-                logfile_name = logfile.name
-                try:
-                    logfile_fileno = logfile.fileno()
-                except ValueError as e:
-                    # If closed, just pass it on
-                    logfile_fileno = -1
-                if r[1] in (select.POLLERR, select.POLLHUP, select.POLLNVAL):
-                    # Something is wrong, let it be refreshed; be
-                    # loud, normally this means something bad has
-                    # happened to the HW or a lurking bug (file has
-                    # been closed somehow).
-                    logging.warning(
-                        "BUG? fd %d[%s/%d]: has to be removed: 0x%x",
-                        fd, logfile_name, logfile_fileno, r[1])
-                    _close(fd)
-                    _reopen(spec, logfile_name)
-                elif r[1] == select.POLLIN or r[1] == select.POLLPRI:
-                    # Data is available, read in 1K chunks and record
-                    # it [FIXME: consider using sendfile()].
-                    try:
-                        data = os.read(fd, 1024)
-                        logging.log(7, "fd %d[%s/%d]: Read %dB: %s",
-                                    fd, logfile_name, logfile_fileno,
-                                       len(data), data)
-                    except OSError as e:
-                        logging.error(
-                            "fd %d[%s/%d]: log read error, reopening: %s",
-                            fd, logfile_name, logfile_fileno, e)
-                        _close(fd)
-                        _reopen(spec, logfile_name)
-                        data = "[some data might have been lost]"
-                    try:
-                        os.write(logfile_fileno, data)
-                    except OSError as e:
-                        logging.error("fd %d[%s/%d]: log write error: %s",
-                                      fd, logfile_name, logfile_fileno, e)
-                    del data			# Ensure data it is gone
-                elif r[1] == errno.ENOTTY:
-                    logging.info("fd %d[%s/%d]: reopen due to ENOTTY, "
-                                 "device replugging?",
-                                 fd, logfile_name, logfile_fileno)
-                    _close(fd)
-                    _reopen(spec, logfile_name)
-                else:	# Me not know what you talking'bout
-                    if r[1] != errno.ENODEV:
-                        logging.error(
-                            "fd %d[%s/%d]: Unhandled poll reason 0x%x",
-                            fd, logfile_name, logfile_fileno, r[1])
-                    else:
-                        logging.info("fd %d[%s/%d]: device disconnected",
-                                     fd, logfile_name, logfile_fileno)
-                    _close(fd)
-                    # We do not reopen, usually this means the device is gone
+                    connections[connection.fileno()] = \
+                        ( connection, bytearray() )
+                    _poller.register(connection.fileno(), select.POLLIN)
+                else:
+                    logging.debug("fd %d has been removed: 0x%x", fd, events)
+            ts = time.time()
+            for reader in _readers_by_fd.values():
+                if reader.ts_buffer and ts - reader.ts_buffer >= flush_period:
+                    reader.flush()
         except Exception as e:
             logging.error("Unhandled reader thread exception: %s: %s",
                           e, traceback.format_exc())
 
 def setup():
     """
-    FIXME
+    Start the logger process
+
+    Called automatically by :func:`spec_add` if needed; shall be
+    called before forking processes that will use the logger, so
+    they all know how to reach it.
     """
-    global _spec_queue
-    _spec_queue = multiprocessing.JoinableQueue(100)
-    # Background thread that reads from all serial ports to a log file
-    reader = multiprocessing.Process(target = _reader_fn)
+    global _control_address
+    # abstract socket namespace, nothing to clean up on exit
+    _control_address = "\0ttbd-cm_logger-%d-%d" % (os.getpid(), time.time())
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(_control_address)
+    listener.listen(128)
+    # Background process that reads from all serial ports to log files
+    reader = multiprocessing.Process(target = _reader_fn, args = (listener, ))
     reader.daemon = True
     reader.start()
+    listener.close()
     logging.info("console logger launched")
 
 
+# one connection per process (and thread, since replies are matched to
+# requests by order)
+_connection = threading.local()
+
+def _request(request):
+    connection = getattr(_connection, "connection", None)
+    if connection == None or _connection.pid != os.getpid():
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(_control_address)
+        _connection.connection = connection
+        _connection.pid = os.getpid()
+        _connection.buffer = bytearray()
+    connection.sendall(json.dumps(request).encode() + b"\n")
+    buffer = _connection.buffer
+    while b"\n" not in buffer:
+        data = connection.recv(4096)
+        if not data:
+            _connection.connection = None
+            connection.close()
+            raise RuntimeError("console logger process closed connection")
+        buffer += data
+    line, _, rest = buffer.partition(b"\n")
+    buffer[:] = rest
+    reply = json.loads(line)
+    if '_message' in reply:
+        logging.error("%s: %s failed: %s", request['logfile_name'],
+                      request['action'], reply['_message'])
+
+
 # This to be ran by the master or other processes in the
 # multiprocessing pool
 def spec_add(logfile_name, spec):
     """
-    FIXME
+    Start logging a serial port to a file
+
+    :param str logfile_name: name of the file where to log; this also
+      names the logger for the other calls
+    :param dict spec: serial port specification; *port* is the
+      URL (see :func:`serial.serial_for_url`), the rest are
+      arguments to it
     """
     assert isinstance(logfile_name, str)
     assert isinstance(spec, dict)
-    global _spec_queue
-    if _spec_queue == None:
+    if _control_address == None:
         setup()
 
     # wait here for the node to show up -- we'll also do it in the
@@ -306,8 +405,7 @@ def spec_add(logfile_name, spec):
         raise RuntimeError("Cannot open serial port (%s); is "
                            "ModemManager trying to scan it?" % spec)
 
-    _spec_queue.put(['add', logfile_name, spec])
-    _spec_queue.join()
+    _request(dict(action = 'add', logfile_name = logfile_name, spec = spec))
     logging.debug("%s: adding logger for '%s'", logfile_name, spec)
 
 def spec_write(logfile_name, data = None, filename = None):
@@ -321,28 +419,27 @@ def spec_write(logfile_name, data = None, filename = None):
     :param str filename: name of the file that contains the data that
       has to be written, use this for longer data.
     """
-    global _spec_queue
     # Either one has to be given, but not both
     assert (data == None) != (filename == None)
-    _spec_queue.put(['write', logfile_name, data, filename])
-    _spec_queue.join()
+    request = dict(action = 'write', logfile_name = logfile_name)
+    if data != None:
+        if isinstance(data, str):
+            data = data.encode()
+        request['data'] = base64.b64encode(data).decode()
+    else:
+        request['filename'] = filename
+    _request(request)
     logging.debug("%s: wrote to logger", logfile_name)
 
 # This is to be ran by the master or other processes in the
 # multiprocessing pool
 def spec_rm(logfile_name):
-    global _spec_queue
-    _spec_queue.put(['rm', logfile_name])
-    _spec_queue.join()
+    _request(dict(action = 'rm', logfile_name = logfile_name))
     logging.debug("%s: removing logger", logfile_name)
 
 # This is to be ran by the master or other processes in the
 # multiprocessing pool
 def spec_reset(logfile_name):
-    global _spec_queue
     logging.debug("%s: resetting logger", logfile_name)
-    _spec_queue.put(['reset', logfile_name])
-    _spec_queue.join()
-    # Wait for queue to be flushed?
+    _request(dict(action = 'reset', logfile_name = logfile_name))
     logging.debug("%s: reset logger completed", logfile_name)
-
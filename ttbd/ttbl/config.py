@@ -34,6 +34,24 @@ upload_max_size = 16 * 1024 * 1024
 #: serialize it.
 power_startup_serialize = False
 
+#: Maximum number of deferred power actions to run at the same time
+#:
+#: When the startup power up sequence (or any other list of deferred
+#: power actions, see :func:`ttbl.power.execute_defer_list`) runs in
+#: parallel mode, run at most this many power actions at the same
+#: time.
+power_defer_max = 32
+
+#: Maximum number of deferred power actions to run at the same time
+#: on a single physical device
+#:
+#: PDUs, USB hubs and alike can only take so many requests at the
+#: same time; when running deferred power actions in parallel, at most
+#: this many will be working on the same device (as reported by
+#: :meth:`ttbl.power.impl_c.device_key`). *0* for no limit (*None*,
+#: as used by older configurations, is taken as *0*).
+power_defer_device_max = 2
+
 #: Maximum duration to service a request time (in seconds)
 #:
 #: All the calls in ttbd are synchronous; we let the underlaying code
@@ -125,6 +143,20 @@ instance_suffix = ""
 #: Maximum length of the reason given to an allocation
 reason_len_max = 128
 
+#: Maximum time (in seconds) an *allocation/watch* call waits for
+#: state changes
+#:
+#: Each waiting call keeps one of the server's :data:`processes` busy,
+#: so this shall be kept short; clients just call again.
+allocation_watch_timeout_max = 10
+
+#: Number of allocations whose keepalives can be kept in the shared
+#: keepalive table (:class:`ttbl.allocation.keepalive_table_c`)
+#:
+#: Each takes 24 bytes; allocations that don't fit get their
+#: keepalives recorded in the allocation database, which is slower.
+allocation_keepalive_slots = 16384
+
 #: Server implementation to use: gunicorn, tornado, flask
 #:
 #: (defaults to Tornado) Set in any serverconfiguration file:
@@ -274,8 +306,28 @@ target_owned_max_idle = 5 * 60  # 5 min
 cleanup_files_period = 60 # 60sec
 
 #: Age of the file after which it will be deleted
+#:
+#: The age counts from the last time the file was uploaded or used
+#: (eg: flashed), see :class:`ttbl.store.files_index_c`.
 cleanup_files_maxage = 86400 #  1day, count is in seconds, 24x60x60 sec
 
+#: Maximum amount of storage (in bytes) each user can take with
+#: uploaded files
+#:
+#: When a user goes over, the least recently used files are removed
+#: until they are under; *None* for no limit.
+#:
+#: >>> ttbl.config.cleanup_files_user_quota = 20 * 1024 * 1024 * 1024
+cleanup_files_user_quota = None
+
+#: Time between full scans of the uploaded files to verify the
+#: file index (seconds)
+#:
+#: The index is updated as files are uploaded, used and removed; this
+#: catches files created or removed behind its back. See also *ttbd
+#: --files-index-repair*.
+cleanup_files_repair_period = 86400
+
 #: Which TCP port range we can use
 #:
 #: The server will take this into account when services that need port
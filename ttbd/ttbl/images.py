@@ -201,12 +201,44 @@ flashers::
            ],
        ))
 
+Flashing jobs and shared physical resources
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+By default, *PUT images/flash* is synchronous: the request is held
+until all the images are flashed. When called with *job = true*, the
+request returns right away with a *job_id* and the flashing is done
+by a separate process; the client can then poll (or long-poll, with
+the *wait* argument) *GET images/flash_job* to get the state,
+progress and ETA of the job (computed from the *estimated_duration*
+of the flashers involved). The job's state is also published in the
+inventory under *interfaces.images.job*.
+
+Flashers that use a physical resource shared with other targets
+(eg: a USB hub that can't take more than two flashing devices
+enumerating at the same time, a JTAG pod wired to many targets) can
+declare it with the *resources* argument; the server will then limit
+how many flashing operations run at the same time on each resource,
+across all the targets and server processes, as configured in
+:data:`resource_limits`:
 
+.. code-block:: python
+
+   ttbl.images.resource_limits['usb-hub-3'] = 2
+
+   target.interface_add(
+       "images", ttbl.images.interface(
+           image0 = ttbl.images.flash_shell_cmd_c(
+               cmdline = [ ... ],
+               resources = [ 'usb-hub-3' ],
+               estimated_duration = 10, parallel = True,
+           ),
+       ))
 
 """
 
 import codecs
 import collections
+import contextlib
 import copy
 import errno
 import filelock
@@ -214,6 +246,7 @@ import hashlib
 import numbers
 import os
 import re
+import select
 import shutil
 import subprocess
 import tempfile
@@ -223,8 +256,110 @@ import serial
 
 import commonl
 import ttbl
+import ttbl.config
 import ttbl.store
 
+#: Maximum number of flashing operations that can run at the same
+#: time over a shared physical resource
+#:
+#: Flasher implementations declare the physical resources they use
+#: with the *resources* argument to :class:`impl_c`; this dictionary,
+#: keyed by resource name, says how many flashing operations can be
+#: running at the same time on each of them (across all the targets
+#: and processes of the server). Resources not listed here take
+#: :data:`resource_limit_default`. E.g., in a configuration file:
+#:
+#: >>> ttbl.images.resource_limits['usb-hub-3'] = 2
+#: >>> ttbl.images.resource_limits['jtag-pod-A'] = 1
+resource_limits = {}
+
+#: Default number of flashing operations that can run at the same
+#: time on a resource not listed in :data:`resource_limits`
+resource_limit_default = 1
+
+#: Seconds to wait in between checks when waiting for a slot in a
+#: busy resource
+resource_wait_period = 0.5
+
+#: When all the flashers report a file descriptor to wait on for
+#: completion (see :meth:`impl2_c.flash_wait_fds`), maximum number of
+#: seconds to wait before waking up to refresh the target's timestamp
+#: and the image files (see :meth:`interface._flash_parallel_do`)
+wait_period_max = 5
+
+
+def _resource_path(resource, slot):
+    # all the locks for all the resources are kept in a common,
+    # server-wide directory
+    path = os.path.join(ttbl.config.state_path, "images-resources")
+    commonl.makedirs_p(path)
+    return os.path.join(
+        path, commonl.file_name_make_safe(resource) + f".{slot}.lock")
+
+
+def _resource_slot_acquire(target, resource, timeout):
+    # Acquire any of the slots of a resource, waiting for up to
+    # timeout seconds; we use one lock file per slot, so it works
+    # across all the server's processes
+    limit = resource_limits.get(resource, resource_limit_default)
+    assert isinstance(limit, int) and limit > 0, \
+        f"{resource}: resource limit must be a positive integer;" \
+        f" got {limit}"
+    ts0 = time.time()
+    waiting = False
+    while True:
+        for slot in range(limit):
+            lock = filelock.FileLock(_resource_path(resource, slot))
+            try:
+                lock.acquire(timeout = 0)
+                target.log.info(
+                    "flash resource %s: acquired slot %d/%d after %.1fs",
+                    resource, slot, limit, time.time() - ts0)
+                return lock
+            except filelock.Timeout:
+                continue
+        if not waiting:
+            target.log.info(
+                "flash resource %s: all %d slots busy, waiting",
+                resource, limit)
+            waiting = True
+        if time.time() - ts0 > timeout:
+            raise RuntimeError(
+                f"flash resource {resource}: timed out after {timeout}s"
+                f" waiting for one of {limit} slots to be available")
+        target.timestamp()	# waiting counts as using it
+        time.sleep(resource_wait_period)
+
+
+@contextlib.contextmanager
+def resources_acquired(target, resources, timeout = None):
+    """
+    Context manager to acquire a slot in each of a list of shared
+    physical resources (see :data:`resource_limits`)
+
+    :param ttbl.test_target target: target on which we are flashing
+
+    :param set(str) resources: names of the resources to acquire
+
+    :param float timeout: (optional, default
+      :data:`ttbl.config.request_duration_max`) maximum seconds to
+      wait for each resource to have a free slot.
+
+    Resources are always acquired in the same (sorted) order, so two
+    flashers sharing more than one resource can't deadlock.
+    """
+    if timeout == None:
+        timeout = ttbl.config.request_duration_max
+    locks = []
+    try:
+        for resource in sorted(resources):
+            locks.append(_resource_slot_acquire(target, resource, timeout))
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
 class impl_c(ttbl.tt_interface_impl_c):
     """Driver interface for flashing with :class:`interface`
 
@@ -265,18 +400,26 @@ class impl_c(ttbl.tt_interface_impl_c):
       string to use to generate the log file name (*flash-NAME.log*);
       this is useful for drivers that are used for multiple images,
       where it is not clear which one will it be called to flash to.
+
+    :param list(str) resources: (optional) names of the shared
+      physical resources this flasher uses (eg: *usb-hub-3*,
+      *jtag-pod-A*); flashing will wait for a free slot in each of
+      them, as configured in :data:`resource_limits`.
     """
     def __init__(self,
                  power_sequence_pre = None,
                  power_sequence_post = None,
                  consoles_disable = None,
                  log_name = None,
-                 estimated_duration = 60):
+                 estimated_duration = 60,
+                 resources = None):
         assert isinstance(estimated_duration, int)
         assert log_name == None or isinstance(log_name, str)
 
         commonl.assert_none_or_list_of_strings(
             consoles_disable, "consoles_disable", "console name")
+        commonl.assert_none_or_list_of_strings(
+            resources, "resources", "resource name")
 
         # validation of this one by ttbl.images.interface._target_setup
         self.power_sequence_pre = power_sequence_pre
@@ -287,6 +430,9 @@ class impl_c(ttbl.tt_interface_impl_c):
         self.consoles_disable = consoles_disable
         self.estimated_duration = estimated_duration
         self.log_name = log_name
+        if resources == None:
+            resources = []
+        self.resources = resources
         ttbl.tt_interface_impl_c.__init__(self)
 
     def target_setup(self, target, iface_name, component):
@@ -466,6 +612,26 @@ class impl2_c(impl_c):
         """
         raise NotImplementedError
 
+    def flash_wait_fds(self, target, images, context):
+        """
+        Return file descriptors that will become readable when the
+        flashing process completes
+
+        Same arguments as :meth:flash_start.
+
+        This allows the infrastructure to wake up as soon as the
+        flashing process is done instead of waiting for the next
+        :meth:flash_check_done check period; implementations that
+        can't provide this return an empty list (default) and are
+        checked every :attr:check_period seconds.
+
+        Eg: a PID file descriptor for the flashing process, see
+        :class:flash_shell_cmd_c.
+
+        :returns list(int): list of file descriptors
+        """
+        return []
+
     def flash_kill(self, target, images, context, msg):
         """
         Kill a flashing process that has gone astray, timedout or others
@@ -479,6 +645,19 @@ class impl2_c(impl_c):
         """
         raise NotImplementedError
 
+    def flash_context_release(self, target, images, context):
+        """
+        Release resources kept in the context (eg: file descriptors)
+
+        Same arguments as :meth:flash_start.
+
+        Called once flashing is over, no matter how it ended
+        (completed, failed, killed or an exception was raised); by
+        default, does nothing. See :class:flash_shell_cmd_c for an
+        example.
+        """
+        pass
+
     def flash_post_check(self, target, images, context):
         """
         Check execution logs after a proces succesfully completes
@@ -558,9 +737,6 @@ class interface(ttbl.tt_interface):
             target.power.sequence_verify(target, self.power_sequence_post,
                                          "flash post power sequence")
 
-    def _release_hook(self, target, _force):
-        pass
-
     def _hash_record(self, target, images):
         # if update MD5s of the images we flashed (if succesful)
         # so we can use this to select where we want to run
@@ -584,10 +760,65 @@ class interface(ttbl.tt_interface):
                 name
             )
 
-    def _flash_parallel_do(self, target, parallel, image_names):
+    @staticmethod
+    def _flash_wait(target, parallel, contexts, done_impls,
+                    check_period, time_left):
+        # Wait for any flasher to complete
+        #
+        # If all the flashers still running can give us a file
+        # descriptor that becomes readable when they are done, we
+        # sleep on them, waking up only to refresh the timestamp and
+        # keep the files accessed; otherwise we wait for check_period
+        # as we have to poll the ones that can't.
+        #
+        # Returns the set of implementations whose file descriptors
+        # are ready
+        fds = {}
+        poll_needed = False
+        for impl, images in parallel.items():
+            if impl in done_impls:
+                continue
+            impl_fds = impl.flash_wait_fds(target, images, contexts[impl])
+            if not impl_fds:
+                poll_needed = True
+            for fd in impl_fds:
+                fds[fd] = impl
+        if poll_needed or not fds:
+            timeout = check_period
+        else:
+            timeout = wait_period_max
+        timeout = max(0, min(timeout, time_left))
+        if not fds:
+            time.sleep(timeout)
+            return set()
+        try:
+            ready_fds, _, _ = select.select(list(fds.keys()), [], [], timeout)
+        except InterruptedError:	# SIGCHLD and friends; recheck
+            return set()
+        return set(fds[fd] for fd in ready_fds)
+
+    def _flash_parallel_do(self, target, parallel, image_names,
+                           job_id = None):
+        contexts = {}
+        try:
+            self._flash_parallel_run(target, parallel, image_names,
+                                     contexts, job_id)
+        finally:
+            # whatever happened, the flashers release what they
+            # hold (eg: pidfds)
+            for impl, context in contexts.items():
+                try:
+                    impl.flash_context_release(target, parallel[impl],
+                                               context)
+                except Exception as e:
+                    target.log.error("%s: error releasing flasher context:"
+                                     " %s", image_names[impl], e,
+                                     exc_info = True)
+
+    def _flash_parallel_run(self, target, parallel, image_names,
+                            contexts, job_id):
         # flash a parallel-capable flasher in a serial fashion; when
         # something fails, repeat it right away if it has retries
-        contexts = {}
         estimated_duration = 0
         check_period = 4
         all_images = [ ]
@@ -629,8 +860,12 @@ class interface(ttbl.tt_interface):
         ts = ts0 = time.time()
         done = set()
         done_impls = set()
+        ready_impls = set()
         while ts - ts0 < estimated_duration:
             target.timestamp()	# timestamp so we don't idle...
+            if job_id:
+                self._job_update(target, job_id, state = "flashing",
+                                 images_done = ",".join(sorted(done)))
 
             # sometimes files are in dynamically mounted
             # directories -- avoid they being mounted in very long
@@ -646,14 +881,18 @@ class interface(ttbl.tt_interface):
                         "flashing: (ignoring) exception stating file %s: %s",
                         filename, e)
 
-            time.sleep(check_period)
+            ready_impls = self._flash_wait(
+                target, parallel, contexts, done_impls, check_period,
+                estimated_duration - (time.time() - ts0))
             for impl, images in parallel.items():
                 if impl in done_impls:	# already completed? skip
                     continue
                 context = contexts[impl]
                 retry_count = context['retry_count']
                 ts = time.time()
-                if ts - ts0 > impl.check_period \
+                # if the flasher told us it is done (because its wait
+                # file descriptor became readable), check right away
+                if ( impl in ready_impls or ts - ts0 > impl.check_period ) \
                    and impl.flash_check_done(target, images, context) == True:
                     # says it is done, let's verify it
                     r = impl.flash_post_check(target, images, context)
@@ -722,7 +961,20 @@ class interface(ttbl.tt_interface):
                     None, None)
 
 
-    def _flash_parallel(self, target, parallel, power_sequence_pre, power_sequence_post):
+    def _flash_parallel(self, target, parallel, power_sequence_pre,
+                        power_sequence_post, job_id = None):
+        resources = set()
+        for impl in parallel:
+            resources.update(impl.resources)
+        if resources and job_id:
+            self._job_update(target, job_id, state = "waiting-resources",
+                             resources = ",".join(sorted(resources)))
+        with resources_acquired(target, resources):
+            self._flash_parallel_locked(target, parallel, power_sequence_pre,
+                                        power_sequence_post, job_id)
+
+    def _flash_parallel_locked(self, target, parallel, power_sequence_pre,
+                               power_sequence_post, job_id):
         if power_sequence_pre:
             target.power.sequence(target, power_sequence_pre)
 
@@ -734,7 +986,7 @@ class interface(ttbl.tt_interface):
             target.log.info("flasher %s/%s: starting",
                             target.id, image_names[impl])
             self._flash_consoles_disable(target, parallel, image_names)
-            self._flash_parallel_do(target, parallel, image_names)
+            self._flash_parallel_do(target, parallel, image_names, job_id)
         finally:
             target.log.info("flasher %s/%s: done",
                             target.id, image_names[impl])
@@ -747,9 +999,152 @@ class interface(ttbl.tt_interface):
                 target.power.sequence(target, power_sequence_post)
 
 
+    def _flash(self, target, serial, parallel, job_id = None):
+        # iterate over the real implementations only
+        for impl, subimages in serial.items():
+            # Serial implementation we just fake like it is
+            # parallel, but with a single implementation at the
+            # same time
+            self._flash_parallel(target, { impl: subimages },
+                                 impl.power_sequence_pre,
+                                 impl.power_sequence_post, job_id)
+        # FIXME: collect diagnostics here of what failed only if
+        # 'admin' or some other role?
+        if parallel:
+            self._flash_parallel(target, parallel,
+                                 self.power_sequence_pre,
+                                 self.power_sequence_post, job_id)
+
+
+    @staticmethod
+    def _estimated_duration(serial, parallel):
+        # serial flashers add up, parallel flashers take as long as
+        # the longest
+        return sum(impl.estimated_duration for impl in serial) \
+            + max([ impl.estimated_duration for impl in parallel ],
+                  default = 0)
+
+
+    #: Job states that mean the job is finished
+    job_states_final = ( "completed", "failed" )
+
+    @staticmethod
+    def _job_update(target, job_id, **fields):
+        # Update the job's fields in the inventory; if the job has
+        # been replaced by another one, leave it be
+        if target.fsdb.get("interfaces.images.job.id") != job_id:
+            return
+        target.fsdb.set_keys([
+            ( "interfaces.images.job." + field, value )
+            for field, value in fields.items()
+        ])
+
+
+    def _job_run(self, target, job_id, serial, parallel):
+        # This runs in a separate process, started by _job_start()
+        target.log.info("flash job %s: started (PID %d)",
+                        job_id, os.getpid())
+        try:
+            self._flash(target, serial, parallel, job_id)
+            self._job_update(target, job_id, state = "completed",
+                             ts_end = time.time())
+            target.log.info("flash job %s: completed", job_id)
+        except Exception as e:
+            target.log.error("flash job %s: failed: %s", job_id, e,
+                             exc_info = True)
+            self._job_update(target, job_id, state = "failed",
+                             ts_end = time.time(),
+                             message = str(e)[:512])
+
+
+    def _job_active(self, target):
+        # return the ID of the flash job running in the target, None
+        # if none
+        job_pid = target.fsdb.get("interfaces.images.job.pid", None)
+        job_state = target.fsdb.get("interfaces.images.job.state", None)
+        if job_state and job_state not in self.job_states_final \
+           and commonl.process_alive(job_pid):
+            return target.fsdb.get("interfaces.images.job.id")
+        return None
+
+
+    def _job_start(self, target, serial, parallel):
+        # put_flash() already checked no other job is running
+        job_id = commonl.mkid(f"{target.id} {time.time()} {os.getpid()}", 8)
+        images = []
+        for impl_images in list(serial.values()) + list(parallel.values()):
+            images += [ k + ":" + v for k, v in impl_images.items() ]
+        target.fsdb.set("interfaces.images.job", None)
+        target.fsdb.set_keys([
+            ( "interfaces.images.job.id", job_id ),
+            ( "interfaces.images.job.state", "queued" ),
+            ( "interfaces.images.job.images", " ".join(images) ),
+            ( "interfaces.images.job.ts0", time.time() ),
+            ( "interfaces.images.job.estimated_duration",
+              self._estimated_duration(serial, parallel) ),
+        ])
+        p = commonl.fork_c(self._job_run, target, job_id, serial, parallel)
+        p.start()
+        # so the SIGCHLD handler reaps it when done
+        ttbl.daemon_pid_add(p.pid)
+        target.fsdb.set("interfaces.images.job.pid", p.pid)
+        target.log.info("flash job %s: started process %d for %s",
+                        job_id, p.pid, " ".join(images))
+        return job_id
+
+
+    def _job_status(self, target, job_id):
+        job = target.fsdb.get_as_dict("interfaces.images.job.*")
+        prefix = "interfaces.images.job."
+        job = { k[len(prefix):]: v for k, v in job.items() }
+        if job.get('id', None) != job_id:
+            raise IndexError(f"{job_id}: unknown flash job")
+        state = job.get('state', None)
+        if state not in self.job_states_final \
+           and not commonl.process_alive(job.get('pid', None)):
+            # the process died on us (eg: daemon restarted)
+            state = "failed"
+            job['message'] = "flash job process died unexpectedly"
+        ts0 = job.get('ts0', time.time())
+        ts = job.get('ts_end', time.time())
+        estimated_duration = job.get('estimated_duration', 0)
+        elapsed = ts - ts0
+        if state == "completed":
+            progress = 100
+            eta = 0
+        elif estimated_duration:
+            # we can't know for sure, so we never say 100% until done
+            progress = min(99, int(100 * elapsed / estimated_duration))
+            eta = max(0, estimated_duration - elapsed)
+        else:
+            progress = 0
+            eta = None
+        return dict(
+            job_id = job_id,
+            state = state,
+            images = job.get('images', ""),
+            images_done = job.get('images_done', ""),
+            elapsed = elapsed,
+            estimated_duration = estimated_duration,
+            progress = progress,
+            eta = eta,
+            message = job.get('message', None),
+        )
+
+
     def put_flash(self, target, who, args, _files, user_path):
         images = self.arg_get(args, 'images', dict)
+        job = self.arg_get(args, 'job', bool,
+                           allow_missing = True, default = False)
         with target.target_owned_and_locked(who):
+            # a flash job running in the background would be using
+            # the same hardware, so nothing else can be flashed until
+            # it is done
+            job_id = self._job_active(target)
+            if job_id:
+                raise RuntimeError(
+                    "flash job %s still running; wait for it to complete"
+                    % job_id)
             # look at all the images we are asked to flash and
             # classify them, depending on what implementation will
             # handle them
@@ -815,24 +1210,47 @@ class interface(ttbl.tt_interface):
                     # we are still using this file and doesn't not attempt
                     # to clean it up too soon
                     commonl.file_touch(real_file_name)
+                    ttbl.store.files_index_record(real_file_name)
             target.timestamp()
-            # iterate over the real implementations only
-            for impl, subimages in serial.items():
-                # Serial implementation we just fake like it is
-                # parallel, but with a single implementation at the
-                # same time
-                self._flash_parallel(target, { impl: subimages },
-                                     impl.power_sequence_pre,
-                                     impl.power_sequence_post)
-            # FIXME: collect diagnostics here of what failed only if
-            # 'admin' or some other role?
-            if parallel:
-                self._flash_parallel(target, parallel,
-                                     self.power_sequence_pre,
-                                     self.power_sequence_post)
+            if job:
+                return dict(job_id = self._job_start(target, serial, parallel))
+            self._flash(target, serial, parallel)
             return {}
 
 
+    def get_flash_job(self, target, who, args, _files, _user_path):
+        job_id = self.arg_get(args, 'job_id', str)
+        wait = self.arg_get(args, 'wait', ( int, float ),
+                            allow_missing = True, default = 0)
+        with target.target_owned_and_locked(who):
+            # long polling: if asked to, hold on to the request until
+            # the job finishes or we are out of time
+            ts0 = time.time()
+            while True:
+                r = self._job_status(target, job_id)
+                if r['state'] in self.job_states_final \
+                   or time.time() - ts0 >= wait:
+                    return r
+                time.sleep(min(1, max(0, wait - (time.time() - ts0))))
+
+
+    def _release_hook(self, target, _force):
+        # if a flash job is still running, kill it, the target is no
+        # longer ours
+        job_state = target.fsdb.get("interfaces.images.job.state", None)
+        if job_state == None or job_state in self.job_states_final:
+            return
+        job_pid = target.fsdb.get("interfaces.images.job.pid", None)
+        if commonl.process_alive(job_pid):
+            target.log.error("flash job %s: killing PID %s on release",
+                             target.fsdb.get("interfaces.images.job.id"),
+                             job_pid)
+            commonl.process_terminate(job_pid, tag = "flash job")
+        target.fsdb.set("interfaces.images.job.state", "failed")
+        target.fsdb.set("interfaces.images.job.message",
+                        "killed: target released")
+
+
     def get_flash(self, target, who, args, _files, user_path):
         image = self.arg_get(args, 'image', str)
         image_offset = self.arg_get(args, 'image_offset', int,
@@ -1762,11 +2180,40 @@ class flash_shell_cmd_c(impl2_c):
         # this is needed so SIGCHLD the process and it doesn't become
         # a zombie
         ttbl.daemon_pid_add(self.p.pid)	# FIXME: race condition if it died?
+        self._pidfd_open(target, context)
         target.log.debug("%s: flasher PID %s started (%s)",
                          image_types, self.p.pid, cmdline_s)
         return
 
 
+    def _pidfd_open(self, target, context):
+        # get a PID file descriptor for the flasher process, which
+        # becomes readable when it exits, so the core can wait on it
+        # instead of polling; needs Python >= 3.9 and Linux >= 5.3,
+        # otherwise we'll just be polled.
+        self._pidfd_close(context)
+        try:
+            context['pidfd'] = os.pidfd_open(self.p.pid)
+        except ( AttributeError, OSError ) as e:
+            target.log.info("flasher PID %s: can't open pidfd, will poll: %s",
+                            self.p.pid, e)
+
+    @staticmethod
+    def _pidfd_close(context):
+        pidfd = context.pop('pidfd', None)
+        if pidfd != None:
+            os.close(pidfd)
+
+    def flash_context_release(self, target, images, context):
+        self._pidfd_close(context)
+
+    def flash_wait_fds(self, target, images, context):
+        pidfd = context.get('pidfd', None)
+        if pidfd == None:
+            return []
+        return [ pidfd ]
+
+
     def flash_check_done(self, target, images, context):
         ts = time.time()
         ts0 = context['ts0']
@@ -1777,6 +2224,7 @@ class flash_shell_cmd_c(impl2_c):
             r = False
         else:
             r = True
+            self._pidfd_close(context)
         ts = time.time()
         target.log.debug(
             "%s: [+%.1fs] flasher PID %s checked %s",
@@ -1790,6 +2238,7 @@ class flash_shell_cmd_c(impl2_c):
         target.log.debug(
             "%s: [+%.1fs] flasher PID %s terminating due to timeout",
             context['kws']['image_types'], ts - ts0, self.p.pid)
+        self._pidfd_close(context)
         commonl.process_terminate(context['pidfile'], path = self.path)
 
 
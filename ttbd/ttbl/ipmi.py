@@ -18,13 +18,317 @@ import numbers
 import os
 import pprint
 import re
+import select
 import subprocess
+import threading
 import time
 
 import commonl
 import ttbl.power
 import ttbl.console
 
+#: Close a BMC session that has not been used in this many seconds
+#:
+#: BMCs can only keep a few sessions open (often four or five); each
+#: server process keeps its own, so they shall not be kept idle for
+#: long.
+session_idle_max = 30
+
+#: Reuse a BMC's power status for this many seconds
+#:
+#: When checking the power of many targets controlled by the same BMC
+#: (or many components in the same target), only one of them queries
+#: the BMC, the rest use the answer. Keep it shorter than the time
+#: implementations wait between samples when checking for a stable
+#: power state (:attr:`ttbl.power.impl_c.wait`).
+session_status_max_age = 0.5
+
+
+class session_c:
+    """
+    Persistent *ipmitool* session to a BMC
+
+    Instead of starting *ipmitool* (and thus authenticating a new
+    RMCP+ session with the BMC) for each operation, start it once in
+    *shell* mode and feed it commands over its standard input.
+
+    After each command, an *echo* of a unique marker is sent; the
+    command's output is everything printed before the marker.
+
+    If a command fails in a session that was already open (eg: the
+    BMC timed it out), the session is restarted and the command
+    retried once; sessions unused for :data:`session_idle_max`
+    seconds are closed.
+
+    Use :func:`session_get` to get the one shared in the process.
+
+    :param list(str) cmdline: *ipmitool* command line, without the
+      command to run
+
+    :param dict env: environment for *ipmitool* (eg: *IPMI_PASSWORD*)
+
+    :param float timeout: maximum time to wait for a command to
+      complete
+    """
+    #: Prompt *ipmitool* prints in shell mode
+    prompt = b"ipmitool> "
+
+    # ipmitool only exits with an error code on failures, but in
+    # shell mode we don't get exit codes; this catches the messages
+    # it prints then
+    _error_regex = re.compile(
+        r"^(Error|Unable to|Invalid|.* failed\b)", re.MULTILINE)
+
+    class session_e(Exception):
+        pass
+
+    def __init__(self, cmdline, env, timeout):
+        commonl.assert_list_of_strings(cmdline, "cmdline", "argument")
+        assert isinstance(env, dict)
+        assert isinstance(timeout, numbers.Real) and timeout > 0
+        self.cmdline = cmdline
+        self.env = env
+        self.timeout = timeout
+        self.p = None
+        self.buffer = b""
+        self.lock = threading.Lock()
+        self.count = 0
+        #: Number of sessions started
+        self.sessions = 0
+        #: When the open session is closed if not used again
+        self.deadline = 0
+        self.status = None
+        self.status_ts = 0
+        self.status_lock = threading.Lock()
+
+
+    def _start(self):
+        self.p = subprocess.Popen(
+            self.cmdline + [ "shell" ], env = self.env, shell = False,
+            stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT, close_fds = True)
+        os.set_blocking(self.p.stdout.fileno(), False)
+        self.buffer = b""
+        self.sessions += 1
+        _sessions_reaper_kick()
+
+
+    def _stop(self):
+        if self.p == None:
+            return
+        try:
+            # closes the session with the BMC
+            self.p.stdin.write(b"exit\n")
+            self.p.stdin.close()
+        except OSError:
+            pass		# already dead
+        try:
+            self.p.wait(timeout = 2)
+        except subprocess.TimeoutExpired:
+            self.p.kill()
+            self.p.wait()
+        self.p.stdout.close()
+        self.p = None
+
+
+    def close(self):
+        """
+        Close the session (the next command will open a new one)
+        """
+        with self.lock:
+            self._stop()
+
+
+    def _idle_close(self):
+        # called by _sessions_reap(); returns when to check again,
+        # *None* if there is no session open
+        if not self.lock.acquire(blocking = False):
+            # in use, so it'll be a while before it is idle
+            return time.time() + session_idle_max
+        try:
+            if self.p == None:
+                return None
+            if time.time() >= self.deadline:
+                self._stop()
+                return None
+            return self.deadline
+        finally:
+            self.lock.release()
+
+
+    def _line_read(self, deadline):
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise self.session_e("timed out waiting for ipmitool")
+            fd = self.p.stdout.fileno()
+            readable, _, _ = select.select([ fd ], [], [], remaining)
+            if not readable:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                raise self.session_e("ipmitool died")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        while line.startswith(self.prompt):
+            line = line[len(self.prompt):]
+        return line.rstrip(b"\r")
+
+
+    def _command_run(self, command):
+        self.count += 1
+        marker = b"@@ttbd-ipmi-%d@@" % self.count
+        command_line = " ".join(command).encode("utf-8")
+        try:
+            self.p.stdin.write(command_line + b"\necho " + marker + b"\n")
+            self.p.stdin.flush()
+        except OSError as e:
+            raise self.session_e(f"ipmitool died: {e}") from e
+        deadline = time.time() + self.timeout
+        output = []
+        while True:
+            try:
+                line = self._line_read(deadline)
+            except self.session_e as e:
+                # whatever it printed before dying tells why
+                output += [ self.buffer, str(e).encode("utf-8") ]
+                raise self.session_e(b"\n".join(output)) from e
+            if line == marker:
+                return b"\n".join(output)
+            # readline echoes what we type
+            if line in ( command_line, b"echo " + marker ):
+                continue
+            output.append(line)
+
+
+    def run(self, command):
+        """
+        Run an *ipmitool* command
+
+        :param list(str) command: command and arguments (eg: *[
+          "chassis", "power", "on" ]*)
+
+        :returns bytes: output of the command
+
+        :raises subprocess.CalledProcessError: if the command fails,
+          as if *ipmitool* had been run with it
+        """
+        commonl.assert_list_of_strings(command, "command", "argument")
+        with self.lock:
+            if self.p != None and time.time() >= self.deadline:
+                self._stop()	# the BMC might have closed it already
+            for retry in ( True, False ):
+                if self.p == None:
+                    self._start()
+                    retry = False	# a new session won't do better
+                try:
+                    output = self._command_run(command)
+                    failed = self._error_regex.search(
+                        output.decode("utf-8", errors = "replace")) != None
+                except self.session_e as e:
+                    output = e.args[0]
+                    failed = True
+                if not failed:
+                    break
+                self._stop()
+                if not retry:
+                    break
+            self.deadline = time.time() + session_idle_max
+            if command[:2] == [ "chassis", "power" ] \
+               and command[2:] != [ "status" ]:
+                self.status = None
+        if failed:
+            raise subprocess.CalledProcessError(
+                1, self.cmdline + command, output = output)
+        return output
+
+
+    def power_status(self):
+        """
+        Run *ipmitool chassis power status*, sharing the result
+
+        If another thread is already querying the BMC, wait for its
+        result; reuse the result for
+        :data:`session_status_max_age` seconds.
+
+        :returns bytes: output of the command
+        """
+        with self.status_lock:
+            if self.status != None \
+               and time.time() - self.status_ts < session_status_max_age:
+                return self.status
+            status = self.run([ "chassis", "power", "status" ])
+            self.status = status
+            self.status_ts = time.time()
+            return status
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sessions_pid = None
+# _sessions_reap() waits on this for new sessions
+_sessions_cond = threading.Condition(_sessions_lock)
+_sessions_started = 0
+
+def _sessions_reaper_kick():
+    # a new session was started; its deadline might be sooner than
+    # what _sessions_reap() is waiting for
+    global _sessions_started
+    with _sessions_cond:
+        _sessions_started += 1
+        _sessions_cond.notify()
+
+
+def _sessions_reap():
+    # one thread per process closes the sessions that have been
+    # idle for session_idle_max seconds
+    while True:
+        with _sessions_lock:
+            started = _sessions_started
+            sessions = list(_sessions.values())
+        deadline = None
+        for session in sessions:
+            session_deadline = session._idle_close()
+            if session_deadline != None \
+               and ( deadline == None or session_deadline < deadline ):
+                deadline = session_deadline
+        with _sessions_cond:
+            if started != _sessions_started:
+                continue
+            if deadline == None:
+                _sessions_cond.wait()
+            else:
+                _sessions_cond.wait(max(deadline - time.time(), 0))
+
+
+def session_get(cmdline, env, timeout):
+    """
+    Return the session to a BMC shared in this process
+
+    Sessions are not shared with processes forked after starting
+    them, each process gets its own.
+
+    Parameters as for :class:`session_c`; the same *cmdline* and *env*
+    get the same session.
+
+    :returns session_c: session
+    """
+    global _sessions_pid
+    key = ( tuple(cmdline), tuple(sorted(env.items())) )
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # forked; these belong to the parent, as did the reaper
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+            threading.Thread(target = _sessions_reap, daemon = True,
+                             name = "ipmi-sessions-reaper").start()
+        session = _sessions.get(key, None)
+        if session == None:
+            session = session_c(cmdline, env, timeout)
+            _sessions[key] = session
+        return session
+
+
 class pci(ttbl.power.impl_c):
     """
     Power controller to turn on/off a server via IPMI
@@ -42,6 +346,10 @@ class pci(ttbl.power.impl_c):
     :param int ipmi_retries: times to retry the IPMI operation (will be
       passed to *ipmitool*'s *-R* option.
 
+    :param bool session_reuse: (optional, default *False*) keep a
+      session open with the BMC to run the commands (see
+      :class:`session_c`) instead of starting *ipmitool* for each.
+
     :param bool lenient: (optional, default *False*) if the IPMI
       commands fail when power on, pretend nothing happened.
 
@@ -56,11 +364,15 @@ class pci(ttbl.power.impl_c):
 
     Other parameters as to :class:ttbl.power.impl_c.
     """
+    upid_device_fields = ( "hostname", )
+
     def __init__(self, bmc_hostname, ipmi_timeout = 10, ipmi_retries = 3,
                  extra_ipmitool_cmdline = None,
                  lenient: bool = False,
+                 session_reuse: bool = False,
                  **kwargs):
         assert isinstance(lenient, bool)
+        assert isinstance(session_reuse, bool)
         ttbl.power.impl_c.__init__(self, paranoid = True, **kwargs)
         user, password, hostname \
             = commonl.split_user_pwd_hostname(bmc_hostname)
@@ -91,6 +403,8 @@ class pci(ttbl.power.impl_c):
         self.wait = 2
         self.lenient = lenient
         self.lenient_runtime = None
+        self.session_reuse = session_reuse
+        self.session_timeout = ipmi_timeout * (ipmi_retries + 1) + 5
 
         # We don't use the username because it doesn't uniquely
         # identify the physical instrument
@@ -98,11 +412,19 @@ class pci(ttbl.power.impl_c):
                       name = f"IPMI@{hostname}",
                       hostname = hostname)
 
-    def _run(self, target, command):
+    def _run(self, target, command, status = False):
         try:
-            result = subprocess.check_output(
-                self.cmdline + command, env = self.env, shell = False,
-                stderr = subprocess.STDOUT)
+            if not self.session_reuse:
+                result = subprocess.check_output(
+                    self.cmdline + command, env = self.env, shell = False,
+                    stderr = subprocess.STDOUT)
+            else:
+                session = session_get(self.cmdline, self.env,
+                                      self.session_timeout)
+                if status:
+                    result = session.power_status()
+                else:
+                    result = session.run(command)
         except subprocess.CalledProcessError as e:
             if self.lenient_runtime:
                 target.log.exception(
@@ -138,7 +460,8 @@ class pci(ttbl.power.impl_c):
         self.lenient_runtime = target.property_get(
             f"interfaces.power.{component}.ipmi_lenient",
             self.lenient)
-        result = self._run(target, [ "chassis", "power", "status" ])
+        result = self._run(target, [ "chassis", "power", "status" ],
+                           status = True)
         if b'Chassis Power is on' in result:
             return True
         elif b'Chassis Power is off' in result:
@@ -204,13 +527,19 @@ class pos_mode_c(ttbl.power.impl_c):
     :param int ipmi_retries: times to retry the IPMI operation (will be
       passed to *ipmitool*'s *-R* option.
 
+    :param bool session_reuse: (optional, default *False*) keep a
+      session open with the BMC to run the commands (see
+      :class:`session_c`) instead of starting *ipmitool* for each.
+
     Other parameters as to :class:ttbl.power.impl_c.
     """
     def __init__(self, hostname, ipmi_timeout = 10, ipmi_retries = 3,
+                 session_reuse: bool = False,
                  **kwargs):
         assert isinstance(hostname, str)
         assert isinstance(ipmi_timeout, numbers.Real)
         assert isinstance(ipmi_retries, int)
+        assert isinstance(session_reuse, bool)
         ttbl.power.impl_c.__init__(self, paranoid = True, **kwargs)
         self.power_on_recovery = True
         self.paranoid_get_samples = 1
@@ -236,6 +565,8 @@ class pos_mode_c(ttbl.power.impl_c):
         self.timeout = 20
         self.wait = 0.1
         self.paranoid_get_samples = 1
+        self.session_reuse = session_reuse
+        self.session_timeout = ipmi_timeout * (ipmi_retries + 1) + 5
 
         # We don't use the username because it doesn't uniquely
         # identify the physical instrument
@@ -246,9 +577,13 @@ class pos_mode_c(ttbl.power.impl_c):
 
     def _run(self, target, command):
         try:
-            result = subprocess.check_output(
-                self.cmdline + command, env = self.env, shell = False,
-                stderr = subprocess.STDOUT)
+            if not self.session_reuse:
+                result = subprocess.check_output(
+                    self.cmdline + command, env = self.env, shell = False,
+                    stderr = subprocess.STDOUT)
+            else:
+                result = session_get(self.cmdline, self.env,
+                                     self.session_timeout).run(command)
         except subprocess.CalledProcessError as e:
             target.log.error("ipmitool %s failed: %s",
                              " ".join(command), e.output)
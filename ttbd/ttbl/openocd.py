@@ -32,28 +32,12 @@ import re
 import socket
 import time
 import traceback
-import types
-
-import pexpect
-try:
-    import pexpect.fdpexpect
-except ImportError:
-    # RHEL 7 -> fdpexpect is a separate module, not a submod of pexpectg    import fdpexpect
-    import fdpexpect
-    pexpect.fdpexpect = fdpexpect
-
-# FIXME: remove -> cleanup
-try:
-    from pexpect.exceptions import TIMEOUT as pexpect_TIMEOUT
-    from pexpect.exceptions import EOF as pexpect_EOF
-except ImportError:
-    from pexpect import TIMEOUT as pexpect_TIMEOUT
-    from pexpect import EOF as pexpect_EOF
 
 import commonl
 import ttbl
 import ttbl.debug
 import ttbl.images
+import ttbl.openocd_tcl
 import ttbl.power
 
 # FIXME: rename to address_maps
@@ -437,7 +421,9 @@ class pc(ttbl.power.daemon_c, ttbl.images.impl_c, ttbl.debug.impl_c):
 
     To execute commands, it connects to the daemon via TCL and
     runs them using the ``'capture "OPENOCDCOMMAND"'`` TCL command
-    (FIXME: is there a better way?). The telnet port is open for
+    (FIXME: is there a better way?); the connection is kept open and
+    shared by all the operations in the same server process (see
+    :func:`ttbl.openocd_tcl.client_get`). The telnet port is open for
     manual debugging (check your firewall! **no passwords!**); the GDB
     ports are also available.
 
@@ -594,6 +580,12 @@ class pc(ttbl.power.daemon_c, ttbl.images.impl_c, ttbl.debug.impl_c):
     class expect_connect_e(error):
         pass
 
+    class error_timeout(error):
+        pass
+
+    class error_eof(error):
+        pass
+
     #
     # Power interface
     #
@@ -769,23 +761,17 @@ def __pending(self):
     @contextlib.contextmanager
     def _expect_mgr(self):
         """
-        Open up a socket to the OpenOCD TCL port and start a expect
-        object to talk to it.
+        Get the connection to the OpenOCD TCL port
 
-        This is a context manager; upon return, kill it all.
-        """
-        def read_nonblocking_patched(self, size = 1, timeout = None):
-            try:
-                return self.read_nonblocking_original(size, timeout)
-            except OSError as e:
-                if e.args[0] == errno.EAGAIN:
-                    return ""
-                raise
-            except:
-                raise
+        The connection (:class:`ttbl.openocd_tcl.tcl_client_c`) is
+        shared by all the operations done in this process on this
+        OpenOCD instance and it is not closed when leaving; it is
+        reopened if OpenOCD is restarted or the connection drops.
 
-        self.p = None
-        self.sk = None
+        This is a context manager.
+        """
+        self.tcl = None
+        self.response = None
         self.pid = None
         self.pid_s = None
         tcp_port_base = -1
@@ -796,27 +782,13 @@ def __pending(self):
                     raise self.error("can't find OpenOCD's pid")
                 self.pid = int(self.pid_s)
                 tcp_port_base = int(self.tt.fsdb.get("openocd.port"))
-                self.log.debug("connecting to openocd pid %d port %d"
+                self.log.debug("using connection to openocd pid %d port %d"
                                % (self.pid, tcp_port_base + 1))
-                self.sk = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 # TCL conection!
-                self.sk.settimeout(5)
-                self.sk.connect(("localhost", tcp_port_base + 1))
-                self.p = pexpect.fdpexpect.fdspawn(
-                    self.sk.fileno(),
-                    # Open logfile with no codec anything, this seems to
-                    # yield the best result to avoid UnicodeErrors; we
-                    # open it, however, as utf-8,errors=replace
-                    # Append to log file, so we can tell the full story
-                    logfile = open(self.log_name + ".expect", "ab"),
-                    timeout = 5)
-                # FDexpect seems to have a bug where an EAGAIN is just
-                # floated up instead of waiting
-                self.p.read_nonblocking_original = self.p.read_nonblocking
-                self.p.read_nonblocking = types.MethodType(
-                    read_nonblocking_patched, self.p)
+                self.tcl = ttbl.openocd_tcl.client_get(
+                    tcp_port_base + 1, pid = self.pid, log = self.log)
             except (Exception, OSError) as e:
-                s = "expect init (pid %s port %d) failed: %s" \
+                s = "TCL client init (pid %s port %d) failed: %s" \
                     % (self.pid_s, tcp_port_base + 1, e)
                 if type(e) == Exception:	# Code BUG?
                     s += "\n" + traceback.format_exc()
@@ -824,26 +796,14 @@ def __pending(self):
                 raise self.expect_connect_e(s)
             yield
         finally:
-            # Make sure the cleanup is always executed no matter what
-            if self.p != None:
-                # Some pexpect versions don't close this file properly
-                if self.p.logfile:
-                    del self.p.logfile
-                del self.p
-            if self.sk != None:
-                try:
-                    self.sk.shutdown(socket.SHUT_RDWR)
-                except Exception as e:
-                    self.log.warning("Error shutting down socket: %s", e)
-                self.sk.close()
-                del self.sk
+            # the connection stays open for the next operation
+            self.tcl = None
 
     def _log_error_output(self, msg = "n/a"):
         self.log.error("Error condition: " + msg)
-        if self.p != None:
-            for line in self.p.before.splitlines():
-                self.log.error("output[before]: "
-                               + line.encode('utf-8').strip())
+        if self.response != None:
+            for line in self.response.splitlines():
+                self.log.error("output: " + line.strip())
         # FIXME: not really needed, it adds too much blub
         #with codecs.open(self.log_name + ".expect", "r", encoding = 'utf-8',
         #                 errors = 'replace') as inf:
@@ -856,60 +816,57 @@ def __pending(self):
             for line in inf:
                 self.log.error("log: " + line.strip())
 
-    def __send_command(self, action, command, expect = None,
-                       timeout = 3):
+    def __send_commands(self, action, commands, timeout = 3):
         """
-        :param str|list|regex expect: what to expect. Don't use open
-                      ended regular expressions (eg: "something.*") as
-                      that would capture the last character that
-                      expect sends (the transmission terminator) and
-                      this function would not be able to find it.
+        Run multiple OpenOCD commands in a single round trip
 
-        :param int timeout: Default timeout for normal command
-           execution; commands that take longer to execute (like
-           memory writes, etc), shall increase it
+        :param list commands: list of *(COMMAND, EXPECT)*, as the
+          *command* and *expect* arguments to :meth:`__send_command`;
+          they are all sent at the same time, so only use it when
+          running a command doesn't depend on how the previous ones
+          went.
 
-        Note this creates/connects a socket and a expect object which
-        each command we send. Sounds (and is) quite a lot of overhead,
-        but it has proben to work much more dependably than keeping a
-        expect object and socket around.
+        :param int timeout: time to wait for all the responses
 
-        Note this has to be called from within a 'with
-        self._expect_mgr' block. If you run multiple commands, you
-        might want to use a single block for them, otherwise OpenOCD
-        runs out of sockets (and doesn't recycle them fast enough) and
-        connections are rejected, resulting in EOF
-        errors. Annoying. As we kill the OpenOCD process when we power
-        off the target, this seems to be good enough to not run out of sockets.
+        :returns list: for each command, *None* if no expectations
+          were given, otherwise the index of the one that matched.
 
+        Note this has to be called from within a 'with
+        self._expect_mgr' block.
         """
         self.log.action = action
-        waiting_for = self._pattern_or_str(expect)
-        r = None
+        waiting_for = "response"
+        rs = []
         try:
-            self.log.debug("running: %s" % command)
-            if command:
-                self.p.send(('capture "' + command + '"\x1a').encode("utf-8"))
-            self.p.timeout = timeout		# spec in the fn does not work
-            if expect != None:
-                self.log.debug("waiting for response [%.fs]: %s",
-                               timeout, expect)
-                r = self.p.expect(expect, timeout = timeout)
+            self.log.debug("running: %s" % [ i[0] for i in commands ])
+            self.log.debug("waiting for responses [%.fs]", timeout)
+            responses = self.tcl.commands(
+                [ 'capture "' + command + '"' for command, _ in commands ],
+                timeout = timeout)
+            for response, ( _command, expect ) in zip(responses, commands):
+                self.response = response
+                if expect == None:
+                    rs.append(None)
+                    continue
+                waiting_for = self._pattern_or_str(expect)
+                r = ttbl.openocd_tcl.expect_match(response, expect)
+                if r == None:
+                    # no more output is coming, as it would have
+                    # timed out waiting for it
+                    raise ttbl.openocd_tcl.tcl_client_c.timeout_e()
                 self.log.debug("got response: %d", r)
-            self.log.debug("waiting for response terminator [%.fs]", timeout)
-            waiting_for = "response terminator"
-            self.p.expect("\x1a")
-            self.log.info("completed, r = %s" % r)
-        except pexpect_TIMEOUT as e:
+                rs.append(r)
+            self.log.info("completed, r = %s" % rs)
+        except ttbl.openocd_tcl.tcl_client_c.timeout_e as e:
             self.log.error("timeout waiting for '%s'" % waiting_for)
             self._log_error_output()
             raise self.error_timeout("%s: failed (timeout)" % self.log.action)
-        except pexpect_EOF as e:
-            self.log.error("can't find '%s' (EOF)" % waiting_for)
+        except ttbl.openocd_tcl.tcl_client_c.eof_e as e:
+            self.log.error("can't find '%s' (EOF): %s" % (waiting_for, e))
             self._log_error_output()
             # Is OpenOCD alive at this point?
             try:
-                # note __send_command() is only called inside a 'with
+                # note __send_commands() is only called inside a 'with
                 # expect_mgr()' block, which will have initialized self.pid*
                 os.kill(self.pid, 0)
             except OSError as e:
@@ -920,7 +877,29 @@ def __pending(self):
             self._log_error_output(msg)
             raise RuntimeError("%s: failed (exception): %s"
                                % (self.log.action, e))
-        return r
+        return rs
+
+    def __send_command(self, action, command, expect = None,
+                       timeout = 3):
+        """
+        :param str|list|regex expect: what to expect in the response;
+          if a list, the index of the one found first is returned.
+
+        :param int timeout: Default timeout for normal command
+           execution; commands that take longer to execute (like
+           memory writes, etc), shall increase it
+
+        Note this has to be called from within a 'with
+        self._expect_mgr' block; the connection to OpenOCD is kept
+        across commands and blocks, so OpenOCD doesn't run out of
+        sockets (connections used to be opened for each block, which
+        made OpenOCD reject connections when done too often).
+
+        """
+        if not command:
+            return None
+        return self.__send_commands(action, [ ( command, expect ) ],
+                                    timeout)[0]
 
 
     def _per_target_setup(self, _target, _component):
@@ -943,14 +922,15 @@ def __pending(self):
                 target_id, "%d" % target_id)
         else:
             target_id_name = "%d" % target_id
-        self.__send_command("set target %s %s" % (target_id, for_what),
-                            "targets %s" % target_id_name)
         # ... so we look for TARGET* in the targets output
         # ' 1* quark_se.arc-em    arc32      little quark_se.arc-em    halted'
-        self.__send_command(
-            "check target %s selected %s" % (target_id_name, for_what),
-            "targets",
-            re.compile(r" %d\* .*(halted|reset|running)" % target_id))
+        self.__send_commands(
+            "set and check target %s selected %s" % (target_id_name, for_what),
+            [
+                ( "targets %s" % target_id_name, None ),
+                ( "targets",
+                  re.compile(r" %d\* .*(halted|reset|running)" % target_id) ),
+            ])
 
     def __target_id_halt(self, target_id, for_what = ""):
         try:
@@ -1177,7 +1157,7 @@ def __pending(self):
         self.log.action = "command run"
         with self._expect_mgr():
             self.__send_command("command from user", cmd)
-            return self.p.before
+            return self.response
 
     # Wrap actual reset with retries
     def target_reset(self, for_what = ""):
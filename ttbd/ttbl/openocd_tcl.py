@@ -0,0 +1,285 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""Client for OpenOCD's TCL server
+-------------------------------
+
+OpenOCD takes TCL commands in its TCL port (*tcl_port*); each command
+and each response is terminated by a *\\x1a* (ASCII SUB) byte, which
+is all the framing there is.
+
+:class:`tcl_client_c` keeps a connection open to an OpenOCD instance
+so a sequence of operations (eg: reset, halt, flash, resume) doesn't
+have to reconnect for each, frames the responses directly on the
+terminator and can pipeline multiple commands; use
+:func:`client_get` to get the one shared by all the operations on the
+same OpenOCD instance in the current process.
+"""
+
+import logging
+import os
+import re
+import select
+import socket
+import threading
+import time
+
+
+class tcl_client_c:
+    """
+    Persistent connection to an OpenOCD TCL server
+
+    >>> client = ttbl.openocd_tcl.tcl_client_c(6666)
+    >>> client.command('capture "targets"')
+    >>> client.commands([ 'capture "halt"', 'capture "targets"' ])
+
+    The connection is opened on the first command and reopened
+    automatically when it is found closed (eg: OpenOCD was
+    restarted). Because we can't know if a command that didn't get a
+    response was executed, a command is never resent once it was
+    sent; the error is raised and the next command will reconnect.
+
+    If a response times out, the connection is closed, since a late
+    response would otherwise be taken as the response of the next
+    command.
+
+    This is thread safe; commands and their responses are never
+    interleaved.
+
+    :param int port: TCP port where OpenOCD's TCL server listens
+
+    :param str host: (optional; default *localhost*) host where
+      OpenOCD runs
+
+    :param float timeout: (optional; default 5s) default time to wait
+      for a response
+
+    :param logging.Logger log: (optional) where to log
+    """
+    #: Terminator for commands and responses
+    terminator = b"\x1a"
+
+    class error_e(Exception):
+        pass
+
+    class timeout_e(error_e):
+        pass
+
+    class eof_e(error_e):
+        pass
+
+    def __init__(self, port, host = "localhost", timeout = 5, log = None):
+        assert isinstance(port, int)
+        assert isinstance(host, str)
+        assert isinstance(timeout, (int, float)) and timeout > 0
+        self.port = port
+        self.host = host
+        self.timeout = timeout
+        if log == None:
+            log = logging.getLogger(f"openocd-tcl[{host}:{port}]")
+        self.log = log
+        self.sk = None
+        self.buffer = b""
+        self.lock = threading.Lock()
+        #: Number of times we connected to the server
+        self.connections = 0
+
+
+    def _connect(self):
+        try:
+            self.sk = socket.create_connection((self.host, self.port),
+                                               timeout = self.timeout)
+        except OSError as e:
+            raise self.eof_e(f"{self.host}:{self.port}: can't connect: {e}") \
+                from e
+        # commands are small and we wait for their responses
+        self.sk.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b""
+        self.connections += 1
+        self.log.debug("connected (#%d)", self.connections)
+
+
+    def _close(self):
+        if self.sk == None:
+            return
+        try:
+            self.sk.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass		# already closed by the other end
+        self.sk.close()
+        self.sk = None
+        self.buffer = b""
+
+
+    def close(self):
+        """
+        Close the connection (the next command will reopen it)
+        """
+        with self.lock:
+            self._close()
+
+
+    def _stale(self):
+        # a connection we are not waiting for responses on shall have
+        # nothing to read; if it does, the other end closed (we read
+        # EOF) or we got something we didn't ask for, so we can't
+        # trust it
+        readable, _, _ = select.select([ self.sk ], [], [], 0)
+        if not readable:
+            return False
+        try:
+            data = self.sk.recv(4096, socket.MSG_PEEK)
+        except OSError:
+            return True
+        if data:
+            self.log.warning("dropping connection with unexpected data: %r",
+                             data[:64])
+        return True
+
+
+    def _response_read(self, deadline):
+        while True:
+            index = self.buffer.find(self.terminator)
+            if index >= 0:
+                response = self.buffer[:index]
+                self.buffer = self.buffer[index + 1:]
+                return response.decode("utf-8", errors = "replace")
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self._close()
+                raise self.timeout_e(
+                    f"{self.host}:{self.port}: timeout waiting for response")
+            self.sk.settimeout(remaining)
+            try:
+                data = self.sk.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                self._close()
+                raise self.eof_e(f"{self.host}:{self.port}: {e}") from e
+            if not data:
+                self._close()
+                raise self.eof_e(f"{self.host}:{self.port}: connection closed")
+            self.buffer += data
+
+
+    def commands(self, commands, timeout = None):
+        """
+        Run multiple commands, sending them all at once
+
+        :param list(str) commands: TCL commands to run
+
+        :param float timeout: (optional; default as given to the
+          constructor) time to wait for all the responses
+
+        :returns list(str): responses to each command
+
+        :raises: :class:`timeout_e` if the responses don't come in
+          time, :class:`eof_e` if the connection can't be established
+          or is closed before all the responses are received.
+        """
+        assert isinstance(commands, (list, tuple))
+        if timeout == None:
+            timeout = self.timeout
+        data = b"".join(command.encode("utf-8") + self.terminator
+                        for command in commands)
+        with self.lock:
+            if self.sk != None and self._stale():
+                self._close()
+            if self.sk == None:
+                self._connect()
+            self.log.debug("running: %s", commands)
+            try:
+                self.sk.sendall(data)
+            except OSError as e:
+                self._close()
+                raise self.eof_e(f"{self.host}:{self.port}: {e}") from e
+            deadline = time.time() + timeout
+            return [ self._response_read(deadline) for _ in commands ]
+
+
+    def command(self, command, timeout = None):
+        """
+        Run a command
+
+        :param str command: TCL command to run
+
+        :param float timeout: (optional; default as given to the
+          constructor) time to wait for the response
+
+        :returns str: response
+
+        See :meth:`commands` for errors.
+        """
+        return self.commands([ command ], timeout = timeout)[0]
+
+
+def expect_match(response, expect):
+    """
+    Find which of the expectations is found first in a response
+
+    :param str response: response from :meth:`tcl_client_c.command`
+
+    :param expect: regular expression (string or compiled) or list
+      of them
+
+    :returns int: index in *expect* of the expectation that matched
+      at the earliest position in the response (the lowest index on
+      ties); *None* if none matched
+    """
+    if isinstance(expect, (str, re.Pattern)):
+        expect = [ expect ]
+    r = None
+    start = None
+    for index, pattern in enumerate(expect):
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        m = pattern.search(response)
+        if m and (start == None or m.start() < start):
+            r = index
+            start = m.start()
+    return r
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = None
+
+def client_get(port, pid = None, host = "localhost", timeout = 5,
+               log = None):
+    """
+    Return the client for an OpenOCD instance shared in this process
+
+    Sockets are not shared with processes forked after creating
+    them, each process gets its own clients.
+
+    :param int port: TCP port where OpenOCD's TCL server listens
+
+    :param int pid: (optional) PID of the OpenOCD instance; if it
+      changes (OpenOCD was restarted), a new client is created.
+
+    Other parameters as for :class:`tcl_client_c`.
+
+    :returns tcl_client_c: client
+    """
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # forked; these belong to the parent
+            _clients.clear()
+            _clients_pid = os.getpid()
+        entry = _clients.get((host, port), None)
+        if entry != None:
+            client, client_pid = entry
+            if client_pid == pid:
+                if log != None:
+                    client.log = log
+                return client
+            client.close()
+        client = tcl_client_c(port, host = host, timeout = timeout,
+                              log = log)
+        _clients[(host, port)] = ( client, pid )
+        return client
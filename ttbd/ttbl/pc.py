@@ -578,6 +578,8 @@ class dlwps7(ttbl.power.impl_c):
     authentication and imposing javascript execution that made the
     driver fail.
     """
+    upid_device_fields = ( "url", )
+
     def __init__(self, _url, reboot_wait_s = 0.5, **kwargs):
         ttbl.power.impl_c.__init__(self, paranoid = True, **kwargs)
         # we run the driver in paranoid mode so the on and off
@@ -28,6 +28,8 @@ class ykush(ttbl.power.impl_c, ttbl.things.impl_c):
     # backend to cut in the number of open file handles
     backend = None
 
+    upid_device_fields = ( "serial_number", )
+
     def __init__(self, ykush_serial, port, **kwargs):
         """
         A power control implementation using an YKUSH switchable hub
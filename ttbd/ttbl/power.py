@@ -291,6 +291,17 @@ class impl_c(ttbl.tt_interface_impl_c):
       used once a machine is released.
 
     """
+    #: Fields of :data:`upid <ttbl.tt_interface_impl_c.upid>` that
+    #: identify the physical device (PDU, USB hub...) this component
+    #: acts on; components using the same device (eg: different
+    #: outlets of a PDU) have the same values on these fields.
+    #:
+    #: Used to limit how many deferred power actions are run on the
+    #: same device at the same time (see :func:`execute_defer_list`);
+    #: empty (default) if the component drives no shared device
+    #: (delays, local processes...).
+    upid_device_fields = ()
+
     def __init__(self, paranoid = False, explicit = None,
                  ignore_get = False, ignore_get_errors = False,
                  off_on_release = False):
@@ -323,6 +334,21 @@ class impl_c(ttbl.tt_interface_impl_c):
             " expected None, 'on', 'off' or 'both'"
 
 
+    def device_key(self):
+        """
+        Return a key identifying the physical device this component
+        acts on
+
+        :returns tuple: *(( FIELD, VALUE ), ...)* from the
+          :data:`upid_device_fields` in the UPID; *None* if the
+          component drives no shared device.
+        """
+        if not self.upid_device_fields:
+            return None
+        return tuple(( field, self.upid.get(field, None) )
+                     for field in self.upid_device_fields)
+
+
     class retry_all_e(Exception):
         """
         Exception raised when a power control implementation operation
@@ -427,9 +453,39 @@ class interface(ttbl.tt_interface):
     target, which can be a single switch or a whole power rail of
     components that have to be powered on and off in an specific
     sequence.
+
+    By default, components are powered on in the order they are
+    declared and off in the reverse order, one at a time. Components
+    that do not need each other can be powered on and off at the same
+    time by declaring what each depends on with *depends*:
+
+    >>> target.interface_add("power", ttbl.power.interface(
+    >>>     ( "AC", ttbl.raritan_emx.pci(...) ),
+    >>>     ( "USB hub", ttbl.pc_ykush.ykush(...) ),
+    >>>     ( "serial0", ttbl.console.serial_pc(...) ),
+    >>>     ( "tunnel", ttbl.power.socat_pc(...) ),
+    >>>     depends = {
+    >>>         "USB hub": [ ],
+    >>>         "serial0": [ "USB hub" ],
+    >>>         "tunnel": [ "AC" ],
+    >>>     }))
+
+    here *AC* and *USB hub* are powered on at the same time; then
+    *serial0* as soon as *USB hub* is on and *tunnel* as soon as *AC*
+    is. When powering off, a component is powered off once all the
+    ones that depend on it are off.
+
+    :param dict depends: (optional) dictionary keyed by component
+      name of lists of components that have to be powered on before
+      it. Components not listed depend on the component declared
+      before them. If not given, the whole rail is sequential.
+
+    :param bool get_parallel: (optional; default *False*) get the
+      state of all the components in parallel.
     """
 
-    def __init__(self, *impls, get_parallel: bool = False, **kwimpls):
+    def __init__(self, *impls, get_parallel: bool = False,
+                 depends: dict = None, **kwimpls):
         # in Python 3.6, kwargs are sorted; but for now, they are not.
         ttbl.tt_interface.__init__(self)
         # we need an ordered dictionary because we need to iterate in
@@ -438,6 +494,15 @@ class interface(ttbl.tt_interface):
         # each rail component matters.
         self.impls_set(impls, kwimpls, impl_c)
         self.get_parallel = get_parallel
+        assert depends == None or isinstance(depends, dict), \
+            f"depends: expected dict; got {type(depends)}"
+        for component, dependencies in ( depends or {} ).items():
+            assert isinstance(dependencies, ( list, tuple, set )), \
+                f"depends[{component}]: expected list of component names;" \
+                f" got {type(dependencies)}"
+        #: Components each component depends on (see the *depends*
+        #: argument); *None* if the rail is sequential
+        self.depends = depends
 
 
 
@@ -459,6 +524,54 @@ class interface(ttbl.tt_interface):
                 target.log.error(
                     f"exception setting up {iface_name} {name}: {e}")
                 raise
+        if self.depends:
+            for component, dependencies in self.depends.items():
+                for name in [ component ] + list(dependencies):
+                    assert name in self.impls, \
+                        f"depends: unknown power component '{name}'"
+            # raises on dependency loops
+            self._depends_get()
+
+
+    def _depends_get(self):
+        # Return a dictionary keyed by component of the set of
+        # components that have to be powered on before it (directly
+        # or because the ones it depends on depend on them), following
+        # self.depends. Components not in self.depends depend on the
+        # one declared before them.
+        direct = {}
+        previous = None
+        for component in self.impls:
+            if component in self.aliases:
+                continue
+            if component in self.depends:
+                direct[component] = set(
+                    self.aliases.get(dependency, dependency)
+                    for dependency in self.depends[component])
+            elif previous:
+                direct[component] = { previous }
+            else:
+                direct[component] = set()
+            previous = component
+
+        closure = {}
+        def _closure(component, path):
+            if component in closure:
+                return closure[component]
+            if component in path:
+                raise AssertionError(
+                    "depends: dependency loop %s"
+                    % " -> ".join(path + [ component ]))
+            components = set()
+            for dependency in direct[component]:
+                components.add(dependency)
+                components.update(_closure(dependency, path + [ component ]))
+            closure[component] = components
+            return components
+
+        for component in direct:
+            _closure(component, [])
+        return closure
 
 
     def _release_hook(self, target, _force):
@@ -755,6 +868,130 @@ class interface(ttbl.tt_interface):
         return state, data, substate
 
 
+    def _impl_off_retry(self, impl, target, component, component_real, why):
+        # power off a component, retrying once; errors are logged and
+        # ignored, so we can cleanup state and continue with the rest
+        target.log.debug("%s: powering off%s" % (component, why))
+        try:		        # we retry power off twice
+            self._impl_off(impl, target, component_real)
+            return
+        except Exception as e:	# pylint: disable = broad-except
+            target.log.error("%s: power off%s: failed; retrying: %s"
+                             % (component, why, e))
+        try:
+            self._impl_off(impl, target, component_real)
+        except Exception as e:	# pylint: disable = broad-except
+            target.log.error(
+                "%s: power off%s: failed twice; skipping: %s\n%s"
+                % (component, why, e, traceback.format_exc()))
+
+
+    def _impl_on_recover(self, impl, target, component, component_real, why):
+        # power on a component; if it fails and it supports recovery,
+        # power it off and try again.
+        #
+        # impl_c.retry_all_e is passed to the caller, who shall power
+        # off and on the whole rail
+        recovery_wait = 0.5
+        target.log.debug("%s: powering on%s" % (component, why))
+        try:
+            self._impl_on(impl, target, component_real)	# ok, power ir on
+            return
+        except impl_c.retry_all_e:
+            raise
+        except Exception as e:	# pylint: disable = broad-except
+            # This power component has errored when powering on.
+            # We'll retry by powering it off, then on again
+            if impl.power_on_recovery:
+                target.log.error(
+                    "%s: power-on%s failed: retrying after power-off: %s"
+                    % (component, why, e))
+            else:
+                target.log.error(
+                    "%s: power-on%s failed: not retrying: %s"
+                    % (component, why, e))
+                raise
+        try:
+            # power off to recover
+            self._impl_off(impl, target, component_real)
+        except Exception as e:	# pylint: disable = broad-except
+            target.log.error("%s: power off%s for recovery "
+                             "failed (ignoring): %s"
+                             % (component, why, e))
+        time.sleep(recovery_wait)
+        try:		        # Let's retry
+            self._impl_on(impl, target, component_real)
+        except Exception as e:
+            target.log.error(
+                "%s: power-on%s failed (again): aborting: %s"
+                % (component, why, e))
+            try:	        # ok, not good, giving up
+                # power off just in case, to avoid electrical
+                # issues, etc.
+                self._impl_off(impl, target, component_real)
+            except Exception as e:	# pylint: disable = broad-except
+                # is not much we can do if it fails
+                target.log.error(
+                    "%s: power-off%s due to failed power-on failed: %s"
+                    % (component, why, e))
+                # don't raise this, raise the original one
+            raise
+
+
+    def _graph_run(self, target, todo, fn, why, reverse = False):
+        # Run fn(impl, target, component, component_real, why) for
+        # each component in todo (a dict keyed by component of
+        # (impl, component_real)), each as soon as the ones it depends
+        # on are done (or, if reverse, as soon as the ones that depend
+        # on it are done), in parallel otherwise.
+        #
+        # We use threads, since most of the work is waiting for
+        # devices and processes started by the components have to
+        # stay with this process; if one fails, we wait for those
+        # running to finish, start no more and raise its exception.
+        if not todo:
+            return
+        depends = self._depends_get()
+        waits = {}
+        for component, ( _impl, component_real ) in todo.items():
+            if reverse:
+                waits[component] = set(
+                    other for other, ( _, other_real ) in todo.items()
+                    if component_real in depends.get(other_real, ()))
+            else:
+                waits[component] = set(
+                    other for other, ( _, other_real ) in todo.items()
+                    if other_real in depends.get(component_real, ()))
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            len(todo), thread_name_prefix = f"{target.id}/power")
+        running = {}
+        done = set()
+        exception = None
+        try:
+            while waits or running:
+                for component in list(waits):
+                    if exception != None or not waits[component] <= done:
+                        continue
+                    del waits[component]
+                    impl, component_real = todo[component]
+                    future = executor.submit(fn, impl, target, component,
+                                             component_real, why)
+                    running[future] = component
+                if not running:
+                    break
+                futures_done, _ = concurrent.futures.wait(
+                    running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in futures_done:
+                    done.add(running.pop(future))
+                    if future.exception() != None and exception == None:
+                        exception = future.exception()
+        finally:
+            executor.shutdown(wait = True)
+        if exception != None:
+            raise exception
+
+
     def _off(self, target, impls, why, whole_rail = True, explicit = False):
         #
         # Power off everything
@@ -775,6 +1012,7 @@ class interface(ttbl.tt_interface):
                 f(target)
             target.log.debug("power pre-off%s done" % why)
 
+        todo = collections.OrderedDict()
         for component, impl in reversed(impls):
             if component in self.aliases:
                 if whole_rail:
@@ -794,24 +1032,15 @@ class interface(ttbl.tt_interface):
                 target.log.debug("%s: powering off%s: skipping (explicit/%s)"
                                  % (component, why, impl.explicit))
                 continue            	# it says it is off, so we skip it
+            todo[component] = ( impl, component_real )
 
-            target.log.debug("%s: powering off%s" % (component, why))
-            try:		        # we retry power off twice
-                self._impl_off(impl, target, component_real)
-                continue
-            except Exception as e:	# pylint: disable = broad-except
-                target.log.error("%s: power off%s: failed; retrying: %s"
-                                 % (component, why, e))
-            try:
-                self._impl_off(impl, target, component_real)
-                continue
-            except Exception as e:	# pylint: disable = broad-except
-                target.log.error(
-                    "%s: power off%s: failed twice; skipping: %s\n%s"
-                    % (component, why, e, traceback.format_exc()))
-                # we don't raise no more, we want to be able to
-                # cleanup state and continue with the rest
-                target.log.debug("%s: powered off%s" % (component, why))
+        if self.depends:
+            self._graph_run(target, todo, self._impl_off_retry, why,
+                            reverse = True)
+        else:
+            for component, ( impl, component_real ) in todo.items():
+                self._impl_off_retry(impl, target, component,
+                                     component_real, why)
         if whole_rail:
             target.log.debug(
                 "power post-off%s; fns %s"
@@ -830,6 +1059,58 @@ class interface(ttbl.tt_interface):
         target.log.info("powered off%s" % why)
 
 
+    def _on_graph(self, target, impls, data, why, whole_rail, explicit):
+        # _on() for rails with dependencies: filter what needs to be
+        # powered on as _on() does and then run them in parallel as
+        # the dependencies allow.
+        todo = collections.OrderedDict()
+        for component, impl in impls:
+            if component in self.aliases:
+                if whole_rail:
+                    target.log.debug("%s: power on%s: skipping (alias)"
+                                     % (component, why))
+                    continue
+                component_real = self.aliases[component]
+            else:
+                component_real = component
+            if whole_rail \
+               and impl.explicit in ( "on", "both" ) and not explicit:
+                target.log.debug("%s: powering on%s: skipping (explicit/%s)"
+                                 % (component, why, impl.explicit))
+                continue
+            if data[component]['state'] == True:
+                target.log.debug("%s: powering on%s: skipping (already on)"
+                                 % (component, why))
+                continue
+            todo[component] = ( impl, component_real )
+
+        retries = 0
+        retries_max = 3
+        while True:
+            try:
+                self._graph_run(target, todo, self._impl_on_recover, why)
+                return
+            except impl_c.retry_all_e as e:
+                # as _on(), power off the rail and start again
+                retries += 1
+                if retries >= retries_max:
+                    raise RuntimeError(
+                        "power on%s: failed too many retries (%d)"
+                        % (why, retries)) from e
+                target.log.error("power-on%s failed: retrying (%d/%d) "
+                                 "the whole power rail: %s",
+                                 why, retries, retries_max, e)
+                try:
+                    # power off the whole given rail, but no pre/post
+                    # execution, since we are just dealing with the components
+                    self._off(target, impls,
+                              " (retrying because of failure)", False)
+                except:		        # pylint: disable = bare-except
+                    pass	        # yeah, we ignore errors here
+                if e.wait:
+                    time.sleep(e.wait)
+
+
     def _on(self, target, impls, why, whole_rail = True, explicit = False):
         #
         # Power on
@@ -867,8 +1148,12 @@ class interface(ttbl.tt_interface):
         impls_items = impls
         retries = 0
         retries_max = 3
-        recovery_wait = 0.5
-        while index < len(impls):
+        if self.depends:
+            # power on in parallel following the dependencies, nothing
+            # left for the serial loop
+            self._on_graph(target, impls, data, why, whole_rail, explicit)
+            impls_items = []
+        while index < len(impls_items):
             impl_item = impls_items[index]
             component = impl_item[0]
             impl = impl_item[1]
@@ -891,10 +1176,10 @@ class interface(ttbl.tt_interface):
                 target.log.debug("%s: powering on%s: skipping (already on)"
                                  % (component, why))
                 continue            	# it says it is off, so we skip it
-            target.log.debug("%s: powering on%s" % (component, why))
             try:
-                self._impl_on(impl, target, component_real)	# ok, power ir on
-                continue	        # fallthrough is error recovery
+                self._impl_on_recover(impl, target, component,
+                                      component_real, why)
+                continue
 
             except impl_c.retry_all_e as e:
                 # This power component has errored when powering on.
@@ -921,50 +1206,8 @@ class interface(ttbl.tt_interface):
                 index = 0	        # start again
                 if e.wait:
                     time.sleep(e.wait)
-                continue	        # fallthrough is error recovery!
-
-            except Exception as e:	# pylint: disable = broad-except
-                # This power component has errored when powering on.
-                # We'll retry by powering it off, then on again
-                if impl.power_on_recovery:
-                    target.log.error(
-                        "%s: power-on%s failed: retrying after power-off: %s"
-                        % (component, why, e))
-                else:
-                    target.log.error(
-                        "%s: power-on%s failed: not retrying: %s"
-                        % (component, why, e))
-                    raise
-                # fall through!
-            if impl.power_on_recovery:
-                try:
-                    # power off to recover
-                    self._impl_off(impl, target, component_real)
-                except Exception as e:	# pylint: disable = broad-except
-                    target.log.error("%s: power off%s for recovery "
-                                     "failed (ignoring): %s"
-                                     % (component, why, e))
-                time.sleep(recovery_wait)
-                try:		        # Let's retry
-                    self._impl_on(impl, target, component_real)
-                    continue	        # good, it worked
-                except Exception as e:
-                    target.log.error(
-                        "%s: power-on%s failed (again): aborting: %s"
-                        % (component, why, e))
-                    try:	        # ok, not good, giving up
-		        # power off just in case, to avoid electrical
-                        # issues, etc.
-                        self._impl_off(impl, target, component_real)
-                    except Exception as e:	# pylint: disable = broad-except
-                        # is not much we can do if it fails
-                        target.log.error(
-                            "%s: power-off%s due to failed power-on failed: %s"
-                            % (component, why, e))
-                        # don't raise this, raise the original one
-                    raise
+                continue
 
-            target.log.debug("%s: powered on%s" % (component, why))
         if whole_rail:
             target.log.debug(
                 "power post-on%s; fns: %s"
@@ -1554,6 +1797,18 @@ class daemon_c(impl_c):
 
       Can be set before calling :meth:`on`
 
+    :param bool notify: (optional; default *False*) the daemon
+      supports the *sd_notify()* protocol (as when started by
+      systemd with *Type=notify*); consider it started only once it
+      notifies *READY=1*.
+
+    When starting, the daemon is considered started once it is
+    running and :meth:`verify` returns *True*. This is checked every
+    time a file is created or modified in the target's state
+    directory or the pidfile's directory or when the daemon
+    notifies, and periodically otherwise. If the daemon exits with
+    an error while starting, the power on fails right away.
+
     Other parameters as to :class:ttbl.power.impl_c.
 
     The *kws* member are keywords that can be used to expand the
@@ -1570,7 +1825,7 @@ class daemon_c(impl_c):
                  pidfile = "%(path)s/%(component)s-%(name)s.pid",
                  mkpidfile = True, paranoid = False,
                  close_fds = True, kill_before_on: bool = True,
-                 stderr_name: str = None,
+                 stderr_name: str = None, notify: bool = False,
                  **kwargs):
         assert isinstance(cmdline, list), \
             "cmdline has to be a list of strings; got %s" \
@@ -1578,6 +1833,7 @@ class daemon_c(impl_c):
         assert precheck_wait >= 0
         assert isinstance(close_fds, bool)
         assert isinstance(kill_before_on, bool)
+        assert isinstance(notify, bool)
         assert pidfile == None or isinstance(pidfile, str)
 
         impl_c.__init__(self, paranoid = paranoid, **kwargs)
@@ -1660,6 +1916,8 @@ class daemon_c(impl_c):
         #: stderr; can be set before calling on(); can be templated
         #: with kws
         self.stderr_name = stderr_name
+        #: Wait for the daemon to notify it is ready with *sd_notify()*
+        self.notify = notify
 
 
 
@@ -1775,6 +2033,15 @@ class daemon_c(impl_c):
         else:
             pidfile = None
         stderrf = open(commonl.kws_expand(self.stderr_name, kws), "w+")
+        # most daemons tell they are ready creating files (pidfiles,
+        # sockets...), so watch where they usually go
+        watch_paths = [ target.state_dir ]
+        if pidfile and os.path.isdir(os.path.dirname(pidfile)):
+            watch_paths.append(os.path.dirname(pidfile))
+        waiter = commonl.process_waiter_c(watch_paths, notify = self.notify)
+        if self.notify:
+            env = dict(env)
+            env['NOTIFY_SOCKET'] = waiter.notify_address
 
         if self.kill_before_on:
             def _go_for_the_kill(cmdline_check):
@@ -1821,17 +2088,25 @@ class daemon_c(impl_c):
                 for key, val in env.items():
                     target.log.error(
                         "env %s: [%s] %s", key, type(val).__name__, val)
+            waiter.close()
             raise
         except OSError as e:
+            waiter.close()
             raise self.power_on_e("%s: %s failed to start [cmdline %s]: %s" % (
                 component, self.name, " ".join(_cmdline), e))
 
-        if self.precheck_wait:
-            time.sleep(self.precheck_wait)
-        pid = commonl.process_started(pidfile, self.check_path,
-                                      component + "-" + self.name, target.log,
-                                      self.verify,
-                                      ( target, component, _cmdline, ))
+        try:
+            waiter.popen_watch(p)
+            if self.precheck_wait:
+                time.sleep(self.precheck_wait)
+            pid = commonl.process_started(pidfile, self.check_path,
+                                          component + "-" + self.name,
+                                          target.log,
+                                          self.verify,
+                                          ( target, component, _cmdline, ),
+                                          waiter = waiter)
+        finally:
+            waiter.close()
         if pid == None:
             self.log_stderr(target, component, stderrf)
             raise self.power_on_e("%s: %s failed to start"
@@ -4287,11 +4562,153 @@ def defer(target: ttbl.test_target, state: bool,
 
 
 
+def _defer_device_keys(target: ttbl.test_target, state):
+    # set of physical devices a deferred power action works on
+    if not isinstance(state, bool):
+        return frozenset()		# waits, nothing
+    power = getattr(target, "power", None)
+    if power == None:
+        return frozenset()
+    device_keys = set()
+    for impl in power.impls.values():
+        device_key = getattr(impl, "device_key", None)
+        if device_key == None:
+            continue
+        device_key = device_key()
+        if device_key != None:
+            device_keys.add(device_key)
+    return frozenset(device_keys)
+
+
+
+class _defer_scheduler_c:
+    """
+    Decide in which order to run deferred power actions
+
+    Actions are grouped by the set of physical devices they work on
+    (see :meth:`impl_c.device_key`). An action can be started when
+    none of its devices are already running *device_max* actions;
+    from those that can, we start first the ones whose devices have
+    the most actions still pending, so the busiest PDUs and hubs
+    are kept fed all the time and they all finish about the same
+    time. Actions that use no devices are started last.
+
+    :param list defer_list: list of deferred power actions filled by
+      :func:`ttbl.power.defer`
+
+    :param int device_max: maximum number of actions running at the
+      same time on each device; *0* for no limit.
+    """
+    def __init__(self, defer_list: list, device_max: int = 0):
+        assert isinstance(device_max, int) and device_max >= 0, \
+            f"device_max: expected an integer >= 0; got {device_max!r}"
+        self.device_max = device_max
+        # DEVICEKEYS -> [ ACTIONS ], in the order they were deferred
+        self.groups = collections.OrderedDict()
+        # DEVICEKEY -> number of actions pending and running
+        self.pending = collections.defaultdict(int)
+        self.running = collections.defaultdict(int)
+        for action in defer_list:
+            target, state, _soft_failure = action
+            device_keys = _defer_device_keys(target, state)
+            self.groups.setdefault(
+                device_keys, collections.deque()).append(action)
+            for device_key in device_keys:
+                self.pending[device_key] += 1
+
+
+    def __len__(self):
+        return sum(len(actions) for actions in self.groups.values())
+
+
+    def _available(self, device_keys):
+        if self.device_max == 0:
+            return True
+        for device_key in device_keys:
+            if self.running[device_key] >= self.device_max:
+                return False
+        return True
+
+
+    def next(self):
+        """
+        Pick the next action to run
+
+        :returns: *( DEVICEKEYS, ( TARGET, STATE, SOFT_FAILURE ) )*
+          or *None* if no action can be started now (because
+          there are none left or their devices are busy)
+        """
+        best = None
+        best_backlog = -1
+        for device_keys, actions in self.groups.items():
+            if not actions or not self._available(device_keys):
+                continue
+            backlog = max(( self.pending[device_key]
+                            for device_key in device_keys ), default = 0)
+            if backlog > best_backlog:
+                best = device_keys
+                best_backlog = backlog
+        if best == None:
+            return None
+        action = self.groups[best].popleft()
+        if not self.groups[best]:
+            del self.groups[best]
+        for device_key in best:
+            self.pending[device_key] -= 1
+            self.running[device_key] += 1
+        return best, action
+
+
+    def done(self, device_keys):
+        """
+        Note an action started with :meth:`next` has completed
+
+        :param frozenset device_keys: keys returned by :meth:`next`
+        """
+        for device_key in device_keys:
+            self.running[device_key] -= 1
+
+
+    def drain(self):
+        """
+        Take out the actions not yet started
+
+        :returns list: list of *( TARGET, STATE, SOFT_FAILURE )*
+        """
+        actions = []
+        for device_keys, group in self.groups.items():
+            actions += group
+            for device_key in device_keys:
+                self.pending[device_key] -= len(group)
+        self.groups.clear()
+        return actions
+
+
+def _defer_skipped_log(name: str, actions: list):
+    # a hard failure stops running the deferred list; say what
+    # was not done
+    if not actions:
+        return
+    logging.error(
+        "power defer list '%s': %d actions skipped after a failure: %s",
+        name, len(actions), " ".join(
+            "%s:%s" % (target.id, "on" if state == True
+                       else "off" if state == False else f"wait{state}s")
+            for target, state, _soft_failure in actions))
+
+
+
 def execute_defer_list(defer_list: list, name: str, serialize: bool = False,
-                       keepalive_fn: callable = None):
+                       keepalive_fn: callable = None,
+                       max_workers: int = None, device_max: int = None):
     """
     Execute the deferred power actions in @defer_list
 
+    In parallel mode, at most *max_workers* actions run at the same
+    time and at most *device_max* on each physical device (PDU, USB
+    hub...); see :class:`_defer_scheduler_c` for how the order is
+    decided.
+
     :param list defer_list: list of deferred power actions filled by
       :func:`ttbl.power.defer`
 
@@ -4304,60 +4721,86 @@ def execute_defer_list(defer_list: list, name: str, serialize: bool = False,
       defined, function to call every ten seconds while waiting for
       *defer_list*.
 
+    :param int max_workers: (optional; defaults to
+      :data:`ttbl.config.power_defer_max`) maximum number of
+      actions to run at the same time.
+
+    :param int device_max: (optional; defaults to
+      :data:`ttbl.config.power_defer_device_max`) maximum number of
+      actions to run at the same time on a single physical device;
+      *0* for no limit (same as in the configuration).
+
+    If an action that is not allowed to fail (see
+    :func:`ttbl.power.defer`) fails, the exception is raised once the
+    actions already running complete; the ones not started yet are
+    skipped and logged as such.
     """
     assert keepalive_fn == None or callable(keepalive_fn)
     logging.info("power defer list '%s': executing", name)
     if serialize:
-        for ( target, state, soft_failure ) in defer_list:
-            _execute_action(target, state, soft_failure)
-    else:
-        processes = max(20, len(defer_list))
+        for count, ( target, state, soft_failure ) in enumerate(defer_list):
+            try:
+                _execute_action(target, state, soft_failure)
+            except Exception:
+                _defer_skipped_log(name, defer_list[count + 1:])
+                raise
+    elif defer_list:
+        if max_workers == None:
+            max_workers = ttbl.config.power_defer_max
+        if device_max == None:
+            device_max = ttbl.config.power_defer_device_max
+            if device_max == None:	# older configurations
+                device_max = 0
+        scheduler = _defer_scheduler_c(defer_list, device_max)
+        max_workers = min(max_workers, len(defer_list))
         current_process = multiprocessing.process.current_process()
         _config = getattr(current_process, "_config", None)
         daemon_orig = _config.get('daemon', None)
         _config['daemon'] = False
-        executor = concurrent.futures.ProcessPoolExecutor(processes)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+        futures = {}
         try:
-            futures = {
-                executor.submit(_execute_action,
-                                target, state, soft_failure): (
-                                    target, state, soft_failure
-                                )
-                for ( target, state, soft_failure ) in defer_list
-            }
             ts0 = time.time()
-            while True:
-                # We are going to run this in a loop and timeout every 10s
-                # so we can keepalive
-                try:
-                    for future in concurrent.futures.as_completed(
-                            futures, timeout = 10):
-                        target, state, soft_failure = futures[future]
-                        try:
-                            _ = future.result()
-                        except Exception as e:
-                            logging.error(
-                                "%s: exception running deferred power-%s"
-                                " operation: %s",
-                                target.id, "on" if state else "off", e,
-                                exc_info = True)
-                            if not soft_failure:
-                                raise
-                    # if we end up here, it means the as_completed()
-                    # process is done with all tasks, so we can stop
-                    # repeating the loop
-                    break
-                except TimeoutError:
+            ts_keepalive = ts0
+            while scheduler or futures:
+                while len(futures) < max_workers:
+                    r = scheduler.next()
+                    if r == None:
+                        break
+                    device_keys, action = r
+                    future = executor.submit(_execute_action, *action)
+                    futures[future] = ( device_keys, action )
+                # We are going to wake up at least every 10s so we
+                # can keepalive
+                done, _ = concurrent.futures.wait(
+                    futures, timeout = 10,
+                    return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    device_keys, ( target, state, soft_failure ) = \
+                        futures.pop(future)
+                    scheduler.done(device_keys)
+                    try:
+                        _ = future.result()
+                    except Exception as e:
+                        logging.error(
+                            "%s: exception running deferred power-%s"
+                            " operation: %s",
+                            target.id, "on" if state else "off", e,
+                            exc_info = True)
+                        if not soft_failure:
+                            _defer_skipped_log(name, scheduler.drain())
+                            raise
+                ts = time.time()
+                if keepalive_fn and ts - ts_keepalive >= 10:
                     # if this is being used from the cleanup process, we
                     # want to run the keepalive function evrynow and then,
                     # to notify the service manager this process is alive
-                    if keepalive_fn:
-                        ts = time.time()
-                        logging.info(
-                            "power defer list '%s': keepaliving @%.02fs",
-                            name, ts - ts0)
-                        keepalive_fn()
-                    continue
+                    logging.info(
+                        "power defer list '%s': keepaliving @%.02fs"
+                        " (%d running, %d pending)",
+                        name, ts - ts0, len(futures), len(scheduler))
+                    keepalive_fn()
+                    ts_keepalive = ts
         finally:
             executor.shutdown(wait = True)
             del executor
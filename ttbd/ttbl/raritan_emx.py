@@ -150,6 +150,8 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
       controlled).
 
     """
+    upid_device_fields = ( "url", )
+
     def __init__(self, url: str, outlet_number: int = None,
                  https_verify: bool = False,
                  password: str = None, **kwargs):
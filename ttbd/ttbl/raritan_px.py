@@ -65,6 +65,8 @@ class pc(ttbl.power.impl_c):
     **Rationale:** I was not able to find any JSON-RPC APIs that would
     work with old PDUs.
     """
+    upid_device_fields = ( "hostname", )
+
     def __init__(self, device_spec: str,
                  prompt_regex: re.Pattern = re.compile(br".*[>#]\s*\Z", re.MULTILINE),
                  **kwargs):
@@ -162,11 +162,17 @@ use chroot = no
                 pidf.write("%s" % p.pid)
         except OSError as e:
             raise self.start_e("rsync failed to start: %s" % e)
-        pid = commonl.process_started(
-            pidfile, self.path,
-            verification_f = commonl.tcp_port_busy,
-            verification_f_args = (self.port,),
-            tag = "rsync", log = target.log)
+        waiter = commonl.process_waiter_c()
+        try:
+            # fail right away if rsync dies
+            waiter.popen_watch(p)
+            pid = commonl.process_started(
+                pidfile, self.path,
+                verification_f = commonl.tcp_port_busy,
+                verification_f_args = (self.port,),
+                tag = "rsync", log = target.log, waiter = waiter)
+        finally:
+            waiter.close()
         # systemd might complain with
         #
         # Supervising process PID which is not our child. We'll most
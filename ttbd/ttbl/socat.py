@@ -106,11 +106,17 @@ class pci(ttbl.power.impl_c):
                 pidf.write("%s" % p.pid)
         except OSError as e:
             raise self.start_e("socat failed to start: %s", e)
-        pid = commonl.process_started(
-            pidfile, self.path,
-            verification_f = commonl.tcp_port_busy,
-            verification_f_args = (self.local_port,),
-            tag = "socat", log = target.log)
+        waiter = commonl.process_waiter_c()
+        try:
+            # fail right away if socat dies
+            waiter.popen_watch(p)
+            pid = commonl.process_started(
+                pidfile, self.path,
+                verification_f = commonl.tcp_port_busy,
+                verification_f_args = (self.local_port,),
+                tag = "socat", log = target.log, waiter = waiter)
+        finally:
+            waiter.close()
         # systemd might complain with
         #
         # Supervising process PID which is not our child. We'll most
@@ -19,19 +19,32 @@ subdirectories) which can be use to place blobs which might be removed
 by the server after a certain time based on policy. Note these storage
 areas are common to all the targets for each user.
 
+The server keeps an index of the files in the storage areas (see
+:class:`files_index_c`), so it can remove files that have not been
+used in a while (:data:`ttbl.config.cleanup_files_maxage`) and keep
+users under a quota (:data:`ttbl.config.cleanup_files_user_quota`)
+without scanning all the storage areas.
+
 Examples:
 
 - upload files to the server than then other tools will
   use to (eg: burn into a  Flash ROM).
 
 """
+import collections
 import errno
+import fcntl
 import glob
 import hashlib
+import heapq
+import json
+import logging
+import numbers
 import os
 import pathlib
 import re
 import stat
+import time
 
 import commonl
 import ttbl
@@ -260,6 +273,7 @@ class interface(ttbl.tt_interface):
         file_object = files['file']
         file_object.save(file_path_final)
         commonl.makedirs_p(user_path)
+        files_index_record(file_path_final)
         target.log.debug("%s: saved" % file_path_final)
         return dict()
 
@@ -280,6 +294,7 @@ class interface(ttbl.tt_interface):
             generation = os.readlink(file_path_final + ".generation")
         except OSError:
             generation = 0
+        files_index_record(file_path_final)
         # ttbd will parse this response in _target_interface() to
         # return a raw file according to these parameters.
         return dict(
@@ -296,4 +311,425 @@ class interface(ttbl.tt_interface):
         if not rw:
             raise PermissionError(f"{file_path}: is a read only location")
         commonl.rm_f(file_path_final)
+        files_index_remove(file_path_final)
         return dict()
+
+
+
+class files_index_c:
+    """
+    Index of the files in the users' storage areas
+
+    Keeps, for each file, its size and when it was last uploaded or
+    used (eg: flashed or downloaded), so files that have not been used
+    in a while can be removed and users kept under a quota without
+    scanning all the storage areas:
+
+    - the server's processes record uploads, uses and removals with
+      :func:`files_index_record` / :func:`files_index_remove`, which
+      append a line to a journal (*FILES_PATH/.index.journal*) with
+      the file locked shared; it is a single small write
+
+    - the cleanup process (the only one that reads it) follows the
+      journal and keeps in memory the size and last access of each
+      file, the usage of each user and heaps ordered by last access;
+      :meth:`expire` pops only the files that have expired and
+      :meth:`quota_enforce` the least recently used files of the
+      users over their quota
+
+    - when the journal has many more records than files, it is
+      rewritten with only the current state; this is done with the
+      file locked exclusive so no records are lost (writers that
+      find the journal they locked was replaced try again with the
+      new one)
+
+    - :meth:`repair` scans the storage areas to fix the index for
+      files created or removed behind its back; it is run when the
+      cleanup process starts, every
+      :data:`ttbl.config.cleanup_files_repair_period` and with *ttbd
+      --files-index-repair*
+
+    Before removing a file, it is checked it was not modified after
+    the last access we know of, in which case it is kept.
+
+    :param str files_path: directory with the users' storage areas
+      (:data:`ttbl.test_target.files_path`)
+
+    :param logging.Logger log: (optional) where to log
+    """
+    #: Name of the journal file in *files_path*
+    journal_name = ".index.journal"
+
+    #: Rewrite the journal when it has more than this many records
+    #: per file known (and at least :data:`journal_records_min`)
+    journal_records_factor = 4
+
+    #: Do not rewrite the journal for less than this many records
+    journal_records_min = 1024
+
+    def __init__(self, files_path, log = None):
+        assert isinstance(files_path, str)
+        self.files_path = os.path.normpath(files_path)
+        self.journal_path = os.path.join(self.files_path, self.journal_name)
+        if log == None:
+            log = logging.getLogger("files-index")
+        self.log = log
+        self._journal = None
+        self._state_reset()
+
+    def _state_reset(self):
+        #: Files known: ( USER, NAME ): [ SIZE, TIMESTAMP ]
+        self.files = {}
+        #: Bytes taken by each user
+        self.usage = collections.defaultdict(int)
+        # both heaps are lazy: an entry whose timestamp is not the
+        # current one for the file is stale and ignored when popped
+        self._heap = []			# [ ( TIMESTAMP, USER, NAME ) ]
+        self._user_heaps = collections.defaultdict(list)
+        					# USER: [ ( TIMESTAMP, NAME ) ]
+        self._partial = b""		# incomplete last line read
+        self._records = 0		# records in the journal
+
+    def _path_split(self, path):
+        # FILES_PATH/USER/NAME -> USER, NAME; None if the path is not
+        # a file in a user's storage area; as the storage areas are
+        # flat, files in subdirectories are not considered, neither
+        # hidden files
+        relpath = os.path.relpath(os.path.normpath(path), self.files_path)
+        parts = relpath.split(os.path.sep)
+        if len(parts) != 2 \
+           or parts[0] == os.path.pardir \
+           or parts[0].startswith(".") or parts[1].startswith("."):
+            return None
+        return parts
+
+    def _append(self, records):
+        data = b"".join(json.dumps(record).encode("utf-8") + b"\n"
+                        for record in records)
+        while True:
+            fd = os.open(self.journal_path,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o660)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                if os.fstat(fd).st_nlink == 0:
+                    continue	# rewritten while we waited, try again
+                os.write(fd, data)
+                return
+            finally:
+                os.close(fd)
+
+    def record(self, path, ts = None):
+        """
+        Record a file in a user's storage area was uploaded or used
+
+        Paths that are not a file in a user's storage area are
+        ignored.
+
+        :param str path: path to the file
+
+        :param float ts: (optional; default now) time when it was used
+        """
+        parts = self._path_split(path)
+        if parts == None:
+            return
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return
+        if ts == None:
+            ts = time.time()
+        self._append([ [ ts, "touch", size ] + parts ])
+
+    def remove(self, path):
+        """
+        Record a file in a user's storage area was removed
+
+        :param str path: path to the file
+        """
+        parts = self._path_split(path)
+        if parts == None:
+            return
+        self._append([ [ time.time(), "remove", 0 ] + parts ])
+
+    #
+    # Only used by the process following the journal
+    #
+
+    def _push(self, user, name, ts):
+        heapq.heappush(self._heap, ( ts, user, name ))
+        heapq.heappush(self._user_heaps[user], ( ts, name ))
+        if len(self._heap) > 2 * len(self.files) + self.journal_records_min:
+            # too many stale entries, rebuild
+            self._heap = [ ( ts, user, name )
+                           for ( user, name ), ( _size, ts )
+                           in self.files.items() ]
+            heapq.heapify(self._heap)
+            self._user_heaps = collections.defaultdict(list)
+            for ( ts, user, name ) in self._heap:
+                self._user_heaps[user].append(( ts, name ))
+            for heap in self._user_heaps.values():
+                heapq.heapify(heap)
+
+    def _touch(self, user, name, size, ts):
+        entry = self.files.get(( user, name ), None)
+        if entry == None:
+            self.files[( user, name )] = [ size, ts ]
+            self.usage[user] += size
+            self._push(user, name, ts)
+            return
+        self.usage[user] += size - entry[0]
+        entry[0] = size
+        if ts > entry[1]:	# records might come slightly out of order
+            entry[1] = ts
+            self._push(user, name, ts)
+
+    def _forget(self, user, name):
+        entry = self.files.pop(( user, name ), None)
+        if entry == None:
+            return
+        self.usage[user] -= entry[0]
+        if self.usage[user] <= 0:
+            del self.usage[user]
+
+    def _read(self):
+        # read new records from the journal
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            st = None
+        if self._journal != None \
+           and ( st == None
+                 or os.fstat(self._journal.fileno()).st_ino != st.st_ino ):
+            # rewritten by someone else (eg: a repair), start over
+            self._journal.close()
+            self._journal = None
+            self._state_reset()
+        if st == None:
+            return
+        if self._journal == None:
+            self._journal = open(self.journal_path, "rb")
+        data = self._partial + self._journal.read()
+        lines = data.split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            try:
+                ts, op, size, user, name = json.loads(line)
+                if op == "touch":
+                    self._touch(user, name, size, ts)
+                elif op == "remove":
+                    entry = self.files.get(( user, name ), None)
+                    # skip if uploaded or used again after it was
+                    # removed (eg: while we were removing others)
+                    if entry != None and entry[1] >= ts:
+                        continue
+                    self._forget(user, name)
+                else:
+                    raise ValueError(f"unknown operation {op}")
+            except ValueError as e:
+                self.log.warning("%s: ignoring bad record %r: %s",
+                                 self.journal_path, line[:128], e)
+        self._records += len(lines)
+
+    def _rewrite(self):
+        # rewrite the journal with the current state
+        while True:
+            fd = os.open(self.journal_path, os.O_RDWR | os.O_CREAT, 0o660)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_nlink == 0:
+                    continue	# rewritten while we waited, try again
+                self._read()	# no one can append now
+                tmp_path = self.journal_path + f".{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    for ( user, name ), ( size, ts ) in self.files.items():
+                        f.write(json.dumps([ ts, "touch", size, user, name ])
+                                .encode("utf-8") + b"\n")
+                os.chmod(tmp_path, 0o660)
+                os.rename(tmp_path, self.journal_path)
+                if self._journal != None:
+                    self._journal.close()
+                self._journal = open(self.journal_path, "rb")
+                self._journal.seek(0, os.SEEK_END)
+                self._partial = b""
+                self._records = len(self.files)
+                return
+            finally:
+                os.close(fd)
+
+    def update(self):
+        """
+        Read the new records from the journal, rewriting it if it has
+        grown too much
+        """
+        self._read()
+        if self._records > max(self.journal_records_min,
+                               self.journal_records_factor * len(self.files)):
+            self._rewrite()
+
+    def _evict(self, user, name, ts, ts_limit, removed):
+        # remove a file, unless it was modified after *ts_limit*
+        # (None for no limit) behind our back; return True if removed
+        # and add ( PATH, TIMESTAMP-REMOVED ) to *removed*
+        path = os.path.join(self.files_path, user, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._forget(user, name)
+            return False
+        if st.st_mtime > ts:
+            # modified after the last access we know of
+            self._touch(user, name, st.st_size, st.st_mtime)
+            if ts_limit == None or st.st_mtime > ts_limit:
+                return False
+        try:
+            os.remove(path)
+        except OSError as e:
+            self.log.error("%s: can't remove: %s", path, e)
+            self._forget(user, name)	# repair will pick it up again
+            return False
+        self._forget(user, name)
+        removed.append(( path, time.time() ))
+        return True
+
+    def expire(self, ts_now, maxage):
+        """
+        Remove the files that have not been uploaded or used in a
+        while
+
+        :param float ts_now: current time (seconds since the epoch)
+
+        :param float maxage: remove files whose last use was more than
+          this many seconds before *ts_now*
+
+        :returns list(str): paths of the files removed
+        """
+        self.update()
+        ts_limit = ts_now - maxage
+        removed = []
+        while self._heap and self._heap[0][0] <= ts_limit:
+            ts, user, name = heapq.heappop(self._heap)
+            entry = self.files.get(( user, name ), None)
+            if entry == None or entry[1] != ts:
+                continue		# stale
+            self._evict(user, name, ts, ts_limit, removed)
+        return self._removed_record(removed)
+
+    def quota_enforce(self, quota):
+        """
+        Remove the least recently used files of each user until they
+        take no more than *quota* bytes
+
+        :param int quota: maximum bytes each user can take (any
+          number, eg: *20e9*, is taken as an integer)
+
+        :returns list(str): paths of the files removed
+        """
+        assert isinstance(quota, numbers.Real) and quota >= 0, \
+            f"quota: expected a positive number; got {quota!r}"
+        quota = int(quota)
+        self.update()
+        removed = []
+        for user in [ user for user, usage in self.usage.items()
+                      if usage > quota ]:
+            heap = self._user_heaps.get(user, [])
+            while heap and self.usage.get(user, 0) > quota:
+                ts, name = heapq.heappop(heap)
+                entry = self.files.get(( user, name ), None)
+                if entry == None or entry[1] != ts:
+                    continue		# stale
+                self._evict(user, name, ts, None, removed)
+        return self._removed_record(removed)
+
+    def _removed_record(self, removed):
+        # journal the files removed with when each was removed, so a
+        # record of it being uploaded again after that (appended
+        # before ours) is not undone; return their paths
+        if removed:
+            self._append([ [ ts, "remove", 0 ] + self._path_split(path)
+                           for path, ts in removed ])
+        return [ path for path, _ts in removed ]
+
+    def repair(self):
+        """
+        Scan the users' storage areas and fix the index to match
+
+        The journal is rewritten with the result.
+
+        :returns dict: number of files *added* (not known to the
+          index), *updated* (their size or modification time changed)
+          and *removed* (no longer there) and the total of *files*
+        """
+        self._read()
+        added = updated = removed = 0
+        seen = set()
+        for user_entry in os.scandir(self.files_path):
+            if user_entry.name.startswith(".") \
+               or not user_entry.is_dir(follow_symlinks = False):
+                continue
+            user = user_entry.name
+            for entry in os.scandir(user_entry.path):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue		# removed while scanning
+                seen.add(( user, entry.name ))
+                known = self.files.get(( user, entry.name ), None)
+                if known == None:
+                    added += 1
+                elif known[0] != st.st_size or st.st_mtime > known[1]:
+                    updated += 1
+                else:
+                    continue
+                self._touch(user, entry.name, st.st_size, st.st_mtime)
+        for user, name in list(self.files):
+            if ( user, name ) not in seen:
+                removed += 1
+                self._forget(user, name)
+        self._rewrite()
+        return dict(added = added, updated = updated, removed = removed,
+                    files = len(self.files))
+
+
+#: Index of the files in the users' storage areas
+#:
+#: Initialized by the server when it starts, see :class:`files_index_c`
+files_index = None
+
+
+def files_index_record(path):
+    """
+    Record in the :data:`files index <files_index>` a file in a
+    user's storage area was uploaded or used
+
+    Does nothing if there is no index; failures are logged and
+    ignored.
+
+    :param str path: path to the file
+    """
+    if files_index == None:
+        return
+    try:
+        files_index.record(path)
+    except OSError as e:
+        files_index.log.error("%s: can't record use: %s", path, e)
+
+
+def files_index_remove(path):
+    """
+    Record in the :data:`files index <files_index>` a file in a
+    user's storage area was removed
+
+    As :func:`files_index_record`.
+
+    :param str path: path to the file
+    """
+    if files_index == None:
+        return
+    try:
+        files_index.remove(path)
+    except OSError as e:
+        files_index.log.error("%s: can't record removal: %s", path, e)
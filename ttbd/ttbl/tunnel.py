@@ -280,11 +280,18 @@ class interface(ttbl.tt_interface):
                 shell = False, cwd = target.state_dir,
                 close_fds = True)
 
-            pid = commonl.process_started(
-                p.pid, "/usr/bin/socat",
-                verification_f = commonl.tcp_port_busy,
-                verification_f_args = ( local_port, ),
-                tag = "socat-" + tunnel_id, log = target.log)
+            waiter = commonl.process_waiter_c()
+            try:
+                # fail right away if socat dies
+                waiter.popen_watch(p)
+                pid = commonl.process_started(
+                    p.pid, "/usr/bin/socat",
+                    verification_f = commonl.tcp_port_busy,
+                    verification_f_args = ( local_port, ),
+                    tag = "socat-" + tunnel_id, log = target.log,
+                    waiter = waiter)
+            finally:
+                waiter.close()
             if p.returncode != None:
                 raise RuntimeError("TUNNEL %s: socat exited with %d"
                                    % (tunnel_id, p.returncode))
@@ -213,6 +213,8 @@ class pc(rly08b, ttbl.power.impl_c):
 
     Other parameters as to :class:ttbl.power.impl_c.
     """
+    upid_device_fields = ( "device_spec", )
+
     def __init__(self, device_spec: str, relay, resilient = False, **kwargs):
         assert isinstance(relay, int) and relay >= 1 or relay <= 8, \
             "relay: relay number is a number 1 - 8, " \